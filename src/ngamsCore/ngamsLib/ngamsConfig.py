@@ -32,8 +32,10 @@ The ngamsConfig class is used to handle the NG/AMS Configuration.
 """
 
 import base64
+import binascii
 import collections
 import functools
+import hashlib
 import logging
 import os
 
@@ -44,7 +46,7 @@ from . import ngamsStorageSet, ngamsStream, ngamsMirroringSource
 from . import utils
 from .ngamsCore import (
     genLog, NGAMS_UNKNOWN_MT, isoTime2Secs, NGAMS_BACK_LOG_DIR,
-    loadPlugInEntryPoint,
+    loadPlugInEntryPoint, NGAMS_HTTP_INT_AUTH_USER,
 )
 
 
@@ -98,6 +100,97 @@ class ngamsConfigException(Exception): pass
 plugin_def = collections.namedtuple('plugin_def', 'name pars')
 dppi_plugin_def = collections.namedtuple('dppi_plugin_def', 'name pars mime_types')
 
+# Salted password hashes are given in the configuration as
+# pbkdf2_sha256$<iterations>$<base64 salt>$<base64 hash>
+PASSWORD_HASH_ALGORITHM = 'pbkdf2_sha256'
+password_hash = collections.namedtuple('password_hash', 'iterations salt digest')
+
+def hash_password(password, salt=None, iterations=100000):
+    """
+    Returns a salted hash of `password` to be used as the Password attribute
+    of an Authorization User element.
+
+    :param password: the password
+    :param salt: the salt to use, random if not given
+    :param iterations: the number of iterations of the hash function
+    """
+    if isinstance(password, six.text_type):
+        password = password.encode('utf8')
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+    return '%s$%d$%s$%s' % (PASSWORD_HASH_ALGORITHM, iterations,
+                            utils.b2s(base64.b64encode(salt)),
+                            utils.b2s(base64.b64encode(digest)))
+
+def parse_password_hash(value):
+    """Returns a password_hash from a hashed Password value, or None if it is not one"""
+    parts = value.split('$')
+    if len(parts) != 4 or parts[0] != PASSWORD_HASH_ALGORITHM:
+        return None
+    return password_hash(int(parts[1]), base64.b64decode(six.b(parts[2])),
+                         base64.b64decode(six.b(parts[3])))
+
+class auth_user(collections.namedtuple('auth_user', 'name encoded_password password password_hash commands')):
+    """
+    An authorization user, with either its decoded password or its salted
+    password hash, and its allowed commands
+    """
+
+    def may_run(self, command):
+        return self.commands is not None and ('*' in self.commands or command in self.commands)
+
+
+class CompiledConfig(object):
+    """
+    Read-only snapshot of the configuration values used on every request,
+    already converted to their final types and indexed for direct lookups.
+
+    A new snapshot is built every time the configuration is (re)loaded or
+    changed, and replaces the previous one with a single assignment; readers
+    therefore always see a complete snapshot, either the old or the new one.
+    """
+
+    def __init__(self, cfg):
+        self.block_size = cfg._getIntVal("Server[1].BlockSize")
+        self.max_sim_reqs = cfg._getIntVal("Server[1].MaxSimReqs")
+        self.crc_variant = cfg._getIntVal("ArchiveHandling[1].CRCVariant", 0)
+        self.trust_client_checksum = cfg._getIntVal("ArchiveHandling[1].TrustClientChecksum", 0)
+
+        # Authorization
+        self.authorize = cfg._getIntVal("Authorization[1].Enable")
+        self.auth_cache_time = cfg._getIntVal("Authorization[1].CacheTime", 300)
+        exclude = cfg.getVal("Authorization[1].Exclude")
+        self.auth_exclude_commands = tuple(exclude.split(',')) if exclude is not None else None
+        self.auth_exclude_all = '*' in (self.auth_exclude_commands or ())
+        self.auth_users = {}
+        for name, encoded_password, commands in cfg._getAuthUsers():
+            password = pwd_hash = None
+            try:
+                if encoded_password:
+                    pwd_hash = parse_password_hash(encoded_password)
+                    if pwd_hash is None:
+                        password = base64.b64decode(six.b(encoded_password))
+            except (binascii.Error, TypeError, ValueError):
+                logger.warning("Password of user %s is neither base64-encoded nor a valid hash", name)
+            if commands:
+                commands = frozenset(commands.split(','))
+            self.auth_users[name] = auth_user(name, encoded_password, password, pwd_hash, commands)
+
+        # The first Storage Set/Stream defined for a slot/mime-type is used
+        self.storage_sets_by_slot = {}
+        for storage_set in cfg.getStorageSetList():
+            self.storage_sets_by_slot.setdefault(storage_set.getMainDiskSlotId(), storage_set)
+            self.storage_sets_by_slot.setdefault(storage_set.getRepDiskSlotId(), storage_set)
+        self.streams_by_mime_type = {}
+        for stream in cfg.getStreamList():
+            self.streams_by_mime_type.setdefault(stream.getMimeType(), stream)
+
+    def auth_excluded(self, command):
+        """Whether the command is excluded from authorization"""
+        return self.auth_exclude_all or (self.auth_exclude_commands is not None and
+                                         command in self.auth_exclude_commands)
+
+
 def relative_to_root(f):
     @functools.wraps(f)
     def _wrapper(self):
@@ -128,7 +221,9 @@ class ngamsConfig:
         dbConObj:    DB connection object (ngamsDb).
         """
         self.__cfgMgr = ngamsConfigBase.ngamsConfigBase(None, dbObj)
+        self.__unpacking = False
         self.clear()
+        self._compile()
         if (self.getCfg()): self.load(filename)
 
 
@@ -307,6 +402,18 @@ class ngamsConfig:
 
         Returns:     Reference to object itself.
         """
+        # The previous compiled configuration stays in use until the new one
+        # is fully unpacked
+        self.__unpacking = True
+        try:
+            self.__unpackCfg()
+        finally:
+            self.__unpacking = False
+        self._compile()
+        return self
+
+
+    def __unpackCfg(self):
         self.clear()
 
         # Get session SQL statements
@@ -350,7 +457,10 @@ class ngamsConfig:
                                          self.getVal(nm % "MainDiskSlotId"),
                                          self.getVal(nm % "RepDiskSlotId"),
                                          self.getVal(nm % "Mutex"),
-                                         self.getVal(nm % "Synchronize"))
+                                         self.getVal(nm % "Synchronize"),
+                                         self.getVal(nm % "Preallocate"),
+                                         self.getVal(nm % "Durability"),
+                                         self.getVal(nm % "SyncInterval"))
                 self.addStorageSetObj(setObj)
 
         # Handle Streams.
@@ -549,9 +659,42 @@ class ngamsConfig:
                     raise Exception(msg % mirSrcObj.getId())
                 self.addMirroringSrcObj(mirSrcObj)
 
+
+    def _compile(self):
+        """
+        Build a new compiled configuration with the current contents of the
+        object and put it in use.
+
+        Returns:     Reference to object itself.
+        """
+        self.__compiled = CompiledConfig(self)
         return self
 
 
+    def _changed(self):
+        if not self.__unpacking:
+            self._compile()
+
+
+    @property
+    def compiled(self):
+        """
+        The compiled configuration currently in use (CompiledConfig). Callers
+        needing several values should keep a reference to it, rather than
+        accessing this property many times.
+        """
+        return self.__compiled
+
+
+    def _getIntVal(self, par, retValOnFailure = -1):
+        return getInt(par, self.getVal(par), retValOnFailure)
+
+
+    def _getAuthUsers(self):
+        return [(user, password, self.__authUserCommandsDic.get(user))
+                for user, password in self.__authUserDic.items()]
+
+
     def getVal(self,
                parName):
         """
@@ -585,6 +728,7 @@ class ngamsConfig:
         Returns:      Reference to object itself.
         """
         self.__cfgMgr.storeVal(parName, value, dbCfgGroupId)
+        self._changed()
         return self
 
 
@@ -745,7 +889,53 @@ class ngamsConfig:
                  * 1: ``crc32c`` (using Intel's SSE 4.2 implementation via the ``crc32c`` module)
                  * 2: ``crc32z`` (using python's binascii implementation w/ masking)
         """
-        par = "ArchiveHandling[1].CRCVariant"
+        return self.__compiled.crc_variant
+
+
+    def getTrustClientChecksum(self):
+        """
+        Whether to trust the checksum sent by clients for Data Archiving
+        Plug-Ins that don't say if they modify the data. The checksum is
+        verified while the data is received, and used instead of re-reading
+        the archived file if the plug-in didn't change its size.
+
+        :return: 0 (don't trust) or 1 (trust)
+        """
+        return self.__compiled.trust_client_checksum
+
+
+    def getVolumeStatsFlushFiles(self):
+        """
+        Number of files archived onto a volume after which its statistics
+        (number of files, bytes stored, available space) are written to the
+        DB.
+
+        :return: The number of files, 1 to write them after every file
+        """
+        par = "ArchiveHandling[1].VolumeStatsFlushFiles"
+        return getInt(par, self.getVal(par), 1)
+
+
+    def getVolumeStatsFlushPeriod(self):
+        """
+        Maximum time the statistics of a volume are kept in memory before
+        being written to the DB.
+
+        :return: The time, in seconds
+        """
+        par = "ArchiveHandling[1].VolumeStatsFlushPeriod"
+        return getInt(par, self.getVal(par), 5)
+
+
+    def getVolumeCacheTime(self):
+        """
+        Time during which the information about the volumes of the server,
+        used to select the volume for new files, is kept in memory before
+        reading it from the DB again.
+
+        :return: The time, in seconds, 0 to always read it from the DB
+        """
+        par = "ArchiveHandling[1].VolumeCacheTime"
         return getInt(par, self.getVal(par), 0)
 
 
@@ -755,8 +945,7 @@ class ngamsConfig:
 
         Returns:   HTTP data read/write block size (integer).
         """
-        par = "Server[1].BlockSize"
-        return getInt(par, self.getVal(par))
+        return self.__compiled.block_size
 
     def getMaxSimReqs(self):
         """
@@ -764,8 +953,7 @@ class ngamsConfig:
 
         Returns:   Maximum number of simultaneous requests (integer).
         """
-        par = "Server[1].MaxSimReqs"
-        return getInt(par, self.getVal(par))
+        return self.__compiled.max_sim_reqs
 
 
     def getMinSpaceSysDirMb(self):
@@ -838,6 +1026,35 @@ class ngamsConfig:
         par = "Server[1].ProxyCRC"
         return getInt(par, self.getVal(par), retValOnFailure = 0)
 
+    def getFileLocationCacheSize(self):
+        """
+        Maximum number of file location queries whose results are kept in
+        memory to serve subsequent requests for the same files.
+
+        :return: The number of query results, 0 to disable the cache
+        """
+        par = "Server[1].FileLocationCacheSize"
+        return getInt(par, self.getVal(par), 10000)
+
+    def getFileLocationCacheTime(self):
+        """
+        Maximum time the result of a file location query is kept in memory.
+
+        :return: The time, in seconds
+        """
+        par = "Server[1].FileLocationCacheTime"
+        return getInt(par, self.getVal(par), 30)
+
+    def getHostTopologyRefreshPeriod(self):
+        """
+        Period after which the in-memory copy of the NGAS Hosts table is
+        re-loaded from the database to pick up changes done by other servers.
+
+        :return: The period, in seconds
+        """
+        par = "Server[1].HostTopologyRefreshPeriod"
+        return getInt(par, self.getVal(par), 10)
+
 
     def getArchiveUnits(self):
         """
@@ -1039,6 +1256,7 @@ class ngamsConfig:
         Returns:        Reference to object itself.
         """
         self.__storageSetList.append(storageSetObj)
+        self._changed()
         return self
 
 
@@ -1071,10 +1289,9 @@ class ngamsConfig:
         Returns:      Instance of ngamsStorageSet or
                       None (ngamsStorageSet | None).
         """
-        for set in self.getStorageSetList():
-            if ((set.getMainDiskSlotId() == slotId) or \
-                (set.getRepDiskSlotId() == slotId)):
-                return set
+        storage_set = self.__compiled.storage_sets_by_slot.get(slotId)
+        if storage_set is not None:
+            return storage_set
         # Raise exception.
         errMsg = genLog("NGAMS_ER_NO_STORAGE_SET", [slotId, self.getCfg()])
         raise Exception(errMsg)
@@ -1222,11 +1439,7 @@ class ngamsConfig:
 
         Returns:    Stream object or None (ngamsStream|None).
         """
-        logger.debug("Finding stream for  mime-type: %s ...", mimeType)
-        for stream in self.getStreamList():
-            if (stream.getMimeType() == mimeType):
-                return stream
-        return None
+        return self.__compiled.streams_by_mime_type.get(mimeType)
 
 
     def addStreamObj(self,
@@ -1239,6 +1452,7 @@ class ngamsConfig:
         Returns:     Reference to object itself.
         """
         self.__streamList.append(streamObj)
+        self._changed()
         return self
 
 
@@ -1660,14 +1874,43 @@ class ngamsConfig:
         par = "FileStagingDef[1].PlugIn"
         return self.getVal(par)
 
+    def getFileStagingMaxBatchSize(self):
+        """
+        Maximum number of files handed over to the stageFiles function of
+        the File Staging Plug-In in a single call.
+
+        :return: The number of files
+        """
+        par = "FileStagingDef[1].MaxBatchSize"
+        return getInt(par, self.getVal(par), 100)
+
+    def getFileStagingBatchWait(self):
+        """
+        Time offline files are gathered for before being staged together.
+
+        :return: The time, in seconds
+        """
+        par = "FileStagingDef[1].BatchWait"
+        val = float_value(self.getVal(par) or '')
+        return 1.0 if val is None else val
+
+    def getFileStagingTimeout(self):
+        """
+        Maximum time requests wait for offline files to be staged.
+
+        :return: The time, in seconds
+        """
+        par = "FileStagingDef[1].Timeout"
+        val = float_value(self.getVal(par) or '')
+        return 10.0 if val is None else val
+
     def getAuthorize(self):
         """
         Return the authorization flag.
 
         Returns:    1 = authorization on (integer/0|1).
         """
-        par = "Authorization[1].Enable"
-        return getInt(par, self.getVal(par))
+        return self.__compiled.authorize
 
     def getAuthExcludeCommandList(self):
         """
@@ -1677,10 +1920,9 @@ class ngamsConfig:
                     e.g. ARCHIVE,CHECKFILE,RETRIEVE,STATUS
                     A "*" is a wildcard for all commands
         """
-        attribute = "Authorization[1].Exclude"
-        exclude_commands = self.getVal(attribute)
+        exclude_commands = self.__compiled.auth_exclude_commands
         if exclude_commands is not None:
-            return exclude_commands.split(",")
+            return list(exclude_commands)
         else:
             return None
 
@@ -1697,6 +1939,7 @@ class ngamsConfig:
         Returns:      Reference to object itself.
         """
         self.__authUserDic[user] = password
+        self._changed()
         return self
 
     def addAuthUserCommands(self, user, commands):
@@ -1712,6 +1955,7 @@ class ngamsConfig:
         """
         if (commands):
             self.__authUserCommandsDic[user] = commands.upper()
+            self._changed()
         return self
 
 
@@ -1724,7 +1968,7 @@ class ngamsConfig:
 
         Returns:   1 = user defined (integer/0|1).
         """
-        if user in self.__authUserDic:
+        if user in self.__compiled.auth_users:
             return 1
         else:
             return 0
@@ -1739,10 +1983,11 @@ class ngamsConfig:
 
         Returns:   Password or None (string).
         """
-        if user not in self.__authUserDic:
+        user_info = self.__compiled.auth_users.get(user)
+        if user_info is None:
             return None
         else:
-            return self.__authUserDic[user]
+            return user_info.encoded_password
 
     def getAuthUserCommands(self, user):
         """
@@ -1769,7 +2014,9 @@ class ngamsConfig:
         """
         if user not in self.__authUserDic:
             raise Exception("Undefined user referenced: %s" % user)
-        pwd = base64.b64decode(self.getAuthUserInfo(user))
+        pwd = self.__compiled.auth_users[user].password
+        if pwd is None:
+            raise Exception("Password of user %s is not available, only its hash" % user)
         authHdrVal = "Basic " + utils.b2s(base64.b64encode(six.b(user) + b":" + pwd))
         return authHdrVal
 
@@ -2022,6 +2269,28 @@ class ngamsConfig:
                 self._check_duplicate(repDiskMtPtDic, "StorageSet.RepDiskSlotId",
                                       set.getRepDiskSlotId())
             self._check_0_1("StorageSet.Mutex", set.getMutex())
+            self._check_0_1("StorageSet.Preallocate", set.getPreallocate())
+            if set.getDurability() not in ("none", "end", "periodic"):
+                errMsg = "Value must be none, end or periodic for property: " +\
+                         "StorageSet.Durability"
+                errMsg = genLog("NGAMS_ER_CONF_PROP", [errMsg])
+                logger.error(errMsg)
+                self.__checkRep.append(errMsg)
+            syncInterval = set.getSyncInterval()
+            if (not isinstance(syncInterval, six.integer_types) or syncInterval <= 0):
+                errMsg = "Value must be a positive integer (MB) for property: " +\
+                         "StorageSet.SyncInterval (got %r)" % (syncInterval,)
+                errMsg = genLog("NGAMS_ER_CONF_PROP", [errMsg])
+                logger.error(errMsg)
+                self.__checkRep.append(errMsg)
+
+        int_user = self.__compiled.auth_users.get(NGAMS_HTTP_INT_AUTH_USER)
+        if int_user is not None and int_user.password is None:
+            errMsg = "The password of the %s user must be base64-encoded, " +\
+                     "not hashed nor invalid"
+            errMsg = genLog("NGAMS_ER_CONF_FILE", [errMsg % NGAMS_HTTP_INT_AUTH_USER])
+            logger.error(errMsg)
+            report.append(errMsg)
 
         if (self.getAllowArchiveReq()):
             mimeTypeDic = {}
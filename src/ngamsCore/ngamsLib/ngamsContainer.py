@@ -119,17 +119,39 @@ class ngamsContainer(object):
 
     def _genXml(self, doc):
         contEl = doc.createElement('Container')
-        contEl.setAttribute('id', str(self.getContainerId())) # might be an uuid.uuid4 object
-        contEl.setAttribute('name', self.getContainerName())
-        contEl.setAttribute('size', str(self.getContainerSize()))
-        if self._ingestionDate is not None:
-            contEl.setAttribute('ingestionDate', toiso8601(self._ingestionDate))
+        for name, value in self.genXmlAttributes():
+            contEl.setAttribute(name, value)
         for fileInfo in self._filesInfo:
             contEl.appendChild( fileInfo.genXml() )
         for childCont in self._containers:
             contEl.appendChild( childCont._genXml(doc) )
         return contEl
 
+    def genXmlAttributes(self):
+        """
+        Returns the attributes of the Container XML Element
+        for this object as a list of (name, value) tuples
+        """
+        attributes = [('id', str(self.getContainerId())), # might be an uuid.uuid4 object
+                      ('name', self.getContainerName()),
+                      ('size', str(self.getContainerSize()))]
+        if self._ingestionDate is not None:
+            attributes.append(('ingestionDate', toiso8601(self._ingestionDate)))
+        return attributes
+
+    def writeXml(self, writer):
+        """
+        Writes the Container XML Element for this object,
+        and those of its files and child containers,
+        with the given status_xml.XmlWriter
+        """
+        writer.start('Container', self.genXmlAttributes())
+        for fileInfo in self._filesInfo:
+            fileInfo.writeXml(writer)
+        for childCont in self._containers:
+            childCont.writeXml(writer)
+        writer.end()
+
     def unpackFromDomNode(self, contEl):
         """
         Unpacks the contents of the given DOM Element
@@ -201,6 +201,7 @@ NGAMS_HTTP_PAR_UNIQUE        = "unique"
 NGAMS_HTTP_HDR_FILE_INFO     = "NGAS-File-Info"
 NGAMS_HTTP_HDR_CONTENT_TYPE  = "Content-Type"
 NGAMS_HTTP_HDR_CHECKSUM      = "NGAS-File-CRC"
+NGAMS_HTTP_HDR_FILE_SIZE     = "NGAS-File-Size"
 
 # Types of Notification Events.
 NGAMS_NOTIF_INFO        = "InfoNotification"
@@ -416,6 +417,9 @@ def createSortDicDump(dic):
 
 _scale = {"B": 1.0, "KB": 1.0/1024.0, "MB": 1.0/1048576.0,
           "GB": 1.0/1073741824.0, "TB": 1.0/1099511627776.0}
+# Time during which the result of a "smart" disk space check is re-used
+DISK_SPACE_CACHE_TIME = 1.0
+_diskSpaceCache = {}
 def getDiskSpaceAvail(mountPoint, format = 'MB', smart = True):
     """
     Get the disk space available for the disk with the given mount point.
@@ -426,21 +430,31 @@ def getDiskSpaceAvail(mountPoint, format = 'MB', smart = True):
 
     float:       Return the result in floating point (0|1/integer).
 
-    smart:       Call maximum this function every 10s on a given path
-                 (0|1/integer).
+    smart:       Check the disk space at most every DISK_SPACE_CACHE_TIME
+                 seconds on a given path (0|1/integer).
 
     Returns:     Returns available space in MB (integer).
     """
-    logger.debug("Checking disk space available for path: %s", mountPoint)
+    now = time.time()
+    if smart:
+        cached = _diskSpaceCache.get(mountPoint)
+        if cached and now - cached[0] < DISK_SPACE_CACHE_TIME:
+            return cached[1] * _scale[format]
 
-    startTime = time.time()
+    logger.debug("Checking disk space available for path: %s", mountPoint)
 
     st = os.statvfs(mountPoint)
-    diskSpace = (st.f_bavail * st.f_frsize) * _scale[format]
+    availBytes = st.f_bavail * st.f_frsize
+    diskSpace = availBytes * _scale[format]
+
+    # Paths come from many places, don't keep them forever
+    if len(_diskSpaceCache) > 1000:
+        _diskSpaceCache.clear()
+    _diskSpaceCache[mountPoint] = (now, availBytes)
 
     msg = ("Checked disk space available for path: %s - Result (MB): %.3f"
            " Time: %.3fs")
-    logger.debug(msg,  mountPoint, diskSpace, (time.time() - startTime))
+    logger.debug(msg,  mountPoint, diskSpace, (time.time() - now))
 
     return diskSpace
 
@@ -665,6 +679,19 @@ def getBoolean(val):
         msg = "Value given: %s, does not seem to be a boolean"
         raise Exception(msg % str(val))
 
+def loadPlugInModule(plugInName):
+    """
+    Loads the module of an NGAMS Plug-In, looking first for it under the
+    ngamsPlugIns package, and then as a top-level module.
+    """
+    logger.debug("Looking for %s plug-in module", plugInName)
+    try:
+        logger.debug("Trying with module ngamsPlugIns.%s", plugInName)
+        return importlib.import_module('ngamsPlugIns.' + plugInName)
+    except ImportError:
+        logger.debug("Trying with module %s", plugInName)
+        return importlib.import_module(plugInName)
+
 def loadPlugInEntryPoint(plugInName, entryPointMethodName=None, returnNone=False):
     """
     Loads the entry point method of an NGAMS Plug-In. First the
@@ -680,14 +707,7 @@ def loadPlugInEntryPoint(plugInName, entryPointMethodName=None, returnNone=False
     if not entryPointMethodName:
         entryPointMethodName = plugInName.split('.')[-1]
 
-    logger.debug("Looking for %s plug-in module", plugInName)
-    try:
-        logger.debug("Trying with module ngamsPlugIns.%s", plugInName)
-        plugInModule = importlib.import_module('ngamsPlugIns.' + plugInName)
-    except ImportError:
-        logger.debug("Trying with module %s", plugInName)
-        plugInModule = importlib.import_module(plugInName)
-
+    plugInModule = loadPlugInModule(plugInName)
     logger.debug("Loading entry-point method %s from module %s ", entryPointMethodName,plugInModule.__name__)
 
     try:
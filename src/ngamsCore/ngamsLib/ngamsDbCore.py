@@ -853,6 +853,20 @@ class ngamsDbCore(object):
             return t.execute(sqlQuery, args)
 
 
+    def getPoolStatistics(self):
+        """
+        Return the number of connections of the pool currently in use, the
+        number of idle connections, and the maximum allowed.
+
+        Returns:    Dictionary with 'in_use', 'idle' and 'max' keys (dictionary).
+        """
+        pool = self.__pool
+        return {
+            'in_use': getattr(pool, '_connections', 0),
+            'idle': len(getattr(pool, '_idle_cache', ())),
+            'max': getattr(pool, '_maxconnections', 0),
+        }
+
     def dbCursor(self, sqlQuery, args=()):
         """
         Create a cursor on the given query and return the cursor object.
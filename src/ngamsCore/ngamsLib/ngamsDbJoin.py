@@ -751,42 +751,96 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
         return fileInfoDbmName
 
 
-    def writeFileEntry(self,
-                       hostId,
-                       diskId,
-                       filename,
-                       fileId,
-                       fileVersion,
-                       format,
-                       fileSize,
-                       uncompressedFileSize,
-                       compression,
-                       ingestionDate,
-                       ignore,
-                       checksum,
-                       checksumPlugIn,
-                       fileStatus,
-                       creationDate,
-                       iotime,
-                       ingestionRate,
-                       genSnapshot = 1,
-                       updateDiskInfo = 0,
-                       prev_disk_id=None):
+    def getClusterFileKeys(self,
+                           clusterName,
+                           fromIngDate = None):
         """
-        The method writes the information in connection with a file in the
-        NGAS DB. If an entry already exists for that file, it is updated
-        with the information contained in the File Info Object. Otherwise,
-        a new entry is created.
+        Return the File ID, File Version and Ingestion Date of the files
+        registered in the name space of the referenced cluster. The result
+        is read through a cursor, so it is never held in memory at once.
 
-        diskId           Values for the columns in the ngas_disks
-        ...              table (use values returned from ngamsFileInfo).
+        Note, all files in the cluster are taken, also the ones marked
+        as bad or to be ignored.
 
-        genSnapshot:     Generate a snapshot file (integer/0|1).
+        clusterName:       Name of cluster to consider (string).
 
-        updateDiskInfo:  Update automatically the disk info for the
-                         disk hosting this file (integer/0|1).
+        fromIngDate:       If given, only files ingested at, or after, this
+                           date are considered (string|None).
 
-        Returns:         Void.
+        Returns:           Generator yielding (<File ID>, <File Version>,
+                           <Ingestion Date>) tuples.
+        """
+        sql = ["SELECT nf.file_id, nf.file_version, nf.ingestion_date "
+               "FROM ngas_files nf, ngas_disks nd "
+               "WHERE nf.disk_id=nd.disk_id AND "
+               "(nd.host_id IN (SELECT host_id FROM ngas_hosts "
+               "WHERE cluster_name={}) OR "
+               "nd.last_host_id IN (SELECT host_id FROM ngas_hosts "
+               "WHERE cluster_name={}))"]
+        vals = [clusterName, clusterName]
+        if fromIngDate:
+            sql.append(" AND nf.ingestion_date >= {}")
+            vals.append(self.convertTimeStamp(fromIngDate))
+
+        with self.dbCursor(''.join(sql), args=vals) as cursor:
+            for fileId, fileVersion, ingDate in cursor.fetch(1000):
+                yield fileId, int(fileVersion), ingDate
+
+
+    def getClusterFileVersions(self,
+                               clusterName,
+                               fileIds):
+        """
+        Return the File ID/Versions registered in the name space of the
+        referenced cluster for the given File IDs.
+
+        clusterName:       Name of cluster to consider (string).
+
+        fileIds:           File IDs to query for (list).
+
+        Returns:           Set with (<File ID>, <File Version>) tuples (set).
+        """
+        if not fileIds:
+            return set()
+        fileIdMarkers = ", ".join(["{}"] * len(fileIds))
+        sql = ("SELECT nf.file_id, nf.file_version "
+               "FROM ngas_files nf, ngas_disks nd "
+               "WHERE nf.disk_id=nd.disk_id AND "
+               "(nd.host_id IN (SELECT host_id FROM ngas_hosts "
+               "WHERE cluster_name={}) OR "
+               "nd.last_host_id IN (SELECT host_id FROM ngas_hosts "
+               "WHERE cluster_name={})) AND "
+               "nf.file_id IN (%s)") % fileIdMarkers
+        res = self.query2(sql, args=[clusterName, clusterName] + list(fileIds))
+        return set((fileId, int(fileVersion)) for fileId, fileVersion in res)
+
+
+    def _fileEntrySql(self,
+                      query_method,
+                      diskId,
+                      filename,
+                      fileId,
+                      fileVersion,
+                      format,
+                      fileSize,
+                      uncompressedFileSize,
+                      compression,
+                      ingestionDate,
+                      ignore,
+                      checksum,
+                      checksumPlugIn,
+                      fileStatus,
+                      creationDate,
+                      iotime,
+                      ingestionRate,
+                      prev_disk_id):
+        """
+        Generates the SQL statement (and its values) that creates or updates
+        the row of a file in the ngas_files table. ``query_method`` is used
+        to check whether the row exists already.
+
+        Returns:    Tuple with the SQL statement, its values and the DB
+                    operation (NGAMS_DB_CH_FILE_UPDATE|NGAMS_DB_CH_FILE_INSERT).
         """
         # Check if the entry already exists. If yes update it, otherwise
         # insert a new element.
@@ -797,11 +851,18 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
         ingDate = self.convertTimeStamp(ingestionDate)
         creDate = self.convertTimeStamp(creationDate)
 
+        sql = ["SELECT file_id FROM ngas_files WHERE file_id={0} AND disk_id={1}"]
+        vals = [fileId, prev_disk_id or diskId]
+        if fileVersion != -1:
+            sql.append(" AND file_version={2}")
+            vals.append(fileVersion)
+        fileInDb = len(query_method(''.join(sql), args=vals)) == 1
+
         sql = []
         vals = []
         sql_str = None
 
-        if (self.fileInDb(prev_disk_id or diskId, fileId, fileVersion)):
+        if fileInDb:
             # We only allow to modify a limited set of columns.
             sql.append(("UPDATE ngas_files SET "
                        "file_name={}, format={}, file_size={}, "
@@ -832,6 +893,51 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
                     int(iotime*1000), ingestionRate)
             dbOperation = NGAMS_DB_CH_FILE_INSERT
 
+        return sql_str, vals, dbOperation
+
+
+    def writeFileEntry(self,
+                       hostId,
+                       diskId,
+                       filename,
+                       fileId,
+                       fileVersion,
+                       format,
+                       fileSize,
+                       uncompressedFileSize,
+                       compression,
+                       ingestionDate,
+                       ignore,
+                       checksum,
+                       checksumPlugIn,
+                       fileStatus,
+                       creationDate,
+                       iotime,
+                       ingestionRate,
+                       genSnapshot = 1,
+                       updateDiskInfo = 0,
+                       prev_disk_id=None):
+        """
+        The method writes the information in connection with a file in the
+        NGAS DB. If an entry already exists for that file, it is updated
+        with the information contained in the File Info Object. Otherwise,
+        a new entry is created.
+
+        diskId           Values for the columns in the ngas_disks
+        ...              table (use values returned from ngamsFileInfo).
+
+        genSnapshot:     Generate a snapshot file (integer/0|1).
+
+        updateDiskInfo:  Update automatically the disk info for the
+                         disk hosting this file (integer/0|1).
+
+        Returns:         Void.
+        """
+        sql_str, vals, dbOperation = self._fileEntrySql(
+            self.query2, diskId, filename, fileId, fileVersion, format,
+            fileSize, uncompressedFileSize, compression, ingestionDate,
+            ignore, checksum, checksumPlugIn, fileStatus, creationDate,
+            iotime, ingestionRate, prev_disk_id)
         self.query2(sql_str, args = vals)
 
         # Update the Disk Info of the disk concerned if requested and
@@ -860,6 +966,50 @@ class ngamsDbJoin(ngamsDbCore.ngamsDbCore):
         self.triggerEvents([diskId, None])
 
 
+    def writeFileEntries(self,
+                         hostId,
+                         fileInfoObjList,
+                         genSnapshot = 1):
+        """
+        Write the information of several files into the NGAS DB within a
+        single DB transaction. Like writeFileEntry(), an existing entry is
+        updated, otherwise a new entry is created.
+
+        hostId:           ID of host writing the entries (string).
+
+        fileInfoObjList:  List of File Info Objects to write (list/ngamsFileInfo).
+
+        genSnapshot:      Generate a snapshot file (integer/0|1).
+
+        Returns:          List with the DB operation carried out for each
+                          file (list/NGAMS_DB_CH_FILE_UPDATE|
+                          NGAMS_DB_CH_FILE_INSERT).
+        """
+        dbOperations = []
+        with self.transaction() as t:
+            for fio in fileInfoObjList:
+                sql_str, vals, dbOperation = self._fileEntrySql(
+                    t.execute, fio.getDiskId(), fio.getFilename(),
+                    fio.getFileId(), fio.getFileVersion(), fio.getFormat(),
+                    fio.getFileSize(), fio.getUncompressedFileSize(),
+                    fio.getCompression(), fio.getIngestionDate(),
+                    fio.getIgnore(), fio.getChecksum(),
+                    fio.getChecksumPlugIn(), fio.getFileStatus(),
+                    fio.getCreationDate(), fio.getIoTime(),
+                    fio.getIngestionRate(), None)
+                t.execute(sql_str, args = vals)
+                dbOperations.append(dbOperation)
+
+        # Create the Temporary DB Change Snapshot Documents if requested.
+        if (self.getCreateDbSnapshot() and genSnapshot):
+            for fio, dbOperation in zip(fileInfoObjList, dbOperations):
+                self.createDbFileChangeStatusDoc(hostId, dbOperation, [fio])
+
+        for diskId in set(fio.getDiskId() for fio in fileInfoObjList):
+            self.triggerEvents([diskId, None])
+        return dbOperations
+
+
     def getClusterReadyArchivingUnits(self,
                                       clusterName):
         """
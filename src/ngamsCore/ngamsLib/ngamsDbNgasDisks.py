@@ -59,30 +59,14 @@ class ngamsDbNgasDisks(ngamsDbCore.ngamsDbCore):
 
         Returns:      Reference to object itself.
         """
-        try:
-            self.takeGlobalDbSem()
-            sql = ("SELECT number_of_files, available_mb, "
-                    "bytes_stored, mount_point "
-                    "FROM ngas_disks WHERE disk_id={}")
-            res = self.query2(sql, args = (diskId,))
-            if not res:
-                errMsg = "Cannot find entry for disk with ID: %s." % diskId
-                raise Exception(errMsg)
-
-            numberOfFiles = res[0][0]
-            bytesStored = res[0][2]
-            mountPoint = res[0][3]
-            newNumberOfFiles = numberOfFiles + 1
-            newAvailMb = getDiskSpaceAvail(mountPoint)
-            newBytesStored = bytesStored + fileSize
-
-            sql = ("UPDATE ngas_disks SET number_of_files={}, available_mb={},"
-                   " bytes_stored={} WHERE disk_id={}")
-            vals = [newNumberOfFiles, newAvailMb, newBytesStored, diskId]
-            self.query2(sql, args = vals)
-            self.triggerEvents()
-        finally:
-            self.relGlobalDbSem()
+        sql = "SELECT mount_point FROM ngas_disks WHERE disk_id={}"
+        res = self.query2(sql, args = (diskId,))
+        if not res:
+            errMsg = "Cannot find entry for disk with ID: %s." % diskId
+            raise Exception(errMsg)
+        self.add_files(diskId, 1, fileSize, getDiskSpaceAvail(res[0][0]))
+        self.triggerEvents()
+        return self
 
 
     def diskInDb(self, diskId):
@@ -670,6 +654,22 @@ class ngamsDbNgasDisks(ngamsDbCore.ngamsDbCore):
         """
         self._add_file(self.query2, fileSize, diskId)
 
+    def add_files(self, disk_id, n_files, n_bytes, available_mb=None):
+        """
+        Update the row for the volume ``disk_id`` hosting ``n_files`` new files
+        with a total size of ``n_bytes``, and optionally with its new amount
+        of available space.
+        """
+        sql = ("UPDATE ngas_disks SET number_of_files=(number_of_files + {0}), "
+               "bytes_stored=(bytes_stored + {1})")
+        args = [n_files, n_bytes]
+        if available_mb is not None:
+            sql += ", available_mb={2}"
+            args.append(available_mb)
+        sql += " WHERE disk_id={%d}" % len(args)
+        args.append(disk_id)
+        self.query2(sql, args=args)
+
     def _add_file(self, query_method, fileSize, diskId):
         sqlQuery = "UPDATE ngas_disks SET " +\
                    "number_of_files=(number_of_files + 1), " +\
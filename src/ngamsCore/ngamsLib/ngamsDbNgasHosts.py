@@ -64,6 +64,17 @@ class ngamsDbNgasHosts(ngamsDbCore.ngamsDbCore):
         return self.query2(''.join(sqlQuery), args=[str(h) for h in hostList])
 
 
+    def getAllHostInfo(self):
+        """
+        Return the information about all hosts in the NGAS Hosts Table.
+
+        Returns:     List with sub-lists containing the information about the
+                     hosts from the NGAS Hosts Table (list).
+        """
+        sqlQuery = "SELECT %s FROM ngas_hosts nh" % ngamsDbCore.getNgasHostsCols()
+        return self.query2(sqlQuery)
+
+
     def getIpFromHostId(self,
                         hostId):
         """
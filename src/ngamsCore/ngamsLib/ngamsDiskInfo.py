@@ -700,25 +700,67 @@ class ngamsDiskInfo:
 
         Returns:            XML Dom Node (Node).
         """
-        ign = ignoreUndefFields
         diskStatusEl = xml.dom.minidom.Document().createElement("DiskStatus")
-        objStat = self.getObjStatus()
-        for fieldName, val in objStat:
+        for name, val in self.genXmlAttributes(genLimitedInfo,
+                                               ignoreUndefFields):
+            diskStatusEl.setAttribute(name, val)
+
+        if (genFileStatus):
+            for file in self.getFileObjList():
+                fileStatusEl = file.genXml(0, ignoreUndefFields)
+                diskStatusEl.appendChild(fileStatusEl)
+
+        return diskStatusEl
+
+
+    def genXmlAttributes(self,
+                         genLimitedInfo = 0,
+                         ignoreUndefFields = 0):
+        """
+        Generate the attributes of the DiskStatus XML Element for this
+        object, in the order they appear in the element.
+
+        For an explanation of the input parameters read man-page for the
+        method genXml().
+
+        Returns:            List with (name, value) tuples (list/tuple).
+        """
+        ign = ignoreUndefFields
+        attributes = []
+        for fieldName, val in self.getObjStatus():
             if ((fieldName == "HostId") or (fieldName == "SlotId") or
                 (fieldName == "Mounted") or (fieldName == "MountPoint") or
                 (fieldName == "LastCheck")):
                 if ((not genLimitedInfo) and (not ignoreValue(ign, val))):
-                    diskStatusEl.setAttribute(fieldName, str(val))
+                    attributes.append((fieldName, str(val)))
             else:
                 if (not ignoreValue(ign, val)):
-                    diskStatusEl.setAttribute(fieldName, str(val))
+                    attributes.append((fieldName, str(val)))
+        return attributes
+
+
+    def writeXml(self,
+                 writer,
+                 genLimitedInfo = 0,
+                 genFileStatus = 1,
+                 ignoreUndefFields = 0):
+        """
+        Write the DiskStatus XML Element for this object with an
+        XML writer, without building a DOM Node.
+
+        writer:             XML writer (status_xml.XmlWriter).
 
+        For an explanation of the other input parameters read man-page for
+        the method genXml().
+
+        Returns:            Void.
+        """
+        writer.start("DiskStatus",
+                     self.genXmlAttributes(genLimitedInfo, ignoreUndefFields))
         if (genFileStatus):
             for file in self.getFileObjList():
-                fileStatusEl = file.genXml(0, ignoreUndefFields)
-                diskStatusEl.appendChild(fileStatusEl)
-
-        return diskStatusEl
+                file.writeXml(writer, 0, ignoreUndefFields)
+        writer.end()
 
 
     def unpackFromDomNode(self,
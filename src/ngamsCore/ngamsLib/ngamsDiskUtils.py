@@ -736,25 +736,51 @@ def updateDiskStatusDb(dbConObj,
 
     Returns:        Disk Info Object (ngamsDiskInfo).
     """
-    logger.debug("Updating disk status for disk with ID: %s", piStat.getDiskId())
+    newFiles = 0 if piStat.getFileExists() else 1
+    return updateDiskStatusDbFiles(dbConObj, piStat.getDiskId(), newFiles,
+                                   piStat.getFileSize(), piStat.getIoTime())
+
+
+def updateDiskStatusDbFiles(dbConObj,
+                            diskId,
+                            newFiles,
+                            bytesStored,
+                            ioTime):
+    """
+    Like updateDiskStatusDb(), but accounts at once for a number of files
+    that were stored on the same disk.
+
+    dbConObj:       DB connection object (ngamsDb).
+
+    diskId:         ID of the disk (string).
+
+    newFiles:       Number of files that were not stored already in this
+                    disk (integer).
+
+    bytesStored:    Total number of bytes stored (integer).
+
+    ioTime:         Total I/O time spent writing the files (float).
+
+    Returns:        Disk Info Object (ngamsDiskInfo).
+    """
+    logger.debug("Updating disk status for disk with ID: %s", diskId)
 
     global _ngamsDisksSem
     _ngamsDisksSem.acquire()
 
     diskInfo = ngamsDiskInfo.ngamsDiskInfo()
-    diskInfo.read(dbConObj, piStat.getDiskId())
+    diskInfo.read(dbConObj, diskId)
     # Increment only the number of files (stored on the disk), if a
     # new file (not already existing in this environment) was stored.
-    if (not piStat.getFileExists()):
-        diskInfo.setNumberOfFiles(diskInfo.getNumberOfFiles() + 1)
+    diskInfo.setNumberOfFiles(diskInfo.getNumberOfFiles() + newFiles)
     diskInfo.setAvailableMb(getDiskSpaceAvail(diskInfo.getMountPoint()))
-    diskInfo.setBytesStored(diskInfo.getBytesStored() + piStat.getFileSize())
+    diskInfo.setBytesStored(diskInfo.getBytesStored() + bytesStored)
     diskInfo.setTotalDiskWriteTime(diskInfo.getTotalDiskWriteTime() +\
-                                   piStat.getIoTime())
+                                   ioTime)
     diskInfo.write(dbConObj)
 
     _ngamsDisksSem.release()
-    logger.debug("Updated disk status for disk with ID: %s", piStat.getDiskId())
+    logger.debug("Updated disk status for disk with ID: %s", diskId)
 
     return diskInfo
 
@@ -788,7 +814,8 @@ def getDiskInfoObjsFromMimeType(hostId,
                                 dbConObj,
                                 ngamsCfgObj,
                                 mimeType,
-                                sendNotification = 1):
+                                sendNotification = 1,
+                                volumes = None):
     """
     Get the Disk Info for the disks allocated related to a certain
     mime-type/stream.
@@ -802,6 +829,9 @@ def getDiskInfoObjsFromMimeType(hostId,
     sendNotification:   1 = send email notification message in case
                         no disks are found (integer).
 
+    volumes:            Disk Info Objects of the disks of the host, used
+                        instead of querying the DB (list/ngamsDiskInfo|None).
+
     Returns:            List of Disk Info Objects (list/ngamsDiskInfo).
     """
     stream = ngamsCfgObj.getStreamFromMimeType(mimeType)
@@ -814,7 +844,10 @@ def getDiskInfoObjsFromMimeType(hostId,
         slotIds.append(set.getMainDiskSlotId())
         if (set.getRepDiskSlotId() != ""):
             slotIds.append(set.getRepDiskSlotId())
-    diskInfo = dbConObj.getDiskInfoForSlotsAndHost(hostId, slotIds)
+    if volumes is not None:
+        diskInfo = [v for v in volumes if v.getSlotId() in slotIds]
+    else:
+        diskInfo = dbConObj.getDiskInfoForSlotsAndHost(hostId, slotIds)
     if (diskInfo == []):
         errMsg = genLog("NGAMS_AL_NO_STO_SETS", [mimeType])
         logger.warning(errMsg)
@@ -823,6 +856,9 @@ def getDiskInfoObjsFromMimeType(hostId,
                                      "NO STORAGE SET (DISKS) AVAILABLE",errMsg)
         raise Exception(errMsg)
 
+    if volumes is not None:
+        return diskInfo
+
     # Unpack the disk information into ngamsDiskInfo objects.
     diskInfoObjs = []
     for diRaw in diskInfo:
@@ -916,6 +952,22 @@ def findTargetDiskResetCache():
     _diskInfoDic       = {}
 
 
+def _bestTargetDisk(diskInfoObjs, mtRootDir):
+    """
+    Like ngamsDb.getBestTargetDisk(), but among the given Disk Info Objects:
+    the ID of the most full disk not completed, mounted under the root
+    directory, installed first.
+    """
+    if not mtRootDir.endswith('/'):
+        mtRootDir += "/"
+    candidates = [d for d in diskInfoObjs if not d.getCompleted() and
+                  (d.getMountPoint() or '').startswith(mtRootDir)]
+    if not candidates:
+        return None
+    candidates.sort(key=lambda d: (-d.getBytesStored(), d.getInstallationDate() or 0))
+    return candidates[0].getDiskId()
+
+
 def findTargetDisk(hostId,
                    dbConObj,
                    ngamsCfgObj,
@@ -923,7 +975,8 @@ def findTargetDisk(hostId,
                    sendNotification = 1,
                    diskExemptList = [],
                    caching = 0,
-                   reqSpace = None):
+                   reqSpace = None,
+                   volumes = None):
     """
     Find a target disk for a file being received.
 
@@ -944,6 +997,11 @@ def findTargetDisk(hostId,
 
     reqSpace:          The required space needed in bytes (integer).
 
+    volumes:           Disk Info Objects of the disks of the host, as kept
+                       in memory by the server. If given, the target disk
+                       is selected among these without querying the DB
+                       (list/ngamsDiskInfo).
+
     Returns:           ngamsDiskInfo object containing the necessary
                        information (ngamsDiskInfo).
     """
@@ -954,7 +1012,8 @@ def findTargetDisk(hostId,
     global _diskInfoObjsDic
     if (not caching) or (mimeType not in _diskInfoObjsDic):
         diskInfoObjs = getDiskInfoObjsFromMimeType(hostId, dbConObj, ngamsCfgObj,
-                                                   mimeType, sendNotification)
+                                                   mimeType, sendNotification,
+                                                   volumes=volumes)
         if (caching): _diskInfoObjsDic[mimeType] = diskInfoObjs
     else:
         diskInfoObjs = _diskInfoObjsDic[mimeType]
@@ -1016,7 +1075,10 @@ def findTargetDisk(hostId,
     # Find the best target disk.
     global _bestTargetDiskDic
     key = str(diskIds)[1:-1].replace("'", "_").replace(", ", "")
-    if ((not caching) or (key not in _bestTargetDiskDic)):
+    if volumes is not None:
+        diskId = _bestTargetDisk([diskIdDic[diskId] for diskId in diskIds],
+                                 ngamsCfgObj.getRootDirectory())
+    elif ((not caching) or (key not in _bestTargetDiskDic)):
         diskId = dbConObj.getBestTargetDisk(diskIds,
                                             ngamsCfgObj.getRootDirectory())
         if (caching): _bestTargetDiskDic[key] = diskId
@@ -1033,7 +1095,11 @@ def findTargetDisk(hostId,
     else:
         global _diskInfoDic
         key = diskId + "_" + mimeType
-        if ((not caching) or (key not in _diskInfoDic)):
+        if volumes is not None:
+            diskInfo = diskIdDic[diskId]
+            storageSet = ngamsCfgObj.getStorageSetFromSlotId(diskInfo.getSlotId())
+            diskInfo.setStorageSetId(storageSet.getStorageSetId())
+        elif ((not caching) or (key not in _diskInfoDic)):
             diskInfo = ngamsDiskInfo.ngamsDiskInfo()
             diskInfo.getInfo(dbConObj, ngamsCfgObj, diskId, mimeType)
             if (caching): _diskInfoDic[key] = diskInfo
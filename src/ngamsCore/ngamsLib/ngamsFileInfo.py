@@ -865,17 +865,53 @@ class ngamsFileInfo:
 
         Returns:            XML DOM Node object (Node).
         """
-        ign = ignoreUndefFields
         fileStatusEl = xml.dom.minidom.Document().createElement("FileStatus")
-        objStat = self.getObjStatus()
-        for fieldName, val in objStat:
+        for name, val in self.genXmlAttributes(storeDiskId, ignoreUndefFields):
+            fileStatusEl.setAttribute(name, val)
+        return fileStatusEl
+
+
+    def genXmlAttributes(self,
+                         storeDiskId = 0,
+                         ignoreUndefFields = 0):
+        """
+        Generate the attributes of the FileStatus XML Element for this
+        object, in the order they appear in the element.
+
+        For an explanation of the input parameters read man-page for the
+        method genXml().
+
+        Returns:            List with (name, value) tuples (list/tuple).
+        """
+        ign = ignoreUndefFields
+        attributes = []
+        for fieldName, val in self.getObjStatus():
             if (fieldName == "DiskId"):
                 if (storeDiskId and (not ignoreValue(ign, self.getDiskId()))):
-                    fileStatusEl.setAttribute("DiskId", self.getDiskId())
+                    attributes.append(("DiskId", self.getDiskId()))
             else:
                 if (not ignoreValue(ign, val)):
-                    fileStatusEl.setAttribute(fieldName, str(val))
-        return fileStatusEl
+                    attributes.append((fieldName, str(val)))
+        return attributes
+
+
+    def writeXml(self,
+                 writer,
+                 storeDiskId = 0,
+                 ignoreUndefFields = 0):
+        """
+        Write the FileStatus XML Element for this object with an
+        XML writer, without building a DOM Node.
+
+        writer:             XML writer (status_xml.XmlWriter).
+
+        For an explanation of the other input parameters read man-page for
+        the method genXml().
+
+        Returns:            Void.
+        """
+        writer.element("FileStatus",
+                       self.genXmlAttributes(storeDiskId, ignoreUndefFields))
 
 
     def dumpBuf(self,
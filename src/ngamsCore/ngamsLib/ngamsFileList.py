@@ -203,11 +203,8 @@ class ngamsFileList:
         Returns:     XML DOM Node object (Node).
         """
         fileListEl = xml.dom.minidom.Document().createElement("FileList")
-        fileListEl.setAttribute("Id", self.getId())
-        if (self.getComment() != ""):
-            fileListEl.setAttribute("Comment", self.getComment())
-        if (self.getStatus() != ""):
-            fileListEl.setAttribute("Status", self.getStatus())
+        for name, val in self.genXmlAttributes():
+            fileListEl.setAttribute(name, val)
         for fileInfoObj in self.getFileInfoObjList():
             fileInfoXmlNode = fileInfoObj.genXml(1, 1)
             fileListEl.appendChild(fileInfoXmlNode)
@@ -217,6 +214,39 @@ class ngamsFileList:
         return fileListEl
 
 
+    def genXmlAttributes(self):
+        """
+        Generate the attributes of the FileList XML Element for this
+        object, in the order they appear in the element.
+
+        Returns:     List with (name, value) tuples (list/tuple).
+        """
+        attributes = [("Id", self.getId())]
+        if (self.getComment() != ""):
+            attributes.append(("Comment", self.getComment()))
+        if (self.getStatus() != ""):
+            attributes.append(("Status", self.getStatus()))
+        return attributes
+
+
+    def writeXml(self,
+                 writer):
+        """
+        Write the FileList XML Element for this object with an
+        XML writer, without building a DOM Node.
+
+        writer:      XML writer (status_xml.XmlWriter).
+
+        Returns:     Void.
+        """
+        writer.start("FileList", self.genXmlAttributes())
+        for fileInfoObj in self.getFileInfoObjList():
+            fileInfoObj.writeXml(writer, 1, 1)
+        for fileListObj in self.getFileListObjList():
+            fileListObj.writeXml(writer)
+        writer.end()
+
+
     def unpackFromDomNode(self,
                           fileListNode):
         """
@@ -323,4 +323,85 @@ class sizeaware(object):
         return buf
 
     def __len__(self):
-        return self.size
\ No newline at end of file
+        return self.size
+
+class chunked_body(object):
+    """
+    Small utility class that presents the contents of the file object `f`
+    framed with chunked transfer encoding, to be sent as the body of an HTTP
+    request. `trailers` is an optional callable, invoked once all the contents
+    of `f` have been read, returning a dictionary with the trailer fields to
+    send after them.
+    """
+
+    def __init__(self, f, trailers=None):
+        self.f = f
+        self.trailers = trailers
+        self.done = False
+
+    def read(self, n=65536):
+        if self.done:
+            return b''
+        buf = self.f.read(n)
+        if buf:
+            return ('%x\r\n' % len(buf)).encode('ascii') + buf + b'\r\n'
+        self.done = True
+        fields = self.trailers() if self.trailers else {}
+        fields = ''.join('%s: %s\r\n' % (k, v) for k, v in fields.items())
+        return b'0\r\n' + fields.encode('latin-1') + b'\r\n'
+
+    def seek(self, pos):
+        self.f.seek(pos)
+        self.done = False
+
+
+class chunked_reader(object):
+    """
+    Small utility class that wraps the file object from which the body of an
+    HTTP message sent with chunked transfer encoding is read, and presents
+    it as a file object with the decoded data. Once all the data has been
+    read, the trailer fields that followed it are available in `trailers`,
+    with lower-cased names.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.left = 0
+        self.eof = False
+        self.trailers = {}
+
+    def _readline(self):
+        line = self.f.readline(65537)
+        if not line.endswith(b'\n'):
+            raise IOError('Premature end of chunked data')
+        return line
+
+    def _next_chunk(self):
+        line = self._readline()
+        try:
+            self.left = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise IOError('Invalid chunk size line: %r' % line)
+        if self.left > 0:
+            return
+        while True:
+            line = self._readline().strip()
+            if not line:
+                break
+            name, _, val = line.decode('latin-1').partition(':')
+            self.trailers[name.strip().lower()] = val.strip()
+        self.eof = True
+
+    def read(self, n=-1):
+        if not self.left and not self.eof:
+            self._next_chunk()
+        if self.eof:
+            return b''
+        buf = self.f.read(self.left if n < 0 or n > self.left else n)
+        if not buf:
+            raise IOError('Premature end of chunked data')
+        self.left -= len(buf)
+        if not self.left:
+            # CRLF closing the chunk
+            self._readline()
+        return buf
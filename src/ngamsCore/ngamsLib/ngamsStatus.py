@@ -39,6 +39,7 @@ import six
 
 from . import ngamsConfig, ngamsDiskInfo, ngamsFileList
 from . import ngamsContainer
+from . import status_xml
 from . import utils
 from .ngamsCore import ngamsGetChildNodes, NGAMS_XML_STATUS_ROOT_EL, \
     getAttribValue, prFormat1, toiso8601, fromiso8601, getNgamsVersion, \
@@ -623,6 +624,55 @@ class ngamsStatus:
             raise Exception(errMsg)
 
 
+    def unpackStatusNode(self,
+                         statusNode,
+                         getStatus = 0):
+        """
+        Unpack the information contained in a DOM Status Node and set the
+        members of the class accordingly.
+
+        statusNode:         DOM Status Node (Node).
+
+        getStatus:          Extract also the status information from the
+                            Status Node (0|1/integer).
+
+        Returns:            Reference to object itself.
+        """
+        self.setDate(getAttribValue(statusNode, "Date"))
+        self.setVersion(getAttribValue(statusNode, "Version"))
+        self.setHostId(getAttribValue(statusNode, "HostId"))
+        if (getStatus):
+            self.setStatus(getAttribValue(statusNode, "Status"))
+        self.setMessage(getAttribValue(statusNode, "Message"))
+        if (getStatus):
+            self.setState(getAttribValue(statusNode, "State"))
+            self.setSubState(getAttribValue(statusNode, "SubState"))
+
+        # Get the optional request handling status.
+        requestId = getAttribValue(statusNode, "RequestId", 1)
+        if (requestId): self.setRequestId(requestId)
+        requestTime = getAttribValue(statusNode, "RequestTime", 1)
+        if (requestTime): self.setRequestTime(fromiso8601(requestTime))
+        completionPercent = getAttribValue(statusNode, "CompletionPercent", 1)
+        if (completionPercent): self.setCompletionPercent(completionPercent)
+        expectedCount = getAttribValue(statusNode, "ExpectedCount", 1)
+        if (expectedCount): self.setExpectedCount(expectedCount)
+        actualCount = getAttribValue(statusNode, "ActualCount", 1)
+        if (actualCount): self.setActualCount(actualCount)
+        estTotalTime = getAttribValue(statusNode, "EstTotalTime", 1)
+        if (estTotalTime): self.setEstTotalTime(float(estTotalTime))
+        remainingTime = getAttribValue(statusNode, "RemainingTime", 1)
+        if (remainingTime): self.setRemainingTime(float(remainingTime))
+        lastRequestStatUpdate = getAttribValue(statusNode,
+                                               "LastRequestStatUpdate", 1)
+        if (lastRequestStatUpdate):
+            self.setLastRequestStatUpdate(fromiso8601(lastRequestStatUpdate))
+        completionTime = getAttribValue(statusNode, "CompletionTime", 1)
+        if (completionTime): self.setCompletionTime(fromiso8601(completionTime))
+
+        return self
+
+
     def unpackXmlDoc(self,
                      doc,
                      getStatus = 0,
@@ -644,42 +694,34 @@ class ngamsStatus:
         """
         if not isinstance(doc, six.string_types):
             doc = utils.b2s(doc)
+        try:
+            return status_xml.StatusParser(self, getStatus,
+                                           ignoreVarDiskPars).parse(doc)
+        except status_xml.NeedsDom:
+            # Only the Status Element precedes the configuration, and it is
+            # unpacked again from the DOM tree
+            return self.unpackXmlDom(doc, getStatus, ignoreVarDiskPars)
+
+
+    def unpackXmlDom(self,
+                     doc,
+                     getStatus = 0,
+                     ignoreVarDiskPars = 0):
+        """
+        Unpack a status report stored in an XML document through a DOM
+        tree and set the members of the class accordingly. Contrary to
+        unpackXmlDoc(), this also handles the complete NG/AMS Configuration.
+
+        For an explanation of the input parameters read man-page for the
+        method unpackXmlDoc().
+
+        Returns:            Reference to object itself.
+        """
         dom = xml.dom.minidom.parseString(doc)
         ngamsStatusEl = ngamsGetChildNodes(dom, NGAMS_XML_STATUS_ROOT_EL)[0]
 
         # Get the information from the Status Element.
-        nodeList = dom.getElementsByTagName("Status")
-        self.setDate(getAttribValue(nodeList[0], "Date"))
-        self.setVersion(getAttribValue(nodeList[0], "Version"))
-        self.setHostId(getAttribValue(nodeList[0], "HostId"))
-        if (getStatus):
-            self.setStatus(getAttribValue(nodeList[0], "Status"))
-        self.setMessage(getAttribValue(nodeList[0], "Message"))
-        if (getStatus):
-            self.setState(getAttribValue(nodeList[0], "State"))
-            self.setSubState(getAttribValue(nodeList[0], "SubState"))
-
-        # Get the optional request handling status.
-        requestId = getAttribValue(nodeList[0], "RequestId", 1)
-        if (requestId): self.setRequestId(requestId)
-        requestTime = getAttribValue(nodeList[0], "RequestTime", 1)
-        if (requestTime): self.setRequestTime(fromiso8601(requestTime))
-        completionPercent = getAttribValue(nodeList[0], "CompletionPercent", 1)
-        if (completionPercent): self.setCompletionPercent(completionPercent)
-        expectedCount = getAttribValue(nodeList[0], "ExpectedCount", 1)
-        if (expectedCount): self.setExpectedCount(expectedCount)
-        actualCount = getAttribValue(nodeList[0], "ActualCount", 1)
-        if (actualCount): self.setActualCount(actualCount)
-        estTotalTime = getAttribValue(nodeList[0], "EstTotalTime", 1)
-        if (estTotalTime): self.setEstTotalTime(float(estTotalTime))
-        remainingTime = getAttribValue(nodeList[0], "RemainingTime", 1)
-        if (remainingTime): self.setRemainingTime(float(remainingTime))
-        lastRequestStatUpdate = getAttribValue(nodeList[0],
-                                               "LastRequestStatUpdate", 1)
-        if (lastRequestStatUpdate):
-            self.setLastRequestStatUpdate(fromiso8601(lastRequestStatUpdate))
-        completionTime = getAttribValue(nodeList[0], "CompletionTime", 1)
-        if (completionTime): self.setCompletionTime(fromiso8601(completionTime))
+        self.unpackStatusNode(dom.getElementsByTagName("Status")[0], getStatus)
 
         # Unpack the NG/AMS Configuration information.
         ngamsCfgRootNode = dom.getElementsByTagName("NgamsCfg")
@@ -756,13 +798,14 @@ class ngamsStatus:
 
         Returns:    XML document (string).
         """
-        return self.genXml(
-            genCfgStatus,
-            genDiskStatus,
-            genFileStatus,
-            genStatesStatus,
-            genLimDiskStatus
-        ).toprettyxml('  ', '\n')[:-1]
+        buf = []
+        self.writeXml(status_xml.XmlWriter(buf.append),
+                      genCfgStatus,
+                      genDiskStatus,
+                      genFileStatus,
+                      genStatesStatus,
+                      genLimDiskStatus)
+        return ''.join(buf)[:-1]
 
 
     def genXml(self,
@@ -793,37 +836,9 @@ class ngamsStatus:
 
         # Status Element.
         statusEl = xml.dom.minidom.Document().createElement("Status")
-        statusEl.setAttribute("Date", self.getDate())
-        statusEl.setAttribute("Version", self.getVersion())
-        statusEl.setAttribute("HostId", self.getHostId())
-        statusEl.setAttribute("Message", self.getMessage())
-        if (genStatesStatus):
-            statusEl.setAttribute("Status", self.getStatus())
-            statusEl.setAttribute("State", self.getState())
-            statusEl.setAttribute("SubState", self.getSubState())
-
-        # Add the request handling status (if defined).
-        if (self.getRequestId()):
-            statusEl.setAttribute("RequestId", str(self.getRequestId()))
-        if self.__requestTime is not None:
-            statusEl.setAttribute("RequestTime", toiso8601(self.__requestTime))
-        if (self.getCompletionPercent()):
-            statusEl.setAttribute("CompletionPercent",
-                                  "%.2f" % self.getCompletionPercent())
-        if (self.getExpectedCount() != None):
-            statusEl.setAttribute("ExpectedCount",str(self.getExpectedCount()))
-        if (self.getActualCount() != None):
-            statusEl.setAttribute("ActualCount", str(self.getActualCount()))
-        if self.__estTotalTime is not None:
-            statusEl.setAttribute("EstTotalTime", str(self.__estTotalTime))
-        if self.__remainingTime is not None:
-            statusEl.setAttribute("RemainingTime", str(self.__remainingTime))
-        if self.__lastRequestStatUpdate is not None:
-            statusEl.setAttribute("LastRequestStatUpdate", toiso8601(self.__lastRequestStatUpdate))
-        if self.__completionTime is not None:
-            statusEl.setAttribute("CompletionTime", toiso8601(self.__completionTime))
-        if (genCfgStatus):
-            statusEl.setAttribute("ConfigFileName", self.__ngamsCfg.getCfg())
+        for name, val in self.genStatusXmlAttributes(genCfgStatus,
+                                                     genStatesStatus):
+            statusEl.setAttribute(name, val)
         ngamsStatusEl.appendChild(statusEl)
 
         # NgamsCfg Element.
@@ -857,6 +872,104 @@ class ngamsStatus:
         return doc
 
 
+    def genStatusXmlAttributes(self,
+                               genCfgStatus = 0,
+                               genStatesStatus = 1):
+        """
+        Generate the attributes of the Status XML Element, in the order
+        they appear in the element.
+
+        For an explanation of the input parameters read man-page for the
+        method genXml().
+
+        Returns:           List with (name, value) tuples (list/tuple).
+        """
+        attributes = [("Date", self.getDate()),
+                      ("Version", self.getVersion()),
+                      ("HostId", self.getHostId()),
+                      ("Message", self.getMessage())]
+        if (genStatesStatus):
+            attributes += [("Status", self.getStatus()),
+                           ("State", self.getState()),
+                           ("SubState", self.getSubState())]
+
+        # Add the request handling status (if defined).
+        if (self.getRequestId()):
+            attributes.append(("RequestId", str(self.getRequestId())))
+        if self.__requestTime is not None:
+            attributes.append(("RequestTime", toiso8601(self.__requestTime)))
+        if (self.getCompletionPercent()):
+            attributes.append(("CompletionPercent",
+                               "%.2f" % self.getCompletionPercent()))
+        if (self.getExpectedCount() != None):
+            attributes.append(("ExpectedCount", str(self.getExpectedCount())))
+        if (self.getActualCount() != None):
+            attributes.append(("ActualCount", str(self.getActualCount())))
+        if self.__estTotalTime is not None:
+            attributes.append(("EstTotalTime", str(self.__estTotalTime)))
+        if self.__remainingTime is not None:
+            attributes.append(("RemainingTime", str(self.__remainingTime)))
+        if self.__lastRequestStatUpdate is not None:
+            attributes.append(("LastRequestStatUpdate",
+                               toiso8601(self.__lastRequestStatUpdate)))
+        if self.__completionTime is not None:
+            attributes.append(("CompletionTime",
+                               toiso8601(self.__completionTime)))
+        if (genCfgStatus):
+            attributes.append(("ConfigFileName", self.__ngamsCfg.getCfg()))
+        return attributes
+
+
+    def writeXml(self,
+                 writer,
+                 genCfgStatus = 0,
+                 genDiskStatus = 0,
+                 genFileStatus = 0,
+                 genStatesStatus = 1,
+                 genLimDiskStatus = 0):
+        """
+        Write the status report as an XML document with an XML writer,
+        without building a DOM tree. The result is identical to the
+        pretty-printed document generated by genXml().
+
+        writer:            XML writer (status_xml.XmlWriter).
+
+        For an explanation of the other input parameters read man-page for
+        the method genXml().
+
+        Returns:           Void.
+        """
+        writer.declaration()
+        writer.start(NGAMS_XML_STATUS_ROOT_EL)
+        writer.element("Status",
+                       self.genStatusXmlAttributes(genCfgStatus,
+                                                   genStatesStatus))
+
+        # NgamsCfg Element.
+        if (genCfgStatus == 1):
+            writer.element("NgamsCfgFile",
+                           [("ConfigFileName", self.__ngamsCfg.getCfg())])
+        elif (genCfgStatus == -1):
+            ngamsCfgEl = self.__ngamsCfg.genXml()
+            ngamsCfgEl.setAttribute("ConfigFileName", self.__ngamsCfg.getCfg())
+            writer.node(ngamsCfgEl)
+
+        # DiskStatus Elements.
+        if (genDiskStatus):
+            for disk in self.getDiskStatusList():
+                disk.writeXml(writer, genLimDiskStatus, genFileStatus)
+
+        # FileList Elements.
+        for fileListObj in self.getFileListList():
+            fileListObj.writeXml(writer)
+
+        # Container Elements
+        for container in self.getContainerList():
+            container.writeXml(writer)
+
+        writer.end()
+
+
     def dumpBuf(self,
                 dumpCfg = 0,
                 dumpStates = 1,
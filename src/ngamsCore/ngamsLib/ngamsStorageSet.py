@@ -33,6 +33,18 @@
 Contains the implementation of the NG/AMS Storage Set Class.
 """
 
+
+def _toInt(value):
+    """
+    Convert value to an integer. Values that cannot be converted are kept as
+    they are, and reported when the configuration is checked.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
 class ngamsStorageSet:
     """
     Class to handle information for one Storage Set.
@@ -44,7 +56,10 @@ class ngamsStorageSet:
                  mainDiskSlotId = "",
                  repDiskSlotId = "",
                  mutex = 0,
-                 synchronize = 0):
+                 synchronize = 0,
+                 preallocate = 1,
+                 durability = "none",
+                 syncInterval = 64):
         """
         Constructor method.
         """
@@ -72,6 +87,18 @@ class ngamsStorageSet:
             self.__synchronize    = int(synchronize)
         else:
             self.__synchronize    = 0
+        if (preallocate in (None, "")):
+            self.__preallocate    = 1
+        else:
+            self.__preallocate    = _toInt(preallocate)
+        if (durability):
+            self.__durability     = str(durability)
+        else:
+            self.__durability     = "none"
+        if (syncInterval in (None, "")):
+            self.__syncInterval   = 64
+        else:
+            self.__syncInterval   = _toInt(syncInterval)
 
 
     def setStorageSetId(self,
@@ -212,6 +239,38 @@ class ngamsStorageSet:
         return self.__synchronize
 
 
+    def getPreallocate(self):
+        """
+        Return the flag indicating if space should be preallocated for the
+        staging files written to the disks of the set, when their size is
+        known in advance.
+
+        Returns:   0 or 1 (integer).
+        """
+        return self.__preallocate
+
+
+    def getDurability(self):
+        """
+        Return the durability policy applied to the staging files written to
+        the disks of the set: "none" (left to the OS), "end" (synced once
+        written) or "periodic" (synced every Sync Interval MB).
+
+        Returns:   Durability policy (string).
+        """
+        return self.__durability
+
+
+    def getSyncInterval(self):
+        """
+        Return the amount of data written to a staging file between syncs
+        when the durability policy is "periodic".
+
+        Returns:   Sync interval in MB (integer).
+        """
+        return self.__syncInterval
+
+
     def dumpBuf(self):
         """
         Dump the contents of the object into a string buffer.
@@ -224,7 +283,10 @@ class ngamsStorageSet:
         buf += "Main Disk Slot ID:        %s\n" % str(self.__mainDiskSlotId)
         buf += "Replication Disk Slot ID: %s\n" % str(self.__repDiskSlotId)
         buf += "Mutex Flag:               %s\n" % str(self.__mutex)
-        buf += "Synchronize Flag:         %s"   % str(self.__synchronize)
+        buf += "Synchronize Flag:         %s\n" % str(self.__synchronize)
+        buf += "Preallocate Flag:         %s\n" % str(self.__preallocate)
+        buf += "Durability:               %s\n" % str(self.__durability)
+        buf += "Sync Interval (MB):       %s"   % str(self.__syncInterval)
         return buf
 
 
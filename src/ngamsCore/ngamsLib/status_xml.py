@@ -0,0 +1,214 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Streaming writer and parser for NG/AMS Status XML documents"""
+
+import sys
+import xml.parsers.expat
+
+from . import ngamsContainer, ngamsDiskInfo, ngamsFileInfo, ngamsFileList
+from .ngamsCore import NGAMS_XML_STATUS_ROOT_EL
+
+
+# xml.dom.minidom writes attributes sorted by name before python 3.8,
+# and in insertion order afterwards
+_sort_attributes = sys.version_info < (3, 8)
+
+def escape(value):
+    """Escapes an attribute value the same way xml.dom.minidom does"""
+    if not value:
+        return ''
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    if '>' in value:
+        value = value.replace('>', '&gt;')
+    return value
+
+
+class XmlWriter(object):
+    """
+    Writes an XML document incrementally through the `write` callable.
+
+    The output is byte-identical to what xml.dom.minidom's
+    toprettyxml(indent, newl) produces for the same tree, but elements are
+    written as they are visited, so no DOM tree is ever built.
+    """
+
+    def __init__(self, write, indent='  ', newl='\n'):
+        self.write = write
+        self.indent = indent
+        self.newl = newl
+        self.tags = []
+        # Whether the start tag of the current element is still open, in
+        # which case it is closed with "/>" if no children are written
+        self.open = False
+
+    def _start_tag(self, tag, attributes):
+        if self.open:
+            self.write('>' + self.newl)
+        if _sort_attributes:
+            attributes = sorted(attributes)
+        return self.indent * len(self.tags) + '<' + tag + ''.join(
+            [' %s="%s"' % (name, escape(value)) for name, value in attributes])
+
+    def declaration(self):
+        """Writes the XML declaration"""
+        self.write('<?xml version="1.0" ?>' + self.newl)
+
+    def start(self, tag, attributes=()):
+        """Starts an element with the given (name, value) attributes"""
+        self.write(self._start_tag(tag, attributes))
+        self.tags.append(tag)
+        self.open = True
+
+    def end(self):
+        """Ends the current element"""
+        tag = self.tags.pop()
+        if self.open:
+            self.write('/>' + self.newl)
+            self.open = False
+        else:
+            self.write(self.indent * len(self.tags) + '</' + tag + '>' + self.newl)
+
+    def element(self, tag, attributes=()):
+        """Writes an element without children"""
+        self.write(self._start_tag(tag, attributes) + '/>' + self.newl)
+        self.open = False
+
+    def node(self, node):
+        """Writes an xml.dom.minidom node as a child of the current element"""
+        if self.open:
+            self.write('>' + self.newl)
+            self.open = False
+        node.writexml(self, self.indent * len(self.tags), self.indent, self.newl)
+
+
+class _Element(object):
+    """
+    The start tag of an element, with the subset of the xml.dom.minidom
+    Element interface used by the unpackFromDomNode() methods. Child
+    elements are not part of it, they are handed over as they are parsed.
+    """
+
+    childNodes = ()
+
+    def __init__(self, name, attrs):
+        self.nodeName = self.tagName = name
+        self.attrs = attrs
+
+    def hasAttribute(self, name):
+        return name in self.attrs
+
+    def getAttribute(self, name):
+        return self.attrs.get(name, '')
+
+    def getElementsByTagName(self, name):
+        return []
+
+
+class NeedsDom(Exception):
+    """Raised for documents with parts that can only be unpacked from a DOM tree"""
+
+
+class StatusParser(object):
+    """
+    Unpacks an NG/AMS Status XML document into an ngamsStatus object with an
+    expat parser, creating the disk, file, file list and container objects
+    as their elements are found instead of building a DOM tree first.
+
+    The objects are populated in the same way ngamsStatus.unpackXmlDoc() does
+    from a DOM tree. Documents containing a full NG/AMS configuration raise
+    NeedsDom.
+    """
+
+    def __init__(self, status, getStatus=0, ignoreVarDiskPars=0):
+        self.status = status
+        self.getStatus = getStatus
+        self.ignoreVarDiskPars = ignoreVarDiskPars
+        self.stack = []
+        self.found_status = False
+
+    def _start(self, name, attrs):
+        el = _Element(name, attrs)
+        parent = self.stack[-1] if self.stack else None
+        obj = None
+
+        if not self.stack:
+            if name != NGAMS_XML_STATUS_ROOT_EL:
+                raise Exception("Not an NG/AMS Status XML document, root element is %s" % name)
+        elif name == 'Status':
+            if not self.found_status:
+                self.status.unpackStatusNode(el, self.getStatus)
+                self.found_status = True
+        elif name == 'NgamsCfg':
+            raise NeedsDom()
+        elif name == 'NgamsCfgFile':
+            self.status.configFileName = el.getAttribute('ConfigFileName')
+        elif name == 'DiskStatus':
+            obj = ngamsDiskInfo.ngamsDiskInfo().unpackFromDomNode(el, self.ignoreVarDiskPars)
+            self.status.addDiskStatus(obj)
+        elif name == 'FileStatus':
+            if isinstance(parent, ngamsDiskInfo.ngamsDiskInfo):
+                parent.addFileObj(ngamsFileInfo.ngamsFileInfo().unpackFromDomNode(el, parent.getDiskId()))
+            elif isinstance(parent, ngamsFileList.ngamsFileList):
+                parent.addFileInfoObj(ngamsFileInfo.ngamsFileInfo().unpackFromDomNode(el))
+            elif isinstance(parent, ngamsContainer.ngamsContainer):
+                parent.addFileInfo(ngamsFileInfo.ngamsFileInfo().unpackFromDomNode(el))
+        elif name == 'FileList':
+            # All file lists are listed in the status, nested or not
+            obj = ngamsFileList.ngamsFileList().unpackFromDomNode(el)
+            self.status.addFileList(obj)
+            if isinstance(parent, ngamsFileList.ngamsFileList):
+                parent.addFileListObj(obj)
+        elif name == 'Container':
+            if len(self.stack) == 1:
+                obj = ngamsContainer.ngamsContainer()
+                obj.unpackFromDomNode(el)
+                self.status.addContainer(obj)
+            elif isinstance(parent, ngamsContainer.ngamsContainer):
+                obj = ngamsContainer.ngamsContainer()
+                obj.unpackFromDomNode(el)
+                parent.addContainer(obj)
+
+        self.stack.append(obj)
+
+    def _end(self, name):
+        self.stack.pop()
+
+    def parse(self, source):
+        """
+        Parses `source`, an XML document (string or bytes) or a file-like
+        object to read it from.
+        """
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        if hasattr(source, 'read'):
+            parser.ParseFile(source)
+        else:
+            parser.Parse(source, True)
+        if not self.found_status:
+            raise Exception("No Status element found in NG/AMS Status XML document")
+        return self.status
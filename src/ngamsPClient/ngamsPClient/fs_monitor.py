@@ -21,20 +21,27 @@
 #
 """Module containing the ngas-fs-monitor client"""
 import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import errno
 import functools
 import glob
+import json
 import logging
 import multiprocessing
 import os
+import select
 import signal
 import socket
+import struct
 import sys
 import time
 
 import lockfile.pidlockfile
 
 from ngamsLib import utils, logutils
-from ngamsLib.ngamsCore import mvFile, rmFile, checkCreatePath
+from ngamsLib.ngamsCore import mvFile, rmFile, checkCreatePath, NGAMS_FILE_STATUS_OK
 from six.moves import queue, cPickle
 
 from . import ngamsPClient
@@ -51,6 +58,8 @@ class archive_request(object):
         self.fname = fname
         self.file_id = None
         self.file_version = None
+        self.file_size = None
+        self.checksum = None
         self.sched_time = time.time()
         self.last_check_attempt = 0
 
@@ -80,6 +89,92 @@ class ClientWrapper(object):
         except socket.error as e:
             raise ClientException(e)
 
+class Inotify(object):
+    """
+    A minimal inotify(7) interface on top of libc, watching a single directory.
+    An OSError is raised on creation if inotify is not available.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    _event = struct.Struct('iIII')
+
+    def __init__(self, path, mask):
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported by %s' % libc_name)
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        if libc.inotify_add_watch(self.fd, path.encode('utf-8'), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch failed for %s' % path)
+
+    def read_events(self, timeout):
+        """Waits up to `timeout` seconds for events, and returns them as (mask, name) tuples"""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        pos = 0
+        while pos < len(data):
+            _, mask, _, name_len = self._event.unpack_from(data, pos)
+            pos += self._event.size
+            name = data[pos:pos + name_len].rstrip(b'\0').decode('utf-8', 'replace')
+            pos += name_len
+            events.append((mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class Metrics(object):
+    """
+    Counters shared by all the processes of a Monitor, from which its
+    queue depths, archiving latency and throughput are reported
+    """
+
+    _names = ('files_queued', 'files_archived', 'bytes_archived', 'archive_failures',
+              'files_verified', 'verification_failures', 'latency_total', 'latency_max')
+
+    def __init__(self):
+        self._lock = multiprocessing.Lock()
+        self._values = {name: multiprocessing.RawValue('d', 0) for name in self._names}
+        self.start_time = time.time()
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._values[name].value += value
+
+    def archived(self, nbytes, latency):
+        with self._lock:
+            self._values['files_archived'].value += 1
+            self._values['bytes_archived'].value += nbytes
+            self._values['latency_total'].value += latency
+            self._values['latency_max'].value = max(self._values['latency_max'].value, latency)
+
+    def snapshot(self):
+        with self._lock:
+            values = {name: val.value for name, val in self._values.items()}
+        uptime = time.time() - self.start_time
+        archived = values['files_archived']
+        latency_total = values.pop('latency_total')
+        values['uptime'] = uptime
+        values['latency_avg'] = latency_total / archived if archived else 0
+        values['throughput_bytes'] = values['bytes_archived'] / uptime if uptime else 0
+        values['throughput_files'] = archived / uptime if uptime else 0
+        return values
+
+def _qsize(the_queue):
+    try:
+        return the_queue.qsize()
+    except NotImplementedError:
+        # Not available in some platforms (e.g., MacOS)
+        return -1
+
 def periodic(period_attr):
     """Wraps a function into a main loop with the given periodicity"""
     def decorator(f):
@@ -102,12 +197,13 @@ def periodic_queue_consumer(poll_period_attr_name):
             the_queue = args[0]
             stop_evt = args[-1]
             args = args[1:-1]
-            queue_poll_period = getattr(self, poll_period_attr_name)
+            # Requests are picked up as soon as they are queued, the poll
+            # period only bounds how long it takes to notice stop_evt
+            queue_poll_period = min(getattr(self, poll_period_attr_name), 1)
             while not stop_evt.is_set():
                 try:
-                    req = the_queue.get_nowait()
+                    req = the_queue.get(timeout=queue_poll_period)
                 except queue.Empty:
-                    stop_evt.wait(queue_poll_period)
                     continue
                 try:
                     f(self, req, *args)
@@ -119,6 +215,14 @@ def periodic_queue_consumer(poll_period_attr_name):
         return _wrapper
     return decorator
 
+def _original_size(row):
+    """Size of a file as it was archived, before any compression applied by
+    the server's DAPI"""
+    size = row.get('uncompressed_file_size')
+    if size in (None, '', -1, '-1'):
+        size = row['file_size']
+    return int(size)
+
 def flush(the_queue):
     """Iterates over all elements of the queue while they are removed"""
     try:
@@ -133,7 +237,8 @@ class Monitor(ClientWrapper):
     def __init__(self, root_dir, host='127.0.0.1', port=7777, servers=None,
                  num_streams=1, fs_poll_period=30, archive_poll_period=30,
                  check_poll_period=30, client_retry_period=60,
-                 cleanup_timeout=60, archiving_cmd='ARCHIVE'):
+                 cleanup_timeout=60, archiving_cmd='ARCHIVE', use_inotify=True,
+                 check_batch_size=100, metrics_period=10, crc_variant=None):
 
         ClientWrapper.__init__(self, host, port, servers)
         self.stopping = False
@@ -144,7 +249,12 @@ class Monitor(ClientWrapper):
         self.client_retry_period = client_retry_period
         self.cleanup_timeout = cleanup_timeout
         self.archiving_cmd = archiving_cmd
+        self.use_inotify = use_inotify
+        self.check_batch_size = max(1, check_batch_size)
+        self.metrics_period = metrics_period
+        self.crc_variant = crc_variant
         self.all_tasks = []
+        self.metrics = Metrics()
 
         # Paths to be created
         root_dir = os.path.normpath(os.path.abspath(root_dir))
@@ -155,6 +265,7 @@ class Monitor(ClientWrapper):
         self.badfiles_dir = _relative('bad')
         self.backlog_dir = _relative('backlog')
         self.pickled_check_reqs = os.path.join(self.archived_dir, '.check_requests.pickle')
+        self.metrics_file = _relative('metrics.json')
         for d in (self.queue_dir, self.archiving_dir, self.archived_dir,
                   self.badfiles_dir, self.backlog_dir):
             checkCreatePath(d)
@@ -171,8 +282,6 @@ class Monitor(ClientWrapper):
 
         self.load_pending_checks()
 
-        divisor = 4
-        num_check_tasks = (self.num_streams + divisor - 1) // divisor
         stop_evt = multiprocessing.Event()
 
         def add_task(name, target, *args):
@@ -184,17 +293,35 @@ class Monitor(ClientWrapper):
             task.start(*args)
             self.all_tasks.append(task)
 
-        add_task('File system poller', self.fs_polling)
+        add_task('File system watcher', self.fs_watching)
         for i in range(self.num_streams):
             add_task('Archiving %d' % i, self.process_archive_request, self.archive_queue)
-        for i in range(num_check_tasks):
-            add_task('Checking %d' % i, self.process_check_request, self.check_queue)
+        add_task('Checking', self.process_check_requests, self.check_queue)
 
-        task = utils.Task('Log handling', self.handle_child_log_records)
-        task.start()
-        self.all_tasks.append(task)
+        for name, target in (('Log handling', self.handle_child_log_records),
+                             ('Metrics', self.write_metrics)):
+            task = utils.Task(name, target)
+            task.start()
+            self.all_tasks.append(task)
         logger.debug('Done starting all tasks')
 
+    def get_metrics(self):
+        """Returns the current metrics of this monitor"""
+        metrics = self.metrics.snapshot()
+        if self.check_queue is not None:
+            metrics['archive_queue_depth'] = _qsize(self.archive_queue)
+            metrics['check_queue_depth'] = _qsize(self.check_queue)
+        return metrics
+
+    @periodic('metrics_period')
+    def write_metrics(self, _stop_evt):
+        metrics = self.get_metrics()
+        tmp_fname = self.metrics_file + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            json.dump(metrics, f, indent=1, sort_keys=True)
+        os.rename(tmp_fname, self.metrics_file)
+        logger.debug('Metrics: %r', metrics)
+
 
     def handle_child_log_records(self, stop_evt):
         while not stop_evt.is_set():
@@ -241,19 +368,55 @@ class Monitor(ClientWrapper):
         for req in flush(self.archive_queue):
             req.move_to(self.queue_dir)
 
-    @periodic('fs_poll_period')
-    def fs_polling(self, _stop_evt):
+    def queue_file(self, fname):
+        req = archive_request(fname)
+        req.move_to(self.archiving_dir)
+        self.archive_queue.put_nowait(req)
+        self.metrics.add('files_queued')
+        logger.info('Added archive request to queue for %s', fname)
+
+    def queue_new_files(self):
         queue_dir_pattern = os.path.join(self.queue_dir, '*')
         for fname in glob.glob(queue_dir_pattern):
-            req = archive_request(fname)
-            req.move_to(self.archiving_dir)
-            self.archive_queue.put_nowait(req)
-            logger.info('Added archive request to queue for %s', fname)
+            self.queue_file(fname)
+
+    @periodic('fs_poll_period')
+    def fs_polling(self, _stop_evt):
+        self.queue_new_files()
+
+    def fs_watching(self, stop_evt):
+        """Queues files as soon as they are written or moved into queue/,
+        falling back to polling if inotify is not available"""
+        notifier = None
+        if self.use_inotify:
+            try:
+                notifier = Inotify(self.queue_dir, Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO)
+            except (OSError, AttributeError) as e:
+                logger.warning('Cannot use inotify (%s), polling for files instead', e)
+        if notifier is None:
+            return self.fs_polling(stop_evt)
+
+        logger.info('Watching %s for new files', self.queue_dir)
+        with contextlib.closing(notifier):
+            # Files that were there before we started watching
+            self.queue_new_files()
+            while not stop_evt.is_set():
+                for mask, name in notifier.read_events(min(self.fs_poll_period, 1)):
+                    if mask & Inotify.IN_Q_OVERFLOW:
+                        logger.warning('inotify events were lost, rescanning %s', self.queue_dir)
+                        self.queue_new_files()
+                        continue
+                    # Same files as in a glob
+                    fname = os.path.join(self.queue_dir, name)
+                    if name and not name.startswith('.') and os.path.isfile(fname):
+                        self.queue_file(fname)
 
     @periodic_queue_consumer('archive_poll_period')
     def process_archive_request(self, req):
 
-        stat = self.client('archive', req.fname, cmd=self.archiving_cmd)
+        req.file_size = os.path.getsize(req.fname)
+        kwargs = {'crcVariant': self.crc_variant} if self.crc_variant else {}
+        stat = self.client('archive', req.fname, cmd=self.archiving_cmd, **kwargs)
 
         # Archive Request after-math.
         status = stat.getStatus()
@@ -271,37 +434,99 @@ class Monitor(ClientWrapper):
                 log = 'Archiving of %s failed (error: %s), will try again later'
                 logger.warning(log, req.fname, msg)
                 self.archive_queue.put_nowait(req)
+            self.metrics.add('archive_failures')
             return
 
         logger.info("%s successfully archived", req.fname)
         file_info = stat.getDiskStatusList()[0].getFileObj(0)
         req.file_id = file_info.getFileId()
         req.file_version = file_info.getFileVersion()
+        req.checksum = file_info.getChecksum()
+        self.metrics.archived(req.file_size, time.time() - req.sched_time)
         req.move_to(self.archived_dir)
         self.check_queue.put_nowait(req)
 
-    @periodic_queue_consumer('check_poll_period')
-    def process_check_request(self, req):
-
-        # Is file 'ripe' for removal?
-        logger.info("Checking if file is ready for removal: %s", req.fname)
-        now = time.time()
-        if now - req.sched_time < self.cleanup_timeout:
-            # Nope, put it in the archive request list/dictionary.
-            self.check_queue.put_nowait(req)
-            return
-
-        # Handle the CHECKFILE Request
+    def check_file(self, req):
+        """Checks a single archived file via the CHECKFILE command"""
         pars = ("file_id", req.file_id), ("file_version", req.file_version)
         stat = self.client('get_status', 'CHECKFILE', pars=pars)
         msg = stat.getMessage()
         if 'NGAMS_INFO_FILE_OK' in msg:
-            logger.info('%s successfully validated, removing', req.fname)
-            rmFile(req.fname)
-        else:
-            log = "%s could not be validated successfully, will try again later: %s"
-            logger.warning(log, req.fname, msg)
-            self.check_queue.put_nowait(req)
+            return True
+        logger.warning("%s could not be validated successfully: %s", req.fname, msg)
+        return False
+
+    def check_files(self, reqs):
+        """
+        Checks that the given archived files are registered in the server with
+        an OK status, their original (i.e., uncompressed) size and the checksum
+        the server reported when archiving them. All files are checked with a single QUERY request;
+        if the server doesn't support it the files are checked one by one via
+        CHECKFILE. Returns the requests whose files were checked successfully.
+        """
+        file_ids = sorted(set(req.file_id for req in reqs))
+        try:
+            rows = self.client('query', 'files_in', pars=[('file_ids', ','.join(file_ids))])
+        except ClientException:
+            raise
+        except Exception as e:
+            logger.warning('Cannot check files with a single request (%s), using CHECKFILE', e)
+            return [req for req in reqs if self.check_file(req)]
+
+        files = {(row['file_id'], int(row['file_version'])): row for row in rows}
+        checked = []
+        for req in reqs:
+            row = files.get((req.file_id, int(req.file_version)))
+            problem = None
+            if row is None:
+                problem = 'file not found in server'
+            elif row['file_status'] != NGAMS_FILE_STATUS_OK or int(row.get('file_ignore') or row.get('ignore') or 0):
+                problem = 'file status is %s' % row['file_status']
+            elif getattr(req, 'file_size', None) is not None and _original_size(row) != req.file_size:
+                problem = 'size is %s, expected %d' % (_original_size(row), req.file_size)
+            elif getattr(req, 'checksum', None) and str(row['checksum']) != str(req.checksum):
+                problem = 'checksum is %s, expected %s' % (row['checksum'], req.checksum)
+            if problem:
+                logger.warning("%s could not be validated successfully: %s", req.fname, problem)
+            else:
+                checked.append(req)
+        return checked
+
+    def process_check_requests(self, the_queue, stop_evt):
+        """Checks archived files in batches once they are 'ripe' for removal,
+        and removes them after a successful check"""
+        while not stop_evt.is_set():
+            now = time.time()
+            ripe = []
+            for req in flush(the_queue):
+                if now - req.sched_time < self.cleanup_timeout:
+                    the_queue.put_nowait(req)
+                else:
+                    ripe.append(req)
+
+            for i in range(0, len(ripe), self.check_batch_size):
+                batch = ripe[i:i + self.check_batch_size]
+                logger.info("Checking %d files before removal", len(batch))
+                try:
+                    checked = self.check_files(batch)
+                except ClientException as e:
+                    logger.exception('Error while communicating with the server, will try again in %f seconds',
+                                     self.client_retry_period, exc_info=e.args[0])
+                    for req in ripe[i:]:
+                        the_queue.put_nowait(req)
+                    stop_evt.wait(self.client_retry_period)
+                    break
+                for req in batch:
+                    if req in checked:
+                        logger.info('%s successfully validated, removing', req.fname)
+                        rmFile(req.fname)
+                        self.metrics.add('files_verified')
+                    else:
+                        # will try again later
+                        the_queue.put_nowait(req)
+                        self.metrics.add('verification_failures')
+
+            stop_evt.wait(self.check_poll_period)
 
 
 def setup_logging(logdir, level, log_rotation_period):
@@ -325,7 +550,9 @@ This tool works within the boundaries of a working directory (-w option). Within
 this, different sub-directories are found:
 
  * queue/ is constantly monitored for new files. New files appearing under this
-   directory are eventually queued for archiving into an NGAS server.
+   directory are queued for archiving into an NGAS server as soon as they are
+   closed after writing or moved into it (using inotify where available, by
+   polling the directory otherwise).
  * archiving/ holds the files that were previously under queue/ and are actively
    queued for archiving. When the tool stops, any file in this directory is put
    back into queue/
@@ -349,6 +576,10 @@ In other words, this is a file's lifecycle:
             v     v
            bad   backlog
 
+Archived files are checked in batches, with a single request to the server.
+The queue depths, archiving latency and throughput of the tool are periodically
+written to metrics.json in the working directory.
+
 The tool runs infinitely until stopped via SIGINT/SIGTERM (e.g., hitting Ctrl-C).
 '''
 def main():
@@ -361,6 +592,9 @@ def main():
     general_group.add_argument('-w', '--workdir', help='The working directory where this tool wil run, defaults to .', default='.')
     general_group.add_argument('-C', '--command', help='Command used to issue archiving, defaults to ARCHIVE', default='ARCHIVE')
     general_group.add_argument('-s', '--streams', help='Number or parallel archiving streams, defaults to #CPUs', default=multiprocessing.cpu_count(), type=int)
+    general_group.add_argument('--no-inotify', help='Poll for new files instead of using inotify', action='store_true')
+    general_group.add_argument('--check-batch-size', help='Maximum number of archived files checked with a single request, defaults to 100', default=100, type=int)
+    general_group.add_argument('--crc-variant', help='Calculate the checksum of files while archiving them, and have the server verify it', choices=['crc32c', 'crc32z'])
     connection_group = parser.add_argument_group('Connection options')
     connection_group.add_argument('-H', '--host', help='The host to connect to, defaults to 127.0.0.1', default='127.0.0.1')
     connection_group.add_argument('-p', '--port', help='The port to connect to, defaults to 7777', type=int, default=7777)
@@ -372,6 +606,7 @@ def main():
     logging_group = parser.add_argument_group('Logging options')
     logging_group.add_argument('--log-level', help="Log level to apply when producing logs", default='INFO', choices=['DEBUG', 'INFO', 'WARNING'])
     logging_group.add_argument('--log-rotation-period', help='Log rotation period, in seconds, defaults to 86400 (1 day)', default=86400, type=float)
+    logging_group.add_argument('--metrics-period', help='Period used to write metrics.json, in seconds, defaults to 10', default=10, type=float)
 
     opts = parser.parse_args()
     servers = [(s.split(':')[0], s.split(':')[1]) for s in opts.servers.split(',') if s]
@@ -386,7 +621,11 @@ def main():
                           fs_poll_period=opts.fs_poll_period,
                           client_retry_period=opts.client_retry_period,
                           cleanup_timeout=opts.cleanup_timeout,
-                          archiving_cmd=opts.command)
+                          archiving_cmd=opts.command,
+                          use_inotify=not opts.no_inotify,
+                          check_batch_size=opts.check_batch_size,
+                          metrics_period=opts.metrics_period,
+                          crc_variant=opts.crc_variant)
         try:
             monitor.start_tasks()
             signal.pause()
@@ -38,17 +38,25 @@ can be used to build up Python applications communicating with NG/AMS.
 
 import argparse
 import base64
+import binascii
 import contextlib
+import json
 import logging
 import os
 import random
 import shutil
 import socket
+import ssl
 import sys
 import tarfile
+import threading
 import time
 from xml.dom import minidom
 
+from six.moves import http_client as httplib  # @UnresolvedImport
+from six.moves import queue as Queue  # @UnresolvedImport
+from six.moves.urllib import parse as urlparse  # @UnresolvedImport
+
 from ngamsLib import ngamsLib, ngamsFileInfo, ngamsStatus, ngamsMIMEMultipart,\
     ngamsHttpUtils, logutils
 from ngamsLib.ngamsCore import NGAMS_EXIT_CMD, NGAMS_INIT_CMD,\
@@ -59,7 +67,8 @@ from ngamsLib.ngamsCore import NGAMS_ARCHIVE_CMD, NGAMS_REARCHIVE_CMD, NGAMS_HTT
     NGAMS_FAILURE, NGAMS_SUBSCRIBE_CMD, NGAMS_UNSUBSCRIBE_CMD, NGAMS_ARCH_REQ_MT, \
     NGAMS_CACHEDEL_CMD, NGAMS_CLONE_CMD, \
     NGAMS_HTTP_REDIRECT, getNgamsVersion, \
-    getNgamsLicense, toiso8601, NGAMS_CONT_MT
+    getNgamsLicense, toiso8601, NGAMS_CONT_MT, NGAMS_SUCCESS, \
+    NGAMS_HTTP_HDR_CHECKSUM, NGAMS_HTTP_HDR_FILE_SIZE
 
 
 logger = logging.getLogger(__name__)
@@ -70,6 +79,81 @@ def is_known_pull_url(s):
            s.startswith('https:') or \
            s.startswith('ftp:')
 
+class _ServerBalancer(object):
+    """
+    Chooses, among a list of servers, the one with the least requests
+    currently outstanding, breaking ties randomly.
+    """
+
+    def __init__(self, servers):
+        self.outstanding = {(host, int(port)): 0 for host, port in servers}
+        self.lock = threading.Lock()
+
+    def acquire(self, tried=()):
+        """Picks a server, avoiding those in `tried` if possible"""
+        with self.lock:
+            candidates = [s for s in self.outstanding if s not in tried]
+            candidates = candidates or list(self.outstanding)
+            least = min(self.outstanding[s] for s in candidates)
+            server = random.choice([s for s in candidates if self.outstanding[s] == least])
+            self.outstanding[server] += 1
+            return server
+
+    def release(self, server):
+        with self.lock:
+            self.outstanding[server] -= 1
+
+
+class _ChecksumReader(object):
+    """Calculates the checksum of the contents of a file object while they are read"""
+
+    def __init__(self, f, crc_variant):
+        if crc_variant == 'crc32c':
+            import crc32c
+            self.method = crc32c.crc32
+        elif crc_variant == 'crc32z':
+            self.method = binascii.crc32
+        else:
+            raise ValueError("Unsupported CRC variant: %s" % crc_variant)
+        self.f = f
+        self.crc = 0
+
+    def read(self, n):
+        buf = self.f.read(n)
+        self.crc = self.method(buf, self.crc)
+        return buf
+
+    def seek(self, pos):
+        self.f.seek(pos)
+        self.crc = 0
+
+    @property
+    def checksum(self):
+        return str(self.crc & 0xffffffff)
+
+
+def _checksummed_upload(f, mime_type, crc_variant):
+    """
+    Returns the headers and body to send the contents of `f`, followed by
+    their checksum in a trailer, using chunked transfer encoding. The size
+    of the data goes in a separate header.
+    """
+    reader = _ChecksumReader(f, crc_variant)
+    hdrs = {'Content-Type': mime_type,
+            'Transfer-Encoding': 'chunked',
+            'Trailer': NGAMS_HTTP_HDR_CHECKSUM,
+            NGAMS_HTTP_HDR_FILE_SIZE: str(os.fstat(f.fileno()).st_size)}
+    body = ngamsHttpUtils.chunked_body(reader, lambda: {NGAMS_HTTP_HDR_CHECKSUM: reader.checksum})
+    return hdrs, body
+
+
+class _ItemFailure(Exception):
+    """An item of a bulk transfer failed locally, so it is not retried"""
+
+
+_END = object()
+
+
 class ngamsPClient:
     """
     Class providing services for sending and receiving commands to/from
@@ -113,7 +197,8 @@ class ngamsPClient:
                 asynchronous = False,
                 noVersioning = 0,
                 pars = [],
-                cmd = NGAMS_ARCHIVE_CMD):
+                cmd = NGAMS_ARCHIVE_CMD,
+                crcVariant = None):
         """
         Send an Archive Request to the associated NG/AMS Server asking to
         have the file specified by the URI archived. This can either
@@ -136,6 +221,11 @@ class ngamsPClient:
 
                          [[<Par>, <Val>], [<Par>, <Val>], ...]    (list).
 
+        crcVariant:    If given, the checksum of the file is calculated with
+                       this CRC variant ('crc32c' or 'crc32z') while the file
+                       is pushed, and sent after it to be verified by the
+                       server, which uses the same variant (string).
+
         Returns:       NG/AMS Status object (ngamsStatus).
         """
 
@@ -157,6 +247,9 @@ class ngamsPClient:
         mt = mimeType or NGAMS_ARCH_REQ_MT
         pars.append(("filename", os.path.basename(fileUri)))
         with open(fileUri, "rb") as f:
+            if crcVariant:
+                pars.append(('crc_variant', crcVariant))
+                return self._post_checksummed(cmd, mt, f, crcVariant, pars)
             return self._post(cmd, mt, f, pars=pars)
 
     def archive_data(self, data, filename, mimeType,
@@ -608,6 +701,137 @@ class ngamsPClient:
             return ngamsStatus.dummy_success_stat(host_id)
 
 
+    def archive_many(self, fileUris, mimeType="", noVersioning=0, pars=[],
+                     cmd='QARCHIVE', max_transfers=4, retries=2, crcVariant=None):
+        """
+        Archive many files, running up to `max_transfers` Archive Requests
+        concurrently. Each request goes to the server with the least requests
+        outstanding, connections to the servers are reused when they allow it,
+        and failed requests are retried on other servers.
+
+        fileUris:      URIs of the files to archive. Any iterable can be given,
+                       which is consumed as the files are archived (iterable).
+
+        mimeType:      Mime-type of the data, as in `archive` (string).
+
+        noVersioning:  If set to 1 no new version number is
+                       generated (integer).
+
+        pars:          Extra parameters to submit with each request (list).
+
+        cmd:           Archive command to use (string).
+
+        max_transfers: Maximum number of concurrent requests (integer).
+
+        retries:       Maximum number of times a failed request is
+                       retried (integer).
+
+        crcVariant:    CRC variant used to calculate the checksum of the
+                       files while they are pushed, as in `archive` (string).
+
+        Returns:       Generator of (fileUri, ngamsStatus) tuples, in the
+                       order in which the requests finish.
+        """
+
+        def archive_one(connections, host, port, fileUri):
+            archive_pars = list(pars) + self._common_pars()
+            archive_pars.append(('async', '0'))
+            archive_pars.append(("no_versioning", '1' if noVersioning else '0'))
+
+            # Archive pulls (fileUri is a URL) are GETs
+            if is_known_pull_url(fileUri):
+                archive_pars.append(('filename', fileUri))
+                if mimeType:
+                    archive_pars.append(("mime_type", mimeType))
+                resp = self._bulk_request(connections, host, port, 'GET', cmd, archive_pars)
+                return ngamsStatus.to_status(resp, "%s:%d" % (host, port), cmd)
+
+            try:
+                f = open(fileUri, "rb")
+            except (IOError, OSError) as e:
+                raise _ItemFailure("Cannot read %s: %s" % (fileUri, e))
+            archive_pars.append(("filename", os.path.basename(fileUri)))
+            if crcVariant:
+                archive_pars.append(('crc_variant', crcVariant))
+                hdrs, body = _checksummed_upload(f, mimeType or NGAMS_ARCH_REQ_MT, crcVariant)
+            else:
+                hdrs = {'Content-Type': mimeType or NGAMS_ARCH_REQ_MT,
+                        'Content-Length': str(os.fstat(f.fileno()).st_size)}
+                body = f
+            with f:
+                resp = self._bulk_request(connections, host, port, 'POST', cmd, archive_pars, hdrs, body)
+                return ngamsStatus.to_status(resp, "%s:%d" % (host, port), cmd)
+
+        return self._run_many(cmd, fileUris, archive_one, max_transfers, retries)
+
+
+    def retrieve_many(self, fileIds, targetDir='.', pars=[], hdrs={},
+                      max_transfers=4, retries=2):
+        """
+        Retrieve many files into `targetDir`, running up to `max_transfers`
+        Retrieve Requests concurrently. Requests are spread among the servers
+        and retried like in `archive_many`.
+
+        fileIds:       IDs of the files to retrieve, or (File ID, File Version)
+                       tuples to retrieve specific versions. Any iterable
+                       can be given (iterable).
+
+        targetDir:     Directory where the files are stored, under the
+                       name given by the server (string).
+
+        pars:          Extra parameters to submit with each request (list).
+
+        hdrs:          Extra headers to submit with each request (dict).
+
+        max_transfers: Maximum number of concurrent requests (integer).
+
+        retries:       Maximum number of times a failed request is
+                       retried (integer).
+
+        Returns:       Generator of (fileId, ngamsStatus) tuples, in the
+                       order in which the requests finish.
+        """
+
+        def retrieve_one(connections, host, port, item):
+            fileId, fileVersion = item if isinstance(item, tuple) else (item, -1)
+            retrieve_pars = list(pars) + self._common_pars()
+            retrieve_pars.append(("file_id", fileId))
+            if fileVersion != -1:
+                retrieve_pars.append(("file_version", str(fileVersion)))
+
+            # Handle redirects, with a maximum of 5
+            for _ in range(6):
+                resp = self._bulk_request(connections, host, port, 'GET', NGAMS_RETRIEVE_CMD, retrieve_pars, hdrs)
+                if resp.status != NGAMS_HTTP_REDIRECT:
+                    break
+                resp.read()
+                host, port = resp.getheader('Location').split("/")[2].split(":")
+                port = int(port)
+                logger.info("Redirecting to NG/AMS running on %s:%d", host, port)
+            else:
+                raise Exception("Too many redirections, aborting")
+
+            host_id = "%s:%d" % (host, port)
+            if resp.status != NGAMS_HTTP_SUCCESS:
+                return ngamsStatus.to_status(resp, host_id, NGAMS_RETRIEVE_CMD)
+
+            parts = ngamsLib.parseHttpHdr(resp.getheader('Content-Disposition'))
+            if 'filename' not in parts:
+                raise Exception("Missing or invalid Content-Disposition header in HTTP response")
+            fname = os.path.join(targetDir, os.path.basename(parts['filename']))
+            try:
+                f = open(fname, 'wb')
+            except (IOError, OSError) as e:
+                # The response was not read, the connection cannot be reused
+                connections.pop((host, port)).close()
+                raise _ItemFailure("Cannot write %s: %s" % (fname, e))
+            with f:
+                shutil.copyfileobj(resp, f, 65536)
+            return ngamsStatus.dummy_success_stat(host_id)
+
+        return self._run_many(NGAMS_RETRIEVE_CMD, fileIds, retrieve_one, max_transfers, retries)
+
+
     def status(self, pars=[], output=None):
         """
         Request a general status from the NG/AMS Server
@@ -628,6 +852,28 @@ class ngamsPClient:
         return self.get_status(NGAMS_STATUS_CMD, pars=pars)
 
 
+    def query(self, query, pars=[]):
+        """
+        Runs a query in the NG/AMS Server through the QUERY command.
+
+        query:       Name of the query to run (string).
+
+        pars:        Extra parameters for the query, like ``like`` or
+                     ``file_ids`` (list).
+
+        Returns:     The resulting rows, as dictionaries indexed by column
+                     name (list).
+        """
+        pars = list(pars) + [('query', query), ('format', 'json')]
+        resp, host, port = self._get('QUERY', pars=pars)
+        if resp.status != NGAMS_HTTP_SUCCESS:
+            stat = ngamsStatus.to_status(resp, '%s:%d' % (host, port), 'QUERY')
+            raise Exception("Query %s failed: %s" % (query, stat.getMessage()))
+        with contextlib.closing(resp):
+            data = resp.content if hasattr(resp, 'content') else resp.read()
+        return json.loads(data.decode('utf-8'))
+
+
     def subscribe(self,
                   url,
                   priority = None,
@@ -745,6 +991,153 @@ class ngamsPClient:
         raise Exception("Too many redirections, aborting")
 
 
+    def _common_pars(self):
+        pars = []
+        if self.timeout:
+            pars.append(("time_out", str(self.timeout)))
+        if self.reload_mod:
+            pars.append(("reload", "1"))
+        return pars
+
+
+    def _new_connection(self, host, port):
+        if self.proto == 'https':
+            context = ssl.create_default_context(cafile=os.environ.get("NGAS_CA_PATH"))
+            client_cert = os.environ.get("NGAS_CLIENT_CERT")
+            if client_cert:
+                context.load_cert_chain(client_cert, os.environ.get("NGAS_CLIENT_KEY"))
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout, context=context)
+        return httplib.HTTPConnection(host, port, timeout=self.timeout)
+
+
+    def _bulk_request(self, connections, host, port, method, cmd, pars, hdrs={}, body=None):
+        """
+        Send a request through the connection to host:port kept in
+        `connections`, opening it if necessary, and return the response.
+        The response must be read completely before the connection
+        is used again.
+        """
+        hdrs = dict(hdrs)
+        if self.basic_auth:
+            hdrs['Authorization'] = self.basic_auth
+        url = '/' + cmd
+        if pars:
+            url += '?' + urlparse.urlencode([(p[0], p[1]) for p in pars])
+
+        key = (host, port)
+        conn = connections.get(key)
+        if conn is None:
+            conn = connections[key] = self._new_connection(host, port)
+        reused = conn.sock is not None
+
+        logger.debug("About to %s to %s:%d%s", method, host, port, url)
+        try:
+            conn.request(method, url, body=body, headers=hdrs)
+            return conn.getresponse()
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            del connections[key]
+            if not reused:
+                raise
+        # The server closed the idle connection in the meanwhile, try again with a fresh one
+        logger.debug("Connection to %s:%d was closed by the server, reconnecting", host, port)
+        if body is not None:
+            body.seek(0)
+        return self._bulk_request(connections, host, port, method, cmd, pars, hdrs, body)
+
+
+    def _transfer(self, cmd, item, func, balancer, connections, retries):
+        """Process one item of a bulk transfer, retrying on other servers if needed"""
+        tried = []
+        for attempt in range(retries + 1):
+            server = balancer.acquire(tried)
+            tried.append(server)
+            host, port = server
+            try:
+                stat = func(connections, host, port, item)
+            except _ItemFailure as e:
+                logger.error("Failed to handle %s: %s", item, e)
+                stat = ngamsStatus.dummy_failure_stat('', cmd, http_status=None)
+                return stat.setMessage(str(e))
+            except Exception as e:
+                logger.warning("Error while handling %s with %s:%d: %s", item, host, port, e)
+                stat = ngamsStatus.dummy_failure_stat("%s:%d" % server, cmd, http_status=None)
+                stat.setMessage(str(e))
+            finally:
+                balancer.release(server)
+            if stat.getStatus() == NGAMS_SUCCESS:
+                return stat
+            if attempt < retries:
+                logger.info("Failed to handle %s with %s:%d, retrying: %s", item, host, port, stat.getMessage())
+        return stat
+
+
+    def _run_many(self, cmd, items, func, max_transfers, retries):
+        """
+        Runs `func` on each of `items` with a pool of `max_transfers` threads,
+        each keeping its own connections to the servers, and yields the
+        (item, ngamsStatus) results as they become available.
+        """
+        max_transfers = max(1, max_transfers)
+        balancer = _ServerBalancer(self.servers)
+        todo = Queue.Queue(maxsize=2 * max_transfers)
+        done = Queue.Queue()
+        stop = threading.Event()
+        feed_errors = []
+
+        def feed():
+            try:
+                for item in items:
+                    while not stop.is_set():
+                        try:
+                            todo.put(item, timeout=0.5)
+                            break
+                        except Queue.Full:
+                            pass
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                feed_errors.append(e)
+            todo.put(_END)
+
+        def work():
+            connections = {}
+            try:
+                while not stop.is_set():
+                    try:
+                        item = todo.get(timeout=0.5)
+                    except Queue.Empty:
+                        continue
+                    if item is _END:
+                        todo.put(_END)
+                        break
+                    done.put((item, self._transfer(cmd, item, func, balancer, connections, retries)))
+            finally:
+                for conn in connections.values():
+                    conn.close()
+                done.put(_END)
+
+        threads = [threading.Thread(target=feed, name='BulkFeeder')]
+        threads += [threading.Thread(target=work, name='BulkTransfer-%d' % i) for i in range(max_transfers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            finished = 0
+            while finished < max_transfers:
+                result = done.get()
+                if result is _END:
+                    finished += 1
+                    continue
+                yield result
+            if feed_errors:
+                raise feed_errors[0]
+        finally:
+            # Also stops the threads if the caller stops consuming the results
+            stop.set()
+
+
     def _assemble_url(self, host, port, cmd):
         return self.proto + '://' + host + ':' + str(port) + '/' + cmd
 
@@ -792,6 +1185,30 @@ class ngamsPClient:
                     raise
 
 
+    def _post_checksummed(self, cmd, mime_type, f, crc_variant, pars):
+        """
+        Like `_post`, but sends the contents of `f` followed by their
+        checksum (see `archive`).
+        """
+        pars = list(pars) + self._common_pars()
+        servers = list(self.servers)
+        random.shuffle(servers)
+
+        for i, (host, port) in enumerate(servers):
+            f.seek(0)
+            hdrs, body = _checksummed_upload(f, mime_type, crc_variant)
+            connections = {}
+            try:
+                resp = self._bulk_request(connections, host, port, 'POST', cmd, pars, hdrs, body)
+                return ngamsStatus.to_status(resp, "%s:%d" % (host, port), cmd)
+            except socket.error:
+                if i == len(servers) - 1:
+                    raise
+            finally:
+                for conn in connections.values():
+                    conn.close()
+
+
 def setup_logging(opts):
 
     logging.root.addHandler(logging.NullHandler())
@@ -848,6 +1265,7 @@ def main():
     parser.add_argument(      '--file-uri',      help='A File URI')
     parser.add_argument(      '--file-info-xml', help='An XML File Info string')
     parser.add_argument('-n', '--no-versioning', help='Do not increase the file version', action='store_true')
+    parser.add_argument(      '--crc-variant',   help='Calculate the checksum of archived files while sending them, and have the server verify it', choices=['crc32c', 'crc32z'])
     parser.add_argument('-d', '--disk-id',       help='Indicates a Disk ID')
     parser.add_argument('-e', '--execute',       help='Executes the action', action='store_true')
     parser.add_argument(      '--path',          help='File path')
@@ -856,6 +1274,11 @@ def main():
     parser.add_argument(      '--p-plugin',      help='Processing plug-in to apply before retrieving data')
     parser.add_argument(      '--p-plugin-pars', help='Parameters for the processing plug-in, can be specified more than once', action='append')
 
+    bparser = parser.add_argument_group('Bulk transfer options')
+    bparser.add_argument(      '--file-list',     help='File with one File URI (ARCHIVE/QARCHIVE) or File ID (RETRIEVE) per line, or - for stdin. These files are transferred in parallel')
+    bparser.add_argument('-j', '--parallel',      help='Number of concurrent transfers for --file-list', type=int, default=4)
+    bparser.add_argument(      '--retries',       help='Number of times a failed transfer is retried on another server', type=int, default=2)
+
     sparser = parser.add_argument_group('Subscription options')
     sparser.add_argument('-u', '--url',           help='URL to subscribe/unsubscribe')
     sparser.add_argument(      '--priority',      help='Priority used for subscription', type=int, default=None)
@@ -899,12 +1322,16 @@ def main():
     cmd = opts.cmd
     mtype = opts.mime_type
     pars = [p.split('=') for p in opts.param]
+    if opts.file_list and cmd in [NGAMS_ARCHIVE_CMD, 'QARCHIVE', NGAMS_RETRIEVE_CMD]:
+        bulk_transfer(client, opts, pars)
+        return
     if cmd in [NGAMS_ARCHIVE_CMD, 'QARCHIVE']:
         if not opts.file_uri:
             msg = "Must specify parameter --file-uri for a ARCHIVE/QARCHIVE commands"
             raise Exception(msg)
         pars += [('file_version', opts.file_version)] if opts.file_version is not None else []
-        stat = client.archive(opts.file_uri, mtype, opts.asynchronous, opts.no_versioning, cmd=cmd, pars=pars)
+        stat = client.archive(opts.file_uri, mtype, opts.asynchronous, opts.no_versioning, cmd=cmd, pars=pars,
+                              crcVariant=opts.crc_variant)
     elif cmd == "CARCHIVE":
         stat = client.carchive(opts.file_uri, mtype)
     elif cmd == "CAPPEND":
@@ -983,6 +1410,42 @@ def main():
     if stat.getStatus() == NGAMS_FAILURE:
         sys.exit(1)
 
+def _read_list(fname):
+    f = sys.stdin if fname == '-' else open(fname)
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def bulk_transfer(client, opts, pars):
+    """
+    Archive or retrieve the files listed in opts.file_list in parallel,
+    printing the outcome for each of them
+    """
+    items = _read_list(opts.file_list)
+    if opts.cmd == NGAMS_RETRIEVE_CMD:
+        results = client.retrieve_many(items, opts.output or '.', pars=pars,
+                                       max_transfers=opts.parallel, retries=opts.retries)
+    else:
+        pars += [('file_version', opts.file_version)] if opts.file_version is not None else []
+        results = client.archive_many(items, opts.mime_type, opts.no_versioning, pars=pars,
+                                      cmd=opts.cmd, max_transfers=opts.parallel, retries=opts.retries,
+                                      crcVariant=opts.crc_variant)
+
+    failed = 0
+    for item, stat in results:
+        print("%s %s %s" % (stat.getStatus(), item, stat.getHostId()))
+        if stat.getStatus() == NGAMS_FAILURE:
+            failed += 1
+            if opts.verbose > 3:
+                printStatus(stat)
+    if failed:
+        sys.exit(1)
+
 def printStatus(stat):
     """
     Pretty print the return status document
@@ -0,0 +1,211 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""In-process cutouts of GLEAM images, without external tools"""
+
+import collections
+import io
+import logging
+import os
+import threading
+
+import astropy.io.fits as pyfits
+import astropy.wcs as pywcs
+from astropy.wcs.utils import proj_plane_pixel_scales
+import numpy as np
+
+try:
+    import matplotlib.image
+    from astropy.visualization import ZScaleInterval
+    can_render_jpeg = True
+except ImportError:
+    can_render_jpeg = False
+
+
+logger = logging.getLogger(__name__)
+
+
+class Image(object):
+    """A FITS image, memory-mapped, together with its celestial WCS"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.hdulist = pyfits.open(path, memmap=True)
+        self.header = self.hdulist[0].header
+        self.data = self.hdulist[0].data
+        self.wcs = pywcs.WCS(self.header).celestial
+
+    def close(self):
+        self.hdulist.close()
+
+
+class ImageCache(object):
+    """
+    Keeps the last `max_images` images used open, so repeated cutouts from
+    the same mosaic don't pay for opening it and parsing its WCS again.
+    Images modified on disk since they were opened are re-opened.
+    """
+
+    def __init__(self, max_images=16):
+        self.max_images = max_images
+        self.images = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """Returns the Image for `path`"""
+        with self.lock:
+            image = self.images.pop(path, None)
+            if image is not None and image.mtime != os.path.getmtime(path):
+                image.close()
+                image = None
+            if image is None:
+                self.misses += 1
+                image = Image(path)
+            else:
+                self.hits += 1
+            self.images[path] = image
+            while len(self.images) > self.max_images:
+                _, evicted = self.images.popitem(last=False)
+                logger.debug("Closing image %s", evicted.path)
+                evicted.close()
+            return image
+
+    def clear(self):
+        with self.lock:
+            for image in self.images.values():
+                image.close()
+            self.images.clear()
+
+
+def pixel(image, ra, dec):
+    """Returns the (integer) x, y pixel of `image` at `ra`, `dec`"""
+    x, y = image.wcs.wcs_world2pix([[ra, dec]], 0)[0]
+    return int(x), int(y)
+
+
+def cutout(image, ra, dec, size):
+    """
+    Cuts a square of `size` degrees centred at `ra`, `dec` from `image`.
+    The pixels are copied out of the memory-mapped image.
+
+    :return: The data and the header of the cutout
+    """
+    scale_x, scale_y = proj_plane_pixel_scales(image.wcs)
+    width = abs(int(size / scale_x))
+    height = abs(int(size / scale_y))
+    xc, yc = image.wcs.wcs_world2pix([[ra, dec]], 0)[0]
+    ny, nx = image.data.shape[-2:]
+    x0 = max(0, int(round(xc - width / 2.)))
+    y0 = max(0, int(round(yc - height / 2.)))
+    x1 = min(nx, int(round(xc - width / 2.)) + width)
+    y1 = min(ny, int(round(yc - height / 2.)) + height)
+    if x0 >= x1 or y0 >= y1:
+        raise Exception("Cutout centred at %f, %f is outside the image" % (ra, dec))
+
+    data = np.array(image.data[..., y0:y1, x0:x1])
+    header = image.header.copy()
+    header['CRPIX1'] -= x0
+    header['CRPIX2'] -= y0
+    return data, header
+
+
+def regrid_header(header, xc, yc, shape, projection='ZEA'):
+    """
+    Returns the header of the grid a `shape` image with `header` is
+    reprojected onto, centred at `xc`, `yc` and with the given projection
+    """
+    head = header.copy()
+    if projection != 'ZEA':
+        head.pop('RADESYS', None)
+        head['EQUINOX'] = 2000.
+        head['CTYPE1'] = "RA---{0}".format(projection)
+        head['CTYPE2'] = "DEC--{0}".format(projection)
+    head['CRVAL1'] = xc
+    head['CRVAL2'] = yc
+    head['CRPIX1'] = shape[-1] / 1.5 / 2
+    head['CRPIX2'] = shape[-2] / 1.5 / 2
+    head['NAXIS1'] = int(shape[-1] / 1.5)
+    head['NAXIS2'] = int(shape[-2] / 1.5)
+    return head
+
+
+def _bilinear(plane, x, y):
+    ny, nx = plane.shape
+    valid = np.isfinite(x) & np.isfinite(y)
+    x = np.where(valid, x, -1)
+    y = np.where(valid, y, -1)
+    x0 = np.floor(x).astype(int)
+    y0 = np.floor(y).astype(int)
+    valid &= (x0 >= 0) & (y0 >= 0) & (x0 < nx - 1) & (y0 < ny - 1)
+    x0 = np.clip(x0, 0, max(0, nx - 2))
+    y0 = np.clip(y0, 0, max(0, ny - 2))
+    x1 = np.minimum(x0 + 1, nx - 1)
+    y1 = np.minimum(y0 + 1, ny - 1)
+    fx = x - x0
+    fy = y - y0
+    values = (plane[y0, x0] * (1 - fx) * (1 - fy) + plane[y0, x1] * fx * (1 - fy) +
+              plane[y1, x0] * (1 - fx) * fy + plane[y1, x1] * fx * fy)
+    values[~valid] = np.nan
+    return values
+
+
+def reproject(data, header, target_header):
+    """
+    Reprojects `data`, described by `header`, onto the grid described by
+    `target_header`, interpolating bilinearly. Pixels falling outside the
+    input are set to NaN.
+
+    :return: The reprojected data
+    """
+    source_wcs = pywcs.WCS(header).celestial
+    target_wcs = pywcs.WCS(target_header).celestial
+    nx, ny = target_header['NAXIS1'], target_header['NAXIS2']
+    y, x = np.indices((ny, nx))
+    ra, dec = target_wcs.wcs_pix2world(x.ravel(), y.ravel(), 0)
+    sx, sy = source_wcs.wcs_world2pix(ra, dec, 0)
+
+    # Non-celestial axes (e.g., frequency and Stokes) are kept as they are
+    planes = data.reshape((-1,) + data.shape[-2:])
+    values = [_bilinear(plane.astype(np.float32), sx, sy) for plane in planes]
+    return np.array(values).reshape(data.shape[:-2] + (ny, nx))
+
+
+def to_fits(data, header):
+    """Returns the FITS file with `data` and `header`, as bytes"""
+    buf = io.BytesIO()
+    pyfits.PrimaryHDU(data, header).writeto(buf)
+    return buf.getvalue()
+
+
+def to_jpeg(data):
+    """
+    Returns `data` rendered as a JPEG image, as bytes, using a zscale
+    interval and a heat colour map
+    """
+    plane = data.reshape((-1,) + data.shape[-2:])[0]
+    vmin, vmax = ZScaleInterval().get_limits(plane[np.isfinite(plane)])
+    buf = io.BytesIO()
+    matplotlib.image.imsave(buf, plane, vmin=vmin, vmax=vmax, cmap='gist_heat',
+                            origin='lower', format='jpeg')
+    return buf.getvalue()
@@ -44,10 +44,10 @@ import traceback
 from astropy.coordinates import SkyCoord
 import astropy.io.fits as pyfits
 import astropy.units as u
-import astropy.wcs as pywcs
 import ephem
 
 from ngamsLib.ngamsCore import NGAMS_HTTP_SUCCESS, NGAMS_FAILURE, NGAMS_TEXT_MT, execCmd as _execCmd
+from . import cutout
 
 
 logger = logging.getLogger(__name__)
@@ -103,6 +103,13 @@ completeness_fnames = ['cmp_map_faint.fits', 'cmp_map_mid.fits', 'cmp_map_bright
 
 ds9_sem = threading.Semaphore(10)
 
+# Cut images in-process by default, instead of using Montage/wcstools
+# and ds9. Requests can choose with native=0|1
+use_native_engine = True
+
+# Mosaics, PSF and completeness maps are kept open between requests
+images = cutout.ImageCache(max_images=16)
+
 html_info = """
 <html>
 <title>GLEAM CUTOUT</title>
@@ -217,31 +224,9 @@ def regrid_fits(infile, outfile, xc, yc, xw, yw, work_dir, projection="ZEA"):
     """
     #import astro_field
     file = pyfits.open(infile)
-    head = file[0].header.copy()
     dim = file[0].data.shape
-    #cd1 = head.get('CDELT1') if head.get('CDELT1') else head.get('CD1_1')
-    #cd2 = head.get('CDELT2') if head.get('CDELT2') else head.get('CD2_2')
-    #if cd1 is None or cd2 is None:
-    #    raise Exception("Missing CD or CDELT keywords in header")
-    #f1 = astro_field.Field([xc, yc], xw * 2)
-    #ref_val = f1.cornersLonLat[2]
-    if (projection != 'ZEA'):
-        try:
-            del head['RADESYS']
-        except KeyError:
-            pass
-        head['EQUINOX'] = 2000.
-        head['CTYPE1'] = "RA---{0}".format(projection)
-        head['CTYPE2'] = "DEC--{0}".format(projection)
-    head['CRVAL1'] = xc#ref_val[0]#xc
-    head['CRVAL2'] = yc#ref_val[1]#yc
-    #cdelt = numpy.sqrt(cd1 ** 2 + cd2 ** 2)
-    #1.5 = 3 / 2
-    head['CRPIX1'] = dim[1] / 1.5 / 2#1#xw / cdelt
-    head['CRPIX2'] = dim[0] / 1.5 / 2#1#yw / cdelt
-
-    head['NAXIS1'] = int(dim[1] / 1.5)#int(xw * 2 / cdelt)
-    head['NAXIS2'] = int(dim[0] / 1.5)#int(yw * 2 / cdelt)
+    head = cutout.regrid_header(file[0].header, xc, yc, dim, projection=projection)
+    file.close()
     st = str(time.time()).replace('.', '_')
     hdr_tpl = '{0}/{1}_temp_montage.hdr'.format(work_dir, st)
     head.toTxtFile(hdr_tpl, clobber=True)
@@ -309,17 +294,16 @@ def cutout_mosaics(ra, dec, radius, work_dir, filePath, do_regrid, cut_fitsnm, t
         to_be_removed.append(work_dir + '/' + cut_fitsnm)
     return cut_fitsnm
 
-def add_header(cut_fits_path, cut_psf_paths, ing_date, obs_date, completeness=None):
+def add_header(header, cut_psf_paths, ing_date, obs_date, completeness=None):
     """
     TODO
     ing_date:
         string (e.g. 2014-11-28T23:56:36.709)
     """
-    output = pyfits.open(cut_fits_path, mode='update')
     for i, t in enumerate(psf_seq):
         #psflist = pyfits.open(cut_psf_paths[i])
         #output[0].header[t] = numpy.nanmean(psflist[0].data[0])
-        output[0].header[t] = cut_psf_paths[i]
+        header[t] = cut_psf_paths[i]
     yr = ing_date.split('-')[0]
     if (yr == '2015'):
         hdr_hist = 'GLEAM-IDR2 11-Aug-2015'
@@ -328,16 +312,16 @@ def add_header(cut_fits_path, cut_psf_paths, ing_date, obs_date, completeness=No
             hdr_hist = 'GLEAM-IDR4 23-May-2016'
         else:
             hdr_hist = 'GLEAM-IDR3 14-Mar-2016'
-    output[0].header['history'] = hdr_hist
+    header['history'] = hdr_hist
     #output.writeto(cut_fits_path, clobber=True)
     #if (not output[0].header.has_key('BUNIT')):
-    output[0].header['BUNIT'] = ('JY/BEAM', 'Units are in Jansky per beam')
-    output[0].header['DATE-OBS'] = obs_date
-    hks = output[0].header.keys()
+    header['BUNIT'] = ('JY/BEAM', 'Units are in Jansky per beam')
+    header['DATE-OBS'] = obs_date
+    hks = header.keys()
     if (not 'ROBUST' in hks):
-        output[0].header['ROBUST'] = -1
+        header['ROBUST'] = -1
     if (not 'WSCWEIGH' in hks):
-        output[0].header['WSCWEIGH'] = 'Briggs(-1)'
+        header['WSCWEIGH'] = 'Briggs(-1)'
 
     if (completeness is not None):
         ra = completeness[0]
@@ -355,9 +339,7 @@ def add_header(cut_fits_path, cut_psf_paths, ing_date, obs_date, completeness=No
             if (compt_perctg is None):
                 continue
             for cpg in compt_perctg:
-                output[0].header['CMPL%04d' % (cpg[0])] = (cpg[1], 'Completeness of 200MHz catalogue at {0}mJy (%)'.format(cpg[0]))
-
-    output.close()
+                header['CMPL%04d' % (cpg[0])] = (cpg[1], 'Completeness of 200MHz catalogue at {0}mJy (%)'.format(cpg[0]))
 
 def get_compt_perctg(ra, dec, compt_path):
     """
@@ -381,18 +363,14 @@ def get_compt_perctg(ra, dec, compt_path):
     completeness_path = '/home/ngas/NGAS/gleam_metadata'
     completeness_fnames = ['cmp_map_faint.fits', 'cmp_map_mid.fits', 'cmp_map_bright.fits']
     """
-    cplist = pyfits.open(compt_path)
-    header = cplist[0].header
-    w = pywcs.WCS(header, naxis=2)
+    cplist = images.get(compt_path)
+    header = cplist.header
     num_intensity_level = int(header['NAXIS3'])
     start_intensity = int(header['CRVAL3'])
     step_width = int(header['CDELT3'])
-    pixcoords = w.wcs_world2pix([[ra, dec]], 0)[0]
-    pixcoords = [int(elem) for elem in pixcoords]
-    a = pixcoords[1]
-    b = pixcoords[0]
-    a_len = cplist[0].data[0].shape[0]
-    b_len = cplist[0].data[0].shape[1]
+    b, a = cutout.pixel(cplist, ra, dec)
+    a_len = cplist.data[0].shape[0]
+    b_len = cplist.data[0].shape[1]
 
     if (a >= a_len or b >= b_len):
         logger.error("Cutout centre is out of the completness map: %d >= %d or %d >= %d ", a, a_len, b, b_len)
@@ -401,7 +379,7 @@ def get_compt_perctg(ra, dec, compt_path):
     ret = []
     for i in range(num_intensity_level):
         il = start_intensity + i * step_width
-        pert = int(cplist[0].data[i][a][b])
+        pert = int(cplist.data[i][a][b])
         #pert = round(float("{0:.2f}".format(pert)), 2)
         ret.append((il, pert))
 
@@ -412,25 +390,19 @@ def get_bparam(ra, dec, psf_path):
     """
     """
     #psflist = pyfits.open('mosaic_Week2_freqrange_psf.fits')
-    psflist = pyfits.open(psf_path)
-    w = pywcs.WCS(psflist[0].header, naxis=2)
-    pixcoords = w.wcs_world2pix([[ra, dec]], 0)[0]
-    #pixcoords = w.wcs_world2pix([[ra, dec]], 1)[0]
-    #pixcoords = [int(round(elem)) for elem in pixcoords]
-    pixcoords = [int(elem) for elem in pixcoords]
-    a = pixcoords[1]
-    b = pixcoords[0]
-    a_len = psflist[0].data[0].shape[0]
-    b_len = psflist[0].data[0].shape[1]
+    psflist = images.get(psf_path)
+    b, a = cutout.pixel(psflist, ra, dec)
+    a_len = psflist.data[0].shape[0]
+    b_len = psflist.data[0].shape[1]
     if (a >= a_len):
         raise Exception("Cutout centre is out of the PSF map: {0} >= {1}".format(a, a_len))
         a = a_len - (a_len - a + 1) # a = a - 1?
     if (b >= b_len):
         raise Exception("Cutout centre is out of the PSF map: {0} >= {1}".format(b, b_len))
         b = b_len - (b_len - b + 1)
-    bmaj = psflist[0].data[0][a][b]
-    bmin = psflist[0].data[1][a][b]
-    bpa = psflist[0].data[2][a][b]
+    bmaj = psflist.data[0][a][b]
+    bmin = psflist.data[1][a][b]
+    bpa = psflist.data[2][a][b]
     return (bmaj, bmin, bpa)
 
 def get_date_obs(file_id):
@@ -441,6 +413,65 @@ def get_date_obs(file_id):
         logger.error("fail to get the obsdate for %s", file_id)
         return 'UNKNOWN'
 
+def mosaic_options(reqPropsObj):
+    """
+    return whether to regrid, the projection and whether to skip the PSF
+    information, as requested
+    """
+    do_regrid = (reqPropsObj.hasHttpPar('regrid') and '1' == reqPropsObj.getHttpPar("regrid"))
+    projection = 'ZEA'
+    if (reqPropsObj.hasHttpPar('projection')):
+        projection = reqPropsObj.getHttpPar("projection")
+    if (projection != 'ZEA'):
+        do_regrid = True # always regrid if reprojection is needed
+    no_psf = (reqPropsObj.hasHttpPar('nopsf') and '1' == reqPropsObj.getHttpPar("nopsf"))
+    return do_regrid, projection, no_psf
+
+def add_psf_header(srvObj, reqPropsObj, fileId, header, ra, dec, ing_date):
+    """
+    Adds the PSF and completeness information at ra, dec to the header of
+    the cutout of mosaic fileId, if its PSF map is found
+    """
+    psf_fileId = fileId.split('.fits')[0] + '_psf.fits'
+    logger.debug("Executing SQL query for GLEAM PSF CUTOUT: %s", qs.format("'%s'" % psf_fileId))
+    psfList = srvObj.getDb().query2(qs, args=(psf_fileId,))
+    if (len(psfList) == 0):
+        return
+    psf_path = psfList[0][0]
+    try:
+        add_header(header, get_bparam(ra, dec, psf_path), ing_date, get_date_obs(fileId), completeness=(ra, dec))
+    except Exception as hdr_except:
+        if (reqPropsObj.hasHttpPar('skip_psf_err') and '1' == reqPropsObj.getHttpPar("skip_psf_err")):
+            logger.debug("PSF error skipped: %s", hdr_except)
+        else:
+            raise AddPSFException(str(hdr_except))
+
+def native_cutout(srvObj, reqPropsObj, fileId, filePath, ra, dec, radius, fits_format, ing_date):
+    """
+    Cuts out (and regrids if requested) the image in-process, reading only
+    the pixels needed from the memory-mapped image
+
+    return the data and header of the cutout
+    """
+    image = images.get(filePath)
+    if (not is_mosaic(fileId)):
+        return cutout.cutout(image, ra, dec, 2 * radius)
+
+    if (ra < 0):
+        ra += 360
+    do_regrid, projection, no_psf = mosaic_options(reqPropsObj)
+    factor = 3 if do_regrid else 2
+    st = time.time()
+    data, header = cutout.cutout(image, ra, dec, radius * factor)
+    if (do_regrid):
+        target_header = cutout.regrid_header(header, ra, dec, data.shape, projection=projection)
+        data = cutout.reproject(data, header, target_header)
+        header = target_header
+    logger.debug("In-process cutout %s took %s seconds", data.shape, time.time() - st)
+    if (no_psf == False and fits_format):
+        add_psf_header(srvObj, reqPropsObj, fileId, header, ra, dec, ing_date)
+    return data, header
+
 def handleCmd(srvObj, reqPropsObj, httpRef):
     """
     Find out which threads are still dangling
@@ -526,8 +557,18 @@ def handleCmd(srvObj, reqPropsObj, httpRef):
     time_str = ('%f' % time.time()).replace('.', '_')
     cut_fitsnm = time_str + '.fits'
     to_be_removed = []
+    use_native = use_native_engine
+    if (reqPropsObj.hasHttpPar('native')):
+        use_native = ('1' == reqPropsObj.getHttpPar("native"))
+    if (reqPropsObj.hasHttpPar('use_montage') and '1' == reqPropsObj.getHttpPar("use_montage")):
+        use_native = False
+    cut_data = cut_header = None
     try:
-        if (not is_mosaic(fileId)):
+        if (use_native):
+            cut_data, cut_header = native_cutout(srvObj, reqPropsObj, fileId, filePath,
+                                                 float(coord[0]), float(coord[1]), radius,
+                                                 fits_format, ing_date)
+        elif (not is_mosaic(fileId)):
             hdulist = pyfits.open(filePath)
             width = abs(int(2 * radius / float(hdulist[0].header['CDELT1'])))
             height = abs(int(2 * radius / float(hdulist[0].header['CDELT2'])))
@@ -539,54 +580,18 @@ def handleCmd(srvObj, reqPropsObj, httpRef):
         else:
             ra = float(coord[0])
             dec = float(coord[1])
-            do_regrid = (reqPropsObj.hasHttpPar('regrid') and '1' == reqPropsObj.getHttpPar("regrid"))
-            projection = 'ZEA'
-            if (reqPropsObj.hasHttpPar('projection')):
-                projection = reqPropsObj.getHttpPar("projection")
-            if (projection != 'ZEA'):
-                do_regrid = True # always regrid if reprojection is needed
-            no_psf = (reqPropsObj.hasHttpPar('nopsf') and '1' == reqPropsObj.getHttpPar("nopsf"))
+            do_regrid, projection, no_psf = mosaic_options(reqPropsObj)
             use_montage_cut = False
             if (reqPropsObj.hasHttpPar('use_montage') and '1' == reqPropsObj.getHttpPar("use_montage")):
                 use_montage_cut = True
 
             cut_fitsnm = cutout_mosaics(ra, dec, radius, work_dir, filePath, do_regrid, cut_fitsnm, to_be_removed, use_montage=use_montage_cut, projection=projection)
             if (no_psf == False and fits_format):
-                psf_fileId = fileId.split('.fits')[0] + '_psf.fits'
-                query = qs.format("'%s'" % psf_fileId)
-                sql_inject_test(query)
-                logger.debug("Executing SQL query for GLEAM PSF CUTOUT: %s", str(query))
-                #pres = srvObj.getDb().query(query, maxRetries=1, retryWait=0)
-                #psfList = pres[0]
-                psfList = srvObj.getDb().query2(qs, args=(psf_fileId,))
-                if (len(psfList) > 0):
-                    psf_path = psfList[0][0]
-
-                    """
-                    dim = pyfits.open(psf_path)[0].shape
-                    cut_psfnm_list = []
-                    for i, t in enumerate(psf_seq):
-                        psf_path_splitnm = work_dir + '/' + psf_fileId.replace('_psf.fits', '{1}_psf{0}.fits'.format(i, time_str))
-                        cmd_split = "{0} '{1}[1:{2}, 1:{3}, {4}:{4}]' {5}".format(fits_copy_exec,
-                                                                                psf_path,
-                                                                                dim[2],
-                                                                                dim[1],
-                                                                                i + 1,
-                                                                                psf_path_splitnm)
-                        info(3, "Executing fitscopy split: %s" % cmd_split)
-                        execCmd(cmd_split)
-                        cut_psfnm = cut_fitsnm.replace('.fits', '_psf{0}.fits'.format(i))
-                        cutout_mosaics(ra, dec, radius, work_dir, psf_path_splitnm, do_regrid, cut_psfnm, to_be_removed)
-                        cut_psfnm_list.append(work_dir + '/' + cut_psfnm)
-                        to_be_removed.append(psf_path_splitnm)
-                    """
-                    try:
-                        add_header(work_dir + '/' + cut_fitsnm, get_bparam(ra, dec, psf_path), ing_date, get_date_obs(fileId), completeness=(ra, dec))
-                    except Exception as hdr_except:
-                        if (reqPropsObj.hasHttpPar('skip_psf_err') and '1' == reqPropsObj.getHttpPar("skip_psf_err")):
-                            logger.debug("PSF error skipped: %s", hdr_except)
-                        else:
-                            raise AddPSFException(str(hdr_except))
+                output = pyfits.open(work_dir + '/' + cut_fitsnm, mode='update')
+                try:
+                    add_psf_header(srvObj, reqPropsObj, fileId, output[0].header, ra, dec, ing_date)
+                finally:
+                    output.close()
 
     except Exception as excmd1:
         """
@@ -631,8 +636,18 @@ def handleCmd(srvObj, reqPropsObj, httpRef):
     if (fits_format):
         hdr_fnm = "gleam_cutout{0}.fits".format(fn_suff)
         hdr_cttp = "image/fits"
+        if (cut_data is not None):
+            httpRef.send_data(cutout.to_fits(cut_data, cut_header), hdr_cttp, fname=hdr_fnm)
+            return
         hdr_dataref = work_dir + '/' + cut_fitsnm
+    elif (cut_data is not None and cutout.can_render_jpeg):
+        httpRef.send_data(cutout.to_jpeg(cut_data), "image/jpeg", fname="gleam_cutout{0}.jpg".format(fn_suff))
+        return
     else:
+        if (cut_data is not None):
+            # No in-process JPEG rendering available, ds9 needs a file
+            pyfits.PrimaryHDU(cut_data, cut_header).writeto(work_dir + '/' + cut_fitsnm)
+            to_be_removed.append(work_dir + '/' + cut_fitsnm)
         ds9_sem.acquire()
         ttt = time.time()
         jpfnm = ('%f' % ttt).replace('.', '_') + '.jpg'
@@ -66,6 +66,7 @@ import time
 
 from six.moves import cPickle as pickle  # @UnresolvedImport
 from six.moves import http_client as httplib  # @UnresolvedImport
+from six.moves import queue as Queue  # @UnresolvedImport
 from six.moves.urllib import parse as urlparse # @UnresolvedImport
 from six.moves.urllib import request as urlrequest # @UnresolvedImport
 
@@ -87,8 +88,11 @@ nextFileDic = {} #key - uuid, value - next file_id to be delivered
 threadDic = {} #key - uuid, value - the threadref
 threadRunDic = {} #key - uuid, value - 1/0, 1: run 0: stop
 ASYNC_DELIVERY_THR = "Asyn-delivery-thrd-"
+ASYNC_STAGING_THR = "Asyn-staging-thrd-"
 fileMimeType = "application/octet-stream"
 THREAD_STOP_TIME_OUT = 8
+TAPE_STATUS_BATCH_SIZE = 100 # number of files whose online/offline status is queried with a single command
+STAGING_POLL_PERIOD = 10 # seconds between checks of the files being staged
 
 def handleCmd(srvObj, reqPropsObj, httpRef):
     """
@@ -512,6 +516,7 @@ def genInstantResponse(srvObj, asyncListReqObj):
         return res
     fileInfoList = srvObj.getDb().getFileSummary1(None, [], asyncListReqObj.file_id, None, [], None, 0)
     baseNameDic = {}
+    filenames = [] # (filename, FileInfo) tuples
     for f in fileInfoList:
         file_id = f[ngamsDbCore.SUM1_FILE_ID]
         if (baseNameDic.has_key(file_id)):
@@ -521,13 +526,15 @@ def genInstantResponse(srvObj, asyncListReqObj):
             baseNameDic[file_id] = 1
         file_size = f[ngamsDbCore.SUM1_FILE_SIZE]
         filename  = f[ngamsDbCore.SUM1_MT_PT] + "/" + f[ngamsDbCore.SUM1_FILENAME]
-        status = AsyncListRetrieveProtocolError.OK #online
-        if (ngamsMWACortexTapeApi.isFileOnTape(filename) == 1):
-            status = AsyncListRetrieveProtocolError.FILE_NOT_ONLINE #offline
-        finfo = FileInfo(file_id, file_size, status)
+        finfo = FileInfo(file_id, file_size, AsyncListRetrieveProtocolError.OK) #online
+        filenames.append((filename, finfo))
         res.file_info.append(finfo)
         statuRes.number_bytes_to_be_delivered += file_size
         statuRes.number_files_to_be_delivered += 1
+    onTape = ngamsMWACortexTapeApi.getFilesOnTape([fn for fn, _ in filenames], TAPE_STATUS_BATCH_SIZE)
+    for filename, finfo in filenames:
+        if (onTape[filename] == 1):
+            finfo.status = AsyncListRetrieveProtocolError.FILE_NOT_ONLINE #offline
     statusResDic[sessionId] = statuRes
     for ff in asyncListReqObj.file_id:
         if (not baseNameDic.has_key(ff)):
@@ -536,6 +543,63 @@ def genInstantResponse(srvObj, asyncListReqObj):
 
     return res
 
+def _isRunning(sessionId):
+    """
+    Whether the delivery of the files of a session has not been cancelled/suspended
+    """
+    return threadRunDic.get(sessionId, 1) != 0
+
+def _stagingThread(sessionId, filesOnTape, fileSizes, deliveryQueue, statusRes):
+    """
+    Request the staging of the files on tape, and put each of them
+    in the delivery queue as soon as it is online. None is put in the
+    queue at the end to signal there are no more files to be delivered.
+
+    sessionId       session uuid
+    filesOnTape     full path of the files to be staged
+    fileSizes       key - full path, value - file size
+    deliveryQueue   queue of files to be delivered
+    statusRes       AsyncListRetrieveStatusResponse of the session (or None)
+    """
+    try:
+        if (ngamsMWACortexTapeApi.requestStaging(filesOnTape) == -1):
+            return
+
+        stagingStart = time.time()
+        bytesStaged = 0
+        pending = filesOnTape
+        while (len(pending) > 0 and _isRunning(sessionId)):
+            onTape = ngamsMWACortexTapeApi.getFilesOnTape(pending, TAPE_STATUS_BATCH_SIZE)
+            stillPending = []
+            for filename in pending:
+                if (onTape[filename] == 1):
+                    stillPending.append(filename)
+                    continue
+                file_size = fileSizes[filename]
+                if (onTape[filename] == 0):
+                    logger.debug("File %s staged, add it in the queue", filename)
+                    deliveryQueue.put(filename)
+                    bytesStaged += file_size
+                else:
+                    logger.warning("Cannot query the staging status of file %s, it will not be delivered", filename)
+                if (statusRes != None):
+                    statusRes.number_files_to_be_staged -= 1
+                    statusRes.number_bytes_to_be_staged -= file_size
+                    statusRes.staging_rate = bytesStaged / max(time.time() - stagingStart, 1e-6)
+            pending = stillPending
+
+            # wait for more files to be staged, but stop promptly on cancel/suspend
+            waitUntil = time.time() + STAGING_POLL_PERIOD
+            while (len(pending) > 0 and _isRunning(sessionId) and time.time() < waitUntil):
+                time.sleep(1.0)
+    except Exception:
+        logger.exception("Error while staging files for session %s", sessionId)
+    finally:
+        if (statusRes != None):
+            statusRes.number_files_to_be_staged = 0
+            statusRes.number_bytes_to_be_staged = 0
+        deliveryQueue.put(None)
+
 def _deliveryThread(srvObj, asyncListReqObj):
     """
     this is where files get pushed
@@ -562,6 +626,8 @@ def _deliveryThread(srvObj, asyncListReqObj):
     fileInfoList = srvObj.getDb().getFileSummary1(fileHost, [], asyncListReqObj.file_id, None, [], None, 0)
     logger.debug("fileIninfList length = %d", len(fileInfoList))
     baseNameDic = {} # key - basename, value - file size
+    filenames = []
+    fileSizes = {} # key - full path, value - file size
 
     statusRes = None
     if (statusResDic.has_key(sessionId)):
@@ -583,29 +649,41 @@ def _deliveryThread(srvObj, asyncListReqObj):
             baseNameDic[basename] = file_size
 
         filename  = fileInfo[ngamsDbCore.SUM1_MT_PT] + "/" + fileInfo[ngamsDbCore.SUM1_FILENAME] #e.g. /home/chen/proj/mwa/testNGAS/NGAS2/volume1/afa/2012-10-26/2/110024_20120914132151_12.fits
+        filenames.append(filename)
+        fileSizes[filename] = file_size
 
-        if (ngamsMWACortexTapeApi.isFileOnTape(filename) == 1):
+    # the online/offline status is queried in batches, rather than running one command per file
+    onTape = ngamsMWACortexTapeApi.getFilesOnTape(filenames, TAPE_STATUS_BATCH_SIZE)
+    for filename in filenames:
+        if (onTape[filename] == 1):
             filesOnTape.append(filename)
             if (statusRes != None):
                 statusRes.number_files_to_be_staged += 1
-                statusRes.number_bytes_to_be_staged += file_size
+                statusRes.number_bytes_to_be_staged += fileSizes[filename]
         else:
             filesOnDisk.append(filename)
             logger.debug("add %s in the queue", filename)
     logger.debug(" * * * middle of the _deliveryThread")
-    stageRet = 0
-    if (len(filesOnTape) > 0):
-        stageRet = ngamsMWACortexTapeApi.stageFiles(filesOnTape) # TODO - this should be done in another thread very soon! then the thread synchronisation issues....
-
-    if (statusRes != None):
-        statusRes.number_files_to_be_staged = 0
-        statusRes.number_bytes_to_be_staged = 0
 
-    allfiles = filesOnDisk
-    if (stageRet != -1):
-        allfiles = filesOnDisk + filesOnTape
+    # files on disk are delivered straight away, while those on tape are
+    # staged by another thread, which queues each of them once it is online
+    deliveryQueue = Queue.Queue()
+    for filename in filesOnDisk:
+        deliveryQueue.put(filename)
+    if (len(filesOnTape) > 0):
+        args = (sessionId, filesOnTape, fileSizes, deliveryQueue, statusRes)
+        stagingThrRef = threading.Thread(None, _stagingThread, ASYNC_STAGING_THR+sessionId, args)
+        stagingThrRef.setDaemon(1)
+        stagingThrRef.start()
+    else:
+        deliveryQueue.put(None)
 
-    for filename in allfiles:
+    deliveryStart = time.time()
+    bytesDelivered = 0
+    while (True):
+        filename = deliveryQueue.get()
+        if (filename is None): # no more files to deliver
+            break
         basename = os.path.basename(filename)
         nextFileDic[sessionId] = basename
         if (threadRunDic.has_key(sessionId) and threadRunDic[sessionId] == 0):
@@ -615,11 +693,13 @@ def _deliveryThread(srvObj, asyncListReqObj):
         ret = _httpPost(srvObj, clientUrl, filename, sessionId)
         if (ret == 0):
             asyncListReqObj.file_id.remove(basename) #once it is delivered successfully, it is removed from the list
+            bytesDelivered += baseNameDic[basename]
             if (statusRes != None):
                 statusRes.number_files_delivered += 1
                 statusRes.number_files_to_be_delivered -= 1
                 statusRes.number_bytes_delivered += baseNameDic[basename]
                 statusRes.number_bytes_to_be_delivered -= baseNameDic[basename]
+                statusRes.delivery_rate = bytesDelivered / max(time.time() - deliveryStart, 1e-6)
         elif (threadRunDic.has_key(sessionId) and threadRunDic[sessionId] == 0):
             logger.debug("transfer cancelled/suspended while transferring file '%s'", basename)
             break
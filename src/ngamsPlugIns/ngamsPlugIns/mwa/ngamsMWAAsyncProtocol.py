@@ -81,4 +81,6 @@ class AsyncListRetrieveStatusResponse:
     number_bytes_delivered = 0
     number_bytes_to_be_delivered = 0
     number_bytes_to_be_staged = 0
+    staging_rate = 0 # bytes staged per second
+    delivery_rate = 0 # bytes delivered per second
     errorcode = None
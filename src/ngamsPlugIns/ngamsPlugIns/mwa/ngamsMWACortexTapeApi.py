@@ -10,6 +10,8 @@
 
 import logging
 
+from six.moves import shlex_quote  # @UnresolvedImport
+
 from ngamsLib import ngamsPlugInApi
 
 
@@ -27,39 +29,76 @@ def isFileOnTape(filename):
     """
     return 1 - on tape, 0 - not on tape, -1 - query error
     """
-    cmd = "sls -D " + filename
-    t = ngamsPlugInApi.execCmd(cmd, -1)
-    exitCode = t[0]
-    if (exitCode != 0 or len(t) != 2):
-        logger.error("Fail to query the online/offline status for file %s", filename)
-        #print errMsg
-        return -1 #raise error
+    return getFilesOnTape([filename])[filename]
 
-    offline = t[1].find('offline;') # Do not use "archdone" any more given this reason: http://www.mail-archive.com/sam-qfs-discuss@mail.opensolaris.org/msg00419.html
+def _parseSlsOutput(output, filenameList):
+    """
+    Parse the output of "sls -D" for a list of files. The details of each
+    file start with a line containing its name followed by a colon.
 
-    if (offline != -1): # the file is offline, i.e. it is on tape
-        return 1
-    else:
-        return 0
+    return a dictionary with filename as key, and 1 - on tape, 0 - not on tape, -1 - query error as value
+    """
+    res = dict((filename, -1) for filename in filenameList)
+    current = None
+    for line in output.splitlines():
+        if (line.endswith(':') and line[:-1] in res):
+            current = line[:-1]
+            res[current] = 0
+        elif (current is not None and line.find('offline;') != -1):
+            res[current] = 1
+    return res
+
+def getFilesOnTape(filenameList, batchSize = 100):
+    """
+    Query the online/offline status of a list of files, using one
+    command for every batchSize files instead of one per file
 
-def stageFiles(filenameList):
+    return a dictionary with filename as key, and 1 - on tape, 0 - not on tape, -1 - query error as value
     """
-    Stage a list of files.
+    res = {}
+    for i in range(0, len(filenameList), batchSize):
+        batch = filenameList[i:i + batchSize]
+        cmd = "sls -D " + " ".join(shlex_quote(filename) for filename in batch)
+        t = ngamsPlugInApi.execCmd(cmd, -1)
+        output = t[1] if len(t) == 2 else ''
+        if (not isinstance(output, str)):
+            output = output.decode('utf-8', 'replace')
+        batchRes = _parseSlsOutput(output, batch)
+        # sls fails if any of the files cannot be found, the rest are still reported
+        failed = [filename for filename in batch if batchRes[filename] == -1]
+        if (failed):
+            logger.error("Fail to query the online/offline status for files %s", ", ".join(failed))
+        res.update(batchRes)
+    return res
+
+def requestStaging(filenameList):
+    """
+    Request the staging of a list of files, without waiting for it to complete.
     The system will sort files in the order that they are archived on the tape volumes for better performance
+
+    return 0 - request accepted, -1 - error
     """
-    cmd1 = "stage -r"
-    cmd2 = "stage -r -w"
-    num_staged = 0
-    for filename in filenameList:
-        if (isFileOnTape(filename) == 1):
-            cmd1 = cmd1 + " " + filename
-            cmd2 = cmd2 + " " + filename
-            num_staged = num_staged + 1
-
-    t = ngamsPlugInApi.execCmd(cmd1, -1)
+    cmd = "stage -r " + " ".join(shlex_quote(filename) for filename in filenameList)
+    t = ngamsPlugInApi.execCmd(cmd, -1)
     exitCode = t[0]
     if (exitCode != 0):
-        logger.error("Staging problem: %s, cmd: %s", str(exitCode), cmd1)
+        logger.error("Staging problem: %s, cmd: %s", str(exitCode), cmd)
+        return -1
+    return 0
+
+def stageFiles(filenameList):
+    """
+    Stage a list of files.
+    The system will sort files in the order that they are archived on the tape volumes for better performance
+    """
+    onTape = getFilesOnTape(filenameList)
+    filenameList = [filename for filename in filenameList if onTape[filename] == 1]
+    cmd2 = "stage -r -w " + " ".join(shlex_quote(filename) for filename in filenameList)
+    num_staged = len(filenameList)
+    if (num_staged == 0):
+        return 0
+
+    if (requestStaging(filenameList) == -1):
         return -1
 
     t = ngamsPlugInApi.execCmd(cmd2, -1)
@@ -45,17 +45,101 @@ that 'volume load balancing' is provided.
 import contextlib
 import logging
 import os
+import threading
 import time
 
 from ngamsLib.ngamsCore import checkCreatePath, NGAMS_RETRIEVE_CMD
 from ngamsLib import ngamsHttpUtils
-from ngamsServer import ngamsFileUtils, ngamsSrvUtils
+from ngamsServer import ngamsFileUtils, ngamsSrvUtils, staging_writer
 from ngamsServer.ngamsArchiveUtils import archiving_results
-from . import ngamsFailedDownloadException
+from . import ngamsFailedDownloadException, ngamsSegmentedFetch
 
 logger = logging.getLogger(__name__)
 
 
+def get_segmenting(cfg):
+    """
+    Get the number of connections and the size of the segments used to fetch large files
+    :param cfg: NG/AMS Configuration object (ngamsConfig)
+    :return: Tuple. Number of connections (1 if segmented fetching is disabled), segment size in bytes
+    """
+    connections = int(cfg.getVal("Mirroring[1].segment_connections") or 1)
+    segment_size = int(cfg.getVal("Mirroring[1].segment_size") or 128) * 1024 * 1024
+    return connections, segment_size
+
+
+def save_segmented(ngams_server, request_properties, state, url, parameter_list, authorization_header, rx_timeout,
+                   block_size, connections):
+    """
+    Save a file into the given staging file by fetching its segments concurrently, resuming a previous download
+    if possible
+    :param ngams_server: Reference to NG/AMS server class object (ngamsServer)
+    :param request_properties: NG/AMS Request Properties object (ngamsReqProps)
+    :param state: ngamsSegmentedFetch.SegmentsState, The segments the staging file is split into
+    :param url: URL of the RETRIEVE command of the source (string)
+    :param parameter_list: Parameters of the RETRIEVE command (list)
+    :param authorization_header: Authorization header to send to the source (string)
+    :param rx_timeout: Socket timeout in seconds (integer)
+    :param block_size: Block size (bytes) to apply when reading the data from the HTTP channel (integer)
+    :param connections: Number of segments fetched concurrently (integer)
+    :return: File save to archive status information (archiving_results)
+    """
+    file_id = request_properties.fileinfo['fileId']
+    checksum = request_properties.checksum
+    crc_variant = request_properties.checksum_plugin
+    crc_info = ngamsFileUtils.get_checksum_info(crc_variant)
+
+    logger.debug("Creating path: %s", state.staging_filename)
+    checkCreatePath(os.path.dirname(state.staging_filename))
+    state.load()
+    request_properties.setBytesReceived(state.bytes_done)
+
+    lock = threading.Lock()
+    throttle = getattr(request_properties, 'throttle', None)
+
+    def on_data(nbytes):
+        with lock:
+            request_properties.setBytesReceived(request_properties.getBytesReceived() + nbytes)
+        if throttle is not None:
+            throttle(nbytes)
+
+    def get_range(first, last):
+        header_dict = {'Range': "bytes={:d}-{:d}".format(first, last)}
+        request_start_time = time.time()
+        response = ngamsHttpUtils.httpGetUrl(url, parameter_list, header_dict, rx_timeout, authorization_header)
+        # The first response is used by the mirroring scheduler as a measure of the latency to the source
+        with lock:
+            if getattr(request_properties, 'fetch_latency', None) is None:
+                request_properties.fetch_latency = time.time() - request_start_time
+        return response
+
+    policy = staging_writer.staging_policy_for(ngams_server.getCfg(),
+                                               request_properties.getTargDiskInfo().getSlotId())
+    logger.info('Fetching file ID %s, checksum %s, checksum variant %s in %d segments over %d connections',
+                file_id, checksum, crc_variant, len(state.segments), connections)
+    fetch_start_time = time.time()
+    fetch = ngamsSegmentedFetch.SegmentedFetch(get_range, state, crc_info, connections, block_size,
+                                               policy=policy, on_data=on_data)
+    result = fetch.run()
+    fetch_duration = time.time() - fetch_start_time
+    # Avoid divide by zeros later on, let's say it took us 1 [us] to do this
+    if fetch_duration == 0.0:
+        fetch_duration = 0.000001
+
+    msg = "Saved data in file: %s. Bytes received: %d. Time: %.3f s. Rate: %.2f Bytes/s"
+    logger.info(msg, state.staging_filename, result.size, fetch_duration, float(result.size) / fetch_duration)
+
+    # The file is complete, if its checksum doesn't match it has to be fetched again from scratch
+    state.remove()
+    logger.info('Source checksum: %s - received checksum: %d', checksum, result.crc)
+    if not crc_info.equals(checksum, result.crc):
+        msg = "checksum mismatch: source={:s}, received={:d}".format(checksum, result.crc)
+        raise ngamsFailedDownloadException.FailedDownloadException(msg)
+
+    return archiving_results(result.size, result.rtime, result.wtime, result.crctime, fetch_duration,
+                             crc_variant, result.crc)
+
+
 def save_to_file(ngams_server, request_properties, target_filename, block_size, start_byte):
     """
     Save the data available on an HTTP channel into the given file
@@ -89,7 +173,29 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
 
     url = 'http://{0}:{1}/{2}'.format(host, port, NGAMS_RETRIEVE_CMD)
     authorization_header = ngamsSrvUtils.genIntAuthHdr(ngams_server)
+
+    # Large files can be fetched in segments over several connections
+    connections, segment_size = get_segmenting(ngams_server.getCfg())
+    file_size = request_properties.getSize()
+    state = ngamsSegmentedFetch.SegmentsState(target_filename, '{0}/{1}'.format(file_id, file_version),
+                                              file_size, segment_size)
+    if connections > 1 and file_size >= 2 * segment_size and (start_byte == 0 or os.path.exists(state.fname)):
+        try:
+            return save_segmented(ngams_server, request_properties, state, url, parameter_list,
+                                  authorization_header, rx_timeout, block_size, connections)
+        except ngamsSegmentedFetch.RangesNotSupported:
+            if state.done:
+                raise
+            logger.warning("Source %s doesn't support segmented downloads, fetching file ID %s in a single stream",
+                           source_host, file_id)
+            state.remove()
+            start_byte = 0
+            header_dict = {'Range': "bytes=0-"}
+
+    request_start_time = time.time()
     response = ngamsHttpUtils.httpGetUrl(url, parameter_list, header_dict, rx_timeout, authorization_header)
+    # Time to the response headers, used by the mirroring scheduler as a measure of the latency to the source
+    request_properties.fetch_latency = time.time() - request_start_time
 
     # Can we resume a previous download?
     download_resume_supported = 'bytes' in response.getheader("Accept-Ranges", '')
@@ -106,11 +212,11 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
         logger.info("Resume requested and mirroring source supports resume. Appending data to previous staging file")
         crc = ngamsFileUtils.get_checksum(65536, target_filename, crc_variant)
         request_properties.setBytesReceived(start_byte)
-        fd_out = open(target_filename, "ab")
+        append = True
     else:
         if start_byte > 0:
             logger.info("Resume of download requested but server does not support it. Starting from byte 0 again.")
-        fd_out = open(target_filename, "wb")
+        append = False
         crc = crc_info.init
 
     fetch_start_time = time.time()
@@ -121,9 +227,17 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
     if 'content-length' in response_header_dict:
         remaining_size = int(response_header_dict['content-length'])
         logger.debug("Got Content-Length header value %d in response", remaining_size)
+        preallocate_size = remaining_size
     else:
         logger.warning("No Content-Length header found in response. Defaulting to 1e11")
         remaining_size = int(1e11)
+        preallocate_size = None
+
+    # The data is checksummed as it arrives, so it doesn't need to stay cached
+    policy = staging_writer.staging_policy_for(ngams_server.getCfg(),
+                                               request_properties.getTargDiskInfo().getSlotId())
+    fd_out = staging_writer.StagingFile(target_filename, preallocate_size, policy,
+                                        append=append, drop_cache=True)
 
     # Receive the data
     read_size = block_size
@@ -134,7 +248,9 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
     read_total_bytes = 0
 
     crc_method = crc_info.method
-    with contextlib.closing(response), contextlib.closing(fd_out):
+    # The mirroring scheduler paces the data received to its bandwidth budgets
+    throttle = getattr(request_properties, 'throttle', None)
+    with contextlib.closing(response), fd_out:
         while remaining_size > 0:
             if remaining_size < read_size:
                 read_size = remaining_size
@@ -162,6 +278,9 @@ def save_to_file(ngams_server, request_properties, target_filename, block_size,
             fd_out.write(data_buffer)
             write_duration += time.time() - write_start_time
 
+            if throttle is not None:
+                throttle(size_read)
+
     crc = crc_info.final(crc)
 
     fetch_duration = time.time() - fetch_start_time
@@ -45,6 +45,19 @@ PARAMETERS
                                 (distributing the process to the active nodes in the local cluster)
 * order                     (=0), Start mirroring sequence order with small files
                             (=1), Start mirroring sequence order with big files
+* priority [optional]       (=small), Schedule the mirroring tasks starting with the small files
+                            (=large), Schedule the mirroring tasks starting with the big files
+                            (=newest), Schedule the mirroring tasks starting with the newest files in the source cluster
+* bandwidth [optional]      Bandwidth budget for the whole source cluster in MB/s
+* link_bandwidth [optional] Bandwidth budget for each source-target link in MB/s
+* adaptive [optional]       (=1), Adapt the number of parallel streams per source node to the observed throughput
+                                and latency, default
+                            (=0), Use a fixed number of streams per source node
+
+When any of priority, bandwidth, link_bandwidth or adaptive are given the mirroring tasks are handed to the threads by
+the mirroring scheduler (see ngamsMirroringScheduler) rather than in the order given by the order parameter. The
+throughput achieved versus the budgets is logged periodically, and the statistics of the last scheduled iteration are
+kept in the mirroring_statistics attribute of the server.
 
 EXAMPLES
 --------
@@ -52,6 +65,8 @@ EXAMPLES
     http://ngas05.hq.eso.org:7778/MIRREXEC?n_threads=4
 * Carry out all pending mirroring tasks assigned to the local cluster using 2 threads per source node
     http://ngas05.hq.eso.org:7778/MIRREXEC?mirror_cluster=1&n_threads=2
+* Carry out pending mirroring tasks for this NGAS server using up to 8 threads, newest files first, within 100 MB/s
+    http://ngas05.hq.eso.org:7778/MIRREXEC?n_threads=8&priority=newest&bandwidth=100
 """
 
 import contextlib
@@ -66,6 +81,7 @@ from ngamsLib.ngamsCore import genUniqueId, toiso8601,\
     FMT_DATETIME_NOMSEC, NGAMS_FAILURE, NGAMS_HTTP_SUCCESS, NGAMS_STAGING_DIR
 from . import ngamsFailedDownloadException
 from . import ngamsCmd_MIRRARCHIVE
+from . import ngamsMirroringScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -89,13 +105,14 @@ def handleCmd(ngams_server, request_properties, http_reference=None):
     if request_properties.hasHttpPar("rx_timeout"):
         rx_timeout = int(request_properties.getHttpPar("rx_timeout"))
     current_iteration = int(request_properties.getHttpPar("iteration"))
+    scheduler_pars = get_scheduler_parameters(request_properties)
 
     # Distributed cluster mirroring
     if mirror_cluster:
         local_cluster_name = get_cluster_name(ngams_server)
         active_target_nodes = get_active_target_nodes(local_cluster_name, current_iteration, ngams_server)
         # Start mirroring
-        distributed_mirroring(active_target_nodes, n_threads, rx_timeout, current_iteration)
+        distributed_mirroring(active_target_nodes, n_threads, rx_timeout, current_iteration, scheduler_pars)
     else:
         local_server_full_qualified_name = get_fully_qualified_name(ngams_server)
         # Format full qualified name as a list
@@ -108,13 +125,33 @@ def handleCmd(ngams_server, request_properties, http_reference=None):
         try:
             # Set mirroring running flag to avoid data check thread and janitor thread
             ngams_server.mirroring_running = True
-            multithreading_mirroring(active_source_nodes, n_threads, current_iteration, ngams_server)
+            multithreading_mirroring(active_source_nodes, n_threads, current_iteration, ngams_server,
+                                     scheduler_pars)
         finally:
             # Set mirroring running flag to trigger data check thread and janitor thread
             ngams_server.mirroring_running = False
     return
 
 
+def get_scheduler_parameters(request_properties):
+    """
+    Get the parameters of the mirroring scheduler from the request
+    :param request_properties: ngamsReqProps, Request Property object
+    :return: dict, Parameters given to the request (with bandwidths in MB/s), or None if the scheduler is not used
+    """
+    scheduler_pars = {}
+    if request_properties.hasHttpPar("priority"):
+        scheduler_pars['priority'] = request_properties.getHttpPar("priority")
+        if scheduler_pars['priority'] not in ngamsMirroringScheduler.PRIORITIES:
+            raise Exception("Unknown mirroring priority: %s" % scheduler_pars['priority'])
+    for name in ('bandwidth', 'link_bandwidth'):
+        if request_properties.hasHttpPar(name):
+            scheduler_pars[name] = float(request_properties.getHttpPar(name))
+    if request_properties.hasHttpPar("adaptive"):
+        scheduler_pars['adaptive'] = int(request_properties.getHttpPar("adaptive"))
+    return scheduler_pars or None
+
+
 def get_cluster_name(ngams_server):
     """
     Get cluster name corresponding to the processing NGAMS server
@@ -247,7 +284,7 @@ def get_list_mirroring_tasks(current_iteration, source_node, target_node, ngams_
     # Pull out the fields from the mirroring bookkeeping table that we may need in order to fetch files.
     # The individual fields are passed around and eventually formed into a command in process_mirroring_tasks
     sql = "select file_size, staging_file, rowid, format, checksum, " \
-          "checksum_plugin, source_host, disk_id, host_id, file_version, file_id " \
+          "checksum_plugin, source_host, disk_id, host_id, file_version, file_id, source_ingestion_date " \
           "from ngas_mirroring_bookkeeping " \
           "where source_host = {0} and target_host = {1} and iteration = {2} and status = 'READY' order by file_size"
 
@@ -453,74 +490,7 @@ def process_mirroring_tasks(mirroring_tasks_queue, target_node, ith_thread, num_
             else:
                 break
 
-            # Get all the fields we are interested in and form them into a command to fetch the files.
-            # These fields were extracted in get_list_mirroring_tasks()
-            logger.debug("Next task: %r", item)
-            staging_file = str(item[1])
-            mime_type = str(item[3])
-            checksum = str(item[4])
-            checksum_plugin = str(item[5])
-            rowid = str(item[2])
-            file_id = str(item[10])
-            file_size = str(item[0])
-            file_info = {}
-            file_info['sourceHost'] = str(item[6])
-            file_info['diskId'] = str(item[7])
-            file_info['hostId'] = str(item[8])
-            file_info['fileVersion'] = str(item[9])
-            file_info['fileId'] = file_id
-
-            logger.info("Processing mirroring task (target node: %s, file size: %s, thread: %d) file info: %s",
-                        target_node, file_size, ith_thread, str(file_info))
-            # Initialize ngamsReqProps object by just specifying the file URI and the mime-type
-            request_properties = ngamsReqProps.ngamsReqProps()
-            request_properties.setMimeType(mime_type)
-            request_properties.checksum = checksum
-            request_properties.checksum_plugin = checksum_plugin
-            request_properties.fileinfo = file_info
-            request_properties.setSize(file_size)
-
-            # Start clock
-            start = time.time()
-            (staging_filename, target_disk_info) = calculate_staging_name(ngams_server, file_id, staging_file)
-            request_properties.setStagingFilename(staging_filename)
-            request_properties.setTargDiskInfo(target_disk_info)
-            try:
-                # Construct query to update ingestion date, ingestion time and status
-                sql = "update ngas_mirroring_bookkeeping " \
-                      "set status = 'FETCHING', staging_file = {0}, attempt = nvl(attempt + 1, 1) " \
-                      "where rowid = {1}"
-                # Add query to the queue
-                ngams_server.getDb().query2(sql, args=(request_properties.getStagingFilename(), rowid))
-                logger.info("Mirroring file: %s", file_id)
-                ngamsCmd_MIRRARCHIVE.handleCmd(ngams_server, request_properties)
-                status = "SUCCESS"
-            except ngamsFailedDownloadException.FailedDownloadException:
-                # Something bad happened...
-                logger.exception("Failed to fetch %s", file_id)
-                status = "FAILURE"
-            except ngamsFailedDownloadException.AbortedException:
-                logger.warning("File fetch aborted: %s", file_id)
-                status = "ABORTED"
-            except ngamsFailedDownloadException.PostponeException:
-                logger.exception("Failed to fetch %s - will try to resume on next iteration", file_id)
-                status = "TORESUME"
-            except Exception:
-                # This clause should never be reached
-                logger.exception("Fetch failed in an unexpected way")
-                status = "FAILURE"
-
-            # Get time elapsed
-            elapsed_time = (time.time() - start)
-
-            # Construct query to update ingestion date, ingestion time and status
-            sql = "update ngas_mirroring_bookkeeping set status = {0},"
-            if status != 'TORESUME':
-                sql += "staging_file = null, "
-            sql += "ingestion_date = {1}, ingestion_time = nvl(ingestion_time, 0.0) + {2} " \
-                   "where rowid = {3}"
-            args = (status, toiso8601(fmt=FMT_DATETIME_NOMSEC) + ":000", elapsed_time, rowid)
-            ngams_server.getDb().query2(sql, args=args)
+            status, elapsed_time, file_info, _ = process_mirroring_task(item, target_node, ith_thread, ngams_server)
 
             # Log message for mirroring task processed
             completion = 100 * (num_tasks - len(mirroring_tasks_queue)) / float(num_tasks)
@@ -532,6 +502,147 @@ def process_mirroring_tasks(mirroring_tasks_queue, target_node, ith_thread, num_
     return
 
 
+def process_scheduled_mirroring_tasks(scheduler, target_node, ith_thread, ngams_server):
+    """
+    Process the mirroring tasks handed out by the mirroring scheduler
+    :param scheduler: ngamsMirroringScheduler.MirroringScheduler, Scheduler of the mirroring tasks assigned to the
+    input server
+    :param target_node: string, Full qualified name of the target node
+    :param ith_thread: int, Thread number
+    :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    """
+    logger.debug("Inside scheduled mirror worker %d to mirror files to %s", ith_thread, target_node)
+    try:
+        while True:
+            item = scheduler.next_task()
+            if item is None:
+                break
+
+            received = [0]
+
+            def throttle(nbytes):
+                received[0] += nbytes
+                scheduler.throttle(item, nbytes)
+
+            status, elapsed_time, file_info, request_properties = "FAILURE", 0, None, None
+            try:
+                status, elapsed_time, file_info, request_properties = \
+                    process_mirroring_task(item, target_node, ith_thread, ngams_server, throttle)
+            except Exception:
+                # One bad task shouldn't stop the rest from being processed
+                logger.exception("Error while processing mirroring task: %r", item)
+                mark_mirroring_task_failed(item, ngams_server)
+            finally:
+                latency = getattr(request_properties, 'fetch_latency', None)
+                scheduler.task_done(item, received[0], latency, status == "SUCCESS")
+
+            logger.info("Mirroring task (Target node: %s Thread: %d) processed in %fs (%s), remaining tasks: %d: %s",
+                        target_node, ith_thread, elapsed_time, status, len(scheduler), str(file_info))
+        logger.info("Mirroring Worker complete")
+    except Exception:
+        logger.exception("Error while running mirroring worker")
+    return
+
+
+def process_mirroring_task(item, target_node, ith_thread, ngams_server, throttle=None):
+    """
+    Process a single mirroring task
+    :param item: Mirroring task, as returned by get_list_mirroring_tasks
+    :param target_node: string, Full qualified name of the target node
+    :param ith_thread: int, Thread number
+    :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    :param throttle: Function called with the number of bytes of each block of data received, or None
+    :return: tuple, Final status of the task, time elapsed, file information and request properties used
+    """
+    # Get all the fields we are interested in and form them into a command to fetch the files.
+    # These fields were extracted in get_list_mirroring_tasks()
+    logger.debug("Next task: %r", item)
+    staging_file = str(item[1])
+    mime_type = str(item[3])
+    checksum = str(item[4])
+    checksum_plugin = str(item[5])
+    rowid = str(item[2])
+    file_id = str(item[10])
+    file_size = str(item[0])
+    file_info = {}
+    file_info['sourceHost'] = str(item[6])
+    file_info['diskId'] = str(item[7])
+    file_info['hostId'] = str(item[8])
+    file_info['fileVersion'] = str(item[9])
+    file_info['fileId'] = file_id
+
+    logger.info("Processing mirroring task (target node: %s, file size: %s, thread: %d) file info: %s",
+                target_node, file_size, ith_thread, str(file_info))
+    # Initialize ngamsReqProps object by just specifying the file URI and the mime-type
+    request_properties = ngamsReqProps.ngamsReqProps()
+    request_properties.setMimeType(mime_type)
+    request_properties.checksum = checksum
+    request_properties.checksum_plugin = checksum_plugin
+    request_properties.fileinfo = file_info
+    request_properties.setSize(file_size)
+
+    # Start clock
+    start = time.time()
+    (staging_filename, target_disk_info) = calculate_staging_name(ngams_server, file_id, staging_file)
+    request_properties.setStagingFilename(staging_filename)
+    request_properties.setTargDiskInfo(target_disk_info)
+    if throttle is not None:
+        request_properties.throttle = throttle
+    try:
+        # Construct query to update ingestion date, ingestion time and status
+        sql = "update ngas_mirroring_bookkeeping " \
+              "set status = 'FETCHING', staging_file = {0}, attempt = nvl(attempt + 1, 1) " \
+              "where rowid = {1}"
+        # Add query to the queue
+        ngams_server.getDb().query2(sql, args=(request_properties.getStagingFilename(), rowid))
+        logger.info("Mirroring file: %s", file_id)
+        ngamsCmd_MIRRARCHIVE.handleCmd(ngams_server, request_properties)
+        status = "SUCCESS"
+    except ngamsFailedDownloadException.FailedDownloadException:
+        # Something bad happened...
+        logger.exception("Failed to fetch %s", file_id)
+        status = "FAILURE"
+    except ngamsFailedDownloadException.AbortedException:
+        logger.warning("File fetch aborted: %s", file_id)
+        status = "ABORTED"
+    except ngamsFailedDownloadException.PostponeException:
+        logger.exception("Failed to fetch %s - will try to resume on next iteration", file_id)
+        status = "TORESUME"
+    except Exception:
+        # This clause should never be reached
+        logger.exception("Fetch failed in an unexpected way")
+        status = "FAILURE"
+
+    # Get time elapsed
+    elapsed_time = (time.time() - start)
+
+    # Construct query to update ingestion date, ingestion time and status
+    sql = "update ngas_mirroring_bookkeeping set status = {0},"
+    if status != 'TORESUME':
+        sql += "staging_file = null, "
+    sql += "ingestion_date = {1}, ingestion_time = nvl(ingestion_time, 0.0) + {2} " \
+           "where rowid = {3}"
+    args = (status, toiso8601(fmt=FMT_DATETIME_NOMSEC) + ":000", elapsed_time, rowid)
+    ngams_server.getDb().query2(sql, args=args)
+
+    return status, elapsed_time, file_info, request_properties
+
+
+def mark_mirroring_task_failed(item, ngams_server):
+    """
+    Mark a mirroring task that could not be processed as failed in the bookkeeping table
+    :param item: Mirroring task, as returned by get_list_mirroring_tasks
+    :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    """
+    sql = "update ngas_mirroring_bookkeeping set status = 'FAILURE', staging_file = null, " \
+          "ingestion_date = {0} where rowid = {1}"
+    args = (toiso8601(fmt=FMT_DATETIME_NOMSEC) + ":000", str(item[2]))
+    try:
+        ngams_server.getDb().query2(sql, args=args)
+    except Exception:
+        logger.exception("Error while marking mirroring task as failed: %r", item)
+
+
 def calculate_staging_name(ngams_server, file_id, existing_staging_file):
     """
     Generate staging filename.
@@ -604,14 +715,15 @@ def get_mounted_disk_info(ngams_server, mount_point):
     return disk_info
 
 
-def multithreading_mirroring(source_nodes_list, num_threads, current_iteration, ngams_server):
+def multithreading_mirroring(source_nodes_list, num_threads, current_iteration, ngams_server, scheduler_pars=None):
     """
     Creates multiple threads per source node and target node to process the corresponding mirroring tasks. Each thread
-    starts from big files or small files alternating.
+    starts from big files or small files alternating, unless the tasks are handed out by the mirroring scheduler.
     :param source_nodes_list: list[string], List of active source nodes in the source cluster
     :param num_threads: int, Number of threads per source-target connection
     :param current_iteration: Current iteration
     :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    :param scheduler_pars: dict, Parameters of the mirroring scheduler, or None to not use it
     """
     target_node = get_fully_qualified_name(ngams_server)
 
@@ -645,6 +757,11 @@ def multithreading_mirroring(source_nodes_list, num_threads, current_iteration,
         all_sources_mirroring_tasks_list.append(ith_source_mirroring_tasks_list)
         source_index += 1
 
+    if scheduler_pars is not None:
+        scheduled_mirroring(all_sources_mirroring_tasks_list, available_threads_for_mirroring, target_node,
+                            ngams_server, scheduler_pars)
+        return
+
     # Reorder lists to mix big/small files and put in queue format
     mirroring_tasks_queue = reorder_list_of_mirroring_tasks_for_target(current_iteration, source_nodes_list,
                                                                        target_node, all_sources_mirroring_tasks_list,
@@ -667,6 +784,41 @@ def multithreading_mirroring(source_nodes_list, num_threads, current_iteration,
     return
 
 
+def scheduled_mirroring(all_sources_mirroring_tasks_list, num_threads, target_node, ngams_server, scheduler_pars):
+    """
+    Process the mirroring tasks from all source nodes with threads fed by the mirroring scheduler
+    :param all_sources_mirroring_tasks_list: list[list], Mirroring tasks from each source node
+    :param num_threads: int, Maximum number of threads to use
+    :param target_node: string, Full qualified name of the target node
+    :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    :param scheduler_pars: dict, Parameters of the mirroring scheduler
+    """
+    tasks = [task for source_tasks in all_sources_mirroring_tasks_list for task in source_tasks]
+    scheduler = ngamsMirroringScheduler.MirroringScheduler(
+        tasks, num_threads,
+        priority=scheduler_pars.get('priority', ngamsMirroringScheduler.PRIORITY_SMALL),
+        cluster_bandwidth=scheduler_pars.get('bandwidth', 0) * 1024 * 1024,
+        link_bandwidth=scheduler_pars.get('link_bandwidth', 0) * 1024 * 1024,
+        adaptive=bool(scheduler_pars.get('adaptive', 1)),
+        target_node=target_node)
+    logger.info("Scheduling %d mirroring tasks to %s with up to %d threads, parameters: %r",
+                len(tasks), target_node, num_threads, scheduler_pars)
+
+    threads_list = []
+    for ith_thread in range(num_threads):
+        logger.info("Initializing scheduled mirror worker %d to mirror files to %s", ith_thread + 1, target_node)
+        ith_mirror_worker = threading.Thread(target=process_scheduled_mirroring_tasks,
+                                             args=(scheduler, target_node, ith_thread + 1, ngams_server))
+        ith_mirror_worker.start()
+        threads_list.append(ith_mirror_worker)
+
+    for ith_thread in threads_list:
+        ith_thread.join()
+
+    scheduler.log_statistics()
+    ngams_server.mirroring_statistics = scheduler.statistics()
+
+
 class MirrorWorker(threading.Thread):
 
     def __init__(self, mirroring_tasks_queue, target_node, ith_thread, ngams_server):
@@ -714,22 +866,29 @@ def sort_target_nodes(target_nodes_list):
     return sorted_target_nodes_list
 
 
-def distributed_mirroring(target_nodes_list, num_threads, rx_timeout, iteration):
+def distributed_mirroring(target_nodes_list, num_threads, rx_timeout, iteration, scheduler_pars=None):
     """
     Send MIRREXEC command to each nodes in the target nodes list in order to have a distributed mirroring process
     :param target_nodes_list: list[string], List of active target nodes in the target cluster
     :param num_threads: int, Number of threads per source-target connection
     :param rx_timeout: Socket timeout in seconds
     :param iteration: Iteration
+    :param scheduler_pars: dict, Parameters of the mirroring scheduler, or None to not use it
     """
     # Get sorted_target_nodes_list
     sorted_target_nodes_list = sort_target_nodes(target_nodes_list)
 
+    # The bandwidth budget of the source cluster is shared by all target nodes
+    if scheduler_pars and scheduler_pars.get('bandwidth') and sorted_target_nodes_list:
+        scheduler_pars = dict(scheduler_pars)
+        scheduler_pars['bandwidth'] /= len(sorted_target_nodes_list)
+
     # Main loop
     threads_list = []
     for target_node in sorted_target_nodes_list:
         # Initialize mirrexec_command_sender thread object
-        mirrexec_command_sender_obj = MirrexecCommandSender(target_node, num_threads, rx_timeout, iteration)
+        mirrexec_command_sender_obj = MirrexecCommandSender(target_node, num_threads, rx_timeout, iteration,
+                                                            scheduler_pars)
         # Add mirrexec_command_sender thread object to the list of threads
         threads_list.append(mirrexec_command_sender_obj)
         # Start mirrexec_command_sender thread object
@@ -744,18 +903,20 @@ def distributed_mirroring(target_nodes_list, num_threads, rx_timeout, iteration)
 
 class MirrexecCommandSender(threading.Thread):
 
-    def __init__(self, target_node, num_threads, rx_timeout, iteration):
+    def __init__(self, target_node, num_threads, rx_timeout, iteration, scheduler_pars=None):
         """
         :param target_node: string, Target node to send MIRREXEC
         :param num_threads: int, Number of threads per source-target connection
         :param rx_timeout: int, Socket timeout time in seconds
         :param iteration: int, Iteration
+        :param scheduler_pars: dict, Parameters of the mirroring scheduler, or None to not use it
         """
         threading.Thread.__init__(self)
         self.target_node = target_node
         self.num_threads = num_threads
         self.rx_timeout = rx_timeout
         self.iteration = iteration
+        self.scheduler_pars = scheduler_pars
 
     def run(self):
         try:
@@ -775,6 +936,8 @@ class MirrexecCommandSender(threading.Thread):
                 'rx_timeout': str(self.rx_timeout),
                 'iteration': str(self.iteration)
             }
+            if self.scheduler_pars:
+                pars.update((name, str(value)) for name, value in self.scheduler_pars.items())
 
             start_time = time.time()
             # it is important to not let this operation time out. If it times out then the files being fetched will
@@ -192,6 +192,7 @@ def execute_mirroring(ngams_server, iteration):
             'rx_timeout': rx_timeout,
             'n_threads': get_num_simultaneous_fetches_per_server(ngams_server)
         }
+        pars.update(get_scheduler_parameters(ngams_server))
         host, port = ngams_server.get_self_endpoint()
         # it is important to not let this operation time out. If it times out then the files being fetched will 
         # be eligable for re-fetching even though the spawned threads may still be executing. Chaos ensues.
@@ -296,6 +297,27 @@ def get_num_simultaneous_fetches_per_server(ngams_server):
     return num_threads
 
 
+# Mirroring scheduler parameters of MIRREXEC set in the ngas_cfg_pars table
+_scheduler_cfg_pars = {
+    'mirroringPriority': 'priority',
+    'clusterBandwidth': 'bandwidth',
+    'linkBandwidth': 'link_bandwidth',
+    'adaptiveStreams': 'adaptive'
+}
+
+
+def get_scheduler_parameters(ngams_server):
+    sql = "select cfg_par, cfg_val from ngas_cfg_pars where cfg_par in ({0}, {1}, {2}, {3})"
+    result = ngams_server.getDb().query2(sql, args=tuple(_scheduler_cfg_pars))
+    scheduler_pars = {}
+    for cfg_par, cfg_val in result:
+        if cfg_val is not None and str(cfg_val) != "None":
+            scheduler_pars[_scheduler_cfg_pars[cfg_par]] = str(cfg_val)
+    if scheduler_pars:
+        logger.info("Using the mirroring scheduler with parameters: %r", scheduler_pars)
+    return scheduler_pars
+
+
 def get_mirroring_baseline_date(ngams_server):
     sql = "select cfg_val from ngas_cfg_pars where cfg_par = 'baselineDate'"
     result = ngams_server.getDb().query2(sql)
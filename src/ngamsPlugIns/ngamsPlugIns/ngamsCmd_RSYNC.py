@@ -38,10 +38,17 @@ logger = logging.getLogger(__name__)
 # for more flexibility it should be derived from ngamsRetrieveCmd - I don't need this right now
 # for the ALMA mirroring
 
-def transferFile(srvObj, fileLocation, targetHost, targetLocation):
-    options = '-P --append --inplace -e "ssh -o StrictHostKeyChecking=no"'
-    if srvObj.getCfg().getVal("Mirroring[1].rsync_options"):
-        options = srvObj.getCfg().getVal("Mirroring[1].rsync_options")
+def transferFile(srvObj, fileLocation, targetHost, targetLocation, delta=False):
+    # A delta transfer updates an older version of the file already at the
+    # target location, which --append would take as a partial transfer
+    if delta:
+        options = '-P --inplace --no-whole-file -e "ssh -o StrictHostKeyChecking=no"'
+        if srvObj.getCfg().getVal("Mirroring[1].rsync_delta_options"):
+            options = srvObj.getCfg().getVal("Mirroring[1].rsync_delta_options")
+    else:
+        options = '-P --append --inplace -e "ssh -o StrictHostKeyChecking=no"'
+        if srvObj.getCfg().getVal("Mirroring[1].rsync_options"):
+            options = srvObj.getCfg().getVal("Mirroring[1].rsync_options")
     fetchCommand = "rsync " + options + " " + fileLocation + " ngas@" + targetHost + ":" + targetLocation
     logger.info("rsync command: %s", fetchCommand)
     process = subprocess.Popen(fetchCommand, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -114,7 +121,8 @@ def _handleCmd(srvObj, reqPropsObj, httpRef):
     logger.info('req props: %s', str(reqPropsObj))
 
     # Send back reply with the result(s) queried and possibly processed.
-    transferFile(srvObj, fileLocation, targetHost, targetLocation)
+    delta = reqPropsObj.hasHttpPar("delta") and reqPropsObj.getHttpPar("delta") == "1"
+    transferFile(srvObj, fileLocation, targetHost, targetLocation, delta=delta)
 
 
 def handleCmd(srvObj,
@@ -39,17 +39,19 @@ that 'volume load balancing' is provided.
 * No probing for storage availability is supported.
 * In general, less SQL queries are performed and the algorithm is more light-weight.
 * crc is computed from the incoming stream
+* new versions of files already present locally can be fetched as rsync deltas
 * ngas_files data is 'cloned' from the source file
 """
 
 import contextlib
 import logging
 import os
+import shutil
 import time
 
-from ngamsLib.ngamsCore import checkCreatePath, getHostName
-from ngamsLib import ngamsLib, ngamsHttpUtils
-from ngamsServer import ngamsFileUtils
+from ngamsLib.ngamsCore import checkCreatePath, getHostName, rmFile
+from ngamsLib import ngamsLib, ngamsHttpUtils, ngamsFileInfo
+from ngamsServer import ngamsFileUtils, staging_writer
 from ngamsServer.ngamsArchiveUtils import archiving_results
 from . import ngamsFailedDownloadException
 
@@ -71,6 +73,97 @@ def get_fully_qualified_name(ngams_server):
     return fqdn
 
 
+def find_delta_basis(ngams_server, file_id, file_version):
+    """
+    Find a local, older version of the file being fetched that rsync can use
+    as the basis of a delta transfer
+    :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    :param file_id: string, ID of the file being fetched
+    :param file_version: int, Version of the file being fetched
+    :return: string, Name of the older version of the file, or None if there is none
+    """
+    # Latest versions come first
+    res = ngams_server.getDb().getFileInfoFromFileId(file_id, ignore=0, dbCursor=False)
+    for r in res:
+        # r[-2] is the host_id, r[-1] is the mount point
+        file_info = ngamsFileInfo.ngamsFileInfo().unpackSqlResult(r)
+        if (r[-2] != ngams_server.getHostId() or file_info.getIgnore() or
+                file_info.getCompression() or file_info.getFileVersion() >= file_version):
+            continue
+        filename = os.path.join(r[-1], file_info.getFilename())
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def rsync_and_verify(ngams_server, request_properties, target_filename, host, port, pars, rx_timeout, delta):
+    """
+    Ask the source node to rsync the file into `target_filename`, and verify
+    its checksum
+    :param ngams_server: ngamsServer, Reference to NG/AMS server class object
+    :param request_properties: NG/AMS Request Properties object (ngamsReqProps)
+    :param target_filename: string, Target name for file where data will be written
+    :param host: string, Host of the source node
+    :param port: int, Port of the source node
+    :param pars: dict, Parameters of the RSYNC request
+    :param rx_timeout: int, Timeout in seconds of the RSYNC request
+    :param delta: bool, Whether the transfer is a delta against the file already at `target_filename`
+    :return: Tuple with the time spent fetching and checksumming the file, and its checksum
+    """
+    checksum = request_properties.checksum
+    crc_variant = request_properties.checksum_plugin
+    crc_info = ngamsFileUtils.get_checksum_info(crc_variant)
+
+    # rsync writes the file in place and in order, so the checksum is
+    # calculated as the data lands. Delta transfers rewrite the basis file
+    # in place though, where reading ahead of rsync would see the old data
+    follower = None
+    if crc_info is not None and not delta:
+        follower = staging_writer.ChecksumFollower(target_filename, crc_info).start()
+
+    fetch_start_time = time.time()
+    try:
+        response = ngamsHttpUtils.httpGet(host, port, 'RSYNC', pars=pars, timeout=rx_timeout)
+        with contextlib.closing(response):
+            data = response.read()
+            if b'FAILURE' in data:
+                raise Exception(data)
+    finally:
+        crc = follower.finish() if follower is not None else None
+
+    # rsync writes the file by itself, we can only make it durable afterwards
+    policy = staging_writer.staging_policy_for(ngams_server.getCfg(),
+                                               request_properties.getTargDiskInfo().getSlotId())
+    staging_writer.sync_file(target_filename, policy)
+    fetch_duration = time.time() - fetch_start_time
+    request_properties.setBytesReceived(os.path.getsize(target_filename))
+
+    # Avoid divide by zeros later on, let's say it took us 1 [us] to do this
+    if fetch_duration == 0.0:
+        fetch_duration = 0.000001
+
+    msg = "Saved data in file: %s. Bytes received: %d. Time: %.3f s. Rate: %.2f Bytes/s"
+    logger.info(msg, target_filename, int(request_properties.getBytesReceived()), fetch_duration,
+                (float(request_properties.getBytesReceived()) / fetch_duration))
+
+    # The checksum calculated during the transfer is not trusted if it
+    # doesn't match, the file is read back in that case
+    crc_duration = 0
+    if crc is None or not crc_info.equals(checksum, crc):
+        if crc is not None:
+            logger.info("Checksum calculated during the transfer doesn't match, reading back %s", target_filename)
+        crc_start_time = time.time()
+        crc = ngamsFileUtils.get_checksum(65536, target_filename, crc_variant)
+        crc_duration = time.time() - crc_start_time
+        logger.info("CRC computed in %f [s]", crc_duration)
+    logger.info('Cource checksum: %s - current checksum: %d', checksum, crc)
+    if not crc_info.equals(checksum, crc):
+        msg = "Checksum mismatch: source={:s}, received={:d}".format(checksum, crc)
+        raise ngamsFailedDownloadException.FailedDownloadException(msg)
+
+    return fetch_duration, crc_duration, crc
+
+
 def save_to_file(ngams_server, request_properties, target_filename):
     """
     Save the data available on an HTTP channel into the given file
@@ -84,6 +177,7 @@ def save_to_file(ngams_server, request_properties, target_filename):
     source_host = request_properties.fileinfo['sourceHost']
     file_version = request_properties.fileinfo['fileVersion']
     file_id = request_properties.fileinfo['fileId']
+    crc_variant = request_properties.checksum_plugin
 
     logger.info("Creating path: %s", target_filename)
     checkCreatePath(os.path.dirname(target_filename))
@@ -100,33 +194,31 @@ def save_to_file(ngams_server, request_properties, target_filename):
         'file_id': file_id
     }
 
-    fetch_start_time = time.time()
-    response = ngamsHttpUtils.httpGet(host, int(port), 'RSYNC', pars=pars, timeout=rx_timeout)
-    with contextlib.closing(response):
-        data = response.read()
-        if 'FAILURE' in data:
-            raise Exception(data)
-    fetch_duration = time.time() - fetch_start_time
-
-    # Avoid divide by zeros later on, let's say it took us 1 [us] to do this
-    if fetch_duration == 0.0:
-        fetch_duration = 0.000001
-
-    msg = "Saved data in file: %s. Bytes received: %d. Time: %.3f s. Rate: %.2f Bytes/s"
-    logger.info(msg, target_filename, int(request_properties.getBytesReceived()), fetch_duration,
-                (float(request_properties.getBytesReceived()) / fetch_duration))
-
-    # Now check the CRC value against what we expected
-    checksum = request_properties.checksum
-    crc_variant = request_properties.checksum_plugin
-    crc_start_time = time.time()
-    crc = ngamsFileUtils.get_checksum(65536, target_filename, crc_variant)
-    crc_duration = time.time() - crc_start_time
-    logger.info("CRC computed in %f [s]", crc_duration)
-    logger.info('Cource checksum: %s - current checksum: %d', checksum, crc)
-    if crc != int(checksum):
-        msg = "Checksum mismatch: source={:s}, received={:d}".format(checksum, crc)
-        raise ngamsFailedDownloadException.FailedDownloadException(msg)
+    # A new version of a file we already have can be fetched as an rsync
+    # delta against the older version, unless a previous attempt left a
+    # partial file to be appended to
+    delta_basis = None
+    if ngams_server.getCfg().getVal("Mirroring[1].rsync_delta") == '1' and not os.path.exists(target_filename):
+        delta_basis = find_delta_basis(ngams_server, file_id, int(file_version))
+    results = None
+    if delta_basis:
+        try:
+            logger.info("Fetching file ID %s as a delta against %s", file_id, delta_basis)
+            shutil.copyfile(delta_basis, target_filename)
+            pars['delta'] = 1
+            results = rsync_and_verify(ngams_server, request_properties, target_filename,
+                                       host, int(port), pars, rx_timeout, True)
+        except Exception as e:
+            # Sources that don't know about delta transfers rsync with --append
+            # on top of the older version, which never verifies. In any case
+            # what's left cannot be appended to, so we fetch the whole file
+            logger.warning("Delta transfer of file ID %s failed (%s), fetching the whole file instead", file_id, e)
+            rmFile(target_filename)
+            del pars['delta']
+    if results is None:
+        results = rsync_and_verify(ngams_server, request_properties, target_filename,
+                                   host, int(port), pars, rx_timeout, False)
+    fetch_duration, crc_duration, crc = results
 
     # We half the total time for reading and writing because we do not have enough data for an accurate measurement
     read_duration = fetch_duration / 2.0
@@ -0,0 +1,411 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Scheduler of the mirroring tasks carried out by the MIRREXEC command.
+
+Tasks are handed to the mirroring workers per source node, in priority
+order, while enforcing a bandwidth budget for the whole source cluster and
+for each source-target link. The number of parallel streams opened against
+each source node is adapted to the throughput and latency observed for the
+transfers already completed.
+"""
+
+import collections
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Positions of the fields of the mirroring tasks, as returned by
+# ngamsCmd_MIRREXEC.get_list_mirroring_tasks
+_FILE_SIZE = 0
+_SOURCE_HOST = 6
+_SOURCE_INGESTION_DATE = 11
+
+_MB = 1024. * 1024.
+
+PRIORITY_SMALL = 'small'
+PRIORITY_LARGE = 'large'
+PRIORITY_NEWEST = 'newest'
+PRIORITIES = (PRIORITY_SMALL, PRIORITY_LARGE, PRIORITY_NEWEST)
+
+# Buckets shared by all the schedulers of this process, so overlapping
+# mirroring iterations stay within the same budget
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_shared_bucket(name, rate):
+    """
+    Return the token bucket registered under the given name, creating it or updating its rate as needed
+    :param name: string, Name of the bucket
+    :param rate: float, Rate in bytes per second, 0 for no limit
+    :return: TokenBucket
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = _buckets[name] = TokenBucket(rate)
+        else:
+            bucket.set_rate(rate)
+        return bucket
+
+
+class TokenBucket(object):
+    """
+    Paces a flow of bytes to a given rate, allowing bursts of up to one second
+    worth of data. The bucket can be shared by several streams; a stream
+    consuming more than the available tokens puts the bucket in debt, and the
+    following consumers wait until the debt is paid off.
+    """
+
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = clock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = float(rate)
+            self.tokens = min(self.tokens, self.rate)
+
+    def consume(self, nbytes):
+        """
+        Take nbytes from the bucket, waiting until the flow is back within the bucket's rate
+        :param nbytes: int, Number of bytes transferred
+        :return: float, Time waited in seconds
+        """
+        with self.lock:
+            if self.rate <= 0:
+                return 0.
+            now = self.clock()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+
+class ConcurrencyController(object):
+    """
+    Adapts the number of parallel streams opened against a source node.
+
+    Completed transfers are grouped in windows. At the end of each window the
+    throughput achieved during the window is compared with the one of the
+    previous window: the number of streams grows by one while the throughput
+    keeps improving, and shrinks by one when it drops, or when the latency
+    of the transfers rises well above the lowest one seen (i.e., when the
+    extra streams only queue up somewhere along the way). Failed transfers
+    halve the number of streams.
+    """
+
+    def __init__(self, initial_streams, max_streams, min_streams=1, window=8, min_window_time=1.,
+                 gain_threshold=0.05, rtt_tolerance=2., clock=time.time):
+        self.min_streams = max(1, min_streams)
+        self.max_streams = max(self.min_streams, max_streams)
+        self.limit = min(self.max_streams, max(self.min_streams, initial_streams))
+        self.window = window
+        self.min_window_time = min_window_time
+        self.gain_threshold = gain_threshold
+        self.rtt_tolerance = rtt_tolerance
+        self.clock = clock
+        self.base_rtt = None
+        self.throughput = None
+        self._start_window()
+
+    def _start_window(self):
+        self.window_start = self.clock()
+        self.window_bytes = 0
+        self.window_transfers = 0
+        self.window_rtts = []
+        self.window_failures = 0
+
+    def record(self, nbytes, rtt, success=True, saturated=False):
+        """
+        Record a completed transfer, adapting the number of streams at the end of each window
+        :param nbytes: int, Number of bytes transferred
+        :param rtt: float, Latency observed for the transfer (e.g., time to first byte) in seconds, or None
+        :param success: bool, Whether the transfer succeeded
+        :param saturated: bool, Whether the bandwidth budget of the source is already used up
+        :return: int, The number of streams to use from now on
+        """
+        self.window_bytes += nbytes
+        self.window_transfers += 1
+        if rtt is not None:
+            self.window_rtts.append(rtt)
+            if self.base_rtt is None or rtt < self.base_rtt:
+                self.base_rtt = rtt
+        if not success:
+            self.window_failures += 1
+
+        elapsed = self.clock() - self.window_start
+        if self.window_transfers < self.window or elapsed < self.min_window_time:
+            return self.limit
+
+        throughput = self.window_bytes / elapsed
+        rtt = sum(self.window_rtts) / len(self.window_rtts) if self.window_rtts else None
+        if self.window_failures:
+            self.limit = max(self.min_streams, self.limit // 2)
+        elif rtt is not None and self.base_rtt and rtt > self.rtt_tolerance * self.base_rtt:
+            self.limit = max(self.min_streams, self.limit - 1)
+        elif self.throughput is None or throughput > self.throughput * (1 + self.gain_threshold):
+            if not saturated:
+                self.limit = min(self.max_streams, self.limit + 1)
+        elif throughput < self.throughput * (1 - self.gain_threshold):
+            self.limit = max(self.min_streams, self.limit - 1)
+        self.throughput = throughput
+        self._start_window()
+        return self.limit
+
+
+class _SourceState(object):
+    """The queued tasks and transfer statistics of a source node"""
+
+    def __init__(self, source, controller, bucket):
+        self.source = source
+        self.controller = controller
+        self.bucket = bucket
+        self.tasks = []
+        self.active = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.bytes = 0
+        self.waited = 0.
+        self.start = None
+        self.last_rtt = None
+
+
+class MirroringScheduler(object):
+    """
+    Hands out the mirroring tasks of a MIRREXEC iteration to its workers.
+
+    Each worker calls next_task() to get the task to process, throttle() for
+    every block of data received while processing it, and task_done() when
+    the transfer has finished. Tasks are taken from the highest priority
+    source node whose number of active streams is below its current limit;
+    next_task() blocks while all source nodes with pending tasks are at their
+    limit, and returns None when there are no tasks left.
+    """
+
+    def __init__(self, tasks, num_streams, priority=PRIORITY_SMALL, cluster_bandwidth=0, link_bandwidth=0,
+                 adaptive=True, cluster_name='mirroring', target_node='', report_interval=60.,
+                 shared_budgets=True, clock=time.time, sleep=time.sleep):
+        """
+        :param tasks: list, Mirroring tasks as returned by ngamsCmd_MIRREXEC.get_list_mirroring_tasks
+        :param num_streams: int, Maximum total number of parallel streams
+        :param priority: string, One of PRIORITIES
+        :param cluster_bandwidth: float, Budget for the whole source cluster in bytes per second, 0 for no limit
+        :param link_bandwidth: float, Budget for each source-target link in bytes per second, 0 for no limit
+        :param adaptive: bool, Whether to adapt the number of streams per source node
+        :param cluster_name: string, Name of the source cluster, identifying its bandwidth budget
+        :param target_node: string, Name of the target node, identifying the link budgets
+        :param report_interval: float, Seconds between the logging of the statistics
+        :param shared_budgets: bool, Whether to share the bandwidth budgets with the other schedulers of this process
+        """
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown mirroring priority %r, must be one of %r" % (priority, PRIORITIES))
+        self.priority = priority
+        self.num_streams = max(1, num_streams)
+        self.cluster_bandwidth = float(cluster_bandwidth)
+        self.link_bandwidth = float(link_bandwidth)
+        self.report_interval = report_interval
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.active = 0
+        self.last_report = clock()
+        self.start = None
+
+        def make_bucket(name, rate):
+            if shared_budgets:
+                return get_shared_bucket(name, rate)
+            return TokenBucket(rate, clock, sleep)
+
+        self.cluster_bucket = make_bucket('cluster/%s' % cluster_name, self.cluster_bandwidth)
+
+        sources = collections.OrderedDict()
+        for seq, task in enumerate(tasks):
+            source = str(task[_SOURCE_HOST])
+            if source not in sources:
+                bucket = make_bucket('link/%s/%s' % (source, target_node), self.link_bandwidth)
+                sources[source] = _SourceState(source, None, bucket)
+            sources[source].tasks.append((self._priority_key(task), seq, task))
+        self.sources = sources
+
+        # Start sharing the streams evenly among the source nodes;
+        # the controllers then move them to where they pay off
+        initial_streams = max(1, self.num_streams // max(1, len(sources)))
+        for state in sources.values():
+            heapq.heapify(state.tasks)
+            max_streams = self.num_streams if adaptive else initial_streams
+            state.controller = ConcurrencyController(initial_streams, max_streams, clock=clock)
+
+    def _priority_key(self, task):
+        if self.priority == PRIORITY_SMALL:
+            return int(task[_FILE_SIZE])
+        elif self.priority == PRIORITY_LARGE:
+            return -int(task[_FILE_SIZE])
+        # Newest first; ISO 8601 dates sort as strings, so invert them character-wise
+        date = str(task[_SOURCE_INGESTION_DATE] or '')
+        return tuple(-ord(c) for c in date)
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(state.tasks) for state in self.sources.values())
+
+    def _eligible(self):
+        best = None
+        for state in self.sources.values():
+            if state.tasks and state.active < state.controller.limit:
+                if best is None or state.tasks[0] < best.tasks[0]:
+                    best = state
+        return best
+
+    def next_task(self):
+        """
+        Return the next task to process, blocking until one can be started
+        :return: The task, or None if there are no tasks left
+        """
+        with self.condition:
+            while True:
+                state = self._eligible()
+                if state is not None:
+                    break
+                if not any(s.tasks for s in self.sources.values()):
+                    return None
+                self.condition.wait(1)
+            _, _, task = heapq.heappop(state.tasks)
+            state.active += 1
+            self.active += 1
+            now = self.clock()
+            if state.start is None:
+                state.start = now
+            if self.start is None:
+                self.start = now
+            return task
+
+    def throttle(self, task, nbytes):
+        """
+        Account for a block of data received for the given task, waiting as necessary to stay within the budgets
+        :param task: The task being processed
+        :param nbytes: int, Number of bytes received
+        """
+        state = self.sources[str(task[_SOURCE_HOST])]
+        waited = state.bucket.consume(nbytes)
+        waited += self.cluster_bucket.consume(nbytes)
+        with self.condition:
+            state.waited += waited
+
+    def task_done(self, task, nbytes, rtt=None, success=True):
+        """
+        Record the completion of a task
+        :param task: The task processed
+        :param nbytes: int, Number of bytes received
+        :param rtt: float, Latency observed for the transfer in seconds, if known
+        :param success: bool, Whether the transfer succeeded
+        """
+        with self.condition:
+            state = self.sources[str(task[_SOURCE_HOST])]
+            state.active -= 1
+            self.active -= 1
+            state.bytes += nbytes
+            state.last_rtt = rtt
+            if success:
+                state.files_done += 1
+            else:
+                state.files_failed += 1
+            old_limit = state.controller.limit
+            new_limit = state.controller.record(nbytes, rtt, success, self._saturated(state))
+            if new_limit != old_limit:
+                logger.info("Mirroring streams from %s: %d -> %d", state.source, old_limit, new_limit)
+            self.condition.notify_all()
+            report = self.clock() - self.last_report >= self.report_interval
+            if report:
+                self.last_report = self.clock()
+        if report:
+            self.log_statistics()
+
+    def _saturated(self, state):
+        now = self.clock()
+        if self.link_bandwidth and state.start is not None and now > state.start:
+            if state.bytes / (now - state.start) >= 0.95 * self.link_bandwidth:
+                return True
+        if self.cluster_bandwidth and self.start is not None and now > self.start:
+            total = sum(s.bytes for s in self.sources.values())
+            if total / (now - self.start) >= 0.95 * self.cluster_bandwidth:
+                return True
+        return False
+
+    def statistics(self):
+        """
+        Return the achieved versus target throughput of the source cluster and of each source node
+        :return: dict
+        """
+        with self.condition:
+            now = self.clock()
+            sources = {}
+            for state in self.sources.values():
+                elapsed = now - state.start if state.start is not None else 0
+                sources[state.source] = {
+                    'streams': state.controller.limit,
+                    'active_streams': state.active,
+                    'pending_files': len(state.tasks),
+                    'files_done': state.files_done,
+                    'files_failed': state.files_failed,
+                    'bytes': state.bytes,
+                    'achieved_rate': state.bytes / elapsed if elapsed > 0 else 0.,
+                    'target_rate': self.link_bandwidth or None,
+                    'throttled_time': state.waited,
+                    'rtt': state.last_rtt,
+                    'base_rtt': state.controller.base_rtt,
+                }
+            elapsed = now - self.start if self.start is not None else 0
+            total = sum(s['bytes'] for s in sources.values())
+            return {
+                'priority': self.priority,
+                'active_streams': self.active,
+                'bytes': total,
+                'achieved_rate': total / elapsed if elapsed > 0 else 0.,
+                'target_rate': self.cluster_bandwidth or None,
+                'sources': sources,
+            }
+
+    def log_statistics(self):
+        stats = self.statistics()
+        target = stats['target_rate']
+        logger.info("Mirroring throughput: %.3f MB/s achieved, target %s, %d active streams",
+                    stats['achieved_rate'] / _MB, '%.3f MB/s' % (target / _MB) if target else 'unlimited',
+                    stats['active_streams'])
+        for source, source_stats in sorted(stats['sources'].items()):
+            target = source_stats['target_rate']
+            logger.info("Mirroring throughput from %s: %.3f MB/s achieved, target %s, %d/%d streams, "
+                        "%d files done, %d failed, %d pending, %.1f [s] throttled", source,
+                        source_stats['achieved_rate'] / _MB,
+                        '%.3f MB/s' % (target / _MB) if target else 'unlimited',
+                        source_stats['active_streams'], source_stats['streams'], source_stats['files_done'],
+                        source_stats['files_failed'], source_stats['pending_files'], source_stats['throttled_time'])
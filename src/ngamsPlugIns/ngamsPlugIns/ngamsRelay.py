@@ -0,0 +1,293 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Relaying of an incoming stream of data to several targets at once, used by
+the PARCHIVE command.
+
+Data is read from the source in the calling thread, and handed to one
+sender thread per target, so reading and sending overlap. Each target has a
+window of blocks kept in memory; when a target falls behind by more than its
+window, the blocks it still has to send are spooled into a temporary file
+instead of blocking the reader, so a slow target doesn't throttle the rest.
+"""
+
+import collections
+import logging
+import tempfile
+import threading
+import time
+
+from six.moves import http_client as httplib  # @UnresolvedImport
+from six.moves.urllib import parse as urlparse  # @UnresolvedImport
+
+from ngamsLib.ngamsCore import NGAMS_FAILURE, NGAMS_HTTP_SUCCESS, NGAMS_HTTP_POST
+from ngamsLib import ngamsStatus
+from ngamsServer import staging_writer
+
+logger = logging.getLogger(__name__)
+
+relay_results = collections.namedtuple('relay_results', 'size rtime crctime crc failed')
+
+
+class HttpTarget(object):
+    """Sends the data as the body of a POST request, and checks the NGAS status replied"""
+
+    def __init__(self, url, headers, timeout=3600):
+        """
+        :param url: string, URL the data is sent to
+        :param headers: dict, HTTP headers of the request
+        :param timeout: int, Socket timeout in seconds
+        """
+        self.name = url
+        self.url = url
+        self.headers = headers
+        self.timeout = timeout
+        self.conn = None
+
+    def open(self):
+        url = urlparse.urlsplit(self.url)
+        self.conn = httplib.HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        self.conn.putrequest(NGAMS_HTTP_POST, path)
+        for name, value in self.headers.items():
+            self.conn.putheader(name, str(value))
+        self.conn.endheaders()
+
+    def write(self, data):
+        self.conn.send(data)
+
+    def finish(self):
+        response = self.conn.getresponse()
+        data = response.read()
+        stat = ngamsStatus.ngamsStatus()
+        if data.strip():
+            stat.unpackXmlDoc(data)
+        if response.status != NGAMS_HTTP_SUCCESS or stat.getStatus() == NGAMS_FAILURE:
+            errMsg = 'Error while relaying data to %s' % self.url
+            if stat.getMessage():
+                errMsg += ". Message: " + stat.getMessage()
+            raise Exception(errMsg)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class FileTarget(object):
+    """Writes the data into a staging file"""
+
+    def __init__(self, fname, size=None, policy=staging_writer.DEFAULT_POLICY):
+        self.name = fname
+        self.fname = fname
+        self.size = size
+        self.policy = policy
+        self.f = None
+
+    def open(self):
+        self.f = staging_writer.StagingFile(self.fname, self.size, self.policy)
+
+    def write(self, data):
+        self.f.write(data)
+
+    def finish(self):
+        self.f.close()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close(completed=False)
+
+
+class _Sender(object):
+    """Feeds a target from its own thread, with the blocks it has been handed"""
+
+    def __init__(self, target, window, spool_dir):
+        self.target = target
+        self.window = window
+        self.spool_dir = spool_dir
+        self.condition = threading.Condition()
+        self.blocks = collections.deque()
+        # Blocks that don't fit in the window go to the spool, which then
+        # has to be emptied before going back to the in-memory blocks
+        self.spool = None
+        self.spool_read = 0
+        self.spool_write = 0
+        self.spooled_bytes = 0
+        self.eof = False
+        self.aborted = False
+        self.error = None
+        self.sent = 0
+        self.send_time = 0
+        self.thread = threading.Thread(target=self._run, name='Relay-%s' % target.name)
+        self.thread.daemon = True
+
+    def put(self, data):
+        """Hands `data` to the target, never blocking for long"""
+        with self.condition:
+            if self.error is not None:
+                return
+            if self.spool is not None or len(self.blocks) >= self.window:
+                if self.spool is None:
+                    logger.info("Target %s is falling behind, spooling its data", self.target.name)
+                    self.spool = tempfile.TemporaryFile(dir=self.spool_dir, prefix='relay-')
+                self.spool.seek(self.spool_write)
+                self.spool.write(data)
+                self.spool_write += len(data)
+                self.spooled_bytes += len(data)
+            else:
+                self.blocks.append(data)
+            self.condition.notify()
+
+    def close(self, abort=False):
+        """
+        Indicates there is no more data. If `abort` is True the data the
+        target was handed is incomplete, and it is not finished.
+        """
+        with self.condition:
+            self.eof = True
+            self.aborted = abort
+            self.condition.notify()
+
+    def _get(self, block_size):
+        with self.condition:
+            while not self.blocks and self.spool is None and not self.eof:
+                self.condition.wait()
+            if self.aborted:
+                return None
+            if self.blocks:
+                return self.blocks.popleft()
+            if self.spool is not None:
+                self.spool.flush()
+                self.spool.seek(self.spool_read)
+                data = self.spool.read(min(block_size, self.spool_write - self.spool_read))
+                self.spool_read += len(data)
+                if self.spool_read == self.spool_write:
+                    self.spool.close()
+                    self.spool = None
+                    self.spool_read = self.spool_write = 0
+                return data
+            return None
+
+    def _run(self):
+        try:
+            self.target.open()
+            block_size = 65536
+            while True:
+                data = self._get(block_size)
+                if data is None:
+                    break
+                block_size = max(block_size, len(data))
+                start = time.time()
+                self.target.write(data)
+                self.send_time += time.time() - start
+                self.sent += len(data)
+            if self.aborted:
+                raise Exception("Relay aborted, data is incomplete")
+            self.target.finish()
+        except Exception as e:
+            logger.exception("Error while relaying data to %s", self.target.name)
+            with self.condition:
+                self.error = e
+                self.blocks.clear()
+                if self.spool is not None:
+                    self.spool.close()
+                    self.spool = None
+        finally:
+            self.target.close()
+
+
+class Relay(object):
+    """Relays the data read from a file object to a number of targets"""
+
+    def __init__(self, rfile, targets, block_size, size=None, window=16,
+                 spool_dir=None, checksum_info=None):
+        """
+        :param rfile: File object the data is read from
+        :param targets: list, Targets the data is relayed to, like HttpTarget or FileTarget
+        :param block_size: int, Block size (bytes) used to read the data
+        :param size: int, Number of bytes to read, or None to read until the end of the data
+        :param window: int, Number of blocks each target can fall behind before they are spooled to disk
+        :param spool_dir: string, Directory where spool files are created
+        :param checksum_info: The checksum to calculate over the data, as returned by
+        ngamsFileUtils.get_checksum_info, or None
+        """
+        self.rfile = rfile
+        self.block_size = block_size
+        self.size = size
+        self.checksum_info = checksum_info
+        self.senders = [_Sender(t, window, spool_dir) for t in targets]
+
+    def run(self):
+        """
+        Relays all the data
+        :return: relay_results, with the number of bytes read, the time spent reading them and calculating
+        their checksum, the checksum, and a dictionary with the targets that failed and their error
+        """
+        for sender in self.senders:
+            sender.thread.start()
+
+        crc = crc_method = None
+        if self.checksum_info is not None:
+            crc = self.checksum_info.init
+            crc_method = self.checksum_info.method
+        rtime = crctime = 0
+        readin = 0
+        complete = False
+        try:
+            while self.size is None or readin < self.size:
+                to_read = self.block_size
+                if self.size is not None:
+                    to_read = min(to_read, self.size - readin)
+                start = time.time()
+                data = self.rfile.read(to_read)
+                rtime += time.time() - start
+                if not data:
+                    break
+                readin += len(data)
+                if crc_method is not None:
+                    start = time.time()
+                    crc = crc_method(data, crc)
+                    crctime += time.time() - start
+                for sender in self.senders:
+                    sender.put(data)
+                if all(sender.error is not None for sender in self.senders):
+                    break
+            complete = self.size is None or readin == self.size
+        finally:
+            for sender in self.senders:
+                sender.close(abort=not complete)
+            for sender in self.senders:
+                sender.thread.join()
+
+        for sender in self.senders:
+            if sender.spooled_bytes:
+                logger.warning("%d bytes for target %s had to be spooled to disk. "
+                               "Consider checking that downstream network link!",
+                               sender.spooled_bytes, sender.target.name)
+            logger.debug("Sent %d bytes to %s in %.3f s", sender.sent, sender.target.name, sender.send_time)
+
+        if crc is not None:
+            crc = self.checksum_info.final(crc)
+        failed = {sender.target.name: sender.error for sender in self.senders
+                  if sender.error is not None}
+        return relay_results(readin, rtime, crctime, crc, failed)
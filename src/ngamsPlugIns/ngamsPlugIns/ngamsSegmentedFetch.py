@@ -0,0 +1,269 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Segmented fetching of files for the HTTPFETCH mirroring method.
+
+Large files are split into byte ranges (segments) that are fetched over
+several concurrent connections, so a single TCP stream doesn't limit the
+throughput on long links. Segments are written directly at their offset
+in the (preallocated) staging file, while the checksum of the file is
+calculated in streaming order as soon as each segment, and all the ones
+before it, have arrived.
+
+The segments already fetched are recorded in a file next to the staging
+file, so interrupted downloads resume at the first missing segment.
+"""
+
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import six
+
+from ngamsServer import staging_writer
+from . import ngamsFailedDownloadException
+
+logger = logging.getLogger(__name__)
+
+fetch_result = collections.namedtuple('fetch_result', 'size rtime wtime crctime crc')
+
+
+class RangesNotSupported(Exception):
+    """Raised when the source doesn't honour bounded byte ranges"""
+    pass
+
+
+class SegmentsState(object):
+    """
+    The segments a staging file is split into, and which of them have been
+    fetched already
+    """
+
+    def __init__(self, staging_filename, key, size, segment_size):
+        """
+        :param staging_filename: string, Name of the staging file
+        :param key: string, Identifies the file being fetched
+        :param size: int, Size of the file
+        :param segment_size: int, Size of each segment (but the last one)
+        """
+        self.staging_filename = staging_filename
+        self.fname = staging_filename + '.segments'
+        self.key = key
+        self.size = size
+        self.segment_size = segment_size
+        self.segments = [(start, min(start + segment_size, size))
+                         for start in range(0, size, segment_size)]
+        self.done = set()
+
+    def load(self):
+        """Loads the segments fetched previously, if any, for this same file"""
+        try:
+            with open(self.fname) as f:
+                state = json.load(f)
+            staging_size = os.path.getsize(self.staging_filename)
+        except (IOError, OSError, ValueError):
+            return
+        if (state.get('key') != self.key or state.get('size') != self.size or
+                state.get('segment_size') != self.segment_size or
+                staging_size != self.size):
+            logger.info("Ignoring segments state in %s, it belongs to another download", self.fname)
+            return
+        self.done = set(state.get('done', ()))
+
+    def save(self):
+        tmp_fname = self.fname + '.tmp'
+        with open(tmp_fname, 'w') as f:
+            json.dump({'key': self.key, 'size': self.size, 'segment_size': self.segment_size,
+                       'done': sorted(self.done)}, f)
+        os.rename(tmp_fname, self.fname)
+
+    def remove(self):
+        try:
+            os.unlink(self.fname)
+        except OSError:
+            pass
+
+    @property
+    def bytes_done(self):
+        return sum(self.segments[idx][1] - self.segments[idx][0] for idx in self.done)
+
+
+class SegmentedFetch(object):
+    """Fetches the segments of a file concurrently"""
+
+    def __init__(self, get_range, state, checksum_info, connections, block_size,
+                 policy=staging_writer.DEFAULT_POLICY, on_data=None):
+        """
+        :param get_range: Function called with the first and last (inclusive) byte of a segment, returning the HTTP
+        response carrying them
+        :param state: SegmentsState, The segments to fetch
+        :param checksum_info: The checksum to calculate, as returned by ngamsFileUtils.get_checksum_info
+        :param connections: int, Number of segments fetched concurrently
+        :param block_size: int, Block size (bytes) used for reading and writing the data
+        :param policy: staging_writer.staging_policy, Preallocation and durability of the staging file
+        :param on_data: Function called with the number of bytes of each block of data received, or None
+        """
+        self.get_range = get_range
+        self.state = state
+        self.checksum_info = checksum_info
+        self.connections = connections
+        self.block_size = block_size
+        self.policy = policy
+        self.on_data = on_data
+        self.condition = threading.Condition()
+        self.pending = [idx for idx in range(len(state.segments)) if idx not in state.done]
+        self.error = None
+        self.rtime = 0
+        self.wtime = 0
+        self.fetched = 0
+
+    def _prepare(self):
+        resume = bool(self.state.done)
+        if resume:
+            logger.info("Resuming download into %s, %d out of %d segments already fetched",
+                        self.state.staging_filename, len(self.state.done), len(self.state.segments))
+        flags = os.O_WRONLY | os.O_CREAT | (0 if resume else os.O_TRUNC)
+        fd = os.open(self.state.staging_filename, flags, 0o666)
+        try:
+            if not resume and self.policy.preallocate:
+                staging_writer.preallocate(fd, 0, self.state.size, self.state.staging_filename)
+            os.ftruncate(fd, self.state.size)
+        finally:
+            os.close(fd)
+        self.state.save()
+
+    def _next_segment(self):
+        with self.condition:
+            if self.error is not None or not self.pending:
+                return None
+            return self.pending.pop(0)
+
+    def _work(self):
+        try:
+            while True:
+                idx = self._next_segment()
+                if idx is None:
+                    return
+                self._fetch_segment(idx)
+        except Exception:
+            with self.condition:
+                if self.error is None:
+                    self.error = sys.exc_info()
+                self.condition.notify_all()
+
+    def _fetch_segment(self, idx):
+        start, end = self.state.segments[idx]
+        response = self.get_range(start, end - 1)
+        rtime = wtime = 0
+        with contextlib.closing(response):
+            # Sources not supporting bounded ranges reply with an error, or with the whole file
+            if response.status not in (200, 206):
+                raise RangesNotSupported("Error while fetching bytes %d-%d: %r" % (start, end - 1, response.read()))
+            content_range = response.getheader('Content-Range', '')
+            if not content_range.startswith('bytes %d-%d/' % (start, end - 1)):
+                raise RangesNotSupported("Expected bytes %d-%d, source sent %r" % (start, end - 1, content_range))
+            with open(self.state.staging_filename, 'r+b') as f:
+                f.seek(start)
+                offset = start
+                while offset < end:
+                    if self.error is not None:
+                        return
+                    rstart = time.time()
+                    data = response.read(min(self.block_size, end - offset))
+                    rtime += time.time() - rstart
+                    if not data:
+                        raise ngamsFailedDownloadException.FailedDownloadException("server is unreachable")
+                    wstart = time.time()
+                    f.write(data)
+                    wtime += time.time() - wstart
+                    offset += len(data)
+                    if self.on_data is not None:
+                        self.on_data(len(data))
+                # Segments are recorded as fetched only once they are as durable as required
+                wstart = time.time()
+                f.flush()
+                if self.policy.durability != staging_writer.DURABILITY_NONE:
+                    staging_writer.fdatasync(f.fileno())
+                wtime += time.time() - wstart
+
+        with self.condition:
+            self.rtime += rtime
+            self.wtime += wtime
+            self.fetched += end - start
+            self.state.done.add(idx)
+            self.state.save()
+            self.condition.notify_all()
+
+    def _wait_for(self, idx):
+        with self.condition:
+            while idx not in self.state.done and self.error is None:
+                self.condition.wait(1)
+            if self.error is not None:
+                six.reraise(*self.error)
+
+    def run(self):
+        """
+        Fetches all the missing segments and calculates the checksum of the
+        whole file
+        :return: fetch_result, with the number of bytes fetched (excluding those fetched previously), and the time
+        spent reading, writing (summed over all connections) and checksumming
+        """
+        self._prepare()
+        threads = [threading.Thread(target=self._work, name='SegmentFetch-%d' % i)
+                   for i in range(min(self.connections, len(self.pending)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        crc_method = self.checksum_info.method
+        crc = self.checksum_info.init
+        crctime = 0
+        try:
+            # Unbuffered, read-ahead data could belong to segments not written yet
+            with open(self.state.staging_filename, 'rb', 0) as f:
+                for idx, (start, end) in enumerate(self.state.segments):
+                    self._wait_for(idx)
+                    crcstart = time.time()
+                    f.seek(start)
+                    left = end - start
+                    while left > 0:
+                        data = f.read(min(self.block_size, left))
+                        if not data:
+                            raise Exception("Staging file %s is shorter than expected" % self.state.staging_filename)
+                        crc = crc_method(data, crc)
+                        left -= len(data)
+                    crctime += time.time() - crcstart
+        except:
+            with self.condition:
+                if self.error is None:
+                    self.error = sys.exc_info()
+            raise
+        finally:
+            for t in threads:
+                t.join()
+
+        return fetch_result(self.fetched, self.rtime, self.wtime, crctime, self.checksum_info.final(crc))
@@ -0,0 +1,655 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2018
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+A parallel, pipelined engine for the CLONE command.
+
+Files flow through the following stages:
+
+ * The planner (i.e., the calling thread) selects the target disk of each
+   file, and hands the file over to a reader and a writer.
+ * Readers, one per source disk (or remote host), read the file's contents
+   in blocks and put them into a bounded queue. Remote files are fetched
+   using a pool of persistent HTTP connections.
+ * Writers, one per target disk, consume those blocks, writing them into a
+   Staging File while calculating their checksum, and move the file into
+   its final location.
+ * A single registration thread writes the new files into the database in
+   batches, each batch within a single transaction, and records them in a
+   checkpoint DBM so an interrupted clone can be resumed by issuing the same
+   CLONE command again.
+
+Readers and writers process files in the order in which the planner hands
+them over, which guarantees that the pipeline can always make progress.
+"""
+
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests import adapters
+from six.moves import queue as Queue  # @UnresolvedImport
+
+from . import ngamsArchiveUtils, ngamsCacheControlThread, ngamsFileUtils, \
+    ngamsSrvUtils, staging_writer
+from ngamsLib import ngamsDbm, ngamsDiskInfo, ngamsDiskUtils, ngamsFileList, \
+    ngamsHighLevelLib, ngamsLib, ngamsReqProps, ngamsStatus
+from ngamsLib.ngamsCore import genLog, rmFile, mvFile, checkCreatePath, \
+    getFileCreationTime, NGAMS_SUCCESS, NGAMS_FAILURE, \
+    NGAMS_DB_CH_FILE_INSERT
+
+
+logger = logging.getLogger(__name__)
+
+# Number of data blocks a reader can get ahead of its writer
+_QUEUE_DEPTH = 8
+
+# Maximum time (in seconds) a successfully cloned file waits to be registered
+_BATCH_TIMEOUT = 1.0
+
+
+class abort_clone(Exception):
+    """Raised when the whole cloning process must be stopped"""
+    pass
+
+
+class _block_queue(object):
+    """
+    A bounded queue of data blocks that a writer can read() like a file.
+
+    The reader puts either data blocks, an empty block indicating the end of
+    the data, or an exception indicating that reading failed.
+    """
+
+    def __init__(self):
+        self._queue = Queue.Queue(_QUEUE_DEPTH)
+        self._done = False
+        self.cancelled = False
+
+    def put(self, block):
+        self._queue.put(block)
+
+    def read(self, _size):
+        block = self._queue.get()
+        if isinstance(block, Exception):
+            self._done = True
+            raise block
+        if not block:
+            self._done = True
+        return block
+
+    def close(self):
+        """Consumes the end of the data, failing if more data is available"""
+        if self._done:
+            return
+        if self.read(0):
+            self.cancel()
+            raise ngamsArchiveUtils.too_much_data("Source has more data than expected")
+
+    def cancel(self):
+        """Tells the reader to stop, discarding any pending data"""
+        self.cancelled = True
+        while not self._done:
+            try:
+                self.read(0)
+            except Exception:
+                pass
+
+
+class _clone_job(object):
+    """A file being cloned"""
+
+    def __init__(self, fio, host_id, mount_point, target, staging_filename):
+        self.fio = fio
+        self.host_id = host_id
+        self.mount_point = mount_point
+        self.target = target
+        self.staging_filename = staging_filename
+        self.blocks = _block_queue()
+        self.start = time.time()
+
+
+class _result(object):
+    """The outcome of cloning a file"""
+
+    def __init__(self, fio, host_id, start, new_fio=None, filename=None,
+                 io_time=0, error=None):
+        self.fio = fio
+        self.host_id = host_id
+        self.start = start
+        self.new_fio = new_fio
+        self.filename = filename
+        self.io_time = io_time
+        self.error = error
+
+
+def checkpoint_name(cfg, diskId, fileId, fileVersion, targetDiskId):
+    """
+    Returns the name of the checkpoint DBM used to resume the CLONE command
+    issued with the given parameters.
+    """
+    key = "%s|%s|%s|%s" % (diskId, fileId, fileVersion, targetDiskId)
+    key = hashlib.md5(key.encode('utf8')).hexdigest()
+    return os.path.join(ngamsHighLevelLib.getNgasChacheDir(cfg),
+                        "CLONE_CHECKPOINT_" + key)
+
+
+class CloneEngine(object):
+    """
+    Clones the files listed in a clone list DBM using a number of concurrent
+    readers and writers. See the module documentation for details.
+    """
+
+    def __init__(self, srvObj, cloneListDbm, targetDiskId, streams,
+                 batch_size, checkChecksum, checkpointName,
+                 cloneStatusDbm=None, reqPropsObj=None):
+        """
+        srvObj:          Reference to instance of Server Object (ngamsServer).
+
+        cloneListDbm:    DBM with the files to clone (ngamsDbm).
+
+        targetDiskId:    ID of disk to where the files should be cloned, or
+                         an empty string to select them automatically (string).
+
+        streams:         Maximum number of concurrent readers (integer).
+
+        batch_size:      Maximum number of files registered in the DB within
+                         a single transaction (integer).
+
+        checkChecksum:   Check the checksum of the cloned files (0|1/integer).
+
+        checkpointName:  Name of the checkpoint DBM (string).
+
+        cloneStatusDbm:  DBM where the status of each file is stored for the
+                         final report, if any (ngamsDbm).
+
+        reqPropsObj:     Request Properties Object to update as files are
+                         processed, if any (ngamsReqProps).
+        """
+        self._srv = srvObj
+        self._db = srvObj.getDb()
+        self._clone_list = cloneListDbm
+        self._target_disk_id = targetDiskId
+        self._streams = max(1, streams)
+        self._batch_size = max(1, batch_size)
+        self._check = checkChecksum
+        self._status_dbm = cloneStatusDbm
+        self._req_props = reqPropsObj
+
+        self._block_size = srvObj.getCfg().getBlockSize()
+        if self._block_size == -1:
+            self._block_size = 4096
+
+        checkCreatePath(os.path.dirname(checkpointName))
+        self._checkpoint_name = checkpointName
+        self._checkpoint = ngamsDbm.ngamsDbm(checkpointName, writePerm=1)
+
+        # Persistent connections to the hosts holding the source files
+        self._session = requests.Session()
+        adapter = adapters.HTTPAdapter(pool_connections=self._streams,
+                                       pool_maxsize=self._streams)
+        self._session.mount('http://', adapter)
+        self._host_info = {}
+
+        self._readers = []
+        self._reader_of = {}
+        self._writers = {}
+        self._results = Queue.Queue()
+        self._planned = set()
+
+        self.success_count = 0
+        self.failed_count = 0
+        self._bytes = 0
+        self._total = 0
+        self._started = None
+
+    #
+    # Planning
+    #
+    def run(self):
+        """
+        Clones all files and returns the number of files that were
+        successfully cloned, the number of files that failed, and the total
+        time spent.
+        """
+        self._started = time.time()
+        collector = threading.Thread(target=self._collect,
+                                     name="CLONE-REGISTER")
+        collector.start()
+
+        finished = True
+        try:
+            self._resolve_hosts()
+            fixed_target = None
+            if self._target_disk_id:
+                fixed_target = self._read_target_disk()
+
+            key = 0
+            while self._clone_list.hasKey(str(key)):
+                if not self._srv.run_async_commands:
+                    finished = False
+                    break
+                fio, host_id, mount_point = self._clone_list.get(str(key))
+                key += 1
+                self._total += 1
+                self._plan(fio, host_id, mount_point, fixed_target)
+        except abort_clone:
+            finished = False
+        finally:
+            for reader in self._readers:
+                reader.jobs.put(None)
+            for writer in self._writers.values():
+                writer.jobs.put(None)
+            for t in self._readers + list(self._writers.values()):
+                t.join()
+            self._results.put(None)
+            collector.join()
+            self._session.close()
+
+        elapsed = time.time() - self._started
+        self._log_progress(elapsed)
+
+        # Only a fully completed clone gets rid of its checkpoint
+        del self._checkpoint
+        if finished:
+            rmFile(self._checkpoint_name + "*")
+        return self.success_count, self.failed_count, elapsed
+
+    def _resolve_hosts(self):
+        hosts = set()
+        self._clone_list.initKeyPtr()
+        while True:
+            key, fileInfo = self._clone_list.getNext()
+            if not key:
+                break
+            hosts.add(fileInfo[1])
+        self._host_info = self._srv.host_topology.resolve(hosts)
+
+    def _read_target_disk(self):
+        try:
+            trgDiskInfo = ngamsDiskInfo.ngamsDiskInfo().\
+                          read(self._db, self._target_disk_id)
+            storageSet = self._srv.getCfg().\
+                         getStorageSetFromSlotId(trgDiskInfo.getSlotId())
+            trgDiskInfo.setStorageSetId(storageSet.getStorageSetId())
+            return trgDiskInfo
+        except Exception as e:
+            msg = "Cannot use target disk %s: %s" % (self._target_disk_id, str(e))
+            logger.error(msg, extra={'to_syslog': True})
+            raise abort_clone(msg)
+
+    def _select_target_disk(self, fio):
+        """Finds a disk not hosting already a file with the same ID + version"""
+        diskExemptList = [fio.getDiskId()]
+        while True:
+            trgDiskInfo = ngamsDiskUtils.findTargetDisk(self._srv.getHostId(),
+                                                        self._db,
+                                                        self._srv.getCfg(),
+                                                        fio.getFormat(),
+                                                        1, diskExemptList)
+            diskId = trgDiskInfo.getDiskId()
+            fileKey = ngamsLib.genFileKey(diskId, fio.getFileId(),
+                                          fio.getFileVersion())
+            if (fileKey in self._planned or
+                self._db.fileInDb(diskId, fio.getFileId(), fio.getFileVersion())):
+                diskExemptList.append(diskId)
+            else:
+                return trgDiskInfo
+
+    def _plan(self, fio, host_id, mount_point, fixed_target):
+
+        start = time.time()
+        srcKey = ngamsLib.genFileKey(fio.getDiskId(), fio.getFileId(),
+                                     fio.getFileVersion())
+        if srcKey in self._checkpoint:
+            logger.debug("File %s already cloned onto disk %s, skipping",
+                         srcKey, self._checkpoint.get(srcKey))
+            self._results.put(_result(fio, host_id, start))
+            return
+
+        try:
+            if fio.getFileStatus()[0] == "1":
+                raise Exception("File marked as bad - skipping!")
+            trgDiskInfo = fixed_target or self._select_target_disk(fio)
+            if trgDiskInfo.getDiskId() == fio.getDiskId():
+                raise Exception("Source and target files are identical")
+            self._planned.add(ngamsLib.genFileKey(trgDiskInfo.getDiskId(),
+                                                  fio.getFileId(),
+                                                  fio.getFileVersion()))
+
+            tmpReqPropsObj = ngamsReqProps.ngamsReqProps()
+            tmpReqPropsObj.setMimeType(fio.getFormat())
+            stagingFilename = ngamsHighLevelLib.\
+                              genStagingFilename(self._srv.getCfg(),
+                                                 tmpReqPropsObj, trgDiskInfo,
+                                                 fio.getFileId())
+        except Exception as e:
+            self._results.put(_result(fio, host_id, start, error=str(e)))
+            return
+
+        job = _clone_job(fio, host_id, mount_point, trgDiskInfo,
+                         stagingFilename)
+        self._reader(job).jobs.put(job)
+        self._writer(trgDiskInfo.getDiskId()).jobs.put(job)
+
+    def _reader(self, job):
+        if job.host_id == self._srv.getHostId():
+            source = "disk:" + job.fio.getDiskId()
+        else:
+            source = "host:" + job.host_id
+        if source not in self._reader_of:
+            if len(self._readers) < self._streams:
+                reader = _worker(self._read, _read_failed,
+                                 "CLONE-READER-%d" % len(self._readers))
+                self._readers.append(reader)
+            else:
+                reader = self._readers[len(self._reader_of) % self._streams]
+            self._reader_of[source] = reader
+        return self._reader_of[source]
+
+    def _writer(self, diskId):
+        if diskId not in self._writers:
+            self._writers[diskId] = _worker(self._write, self._write_failed,
+                                            "CLONE-WRITER-" + diskId)
+        return self._writers[diskId]
+
+    #
+    # Reading
+    #
+    def _read(self, job):
+        blocks = job.blocks
+        try:
+            for block in self._source_blocks(job):
+                if blocks.cancelled:
+                    break
+                blocks.put(block)
+            blocks.put(b'')
+        except Exception as e:
+            blocks.put(e)
+
+    def _source_blocks(self, job):
+
+        fio = job.fio
+        if job.host_id == self._srv.getHostId():
+            filename = os.path.join(job.mount_point, fio.getFilename())
+            logger.debug("Reading file %s into staging filename: %s",
+                         filename, job.staging_filename)
+            with open(filename, 'rb') as f:
+                for block in iter(functools.partial(f.read, self._block_size), b''):
+                    yield block
+            return
+
+        # Check if host is suspended, if yes, wake it up.
+        if self._srv.host_topology.is_suspended(job.host_id):
+            logger.debug("Clone Request - Waking up suspended NGAS Host: %s",
+                         job.host_id)
+            ngamsSrvUtils.wakeUpHost(self._srv, job.host_id)
+
+        host_info = self._host_info[job.host_id]
+        url = "http://%s:%d/RETRIEVE" % (host_info.getIpAddress(),
+                                         host_info.getSrvPort())
+        pars = {'file_id': fio.getFileId(),
+                'file_version': str(fio.getFileVersion())}
+        if fio.getDiskId():
+            pars['disk_id'] = fio.getDiskId()
+        logger.debug("Receiving file via URL: %s (%r) into staging filename: %s",
+                     url, pars, job.staging_filename)
+
+        resp = self._session.get(url, params=pars, stream=True)
+        with contextlib.closing(resp):
+            if resp.status_code != 200:
+                raise Exception(_remote_error(resp))
+            for block in resp.iter_content(self._block_size):
+                yield block
+
+    #
+    # Writing
+    #
+    def _write(self, job):
+
+        fio = job.fio
+        crc_name = fio.getChecksumPlugIn()
+        skip_crc = not (self._check and crc_name is not None and
+                        fio.getChecksum() is not None)
+        try:
+            policy = staging_writer.staging_policy_for(self._srv.getCfg(),
+                                                       job.target.getSlotId())
+            res = ngamsArchiveUtils.archive_contents(job.staging_filename,
+                                                     job.blocks,
+                                                     fio.getFileSize(),
+                                                     self._block_size,
+                                                     crc_name,
+                                                     skip_crc=skip_crc,
+                                                     policy=policy)
+            job.blocks.close()
+            ngamsArchiveUtils.observe_archive_result(self._srv, res)
+
+            if not skip_crc:
+                checksum_info = ngamsFileUtils.get_checksum_info(crc_name)
+                if not checksum_info.equals(str(res.crc), str(fio.getChecksum())):
+                    msg = "Illegal checksum (found: %s, expected %s) on file %s/%s/%s"
+                    raise Exception(msg % (res.crc, fio.getChecksum(),
+                                           fio.getDiskId(), fio.getFileId(),
+                                           fio.getFileVersion()))
+
+            # We simply copy the file into the same destination as the
+            # source file (but on another disk).
+            complFilename = os.path.normpath(job.target.getMountPoint() + "/" +
+                                             fio.getFilename())
+            checkCreatePath(os.path.dirname(complFilename))
+            mvTime = mvFile(job.staging_filename, complFilename)
+            ngamsLib.makeFileReadOnly(complFilename)
+
+            newFileInfo = fio.clone().setDiskId(job.target.getDiskId()).\
+                          setCreationDate(getFileCreationTime(complFilename))
+            self._results.put(_result(fio, job.host_id, job.start,
+                                      new_fio=newFileInfo,
+                                      filename=complFilename,
+                                      io_time=res.wtime + mvTime))
+        except Exception as e:
+            self._write_failed(job, e)
+
+    def _write_failed(self, job, error):
+        job.blocks.cancel()
+        rmFile(job.staging_filename)
+        self._results.put(_result(job.fio, job.host_id, job.start,
+                                  error=str(error)))
+
+    #
+    # Registration
+    #
+    def _collect(self):
+
+        batch = []
+        last_flush = time.time()
+        while True:
+            try:
+                res = self._results.get(timeout=_BATCH_TIMEOUT)
+            except Queue.Empty:
+                res = False
+
+            if res is None:
+                break
+            elif res and res.error is not None:
+                self._failed(res, res.error)
+            elif res and res.new_fio is None:
+                # Cloned in a previous run
+                self._processed(res)
+            elif res:
+                batch.append(res)
+
+            if batch and (len(batch) >= self._batch_size or
+                          time.time() - last_flush >= _BATCH_TIMEOUT):
+                self._register(batch)
+                batch = []
+                last_flush = time.time()
+
+        if batch:
+            self._register(batch)
+
+    def _register(self, batch):
+
+        try:
+            dbOperations = self._db.writeFileEntries(self._srv.getHostId(),
+                                                     [r.new_fio for r in batch])
+        except Exception as e:
+            logger.exception("Failed to register %d cloned files", len(batch))
+            for res in batch:
+                rmFile(res.filename)
+                self._failed(res, str(e))
+            return
+
+        # Update status for the Target Disks in DB + check if they are
+        # completed.
+        disks = {}
+        for res, dbOperation in zip(batch, dbOperations):
+            newFiles, nbytes, ioTime = disks.get(res.new_fio.getDiskId(), (0, 0, 0))
+            if dbOperation == NGAMS_DB_CH_FILE_INSERT:
+                newFiles += 1
+                ioTime += res.io_time
+            nbytes += res.fio.getFileSize()
+            disks[res.new_fio.getDiskId()] = (newFiles, nbytes, ioTime)
+        for diskId, (newFiles, nbytes, ioTime) in disks.items():
+            ngamsDiskUtils.updateDiskStatusDbFiles(self._db, diskId, newFiles,
+                                                   nbytes, ioTime)
+            ngamsArchiveUtils.checkDiskSpace(self._srv, diskId)
+
+        for res in batch:
+            fio, new_fio = res.fio, res.new_fio
+            self._srv.file_location_cache.invalidate(fio.getFileId())
+            self._checkpoint.add(ngamsLib.genFileKey(fio.getDiskId(),
+                                                     fio.getFileId(),
+                                                     fio.getFileVersion()),
+                                 new_fio.getDiskId())
+            self.success_count += 1
+            self._bytes += fio.getFileSize()
+
+            if self._status_dbm is not None:
+                fileList = _status_file_list(fio)
+                fileList.setStatus(NGAMS_SUCCESS)
+                fileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
+                fileList.addFileInfoObj(new_fio.setTag("TARGET_FILE"))
+                self._status_dbm.addIncKey(fileList)
+
+            # If running as a cache archive, update the Cache New Files DBM
+            # with the information about the new file.
+            if self._srv.getCachingActive():
+                ngamsCacheControlThread.addEntryNewFilesDbm(self._srv,
+                                                            new_fio.getDiskId(),
+                                                            fio.getFileId(),
+                                                            fio.getFileVersion(),
+                                                            fio.getFilename())
+
+            cloneTime = time.time() - res.start
+            msg = genLog("NGAMS_INFO_FILE_CLONED",
+                         [fio.getFileId(), fio.getFileVersion(),
+                          fio.getDiskId(), res.host_id])
+            logger.info(msg + ". Time: %.3fs.", cloneTime,
+                        extra={'to_syslog': True})
+            self._processed(res)
+
+        self._checkpoint.sync()
+        self._log_progress(time.time() - self._started)
+
+    def _failed(self, res, error):
+        fio = res.fio
+        errMsg = genLog("NGAMS_ER_FILE_CLONE_FAILED",
+                        [fio.getFileId(), fio.getFileVersion(),
+                         fio.getDiskId(), res.host_id, error])
+        logger.warning(errMsg)
+        if self._status_dbm is not None:
+            fileList = _status_file_list(fio)
+            fileList.setStatus(NGAMS_FAILURE + ": Error: " + errMsg)
+            fileList.addFileInfoObj(fio.setTag("SOURCE_FILE"))
+            self._status_dbm.addIncKey(fileList)
+        self.failed_count += 1
+        self._processed(res)
+
+    def _processed(self, res):
+        if self._req_props:
+            ngamsHighLevelLib.stdReqTimeStatUpdate(self._srv,
+                                                   self._req_props.incActualCount(1),
+                                                   time.time() - self._started)
+
+    def _log_progress(self, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        logger.info("Cloned %d/%d files (%d failed) in %.3fs: "
+                    "%.3f files/s, %.3f MB/s",
+                    self.success_count, self._total, self.failed_count,
+                    elapsed, self.success_count / elapsed,
+                    self._bytes / 1048576. / elapsed)
+
+
+class _worker(threading.Thread):
+    """
+    A thread processing jobs from its queue until it gets None. Unexpected
+    errors while processing a job are handed over to `failed` together with
+    the job, and the thread goes on with the next one.
+    """
+
+    def __init__(self, process, failed, name):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.jobs = Queue.Queue(_QUEUE_DEPTH)
+        self._process = process
+        self._failed = failed
+        self.start()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                self._process(job)
+            except Exception as e:
+                logger.exception("Unexpected error while cloning %s",
+                                 job.staging_filename)
+                try:
+                    self._failed(job, e)
+                except Exception:
+                    logger.exception("Error while recording the failure")
+
+
+def _read_failed(job, error):
+    # The writer of the job reports the failure
+    job.blocks.put(error)
+
+
+def _status_file_list(fio):
+    return ngamsFileList.ngamsFileList("FILE_CLONE_STATUS",
+                                       "File: " + fio.getFileId() + "/" +
+                                       fio.getDiskId() + "/" +
+                                       str(fio.getFileVersion()))
+
+
+def _remote_error(resp):
+    """Extracts the error message from an unsuccessful RETRIEVE reply"""
+    try:
+        stat = ngamsStatus.ngamsStatus().unpackXmlDoc(resp.content, 1)
+        return stat.getMessage()
+    except Exception:
+        return "HTTP error %d: %s" % (resp.status_code, resp.reason)
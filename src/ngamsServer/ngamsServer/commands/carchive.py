@@ -315,6 +315,7 @@ def handleCmd(srvObj,
                    setCreationDate(creDate).\
                    setIoTime(reqPropsObj.getIoTime())
         fileInfo.write(srvObj.getHostId(), srvObj.getDb())
+        srvObj.file_location_cache.invalidate(fileInfo.getFileId())
 
         # Add the file to the container
         srvObj.getDb().addFileToContainer(containerId, resDapi.getFileId(), True)
@@ -335,7 +336,8 @@ def handleCmd(srvObj,
 
         # Update disk info in NGAS Disks.
         logger.debug("Update disk info in NGAS Disks.")
-        srvObj.getDb().updateDiskInfo(resDapi.getFileSize(), resDapi.getDiskId())
+        srvObj.volume_stats.add_file(resDapi.getDiskId(), resDapi.getFileSize(),
+                                     targDiskInfo.getMountPoint())
 
         resDapiList.append(resDapi)
 
@@ -346,7 +348,9 @@ def handleCmd(srvObj,
     availSpace = getDiskSpaceAvail(targDiskInfo.getMountPoint(), smart=False)
     if (availSpace < srvObj.getCfg().getFreeSpaceDiskChangeMb()):
         targDiskInfo.setCompleted(1).setCompletionDate(time.time())
+        srvObj.volume_stats.flush(targDiskInfo.getDiskId())
         targDiskInfo.write(srvObj.getDb())
+        srvObj.volume_stats.invalidate()
 
     # Request after-math ...
     srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
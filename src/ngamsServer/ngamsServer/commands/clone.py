@@ -40,7 +40,7 @@ import six
 from six.moves.urllib import request as urlrequest  # @UnresolvedImport
 
 from .. import ngamsArchiveUtils, ngamsSrvUtils, ngamsFileUtils
-from .. import ngamsCacheControlThread
+from .. import ngamsCacheControlThread, clone_engine
 from ngamsLib import ngamsNotification, ngamsFileInfo, ngamsDiskInfo
 from ngamsLib import ngamsReqProps, ngamsHighLevelLib, ngamsDapiStatus
 from ngamsLib.ngamsCore import genLog, NGAMS_ONLINE_STATE, \
@@ -321,27 +321,20 @@ def _checkFile(srvObj,
             logger.debug("No Checksum or Checksum Plug-In specified for file")
 
 
-def _cloneExec(srvObj,
-               cloneListDbmName,
-               tmpFilePat,
-               targetDiskId,
-               reqPropsObj):
-    """
-    See documentation of ngamsCloneCmd._cloneThread(). This function is
-    merely implemented in order to encapsulate the whole process to be able
-    to clean up properly when the processing is terminated.
+def _cloneSequential(srvObj,
+                     cloneListDbm,
+                     targetDiskId,
+                     reqPropsObj,
+                     cloneStatusDbm,
+                     checkChecksum):
     """
-    cloneStatusDbm = None
-
-    emailNotif = 0
-    checkChecksum = 1
-    if (reqPropsObj):
-        if (reqPropsObj.hasHttpPar("notif_email")): emailNotif = 1
-        if (reqPropsObj.hasHttpPar("check")):
-            checkChecksum = int(reqPropsObj.getHttpPar("check"))
+    Clone the files in the clone list one after the other.
 
-    # Open clone list DB.
-    cloneListDbm = ngamsDbm.ngamsDbm(cloneListDbmName)
+    Returns:    Tuple with the number of files cloned, the number of files
+                that failed and the time spent, or None if the cloning
+                process was aborted (tuple).
+    """
+    emailNotif = cloneStatusDbm is not None
 
     # We have to get the port numbers of the hosts where the files to be
     # cloned are stored.
@@ -351,17 +344,7 @@ def _cloneExec(srvObj,
         key, fileInfo = cloneListDbm.getNext()
         if (not key): break
         hostInfoDic[fileInfo[1]] = -1
-    hostInfoDic = ngamsHighLevelLib.resolveHostAddress(srvObj.getHostId(),
-                                                       srvObj.getDb(),
-                                                       srvObj.getCfg(),
-                                                       hostInfoDic.keys())
-
-    # The cloning loop. Loop over the list of files to clone and generate
-    # a report with the result.
-    if (emailNotif):
-        cloneStatusDbmName = tmpFilePat + "_CLONE_STATUS_DB"
-        cloneStatusDbm = ngamsDbm.ngamsDbm(cloneStatusDbmName,
-                                           cleanUpOnDestr = 0, writePerm = 1)
+    hostInfoDic = srvObj.host_topology.resolve(hostInfoDic.keys())
 
     successCloneCount = 0
     failedCloneCount  = 0
@@ -473,7 +456,7 @@ def _cloneExec(srvObj,
                     fileUrl += "&disk_id=%s" % fio.getDiskId()
 
                 # Check if host is suspended, if yes, wake it up.
-                if (srvObj.getDb().getSrvSuspended(hostId)):
+                if srvObj.host_topology.is_suspended(hostId):
                     logger.debug("Clone Request - Waking up suspended " +\
                          "NGAS Host: %s", hostId)
                     ngamsSrvUtils.wakeUpHost(srvObj, hostId)
@@ -519,6 +502,7 @@ def _cloneExec(srvObj,
                                                  fio.getFileId(),
                                                  fio.getFileVersion())
             newFileInfo.write(srvObj.getHostId(), srvObj.getDb())
+            srvObj.file_location_cache.invalidate(fio.getFileId())
 
             # Update status for the Target Disk in DB + check if the disk is
             # completed.
@@ -566,7 +550,7 @@ def _cloneExec(srvObj,
                              fio.getDiskId(), hostId, str(e)])
             if (abortCloneLoop):
                 logger.error(errMsg, extra={'to_syslog': True})
-                return
+                return None
             else:
                 logger.warning(errMsg)
                 if (emailNotif):
@@ -584,6 +568,62 @@ def _cloneExec(srvObj,
             ngamsHighLevelLib.stdReqTimeStatUpdate(srvObj, reqPropsObj.\
                                                    incActualCount(1), timeAccu)
 
+    return successCloneCount, failedCloneCount, timeAccu
+
+
+def _cloneExec(srvObj,
+               cloneListDbmName,
+               tmpFilePat,
+               targetDiskId,
+               reqPropsObj):
+    """
+    See documentation of ngamsCloneCmd._cloneThread(). This function is
+    merely implemented in order to encapsulate the whole process to be able
+    to clean up properly when the processing is terminated.
+    """
+    cloneStatusDbm = None
+
+    emailNotif = 0
+    checkChecksum = 1
+    streams = 0
+    batchSize = 100
+    if (reqPropsObj):
+        if (reqPropsObj.hasHttpPar("notif_email")): emailNotif = 1
+        if (reqPropsObj.hasHttpPar("check")):
+            checkChecksum = int(reqPropsObj.getHttpPar("check"))
+        if (reqPropsObj.hasHttpPar("parallel")):
+            streams = int(reqPropsObj.getHttpPar("parallel"))
+        if (reqPropsObj.hasHttpPar("batch_size")):
+            batchSize = int(reqPropsObj.getHttpPar("batch_size"))
+
+    # Open clone list DB.
+    cloneListDbm = ngamsDbm.ngamsDbm(cloneListDbmName)
+
+    # The status of each file is kept for generating a report with the result.
+    if (emailNotif):
+        cloneStatusDbmName = tmpFilePat + "_CLONE_STATUS_DB"
+        cloneStatusDbm = ngamsDbm.ngamsDbm(cloneStatusDbmName,
+                                           cleanUpOnDestr = 0, writePerm = 1)
+
+    if (streams > 0):
+        # Resuming a previously interrupted clone requires issuing the same
+        # command, so the checkpoint is named after its parameters.
+        cloneParams = [reqPropsObj.getHttpPar(p) if reqPropsObj.hasHttpPar(p)
+                       else "" for p in ("disk_id", "file_id", "file_version")]
+        checkpointName = clone_engine.checkpoint_name(srvObj.getCfg(),
+                                                      *cloneParams,
+                                                      targetDiskId=targetDiskId)
+        engine = clone_engine.CloneEngine(srvObj, cloneListDbm, targetDiskId,
+                                          streams, batchSize, checkChecksum,
+                                          checkpointName, cloneStatusDbm,
+                                          reqPropsObj)
+        res = engine.run()
+    else:
+        res = _cloneSequential(srvObj, cloneListDbm, targetDiskId,
+                               reqPropsObj, cloneStatusDbm, checkChecksum)
+    if (res is None): return
+    successCloneCount, failedCloneCount, timeAccu = res
+
     # Final update of the Request Status.
     if (reqPropsObj):
         complPercent = (100.0 * (float(reqPropsObj.getActualCount()) /
@@ -595,6 +635,7 @@ def _cloneExec(srvObj,
     # Send Clone Report with list of files cloned to a possible
     # requestor(select) of this.
     totFiles = (successCloneCount + failedCloneCount)
+    avgTime = (timeAccu / totFiles) if totFiles else 0.0
     if (emailNotif):
         xmlStat = 0
         # TODO: Generation of XML status report is disabled since we cannot
@@ -657,7 +698,7 @@ def _cloneExec(srvObj,
             fo.write(tmpFormat % (toiso8601(), srvObj.getHostId(), diskId, fileId,
                                   str(fileVersion), totFiles,
                                   successCloneCount, failedCloneCount,
-                                  timeAccu, (timeAccu / totFiles)))
+                                  timeAccu, avgTime))
             tmpFormat = "%-70s %-70s %-7s\n"
             fo.write(tmpFormat % ("Source File", "Target File", "Status"))
             fo.write(tmpFormat % (70 * "-", 70 * "-", 7 * "-"))
@@ -702,7 +743,7 @@ def _cloneExec(srvObj,
     if (cloneListDbm): del cloneListDbm
     rmFile(cloneListDbmName + "*")
     logger.info("_cloneExec(). Total time: %.3fs. Average time per file: %.3fs.",
-                timeAccu, (timeAccu / totFiles))
+                timeAccu, avgTime)
 
 
 def _cloneThread(srvObj,
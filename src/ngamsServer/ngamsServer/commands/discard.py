@@ -161,6 +161,7 @@ def _discardFile(srvObj,
         _delFile(srvObj, filename, hostId, execute)
         if (execute):
             srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskId, fileId, fileVersion)
+            srvObj.file_location_cache.invalidate(fileId)
             msg = genLog("NGAMS_INFO_DISCARD_OK",
                          ["Disk ID: %s/File ID: %s/File Version: %s" %\
                           (str(diskId), str(fileId), str(fileVersion)),
@@ -37,8 +37,7 @@ import logging
 import threading
 
 from ngamsLib.ngamsCore import NGAMS_OFFLINE_STATE, \
-    NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, NGAMS_BUSY_SUBSTATE, genLog, \
-    loadPlugInEntryPoint
+    NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, NGAMS_BUSY_SUBSTATE, genLog
 
 
 logger = logging.getLogger(__name__)
@@ -80,7 +79,7 @@ def printLabel(srvObj,
     global _labelPrinterSem
     _labelPrinterSem.acquire()
     try:
-        pluginMethod = loadPlugInEntryPoint(plugIn)
+        pluginMethod = srvObj.plugins.entry_point(plugIn)
         pluginMethod(srvObj, prStr, reqPropsObj)
     except:
         _labelPrinterSem.release()
@@ -83,6 +83,9 @@ _LASTVER_LOCATION_SQL = ("SELECT a.host_id, a.mount_point || '/' || b.file_name
 # query_name: (column_list, SQL statement)
 queries = {
 }
+# Maximum number of File IDs in a files_in query
+_MAX_FILES_IN = 1000
+
 def _initialise_queries(db):
     NGAMS_FILES_COLS = columns(ngamsDbCore._ngasFilesDef, {'file_ignore': db.file_ignore_columnname})
     _query = lambda sql, cols: (cols.as_list, sql % cols.as_sql)
@@ -94,6 +97,7 @@ def _initialise_queries(db):
         "disks_list": _query("select %s from ngas_disks", NGAMS_DISKS_COLS),
         "hosts_list": _query("select %s from ngas_hosts", NGAMS_HOST_COLS),
         "files_like": _query("select %s from ngas_files where file_id like {0}", NGAMS_FILES_COLS),
+        "files_in": _query("select %s from ngas_files where file_id in (%%s)", NGAMS_FILES_COLS),
         "files_location": (_LOCATION_COLS, _FILES_LOCATION_SQL),
         "lastver_location":  (_LOCATION_COLS, _LASTVER_LOCATION_SQL),
         "files_between": _query(
@@ -216,6 +220,14 @@ def handleCmd(srvObj,
         if (reqPropsObj.hasHttpPar("like")):
             param = reqPropsObj.getHttpPar("like")
         args = (param,)
+    elif query == 'files_in':
+        file_ids = [f for f in reqPropsObj.get('file_ids', '').split(',') if f]
+        if not file_ids:
+            raise Exception("No file_ids given for query files_in")
+        if len(file_ids) > _MAX_FILES_IN:
+            raise Exception("Too many file_ids given for query files_in, maximum is %d" % _MAX_FILES_IN)
+        sql = sql % ', '.join('{%d}' % i for i in range(len(file_ids)))
+        args = tuple(file_ids)
     elif query == 'files_between':
         param1 = param2 = ''
         if 'start' in reqPropsObj:
@@ -43,7 +43,7 @@ import time
 import urllib
 
 from .. import ngamsArchiveUtils
-from .. import ngamsFileUtils, ngamsCacheControlThread
+from .. import ngamsFileUtils, ngamsCacheControlThread, staging_writer
 from ngamsLib import ngamsLib
 from ngamsLib import ngamsFileInfo
 from ngamsLib import ngamsHighLevelLib, ngamsDiskUtils
@@ -141,8 +141,11 @@ def receiveData(srvObj,
             reqPropsObj.__httpHdrDic[NGAMS_HTTP_HDR_CHECKSUM] = stored_checksum
             skip_crc = False
 
-        ngamsArchiveUtils.archive_contents_from_request(stagingFilename, srvObj.getCfg(),
-                                                        reqPropsObj, rfile, skip_crc=skip_crc)
+        policy = staging_writer.staging_policy_for(srvObj.getCfg(), trgDiskInfoObj.getSlotId())
+        result = ngamsArchiveUtils.archive_contents_from_request(stagingFilename, srvObj.getCfg(),
+                                                                 reqPropsObj, rfile, skip_crc=skip_crc,
+                                                                 policy=policy)
+        ngamsArchiveUtils.observe_archive_result(srvObj, result)
     finally:
         ngamsHighLevelLib.releaseDiskResource(srvObj.getCfg(), trgDiskInfoObj.getSlotId())
 
@@ -194,6 +197,7 @@ def processRequest(srvObj,
     # Update the DB with the information about the new file.
     # Update information for Main File/Disk in DB.
     newFileInfoObj.write(srvObj.getHostId(), srvObj.getDb())
+    srvObj.file_location_cache.invalidate(newFileInfoObj.getFileId())
     diskSpace = getDiskSpaceAvail(trgDiskInfoObj.getMountPoint())
     newSize = (trgDiskInfoObj.getBytesStored() + newFileInfoObj.getFileSize())
     ioTime = (trgDiskInfoObj.getTotalDiskWriteTime() + reqPropsObj.getIoTime())
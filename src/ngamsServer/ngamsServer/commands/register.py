@@ -44,11 +44,12 @@ from ngamsLib.ngamsCore import rmFile, NGAMS_HTTP_GET, \
     NGAMS_NOTIF_INFO, NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE, \
     NGAMS_VOLUME_INFO_FILE, NGAMS_REGISTER_THR, \
     NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, \
-    NGAMS_BUSY_SUBSTATE, loadPlugInEntryPoint, toiso8601
+    NGAMS_BUSY_SUBSTATE, toiso8601
 from ngamsLib import ngamsDbm, ngamsReqProps, ngamsFileInfo, ngamsDbCore, \
     ngamsHighLevelLib, ngamsDiskUtils, ngamsLib, ngamsFileList, \
     ngamsNotification, ngamsDiskInfo, ngamsPlugInApi, ngamsCore
 from .. import ngamsArchiveUtils, ngamsCacheControlThread, ngamsFileUtils
+from .. import register_engine
 
 logger = logging.getLogger(__name__)
 
@@ -199,7 +200,7 @@ def _registerExec(srvObj,
         try:
             # Invoke Registration Plug-In.
             piName = regPi.name
-            plugInMethod = loadPlugInEntryPoint(piName)
+            plugInMethod = srvObj.plugins.entry_point(piName)
             piRes = plugInMethod(srvObj, tmpReqPropsObj, params)
             del tmpReqPropsObj
 
@@ -320,6 +321,53 @@ def _registerExec(srvObj,
     del fileListDbm
     rmFile(fileListDbmName + "*")
 
+    _registerReport(srvObj, tmpFilePat, diskInfoDic, reqPropsObj,
+                    regDbm if emailNotif else None, fileCount, fileRegCount,
+                    fileFailCount, fileRejectCount, regTimeAccu)
+
+
+def _registerReport(srvObj,
+                    tmpFilePat,
+                    diskInfoDic,
+                    reqPropsObj,
+                    regDbm,
+                    fileCount,
+                    fileRegCount,
+                    fileFailCount,
+                    fileRejectCount,
+                    regTimeAccu):
+    """
+    Make the final update of the Request Status and send the Registration
+    Report if requested.
+
+    srvObj:          Instance of NG/AMS Server object (ngamsServer).
+
+    tmpFilePat:      Pattern for temporary files used during the registration
+                     process (string).
+
+    diskInfoDic:     Dictionary with Disk IDs as keys pointing to the info
+                     about the disk (dictionary/ngamsDiskInfo).
+
+    reqPropsObj:     Request Properties Object of the request, if any
+                     (ngamsReqProps).
+
+    regDbm:          DBM with the File Info Objects of the files handled, or
+                     None if no report should be sent (ngamsDbm).
+
+    fileCount:       Number of files handled (integer).
+
+    fileRegCount:    Number of files registered (integer).
+
+    fileFailCount:   Number of files that could not be registered (integer).
+
+    fileRejectCount: Number of files rejected (integer).
+
+    regTimeAccu:     Time spent registering the files (float).
+
+    Returns:         Void.
+    """
+    emailNotif = regDbm is not None
+
     # Final update of the Request Status.
     if (reqPropsObj):
         if (reqPropsObj.getExpectedCount() and reqPropsObj.getActualCount()):
@@ -423,6 +471,7 @@ def _registerExec(srvObj,
         ngamsNotification.notify(srvObj.host_id, srvObj.cfg, NGAMS_NOTIF_INFO,
             "REGISTER STATUS REPORT", statRep, recList=emailAdrList, force=1,
             contentType=mimeType, attachmentName=attachmentName)
+        regDbmName = regDbm.getDbmName()
         del regDbm
         rmFile(regDbmName + "*")
         rmFile(statRep)
@@ -439,21 +488,100 @@ def _registerExec(srvObj,
     logger.debug(msg, fileCount, regTimeAccu, timePerFile)
 
 
+def _registerParallelExec(srvObj,
+                          files,
+                          tmpFilePat,
+                          diskInfoDic,
+                          reqPropsObj = None):
+    """
+    Like _registerExec(), but the files are registered by the parallel
+    register engine (see ngamsServer.register_engine).
+
+    srvObj:          Instance of NG/AMS Server object (ngamsServer).
+
+    files:           Iterable with the information about the files to be
+                     registered. Each element is a list with the following
+                     information:
+
+                       [<Filename>, <Disk ID>, <Mime-Type>]
+
+    tmpFilePat:      Pattern for temporary files used during the registration
+                     process (string).
+
+    diskInfoDic:     Dictionary with Disk IDs as keys pointing to the info
+                     about the disk (dictionary/ngamsDiskInfo).
+
+    reqPropsObj:     If an NG/AMS Request Properties Object is given, the
+                     Request Status will be updated as the request is carried
+                     out (ngamsReqProps).
+
+    Returns:         Void.
+    """
+    workers = int(reqPropsObj.getHttpPar("parallel"))
+    processes = 0
+    batchSize = 100
+    if (reqPropsObj.hasHttpPar("crc_processes")):
+        processes = int(reqPropsObj.getHttpPar("crc_processes"))
+    if (reqPropsObj.hasHttpPar("batch_size")):
+        batchSize = int(reqPropsObj.getHttpPar("batch_size"))
+
+    regDbm = None
+    if (reqPropsObj.hasHttpPar("notif_email")):
+        regDbm = ngamsDbm.ngamsDbm(tmpFilePat + "_NOTIF_EMAIL", writePerm = 1)
+
+    engine = register_engine.RegisterEngine(srvObj, diskInfoDic, workers,
+                                            processes, batchSize,
+                                            reqPropsObj, regDbm)
+    regTimeAccu = engine.run(files)
+    _registerReport(srvObj, tmpFilePat, diskInfoDic, reqPropsObj, regDbm,
+                    engine.file_count, engine.registered_count,
+                    engine.failed_count, engine.rejected_count, regTimeAccu)
+
+
+def _candidateFiles(searchPath,
+                    diskId,
+                    mimeTypeMappings,
+                    threads):
+    """
+    Generator yielding the information about the files found under the given
+    path, which are candidates for being registered, scanning the directory
+    tree in parallel.
+
+    Yields:     [<Filename>, <Disk ID>, <Mime-Type>] (list).
+    """
+    if (os.path.isfile(searchPath)):
+        filenames = [searchPath]
+    else:
+        filenames = register_engine.scan_files(searchPath, threads)
+    for filename in filenames:
+        nextFile = os.path.basename(filename)
+        if nextFile in (NGAMS_DISK_INFO, NGAMS_VOLUME_ID_FILE,
+                        NGAMS_VOLUME_INFO_FILE):
+            continue
+        mimeType = ngamsLib.detMimeType(mimeTypeMappings, nextFile, 1)
+        yield [filename, diskId, mimeType]
+
+
 def _registerThread(srvObj,
                     fileListDbmName,
                     tmpFilePat,
                     diskInfoDic,
                     reqPropsObj = None,
-                    dummyPar = None):
+                    files = None):
     """
-    See documentation for _registerExec().
+    See documentation for _registerExec(). If no fileListDbmName is given
+    the given files are registered with _registerParallelExec() instead.
 
     The purpose of this function is merely to excapsulate the actual
     cloning to make it possible to clean up in case an exception is thrown.
     """
     try:
-        _registerExec(srvObj, fileListDbmName, tmpFilePat, diskInfoDic,
-                      reqPropsObj)
+        if (fileListDbmName is None):
+            _registerParallelExec(srvObj, files, tmpFilePat, diskInfoDic,
+                                  reqPropsObj)
+        else:
+            _registerExec(srvObj, fileListDbmName, tmpFilePat, diskInfoDic,
+                          reqPropsObj)
         rmFile(tmpFilePat + "*")
         return
     except Exception:
@@ -541,6 +669,14 @@ def register(srvObj,
         diskInfoDic[diskId] = tmpDiskInfo
         mtPt2DiskInfo[mtPt] = tmpDiskInfo
 
+    # When registering in parallel the files are found while the
+    # registration is carried out.
+    if (reqPropsObj and reqPropsObj.hasHttpPar("parallel") and
+        int(reqPropsObj.getHttpPar("parallel")) > 0):
+        _registerParallel(srvObj, path, tmpFilePat, diskInfoDic,
+                          mtPt2DiskInfo, reqPropsObj, httpRef)
+        return
+
     # Generate a list with all files found under the specified path, which
     # are candidates for being registered.
     fileListDbmName = tmpFilePat + "_FILE_LIST"
@@ -673,6 +809,61 @@ def register(srvObj,
         httpRef.send_data(six.b(xmlStat), NGAMS_XML_MT)
 
 
+def _registerParallel(srvObj,
+                      path,
+                      tmpFilePat,
+                      diskInfoDic,
+                      mtPt2DiskInfo,
+                      reqPropsObj,
+                      httpRef):
+    """
+    Carry out the registration of the files found under the given path
+    in parallel. See register() for the meaning of the parameters.
+    """
+    searchPath = os.path.normpath(path)
+    diskId = None
+    for mtPt in mtPt2DiskInfo.keys():
+        mtPt2 = mtPt
+        if (mtPt[-1] != "/"): mtPt2 += "/"
+        if (searchPath.find(mtPt2) == 0):
+            diskId = mtPt2DiskInfo[mtPt].getDiskId()
+            break
+    files = []
+    if (diskId):
+        files = _candidateFiles(searchPath, diskId,
+                                srvObj.getCfg().getMimeTypeMappings(),
+                                int(reqPropsObj.getHttpPar("parallel")))
+
+    reqPropsObj.setExpectedCount(0).setActualCount(0).setCompletionPercent(0)
+    srvObj.updateRequestDb(reqPropsObj)
+
+    is_async = 'async' in reqPropsObj and int(reqPropsObj['async'])
+    if is_async:
+        logger.debug("REGISTER command accepted - generating immediate " +\
+             "confimation reply to REGISTER command")
+        status = srvObj.genStatus(NGAMS_SUCCESS,
+                                  "Accepted REGISTER command for execution").\
+                                  setReqStatFromReqPropsObj(reqPropsObj).\
+                                  setActualCount(0)
+        args = (srvObj, None, tmpFilePat, diskInfoDic, reqPropsObj, files)
+        thrName = NGAMS_REGISTER_THR + threading.current_thread().getName()
+        regThread = threading.Thread(None, _registerThread, thrName, args)
+        regThread.daemon = False
+        regThread.start()
+    else:
+        _registerParallelExec(srvObj, files, tmpFilePat, diskInfoDic,
+                              reqPropsObj)
+        msg = "Successfully handled command REGISTER"
+        logger.debug(msg)
+        status = srvObj.genStatus(NGAMS_SUCCESS, msg).\
+                 setReqStatFromReqPropsObj(reqPropsObj).setActualCount(0)
+
+    if (httpRef):
+        xmlStat = status.genXmlDoc(0, 0, 0, 1, 0)
+        xmlStat = ngamsHighLevelLib.addStatusDocTypeXmlDoc(xmlStat, httpRef.host)
+        httpRef.send_data(six.b(xmlStat), NGAMS_XML_MT)
+
+
 def handleCmd(srvObj,
                       reqPropsObj,
                       httpRef):
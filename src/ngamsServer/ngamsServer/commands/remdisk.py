@@ -117,6 +117,7 @@ def _remDisk(srvObj,
         try:
             tmpDir = os.path.dirname(tmpFilePat)
             srvObj.getDb().deleteDiskInfo(diskId, 1)
+            srvObj.file_location_cache.clear()
         except Exception as e:
             errMsg = genLog("NGAMS_ER_DEL_DISK_DB", [diskId, str(e)])
             raise Exception(errMsg)
@@ -136,6 +136,7 @@ def _remFile(srvObj,
                 # for the number of available copies.
                 try:
                     srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskId, fileId, fileVer)
+                    srvObj.file_location_cache.invalidate(fileId)
                     infoMsg = genLog("NGAMS_INFO_DEL_FILE",
                                      [diskId, fileId, fileVer])
                     logger.debug(infoMsg)
@@ -33,6 +33,7 @@ Function + code to handle the RETRIEVE Command.
 
 import logging
 import os
+import re
 import shutil
 import socket
 import time
@@ -43,7 +44,7 @@ from ngamsLib.ngamsCore import NGAMS_TEXT_MT, getFileSize, \
     genLog, NGAMS_PROC_FILE, NGAMS_HOST_LOCAL, \
     NGAMS_HOST_CLUSTER, NGAMS_HOST_REMOTE, \
     NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, \
-    NGAMS_BUSY_SUBSTATE, loadPlugInEntryPoint, NGAMS_XML_MT
+    NGAMS_BUSY_SUBSTATE, NGAMS_XML_MT
 from .. import ngamsFileUtils
 import pkg_resources
 
@@ -69,24 +70,14 @@ def performStaging(srvObj, reqPropsObj, httpRef, filename):
     if srvObj.getCfg().getFileStagingEnable() != 1:
         return
 
-    fspi = srvObj.getCfg().getFileStagingPlugIn()
-    if not fspi:
+    staging_service = srvObj.staging_service
+    if not staging_service:
         return
 
-    logger.info("Invoking FSPI.isFileOffline: %s to check file: %s", fspi, filename)
-    isFileOffline = loadPlugInEntryPoint(fspi, 'isFileOffline')
-
-    if isFileOffline(filename) == 0:
-        return
-
-    logger.info("Invoking FSPI.stageFiles: %s to check file: %s", fspi, filename)
-    stageFiles = loadPlugInEntryPoint(fspi, 'stageFiles')
-
     try:
         st = time.time()
-        stageFiles(filenames = [filename],
-                    requestObj = reqPropsObj,
-                    serverObj = srvObj)
+        if not staging_service.stage([filename], reqPropsObj):
+            return
         howlong = time.time() - st
         fileSize = getFileSize(filename)
         logger.debug('Staging rate = %.0f Bytes/s (%.0f seconds) for file %s', fileSize / howlong, howlong, filename)
@@ -130,7 +121,7 @@ def performProcessing(srvObj,
             raise Exception(errMsg)
         # Invoke the DPPI.
         logger.info("Invoking DPPI: %s to process file: %s", dppi, filename)
-        plugInMethod = loadPlugInEntryPoint(dppi)
+        plugInMethod = srvObj.plugins.entry_point(dppi)
         statusObj = plugInMethod(srvObj, reqPropsObj, filename)
         compression = 'UNKNOWN'
     else:
@@ -216,7 +207,8 @@ def genReplyRetrieve(srvObj,
 
             fname, hdrs = inform_compression(httpRef, resObj, compression)
             httpRef.send_file(resObj.getDataRef(), resObj.getMimeType(),
-                              start_byte=start_byte, fname=fname, hdrs=hdrs)
+                              start_byte=start_byte, fname=fname, hdrs=hdrs,
+                              end_byte=reqPropsObj.retrieve_end)
         else:
             httpRef.send_data(resObj.getDataRef(), resObj.getMimeType(), fname=resObj.getRefFilename())
 
@@ -224,6 +216,8 @@ def genReplyRetrieve(srvObj,
         cleanUpAfterProc(statusObj)
 
 
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
 _ALLOWED_DTDS = (
     "ngamsStatus.dtd",
     "ngamsInternal.dtd",
@@ -399,17 +393,19 @@ def handleCmd(srvObj,
         srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
         raise Exception(errMsg)
 
-    # See if client requested partial content and remember the starting offset
+    # See if client requested partial content and remember the byte range
     retrieve_offset = 0
+    retrieve_end = None
     range_hdr = reqPropsObj.getHttpHdr('range')
     if range_hdr:
-        try:
-            retrieve_offset = int(range_hdr[6:-1])
-            if retrieve_offset < 0:
-                raise
-        except:
-            raise ValueError("Invalid Range header, must have the form 'bytes=start-' (start offset only)")
+        m = _RANGE_RE.match(range_hdr.strip())
+        if not m or (m.group(2) and int(m.group(2)) < int(m.group(1))):
+            raise ValueError("Invalid Range header, must have the form 'bytes=start-[end]'")
+        retrieve_offset = int(m.group(1))
+        if m.group(2):
+            retrieve_end = int(m.group(2))
     reqPropsObj.retrieve_offset = retrieve_offset
+    reqPropsObj.retrieve_end = retrieve_end
 
     _handleCmdRetrieve(srvObj, reqPropsObj, httpRef)
     srvObj.setSubState(NGAMS_IDLE_SUBSTATE)
@@ -0,0 +1,128 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""In-memory cache of the database rows used to locate files"""
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FileLocationCache(object):
+    """
+    Caches the results of the database queries used to locate files, keyed
+    by File ID and the rest of the query arguments (file version, host,
+    domain, disk, etc).
+
+    At most `max_entries` results are kept, the least recently used being
+    discarded first, and each for at most `ttl` seconds, which bounds how
+    long changes done by other servers go unnoticed. Changes done by this
+    server must be notified via invalidate(). A `max_entries` of 0 disables
+    the cache.
+    """
+
+    def __init__(self, max_entries=10000, ttl=30, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (file_id, key) -> (expiration time, value)
+        self.entries = collections.OrderedDict()
+        # file_id -> keys cached for it
+        self.keys = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _remove(self, file_id, key):
+        del self.entries[(file_id, key)]
+        keys = self.keys[file_id]
+        keys.discard(key)
+        if not keys:
+            del self.keys[file_id]
+
+    def get(self, file_id, key):
+        """Returns the value cached for `file_id` and `key`, or None"""
+        with self.lock:
+            entry = self.entries.get((file_id, key))
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(file_id, key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            # Most recently used go last
+            del self.entries[(file_id, key)]
+            self.entries[(file_id, key)] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, file_id, key, value):
+        """Caches `value` for `file_id` and `key`"""
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries.pop((file_id, key), None)
+            self.entries[(file_id, key)] = (self.clock() + self.ttl, value)
+            self.keys.setdefault(file_id, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                (old_file_id, old_key), _ = next(iter(self.entries.items()))
+                self._remove(old_file_id, old_key)
+
+    def invalidate(self, file_id):
+        """Forgets everything cached for `file_id`"""
+        with self.lock:
+            for key in self.keys.pop(file_id, ()):
+                del self.entries[(file_id, key)]
+                self.invalidations += 1
+
+    def clear(self):
+        """Forgets everything"""
+        with self.lock:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.keys.clear()
+
+    def statistics(self):
+        """
+        Return the number of hits, misses and invalidations of the cache,
+        and the number of entries it currently holds
+        :return: dict
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.,
+                'invalidations': self.invalidations,
+            }
+
+    def log_statistics(self):
+        stats = self.statistics()
+        logger.info("File location cache: %d hits, %d misses (%.1f%% hit rate), "
+                    "%d invalidations, %d entries",
+                    stats['hits'], stats['misses'], stats['hit_rate'] * 100,
+                    stats['invalidations'], stats['entries'])
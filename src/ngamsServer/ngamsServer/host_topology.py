@@ -0,0 +1,154 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""In-memory view of the ngas_hosts table and how to reach each host"""
+
+import logging
+import threading
+import time
+
+from ngamsLib import ngamsHighLevelLib, ngamsHostInfo
+
+logger = logging.getLogger(__name__)
+
+
+class HostTopology(object):
+    """
+    Keeps the contents of the ngas_hosts table in memory, together with the
+    result of resolving each host into the host that should actually be
+    contacted (e.g., the master unit of its cluster), so that looking them
+    up doesn't require going to the database.
+
+    The whole table is loaded on first use and re-loaded every
+    `refresh_period` seconds, which bounds how long changes done by other
+    servers go unnoticed. Changes done by this server must be notified via
+    host_changed().
+    """
+
+    def __init__(self, get_db, local_host_id, refresh_period=10, clock=time.time):
+        self.get_db = get_db
+        self.local_host_id = local_host_id
+        self.refresh_period = refresh_period
+        self.clock = clock
+        self.lock = threading.RLock()
+        # host_id -> ngas_hosts row
+        self.rows = {}
+        # host_id -> resolved ngamsHostInfo
+        self.resolved = {}
+        self.loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _check_loaded(self):
+        now = self.clock()
+        if self.loaded_at is not None and now - self.loaded_at < self.refresh_period:
+            return
+        rows = self.get_db().getAllHostInfo()
+        self.rows = {row[0]: row for row in rows}
+        self.resolved.clear()
+        self.loaded_at = now
+        self.reloads += 1
+
+    def getHostInfoFromHostIds(self, hostList):
+        """
+        Like ngamsDbNgasHosts.getHostInfoFromHostIds, but from memory. Hosts
+        that are not known yet are looked up in the database.
+        """
+        with self.lock:
+            self._check_loaded()
+            missing = [h for h in hostList if h not in self.rows]
+            if missing:
+                for row in self.get_db().getHostInfoFromHostIds(missing):
+                    self.rows[row[0]] = row
+            return [self.rows[h] for h in hostList if h in self.rows]
+
+    def get(self, host_id):
+        """
+        Return the information about `host_id` as found in ngas_hosts
+        :return: An ngamsHostInfo object, or None if the host is unknown
+        """
+        rows = self.getHostInfoFromHostIds([host_id])
+        if not rows:
+            return None
+        return ngamsHostInfo.ngamsHostInfo().unpackFromSqlQuery(rows[0])
+
+    def is_suspended(self, host_id):
+        """Whether `host_id` is marked as suspended"""
+        host_info = self.get(host_id)
+        return host_info is not None and host_info.getSrvSuspended() == 1
+
+    def resolve(self, hostList):
+        """
+        Like ngamsHighLevelLib.resolveHostAddress, but from memory.
+
+        :return: A dictionary with host IDs as keys and ngamsHostInfo objects
+                 as values. Callers are free to modify them.
+        """
+        res = {}
+        with self.lock:
+            self._check_loaded()
+            for host_id in hostList:
+                host_info = self.resolved.get(host_id)
+                if host_info is None:
+                    self.misses += 1
+                    host_info = ngamsHighLevelLib.resolveHostAddress(
+                        self.local_host_id, self, None, [host_id])[host_id]
+                    self.resolved[host_id] = host_info
+                else:
+                    self.hits += 1
+                res[host_id] = host_info.clone()
+        return res
+
+    def host_changed(self, host_id):
+        """Re-reads the information about `host_id` from the database"""
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            rows = self.get_db().getHostInfoFromHostIds([host_id])
+            if rows:
+                self.rows[host_id] = rows[0]
+            else:
+                self.rows.pop(host_id, None)
+            # The host might be the contact point of others
+            self.resolved.clear()
+
+    def statistics(self):
+        """
+        Return the number of hosts known, how many times the table was loaded,
+        and the number of hits and misses when resolving hosts
+        :return: dict
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hosts': len(self.rows),
+                'reloads': self.reloads,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / float(lookups) if lookups else 0.,
+            }
+
+    def log_statistics(self):
+        stats = self.statistics()
+        logger.info("Host topology: %d hosts, %d reloads, %d hits, %d misses (%.1f%% hit rate)",
+                    stats['hosts'], stats['reloads'], stats['hits'], stats['misses'],
+                    stats['hit_rate'] * 100)
@@ -25,7 +25,7 @@ import logging
 import time
 
 from ngamsLib import ngamsNotification
-from ngamsLib.ngamsCore import NGAMS_NOTIF_ERROR, loadPlugInEntryPoint
+from ngamsLib.ngamsCore import NGAMS_NOTIF_ERROR
 
 
 logger = logging.getLogger(__name__)
@@ -55,11 +55,12 @@ def run(srvObj, stopEvt):
 
     # Now, suspend this host.
     srvObj.getDb().markHostSuspended(hostId)
+    srvObj.host_changed(hostId)
     suspPi = cfg.getSuspensionPlugIn()
     logger.debug("Invoking Suspension Plug-In: %s to " +\
          "suspend NG/AMS Server: %s", suspPi, hostId)
     try:
-        plugInMethod = loadPlugInEntryPoint(suspPi)
+        plugInMethod = srvObj.plugins.entry_point(suspPi)
         plugInMethod(srvObj)
     except Exception as e:
         errMsg = "Error suspending server with Suspension Plug-In %s"
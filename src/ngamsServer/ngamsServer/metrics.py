@@ -0,0 +1,170 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Server metrics, exposed in the Prometheus text format"""
+
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+#: Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 300, 900)
+
+#: The metrics fed by the server, with their type and description
+DESCRIPTIONS = {
+    'ngas_requests_total': ('counter', 'Requests handled, by command and HTTP status code'),
+    'ngas_request_duration_seconds': ('histogram', 'Time taken to handle requests, by command'),
+    'ngas_received_bytes_total': ('counter', 'Bytes received in request bodies, by command'),
+    'ngas_sent_bytes_total': ('counter', 'Bytes sent in response bodies, by command'),
+    'ngas_archive_read_seconds_total': ('counter', 'Time spent reading incoming data while archiving'),
+    'ngas_archive_write_seconds_total': ('counter', 'Time spent writing incoming data to disk while archiving'),
+    'ngas_checksum_bytes_total': ('counter', 'Bytes checksummed while archiving, by checksum variant'),
+    'ngas_checksum_seconds_total': ('counter', 'Time spent checksumming while archiving, by checksum variant'),
+}
+
+#: The statistics() keys of server components that only ever increase, and
+#: are thus reported as counters rather than gauges
+MONOTONIC_STATISTICS = frozenset(('hits', 'misses', 'invalidations', 'reloads', 'requests',
+                                  'online_hits', 'coalesced', 'recalled', 'failed', 'batches'))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+class Metrics(object):
+    """
+    Holds counters and histograms fed from the request path, and collectors
+    that report the current value of gauges when asked.
+
+    Updating a metric only takes a lock and a dictionary update; all the
+    formatting happens in exposition(), called when metrics are scraped.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # name -> {labels: value}
+        self.counters = {}
+        # name -> {labels: [bucket counts..., sum, count]}
+        self.histograms = {}
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        """Increments counter `name` by `value`"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Records `value` in histogram `name`"""
+        key = tuple(sorted(labels.items()))
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            values = self.histograms.setdefault(name, {})
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * (len(self.buckets) + 2)
+            if idx < len(self.buckets):
+                counts[idx] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def add_collector(self, collector):
+        """
+        Adds a callable that, when metrics are scraped, returns an iterable of
+        (name, labels dictionary, value) tuples with the current value of
+        some gauges. A fourth element with the metric type ('counter' or
+        'gauge') can be given for values kept elsewhere that only increase.
+        Collectors raising errors are skipped.
+        """
+        self.collectors.append(collector)
+
+    def exposition(self):
+        """Returns all metrics in the Prometheus text exposition format"""
+        lines = []
+        def header(name, default_type):
+            typ, text = DESCRIPTIONS.get(name, (default_type, None))
+            if text:
+                lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, typ))
+
+        with self.lock:
+            counters = {name: dict(values) for name, values in self.counters.items()}
+            histograms = {name: {k: list(v) for k, v in values.items()}
+                          for name, values in self.histograms.items()}
+
+        for name in sorted(counters):
+            header(name, 'counter')
+            for labels, value in sorted(counters[name].items()):
+                lines.append('%s%s %s' % (name, _format_labels(labels), repr(float(value))))
+
+        for name in sorted(histograms):
+            header(name, 'histogram')
+            for labels, counts in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (
+                        name, _format_labels(labels + (('le', repr(float(bound))),)), cumulative))
+                lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', '+Inf'),)), counts[-1]))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), repr(float(counts[-2]))))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), counts[-1]))
+
+        collected = {}
+        types = {}
+        for collector in self.collectors:
+            try:
+                for metric in collector():
+                    name, labels, value = metric[:3]
+                    types[name] = metric[3] if len(metric) > 3 else 'gauge'
+                    collected.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception:
+                logger.warning("Error while collecting metrics from %r", collector, exc_info=True)
+        for name in sorted(collected):
+            header(name, types[name])
+            for labels, value in sorted(collected[name]):
+                lines.append('%s%s %s' % (name, _format_labels(labels), repr(float(value))))
+
+        return '\n'.join(lines) + '\n'
+
+
+def statistics_collector(prefix, get_component, counters=MONOTONIC_STATISTICS):
+    """
+    Returns a collector reporting the statistics() of the component returned
+    by `get_component`, if any, named after `prefix`. The keys in `counters`
+    are reported as counters (with a _total suffix), the rest as gauges.
+    """
+    def collect():
+        component = get_component()
+        if component is None:
+            return []
+        return [('%s_%s_total' % (prefix, key), {}, value, 'counter') if key in counters
+                else ('%s_%s' % (prefix, key), {}, value)
+                for key, value in component.statistics().items()]
+    return collect
@@ -0,0 +1,183 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""In-memory queue of Mirroring Requests backed by a write-ahead log"""
+
+import collections
+import logging
+import os
+import struct
+import threading
+
+from six.moves import cPickle  # @UnresolvedImport
+
+logger = logging.getLogger(__name__)
+
+# States of the requests held in the queue
+QUEUED = 'QUEUED'
+ACTIVE = 'ACTIVE'
+ERROR = 'ERROR'
+COMPLETED = 'COMPLETED'
+
+_PUT = 'PUT'
+_DELETE = 'DELETE'
+_header = struct.Struct('<I')
+
+
+class MirroringQueue(object):
+    """
+    The queue of the Mirroring Requests handled by the Mirroring Service.
+
+    Each request, identified by its file key, is in one of these states:
+    queued for mirroring, being mirrored, failed (waiting to be retried or
+    reported) or completed (waiting to be reported). Requests are kept in
+    memory, and every change is appended to a write-ahead log before being
+    applied. On creation the queue is restored from an existing log, with
+    the requests that were being mirrored queued again. The log is
+    compacted when it grows much larger than the queue itself.
+    """
+
+    def __init__(self, wal_fname):
+        self.wal_fname = wal_fname
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.queued = collections.deque()
+        self.wal = None
+        self.wal_records = 0
+        self._recover()
+
+    def _recover(self):
+        if os.path.exists(self.wal_fname):
+            with open(self.wal_fname, 'rb') as f:
+                while True:
+                    header = f.read(_header.size)
+                    if len(header) < _header.size:
+                        break
+                    data = f.read(_header.unpack(header)[0])
+                    try:
+                        op, key, state, request = cPickle.loads(data)
+                    except Exception:
+                        # A record only partially written before a crash
+                        logger.warning("Ignoring incomplete record at the end of %s", self.wal_fname)
+                        break
+                    if op == _PUT:
+                        self.requests[key] = (state, request)
+                    else:
+                        self.requests.pop(key, None)
+        for key, (state, request) in list(self.requests.items()):
+            if state == ACTIVE:
+                state = QUEUED
+                self.requests[key] = (state, request)
+            if state == QUEUED:
+                self.queued.append(key)
+        if self.requests:
+            logger.info("Restored %d Mirroring Requests from %s", len(self.requests), self.wal_fname)
+        self._compact()
+
+    def _write_record(self, f, op, key, state=None, request=None):
+        data = cPickle.dumps((op, key, state, request), 2)
+        f.write(_header.pack(len(data)))
+        f.write(data)
+
+    def _compact(self):
+        tmp_fname = self.wal_fname + '.tmp'
+        with open(tmp_fname, 'wb') as f:
+            for key, (state, request) in self.requests.items():
+                self._write_record(f, _PUT, key, state, request)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.wal is not None:
+            self.wal.close()
+        os.rename(tmp_fname, self.wal_fname)
+        self.wal = open(self.wal_fname, 'ab')
+        self.wal_records = len(self.requests)
+
+    def _log(self, op, key, state=None, request=None):
+        self._write_record(self.wal, op, key, state, request)
+        self.wal.flush()
+        self.wal_records += 1
+        if self.wal_records > max(1000, 4 * len(self.requests)):
+            self._compact()
+
+    def _put(self, key, request, state):
+        self._log(_PUT, key, state, request)
+        self.requests[key] = (state, request)
+        if state == QUEUED:
+            self.queued.append(key)
+
+    def add(self, key, request):
+        """Queues a new request, unless a request with this key is already known. Returns whether it was added"""
+        with self.lock:
+            if key in self.requests:
+                return False
+            self._put(key, request, QUEUED)
+            return True
+
+    def put(self, key, request, state):
+        """Puts a request in the given state, regardless of its previous one"""
+        with self.lock:
+            self._put(key, request, state)
+
+    def pop(self):
+        """Returns the next queued request, marking it as being mirrored, or None if there is none"""
+        with self.lock:
+            while self.queued:
+                key = self.queued.popleft()
+                state, request = self.requests.get(key, (None, None))
+                # The request might have changed state since it was queued
+                if state != QUEUED:
+                    continue
+                self._put(key, request, ACTIVE)
+                return request
+            return None
+
+    def remove(self, key, state=None):
+        """Removes and returns a request, optionally only if it is in the given state"""
+        with self.lock:
+            current_state, request = self.requests.get(key, (None, None))
+            if request is None or (state is not None and state != current_state):
+                return None
+            self._log(_DELETE, key)
+            del self.requests[key]
+            return request
+
+    def entries(self, state):
+        """Returns a list with the (key, request) pairs currently in the given state"""
+        with self.lock:
+            return [(key, request) for key, (s, request) in self.requests.items() if s == state]
+
+    def count(self, state):
+        with self.lock:
+            return sum(1 for s, _ in self.requests.values() if s == state)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.requests
+
+    def __len__(self):
+        with self.lock:
+            return len(self.requests)
+
+    def close(self):
+        with self.lock:
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
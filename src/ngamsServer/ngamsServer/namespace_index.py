@@ -0,0 +1,149 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""In-memory index of the files registered in the name space of a cluster"""
+
+import hashlib
+import logging
+import math
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    """A fixed-size bloom filter over (File ID, File Version) keys"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1024)
+        self.num_bits = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(float(self.num_bits) / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, file_id, file_version):
+        key = ('%s/%d' % (file_id, file_version)).encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, file_id, file_version):
+        for pos in self._positions(file_id, file_version):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def might_contain(self, file_id, file_version):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(file_id, file_version))
+
+    @property
+    def full(self):
+        return self.count > self.capacity
+
+
+class NamespaceIndex(object):
+    """
+    Index of the File ID/Versions registered in the name space of a cluster.
+
+    A bloom filter answers most lookups for files not in the cluster without
+    accessing the DB; its positive answers, which can be false, are confirmed
+    with a DB query, batched over many files. The filter is built once and
+    then kept up to date incrementally, with the files ingested since the
+    last update and with the archive events of this server. Since files
+    are never removed from the filter, removed files are also confirmed
+    against the DB before being reported as present.
+    """
+
+    def __init__(self, db, cluster_name, error_rate=0.01):
+        self.db = db
+        self.cluster_name = cluster_name
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_ingestion_date = None
+
+    def _load(self, bloom, from_ing_date=None):
+        last_ingestion_date = from_ing_date
+        for file_id, file_version, ingestion_date in self.db.getClusterFileKeys(self.cluster_name, from_ing_date):
+            # Archive events can update the same filter concurrently
+            with self.lock:
+                bloom.add(file_id, file_version)
+            if ingestion_date and (not last_ingestion_date or str(ingestion_date) > str(last_ingestion_date)):
+                last_ingestion_date = ingestion_date
+        return last_ingestion_date
+
+    def build(self):
+        """Builds the index from scratch with the files registered in the cluster"""
+        start = time.time()
+        # The number of files in the whole DB is an upper bound for the
+        # cluster, and leaves room for the files added incrementally
+        capacity = max(2 * self.db.getNumberOfFiles(), 2 * self.bloom.count if self.bloom else 0)
+        bloom = BloomFilter(capacity, self.error_rate)
+        last_ingestion_date = self._load(bloom)
+        with self.lock:
+            self.bloom = bloom
+            self.last_ingestion_date = last_ingestion_date
+        logger.info("Built name space index for cluster %s with %d files in %.3f [s]",
+                    self.cluster_name, bloom.count, time.time() - start)
+
+    def update(self):
+        """Adds the files ingested in the cluster since the last update"""
+        if self.bloom is None or self.bloom.full:
+            self.build()
+            return
+        with self.lock:
+            bloom = self.bloom
+            from_ing_date = self.last_ingestion_date
+        last_ingestion_date = self._load(bloom, from_ing_date)
+        with self.lock:
+            if self.bloom is bloom:
+                self.last_ingestion_date = last_ingestion_date
+
+    def add(self, file_id, file_version):
+        """Adds a single file to the index, e.g., when archived locally"""
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(file_id, int(file_version))
+
+    def handle_archive_event(self, evt):
+        """Archive event subscriber keeping the index up to date"""
+        self.add(evt.file_id, evt.file_version)
+
+    def contains(self, file_keys):
+        """
+        Returns the subset of the given (File ID, File Version) keys that are
+        registered in the cluster.
+        """
+        with self.lock:
+            bloom = self.bloom
+        if bloom is None:
+            candidates = list(file_keys)
+        else:
+            candidates = [(file_id, file_version) for file_id, file_version in file_keys
+                          if bloom.might_contain(file_id, file_version)]
+        if not candidates:
+            return set()
+        file_ids = sorted(set(file_id for file_id, _ in candidates))
+        present = set()
+        for i in range(0, len(file_ids), 500):
+            present |= self.db.getClusterFileVersions(self.cluster_name, file_ids[i:i + 500])
+        return present.intersection(candidates)
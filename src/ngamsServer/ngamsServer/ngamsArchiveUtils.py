@@ -50,13 +50,15 @@ from ngamsLib.ngamsCore import NGAMS_FAILURE, getFileCreationTime,\
     NGAMS_HTTP_GET, NGAMS_ARCHIVE_CMD, NGAMS_HTTP_FILE_URL, cpFile,\
     NGAMS_NOTIF_NO_DISKS, mvFile, NGAMS_PICKLE_FILE_EXT,\
     rmFile, NGAMS_BACK_LOG_TMP_PREFIX, NGAMS_BACK_LOG_DIR,\
-    getHostName, loadPlugInEntryPoint, checkCreatePath, NGAMS_HTTP_HDR_CHECKSUM,\
+    getHostName, checkCreatePath, NGAMS_HTTP_HDR_CHECKSUM,\
+    NGAMS_HTTP_HDR_FILE_SIZE,\
     NGAMS_ONLINE_STATE, NGAMS_IDLE_SUBSTATE, NGAMS_BUSY_SUBSTATE,\
     NGAMS_NOTIF_ERROR
 from ngamsLib import ngamsHighLevelLib, ngamsNotification, ngamsPlugInApi, ngamsLib,\
     ngamsHttpUtils, utils
 from ngamsLib import ngamsReqProps, ngamsFileInfo, ngamsDiskInfo, ngamsStatus, ngamsDiskUtils
 from . import ngamsFileUtils
+from . import staging_writer
 from . import ngamsCacheControlThread
 from . import FileDoesntExist, InvalidParameter
 
@@ -77,21 +79,18 @@ def _random_target_volume(srv):
 
     # Get a random volume from the list of available volumes
     # This should balance load the disk utilization
-    res = srv.getDb().getAvailableVolumes(srv.getHostId())
-    if not res:
+    volumes = srv.volume_stats.available_volumes()
+    if not volumes:
         return None
-
-    # Shuffle the results.
-    res = list(res)
-    random.shuffle(res)
-    return ngamsDiskInfo.ngamsDiskInfo().unpackSqlResult(res[0])
+    return random.choice(volumes)
 
 def _stream_target_volume(srvObj, mimeType, file_uri, size):
     try:
         return ngamsDiskUtils.findTargetDisk(srvObj.getHostId(),
                                              srvObj.getDb(), srvObj.getCfg(),
                                              mimeType, 0, caching=0,
-                                             reqSpace=size)
+                                             reqSpace=size,
+                                             volumes=srvObj.volume_stats.get_volumes())
     except Exception as e:
         errMsg = str(e) + ". Attempting to archive file: %s" % file_uri
         ngamsNotification.notify(srvObj.getHostId(), srvObj.getCfg(), NGAMS_NOTIF_NO_DISKS,
@@ -115,12 +114,23 @@ archiving_results = collections.namedtuple('archiving_results',
 previous_file_info = collections.namedtuple('previous_file_info', 'disk_id size path')
 
 
-def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False):
+def observe_archive_result(srvObj, result):
+    """Feeds the server metrics with the timings of archive_contents"""
+    srvObj.metrics.inc('ngas_archive_read_seconds_total', result.rtime)
+    srvObj.metrics.inc('ngas_archive_write_seconds_total', result.wtime)
+    if result.crcname and result.crctime:
+        srvObj.metrics.inc('ngas_checksum_bytes_total', result.size, variant=result.crcname)
+        srvObj.metrics.inc('ngas_checksum_seconds_total', result.crctime, variant=result.crcname)
+
+
+def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False,
+                     policy=None):
     """
     Archives the contents read from `fin` (a file-like object with .read()
     support) and writes it to file `out_fname`, which is opened in write mode
     and truncated. While reading the data its checksum is calculated using the
-    checksum method indicated by `crc_variant`.
+    checksum method indicated by `crc_variant`. The file is preallocated and
+    synced to disk as indicated by the staging_writer.staging_policy `policy`.
 
     This method returns an archiving_results tuple populated with all the
     corresponding fields.
@@ -144,7 +154,9 @@ def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False
     logger.debug("Saving data in file: %s", out_fname)
 
     start = time.time()
-    with open(out_fname, 'wb') as fout:
+    # Data that has been checksummed already is not going to be read back soon
+    fout = staging_writer.StagingFile(out_fname, fsize, policy, drop_cache=not skip_crc)
+    with fout:
         while readin < fsize:
 
             left = fsize - readin
@@ -170,35 +182,14 @@ def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False
                 crc = crc_m(buff, crc)
                 crctime += time.time() - crcstart
 
+        # Closing the file might mean waiting for it to be synced to disk
+        wstart = time.time()
+        fout.close()
+        wtime += time.time() - wstart
+
     if crc_info:
         crc = crc_info.final(crc)
 
-        # rtobar, 31 Aug 2017
-        #
-        # I've added these two lines here to ensure that the contents of the
-        # file are actually safe on disk at this stage, but it's commented out
-        # for the moment because I'm not fully sure this is the best place to do
-        # this. It probably is because any problem that occurs later without
-        # doing an explicit fsync() here would mean that not *all* the data
-        # might have been saved to disk.
-        #
-        # On the other hand, the NGAS code already invokes a disk-sync plug-in
-        # after each file archival (which syncs *the whole disk*!) if the
-        # backlog buffering feature is on (which seems to be the case, at least
-        # in our MWA setups). This later full-disk sync seems unnecessary
-        # (backlog buffering or not), and it looks to me that an unconditional
-        # fsync() is really what we want. Still, I prefer not to rush and try
-        # to understand the reasoning behind the current approach (performance
-        # is the only thing I can think of) before doing any changes.
-        #
-        # All the above means also that if I enable these two lines I'll simply
-        # remove the full disk sync logic.
-
-#        # Make sure all the content has been flushed from user-space caches...
-#        fout.flush()
-#        # ... and hits the disk
-#        os.fsync(fout.fileno())
-
     total_time = time.time() - start
 
     if readin > fsize:
@@ -212,10 +203,12 @@ def archive_contents(out_fname, fin, fsize, block_size, crc_name, skip_crc=False
     return archiving_results(readin, rtime, wtime, crctime, total_time, crc_name, crc)
 
 
-def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, transfer=None):
+def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, transfer=None,
+                                  policy=None):
     """
     Inspects the given configuration and request objects, and calls
-    archive_contents with the required arguments.
+    archive_contents with the required arguments. `policy` is the
+    staging_writer.staging_policy of the volume `out_fname` is on.
     """
 
     checkCreatePath(os.path.dirname(out_fname))
@@ -231,7 +224,8 @@ def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, tr
     def http_transfer(req, out_fname, crc_name, skip_crc):
         block_size = cfg.getBlockSize()
         size = req.getSize()
-        return archive_contents(out_fname, rfile, size, block_size, crc_name, skip_crc)
+        return archive_contents(out_fname, rfile, size, block_size, crc_name, skip_crc,
+                                policy=policy)
 
     transfer = transfer or http_transfer
     result = transfer(req, out_fname, crc_name, skip_crc=skip_crc)
@@ -240,8 +234,14 @@ def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, tr
     req.setBytesReceived(result.size)
     ingestRate = result.size / result.totaltime / 1024. / 1024.
 
-    # Compare checksum if required
+    # Clients can send the checksum as a trailer after the data
     checksum = req.getHttpHdr(NGAMS_HTTP_HDR_CHECKSUM)
+    if isinstance(rfile, ngamsHttpUtils.chunked_reader):
+        if rfile.read(1):
+            raise too_much_data("Received more data than the advertised size of %d bytes" % result.size)
+        checksum = checksum or rfile.trailers.get(NGAMS_HTTP_HDR_CHECKSUM.lower())
+
+    # Compare checksum if required
     checksum_info = ngamsFileUtils.get_checksum_info(variant)
     if checksum and result.crc is not None:
         if not checksum_info.equals(checksum, result.crc):
@@ -249,6 +249,7 @@ def archive_contents_from_request(out_fname, cfg, req, rfile, skip_crc=False, tr
             raise Exception(msg)
         else:
             logger.info("%s CRC checked, OK!", req.getFileUri())
+            req.client_checksum_verified = True
 
     logger.debug('File size: %d; Transfer time: %.4f s; CRC time: %.4f s; write time %.4f s',
                  result.size, result.totaltime, result.crctime, result.wtime)
@@ -328,6 +329,7 @@ def updateFileInfoDb(srvObj,
         fileInfo.setIngestionRate(ingestion_rate)
 
     fileInfo.write(srvObj.getHostId(), srvObj.getDb(), prev_disk_id=prev_disk_id)
+    srvObj.file_location_cache.invalidate(fileInfo.getFileId())
     logger.debug("Updated file info in NGAS DB for file with ID: %s", piStat.getFileId())
 
     # Update the container size with the new size
@@ -477,8 +479,7 @@ def checkDiskSpace(srvObj,
     if mainDiskInfo is None:
         mainDiskInfo = ngamsDiskInfo.ngamsDiskInfo()
         mainDiskInfo.read(srvObj.getDb(), mainDiskId)
-    availSpaceMbMain = getDiskSpaceAvail(mainDiskInfo.getMountPoint(),
-                                         smart=False)
+    availSpaceMbMain = getDiskSpaceAvail(mainDiskInfo.getMountPoint())
 
     # Get the Replication Disk Slot ID. If no Replication Disk is
     # configured for the Main Disk, this will be ''.
@@ -489,8 +490,7 @@ def checkDiskSpace(srvObj,
         repDiskInfo = ngamsDiskInfo.ngamsDiskInfo()
         repDiskId = srvObj.getDiskDic()[repDiskSlotId].getDiskId()
         repDiskInfo.read(srvObj.getDb(), repDiskId)
-        availSpaceMbRep = getDiskSpaceAvail(repDiskInfo.getMountPoint(),
-                                            smart=False)
+        availSpaceMbRep = getDiskSpaceAvail(repDiskInfo.getMountPoint())
     else:
         availSpaceMbRep = -1
 
@@ -520,12 +520,14 @@ def checkDiskSpace(srvObj,
         repDiskCompl  = 0
     if (mainDiskCompl or repDiskCompl):
         complDate = time.time()
+        srvObj.volume_stats.invalidate()
 
     # Mark Main Disk as completed if required.
     if (mainDiskCompl):
         # The amount of space available is below the specified limit.
         # - Mark Main Disk as Completed.
         mainDiskInfo.setCompleted(1).setCompletionDate(complDate)
+        srvObj.volume_stats.flush(mainDiskInfo.getDiskId())
         mainDiskInfo.write(srvObj.getDb())
         logger.warning("Marked Main Disk with ID: " + mainDiskId + " - Name: " +\
                mainDiskInfo.getLogicalName() + " - Slot No.: " +\
@@ -545,6 +547,7 @@ def checkDiskSpace(srvObj,
     # Mark Replication Disk as completed if required.
     if (repDiskCompl):
         repDiskInfo.setCompleted(1).setCompletionDate(complDate)
+        srvObj.volume_stats.flush(repDiskInfo.getDiskId())
         repDiskInfo.write(srvObj.getDb())
         logger.warning("Marked Replication Disk with ID: " + repDiskInfo.getDiskId() +\
                " - Name: " + repDiskInfo.getLogicalName() +\
@@ -628,7 +631,8 @@ def postFileRecepHandling(srvObj,
     if prev_file:
         srvObj.db.replace_file(prev_file.size, prev_file.disk_id, resultPlugIn.getFileSize(), tgtDiskInfo.getDiskId())
     else:
-        srvObj.getDb().updateDiskInfo(resultPlugIn.getFileSize(), resultPlugIn.getDiskId())
+        srvObj.volume_stats.add_file(resultPlugIn.getDiskId(), resultPlugIn.getFileSize(),
+                                     tgtDiskInfo.getMountPoint())
 
 #     mainDiskInfo = ngamsDiskUtils.updateDiskStatusDb(srvObj.getDb(),
 #                                                      resultPlugIn)
@@ -747,7 +751,7 @@ def archiveFromFile(srvObj,
         # Set the log cache to 1 during the handling of the file.
         plugIn = srvObj.getMimeTypeDic()[mimeType]
         logger.info("Invoking DAPI: %s", plugIn)
-        plugInMethod = loadPlugInEntryPoint(plugIn)
+        plugInMethod = srvObj.plugins.entry_point(plugIn)
         resMain = plugInMethod(srvObj, reqPropsObjLoc)
         # Move the file to final destination.
         mv_time = mvFile(reqPropsObjLoc.getStagingFilename(),
@@ -1055,6 +1059,12 @@ def dataHandler(srv, request, httpRef, volume_strategy=VOLUME_STRATEGY_STREAMS,
             logger.exception('Unexpected error while trying to notify archiving error')
         raise
 
+def _has_client_checksum(req):
+    """Whether the client sends the checksum of the data, either as a header or as a trailer"""
+    trailer = req.getHttpHdr('trailer') or ''
+    return (req.hasHttpHdr(NGAMS_HTTP_HDR_CHECKSUM) or
+            NGAMS_HTTP_HDR_CHECKSUM.lower() in trailer.lower())
+
 def _dataHandler(srvObj, reqPropsObj, httpRef, find_target_disk,
                 pickle_request, sync_disk, do_replication, transfer):
 
@@ -1080,6 +1090,12 @@ def _dataHandler(srvObj, reqPropsObj, httpRef, find_target_disk,
         logger.info("Handling archive push request")
         rfile = httpRef.rfile
 
+        # Clients sending the checksum of the file as a trailer use chunked
+        # transfer encoding, and give the size of the file in a separate header
+        if 'chunked' in (reqPropsObj.getHttpHdr('transfer-encoding') or '').lower():
+            rfile = ngamsHttpUtils.chunked_reader(rfile)
+            reqPropsObj.setSize(reqPropsObj.getHttpHdr(NGAMS_HTTP_HDR_FILE_SIZE) or 0)
+
     logger.info(genLog("NGAMS_INFO_ARCHIVING_FILE", [reqPropsObj.getFileUri()]), extra={'to_syslog': True})
 
     if transfer is None and reqPropsObj.getSize() <= 0:
@@ -1121,23 +1137,33 @@ def _dataHandler(srvObj, reqPropsObj, httpRef, find_target_disk,
         # otherwise we must postpone it until the data archiving plug-in is executed,
         # since it can potentially change the data.
         # This method is optional, in which case it is assumed the data is changed
+        # If configured, plug-ins not saying anything are trusted to not change
+        # the data when the client sends its checksum: it is verified here,
+        # and used later on if the size of the data didn't change.
         skip_crc = True
+        trust_client_checksum = False
         plugIn = srvObj.getMimeTypeDic()[mimeType]
         try:
-            modifies = loadPlugInEntryPoint(plugIn,
-                                            entryPointMethodName='modifies_content',
-                                            returnNone=True)
+            modifies = srvObj.plugins.entry_point(plugIn,
+                                                  entryPointMethodName='modifies_content',
+                                                  returnNone=True)
             if modifies:
                 skip_crc = modifies(srvObj, reqPropsObj)
+            elif cfg.getTrustClientChecksum() and _has_client_checksum(reqPropsObj):
+                skip_crc = False
+                trust_client_checksum = True
         except ImportError:
             raise PluginNotFoundError(plugIn)
 
         try:
             ngamsHighLevelLib.acquireDiskResource(cfg, trgDiskInfo.getSlotId())
+            policy = staging_writer.staging_policy_for(cfg, trgDiskInfo.getSlotId())
             archive_result = archive_contents_from_request(tmpStagingFilename, cfg, reqPropsObj,
-                                                           rfile, skip_crc=skip_crc, transfer=transfer)
+                                                           rfile, skip_crc=skip_crc, transfer=transfer,
+                                                           policy=policy)
         finally:
             ngamsHighLevelLib.releaseDiskResource(cfg, trgDiskInfo.getSlotId())
+        observe_archive_result(srvObj, archive_result)
 
         logger.debug("Move Temporary Staging File to Processing Staging File: %s -> %s",
                      tmpStagingFilename, stagingFilename)
@@ -1168,7 +1194,7 @@ def _dataHandler(srvObj, reqPropsObj, httpRef, find_target_disk,
         # use, which we pass down via the 'crc_name' parameter (which we later
         # remove).
         try:
-            plugInMethod = loadPlugInEntryPoint(plugIn)
+            plugInMethod = srvObj.plugins.entry_point(plugIn)
         except (ImportError, AttributeError):
             raise PluginNotFoundError(plugIn)
 
@@ -1217,9 +1243,19 @@ def _dataHandler(srvObj, reqPropsObj, httpRef, find_target_disk,
     # Checksum could have been calculated during archiving or by the DAPI
     # Worst case scenario: we calculate it now at the very end by re-reading
     # the stating file
+    # A checksum calculated only to verify the client's is used if the
+    # plug-in didn't change the size of the data
+    reception_crc = archive_result.crc
+    if trust_client_checksum and reception_crc is not None:
+        if (getattr(reqPropsObj, 'client_checksum_verified', False) and
+            plugin_result.getFileSize() == archive_result.size):
+            logger.info("Using verified client checksum for %s", reqPropsObj.getSafeFileUri())
+        else:
+            reception_crc = None
+
     cksum = None
-    if archive_result.crc is not None:
-        cksum = (archive_result.crc, crc_name)
+    if reception_crc is not None:
+        cksum = (reception_crc, crc_name)
     elif plugin_result.crc is not None:
         cksum = (plugin_result.crc, crc_name)
     elif crc_name is None:
@@ -34,6 +34,10 @@ This module utilities used to authorization.
 
 import logging
 import base64
+import hashlib
+import hmac
+import threading
+import time
 
 import six
 
@@ -52,48 +56,89 @@ class UnauthorizedError(Exception):
     def __init__(self, user):
         self.user = user
 
+class CredentialCache(object):
+    """
+    Cache of the Authorization header values already verified, so that the
+    (possibly expensive) password verification is done only once per client.
+
+    Entries are keyed on a hash of the header value, expire after the
+    configured time, and are discarded whenever the configuration changes.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.compiled = None
+        self.entries = {}
+
+    @staticmethod
+    def _key(header):
+        return hashlib.sha256(six.b(header)).digest()
+
+    def _check_config(self, compiled):
+        if compiled is not self.compiled:
+            self.entries = {}
+            self.compiled = compiled
+
+    def get(self, compiled, header):
+        """Returns the user previously verified for the header, or None"""
+        key = self._key(header)
+        with self.lock:
+            self._check_config(compiled)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user, expiry = entry
+            if expiry < time.time():
+                del self.entries[key]
+                return None
+            return user
+
+    def put(self, compiled, header, user):
+        """Records that the header has been verified as belonging to the user"""
+        if compiled.auth_cache_time <= 0:
+            return
+        key = self._key(header)
+        now = time.time()
+        with self.lock:
+            self._check_config(compiled)
+            if len(self.entries) >= self.max_entries:
+                self.entries = {k: v for k, v in self.entries.items() if v[1] >= now}
+                if len(self.entries) >= self.max_entries:
+                    self.entries = {}
+            self.entries[key] = (user, now + compiled.auth_cache_time)
+
+_credential_cache = CredentialCache()
+
+
+def verify_password(user, password):
+    """Whether `password` is the password of the given configuration user, in constant time"""
+    if user.password_hash is not None:
+        pwd_hash = user.password_hash
+        digest = hashlib.pbkdf2_hmac('sha256', password, pwd_hash.salt, pwd_hash.iterations)
+        return hmac.compare_digest(digest, pwd_hash.digest)
+    if user.password is None:
+        return False
+    return hmac.compare_digest(password, user.password)
+
+
 def cmdPermitted(cfg, reqPropsObj, reqUser):
     """Whether the command is allows to be run by the user"""
 
-    commands = cfg.getAuthUserCommands(reqUser)
-    if not commands:
-        return False
-    elif '*' == commands:
-        return True
-
-    return reqPropsObj.getCmd().strip() in commands.split(',')
+    user = cfg.compiled.auth_users.get(reqUser)
+    return user is not None and user.may_run(reqPropsObj.getCmd().strip())
 
 
 def isCommandExcluded(cfg, command):
     """Check if the requested command is excluded from authorization"""
+    return cfg.compiled.auth_excluded(command)
 
-    exclude_command_list = cfg.getAuthExcludeCommandList()
-    if exclude_command_list is None:
-        return False
-    if "*" in exclude_command_list or command in exclude_command_list:
-        return True
-    return False
 
-
-def authorize(cfg, reqPropsObj):
-    """Check if the request is authorized for the authenticated user, if any"""
-
-    if not cfg.getAuthorize():
-        logger.debug("Authorization is disabled, continuing anonymously")
-        return
-
-    # Check if the requested command is excluded from authorization
-    requested_command = reqPropsObj.getCmd().strip()
-    if isCommandExcluded(cfg, requested_command):
-        logger.debug("Authorization is disabled for the '%s' command, continuing anonymously",
-                     requested_command)
-        return
+def _authenticate(compiled, authorization):
+    """Returns the configuration user the Authorization header value belongs to"""
 
     # For now only Basic HTTP Authentication is implemented.
-    if not reqPropsObj.getAuthorization():
-        raise UnauthenticatedError('Unauthorized request received')
-
-    auth_parts = reqPropsObj.getAuthorization().split(' ')
+    auth_parts = authorization.split(' ')
     if auth_parts[0] != 'Basic':
         raise UnauthenticatedError('Invalid authentication scheme: ' + auth_parts[0])
     if len(auth_parts) != 2:
@@ -106,15 +151,43 @@ def authorize(cfg, reqPropsObj):
     user, password = utils.b2s(user_pass[0]), b':'.join(user_pass[1:])
 
     # Get the user from the configuration.
-    stored_pass = cfg.getAuthUserInfo(user)
-    if not stored_pass:
+    user_info = compiled.auth_users.get(user)
+    if not user_info or not user_info.encoded_password:
         raise UnauthenticatedError("unknown user specified")
 
-    # Password matches and command is allowed
-    stored_pass = base64.b64decode(six.b(stored_pass))
-    if password != stored_pass:
+    if not verify_password(user_info, password):
         raise UnauthenticatedError("wrong password for user " + user)
-    if not cmdPermitted(cfg, reqPropsObj, user):
-        raise UnauthorizedError(user)
-
     logger.info("Successfully authenticated user %s", user)
+    return user_info
+
+
+def authorize(cfg, reqPropsObj):
+    """Check if the request is authorized for the authenticated user, if any"""
+
+    # All checks are done against the same configuration snapshot
+    compiled = cfg.compiled
+    if not compiled.authorize:
+        logger.debug("Authorization is disabled, continuing anonymously")
+        return
+
+    # Check if the requested command is excluded from authorization
+    requested_command = reqPropsObj.getCmd().strip()
+    if compiled.auth_excluded(requested_command):
+        logger.debug("Authorization is disabled for the '%s' command, continuing anonymously",
+                     requested_command)
+        return
+
+    authorization = reqPropsObj.getAuthorization()
+    if not authorization:
+        raise UnauthenticatedError('Unauthorized request received')
+
+    user = _credential_cache.get(compiled, authorization)
+    if user is None:
+        user = _authenticate(compiled, authorization)
+        _credential_cache.put(compiled, authorization, user)
+    else:
+        logger.debug("User %s already authenticated", user.name)
+
+    # Command is allowed
+    if not user.may_run(requested_command):
+        raise UnauthorizedError(user.name)
@@ -1195,6 +1195,7 @@ def removeFile(srvObj,
              diskInfoObj.getDiskId(), fileId, str(fileVersion))
         srvObj.getDb().deleteFileInfo(srvObj.getHostId(), diskInfoObj.getDiskId(), fileId,
                                       fileVersion)
+        srvObj.file_location_cache.invalidate(fileId)
     except Exception as e:
         msg = genLog("NGAMS_ER_DEL_FILE_DB", [diskInfoObj.getDiskId(),
                                               fileId, fileVersion, str(e)])
@@ -31,9 +31,7 @@
 Contains various functions for handling commands.
 """
 
-import importlib
 import logging
-import sys
 
 from ngamsLib.ngamsCore import NGAMS_SUCCESS
 
@@ -45,19 +43,11 @@ logger = logging.getLogger(__name__)
 _builtin_cmds = {
     'ARCHIVE', 'BBCPARC', 'CACHEDEL', 'CAPPEND', 'CARCHIVE', 'CCREATE',
     'CDESTROY', 'CHECKFILE', 'CLIST', 'CLONE', 'CONFIG', 'CREMOVE', 'CRETRIEVE',
-    'DISCARD', 'EXIT', 'HELP', 'INIT', 'LABEL', 'LARCHIVE', 'OFFLINE', 'ONLINE', 'QARCHIVE',
+    'DISCARD', 'EXIT', 'HELP', 'INIT', 'LABEL', 'LARCHIVE', 'METRICS', 'OFFLINE', 'ONLINE', 'QARCHIVE',
     'QUERY', 'REARCHIVE', 'REGISTER', 'REMDISK', 'REMFILE', 'RETRIEVE', 'STATUS',
     'SUBSCRIBE', 'UNSUBSCRIBE'
 }
 
-# The reload function has moved around a bit
-if sys.version_info[0] < 3:
-    from __builtin__ import reload
-elif sys.version_info[0:2] < (3, 4):
-    from imp import reload
-else:
-    reload = importlib.reload
-
 
 def handle_cmd(srvObj, reqPropsObj, httpRef):
     """Passes down the request to the corresponding command handling module"""
@@ -90,33 +80,37 @@ def _get_module(server, request):
         request.setCmd('RETRIEVE').addHttpPar("internal", cmd)
         cmd = 'RETRIEVE'
 
-    # Is it a built-in or a plug-in?
-    if cmd in _builtin_cmds:
-        modname = __package__ + '.commands.' + cmd.lower()
-    elif cmd in server.cfg.cmd_plugins:
-        modname = server.cfg.cmd_plugins[cmd]
-    else:
-        modname = 'ngamsPlugIns.ngamsCmd_%s' % cmd
-
     # Reload the module if requested.
+    modname = _module_name(server.cfg, cmd)
     reload_mod = 'reload' in request and int(request['reload']) == 1
 
-    # We previously checked sys.modules before doing import_module, but that's
-    # unnecessary, and moreover thread-usafe, since modules are put in sys.modules
-    # before they are fully built (leading to errors like "module 'ngamsServer.commands.qarchive'
-    # has no attribute 'handleCmd'", which it definitly has)
-    logger.debug("Importing dynamic command module: %s", modname)
+    # Modules are normally imported when the configuration is loaded, and
+    # anything not imported yet is done by the registry in a thread-safe manner
     try:
-        mod = importlib.import_module(modname)
+        if reload_mod:
+            return server.plugins.reload_command(cmd, modname)
+        return server.plugins.command(cmd, modname)
     except ImportError:
         logger.error("No module %s found", modname)
         raise NoSuchCommand()
     except:
         logger.exception("Error while importing %s", modname)
         raise
-    if reload_mod:
-        logger.debug("Re-loading dynamic command module: %s", modname)
-        mod = reload(mod)
-    return mod
+
+def _module_name(cfg, cmd):
+    """Returns the name of the module implementing `cmd`"""
+    if cmd in _builtin_cmds:
+        return __package__ + '.commands.' + cmd.lower()
+    elif cmd in cfg.cmd_plugins:
+        return cfg.cmd_plugins[cmd]
+    return 'ngamsPlugIns.ngamsCmd_%s' % cmd
+
+def command_modules(cfg):
+    """
+    Returns a dictionary with the built-in commands and those configured
+    in `cfg` as keys, and the name of the module implementing them as values
+    """
+    cmds = _builtin_cmds.union(cfg.cmd_plugins)
+    return {cmd: _module_name(cfg, cmd) for cmd in cmds}
 
 # EOF
\ No newline at end of file
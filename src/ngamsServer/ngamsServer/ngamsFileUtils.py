@@ -40,16 +40,18 @@ import logging
 import os
 import re
 import struct
+import threading
 import time
 
 import six
+from six.moves import queue as Queue  # @UnresolvedImport
 
 from ngamsLib import ngamsDbCore, ngamsDiskInfo, ngamsFileInfo, \
-    ngamsLib, ngamsStatus, ngamsHighLevelLib, ngamsHttpUtils
+    ngamsLib, ngamsStatus, ngamsHttpUtils
 from ngamsLib.ngamsCore import NGAMS_HOST_LOCAL, NGAMS_HOST_CLUSTER, \
     NGAMS_HOST_DOMAIN, rmFile, NGAMS_HOST_REMOTE, NGAMS_RETRIEVE_CMD, genLog, \
     NGAMS_STATUS_CMD, NGAMS_CACHE_DIR, \
-    NGAMS_DATA_CHECK_THR, getFileSize, loadPlugInEntryPoint
+    NGAMS_DATA_CHECK_THR, getFileSize
 from . import ngamsSrvUtils
 
 _crc32c_available = True
@@ -304,6 +306,182 @@ def lookup_partner_site_file(ngas_server,
     return file_attribute_list
 
 
+class HostLiveness(object):
+    """
+    Remembers for `ttl` seconds the hosts that recently confirmed, quickly
+    enough, that they can serve a file, so they can be trusted without
+    asking them again.
+    """
+
+    def __init__(self, ttl=10, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.alive_until = {}
+
+    def is_alive(self, host):
+        with self.lock:
+            return self.alive_until.get(host, 0) > self.clock()
+
+    def alive(self, host):
+        with self.lock:
+            self.alive_until[host] = self.clock() + self.ttl
+
+    def dead(self, host):
+        with self.lock:
+            self.alive_until.pop(host, None)
+
+
+# Deadline for each of the STATUS/file_access probes sent to the hosts of
+# remote replicas, which are sent all at once.
+REPLICA_PROBE_TIMEOUT = 5
+
+host_liveness = HostLiveness()
+
+
+def _probeReplica(srvObj, fileInfoObj, host, hostDic):
+    """
+    Asks the server at host whether it can serve the given file.
+
+    Returns:    True if the file is available there (boolean).
+    """
+    port = hostDic[host].getSrvPort()
+    logger.debug("Checking if file with ID/Version: %s/%s " +\
+                 "is available on host/port: %s/%s",
+                 fileInfoObj.getFileId(), str(fileInfoObj.getFileVersion()),
+                 host, str(port))
+    pars = [["file_access", fileInfoObj.getFileId()]]
+    if (fileInfoObj.getFileVersion() != -1):
+        pars.append(["file_version", fileInfoObj.getFileVersion()])
+    ipAddress = hostDic[host].getIpAddress()
+    authHdr = ngamsSrvUtils.genIntAuthHdr(srvObj)
+    try:
+        resp = ngamsHttpUtils.httpGet(ipAddress, port, NGAMS_STATUS_CMD,
+                                      pars=pars, auth=authHdr,
+                                      timeout=REPLICA_PROBE_TIMEOUT)
+        with contextlib.closing(resp):
+            data = resp.read()
+        statusObj = ngamsStatus.ngamsStatus().unpackXmlDoc(data, 1)
+    except Exception as e:
+        logger.warning("Error while asking %s/%s for file %s: %s", host,
+                       str(port), fileInfoObj.getFileId(), str(e))
+        return False
+
+    if ((statusObj.getMessage().find("NGAMS_INFO_FILE_AVAIL") == -1)):
+        logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileInfoObj.getFileId(), host]))
+        return False
+    logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileInfoObj.getFileId(), host]))
+    return True
+
+
+def _firstAvailableReplica(srvObj, candidates, hostDic):
+    """
+    Probes all candidates concurrently, returning the most preferred one
+    whose host answers positively within REPLICA_PROBE_TIMEOUT seconds, if
+    any. A positive answer is accepted as soon as all the candidates
+    preferred over it have answered negatively; otherwise the probes still
+    in flight are waited for until the deadline.
+    """
+    answers = Queue.Queue()
+
+    def probe(idx, fileInfo):
+        start = time.time()
+        available = _probeReplica(srvObj, fileInfo[1], fileInfo[2], hostDic)
+        if (available and time.time() - start < REPLICA_PROBE_TIMEOUT):
+            host_liveness.alive(fileInfo[2])
+        elif (not available):
+            host_liveness.dead(fileInfo[2])
+        answers.put((idx, available))
+
+    # Probes are started in order of preference
+    for idx, fileInfo in enumerate(candidates):
+        t = threading.Thread(target=probe, args=(idx, fileInfo),
+                             name="ReplicaProbe-" + fileInfo[2])
+        t.daemon = True
+        t.start()
+
+    # None until the candidate's host answers
+    available = [None] * len(candidates)
+
+    def best():
+        for idx, avail in enumerate(available):
+            if (avail is None):
+                return None
+            if (avail):
+                return candidates[idx]
+        return None
+
+    deadline = time.time() + REPLICA_PROBE_TIMEOUT
+    for _ in candidates:
+        try:
+            idx, avail = answers.get(timeout=max(0, deadline - time.time()))
+        except Queue.Empty:
+            break
+        available[idx] = avail
+        fileInfo = best()
+        if (fileInfo):
+            return fileInfo
+
+    # The deadline passed, take the best positive answer received so far
+    for idx, avail in enumerate(available):
+        if (avail):
+            return candidates[idx]
+    logger.warning("No replica of %s confirmed within %d [s]",
+                   candidates[0][1].getFileId(), REPLICA_PROBE_TIMEOUT)
+    return None
+
+
+def _probeReplicas(srvObj, candidates, hostDic):
+    """
+    Finds a remote replica that can be served, out of the list of candidates
+    (each of them a [location, ngamsFileInfo, host ID] list), ordered by
+    preference (cluster first, then domain and remote ones).
+
+    Hosts that recently confirmed they could serve a file are trusted
+    without asking them. Otherwise all hosts which are not suspended are
+    asked at once, and the most preferred one answering positively within
+    the deadline is taken. Suspended hosts are only woken up if none of the
+    others can serve the file.
+
+    Returns:    The selected candidate, or None (list|None).
+    """
+    awake = [c for c in candidates if hostDic[c[2]].getSrvSuspended() != 1]
+    suspended = [c for c in candidates if hostDic[c[2]].getSrvSuspended() == 1]
+
+    for fileInfo in awake:
+        if (host_liveness.is_alive(fileInfo[2])):
+            logger.debug("Host %s is known to be alive, selecting its replica of %s",
+                         fileInfo[2], fileInfo[1].getFileId())
+            return fileInfo
+
+    if (awake):
+        fileInfo = _firstAvailableReplica(srvObj, awake, hostDic)
+        if (fileInfo):
+            return fileInfo
+
+    # If a server hosting a file is suspended, it is woken up
+    # to be able to check if the file is really accessible.
+    woken = []
+    for fileInfo in suspended:
+        host = fileInfo[2]
+        port = hostDic[host].getSrvPort()
+        logger.debug("Server hosting requested file (%s/%s) is suspended " + \
+                     "- waking up server ...",
+                     host, str(port))
+        try:
+            ngamsSrvUtils.wakeUpHost(srvObj, host)
+            logger.debug("Suspended server hosting requested file (%s/%s) " +\
+                         "has been woken up",
+                         host, str(port))
+            woken.append(fileInfo)
+        except Exception:
+            logger.exception("Error waking up server hosting selected " +\
+                    "file")
+    if (woken):
+        return _firstAvailableReplica(srvObj, woken, hostDic)
+    return None
+
+
 def _locateArchiveFile(srvObj,
                        fileId,
                        fileVersion,
@@ -345,10 +523,7 @@ def _locateArchiveFile(srvObj,
     domainFileList    = []
     remoteFileList    = []
     all_hosts         = set([x[1] for x in files])
-    hostDic = ngamsHighLevelLib.resolveHostAddress(srvObj.getHostId(),
-                                                   srvObj.getDb(),
-                                                   srvObj.getCfg(),
-                                                   all_hosts)
+    hostDic = srvObj.host_topology.resolve(all_hosts)
 
     # Loop over the candidate files and sort them.
     fileCount = idx = 0
@@ -428,88 +603,50 @@ def _locateArchiveFile(srvObj,
     # To check the file accessibility, it is also checked if the NG/AMS
     # 'responsible' for the file, allows for Retrieve Requests (only done
     # in connection with a Retrieve Request).
+    # Local files are checked first, then all remote replicas are probed
+    # at once.
     logger.debug("Checking which of the candidate files should be selected ...")
     foundFile   = 0
     for fileVer in fileVerList:
         if (foundFile): break
 
+        remoteCandidates = []
         for fileInfo in candFileDic[fileVer]:
             location    = fileInfo[0]
             fileInfoObj = fileInfo[1]
             host        = fileInfo[2]
+
+            if (location != NGAMS_HOST_LOCAL):
+                remoteCandidates.append(fileInfo)
+                continue
+
+            logger.debug("Checking candidate file with ID: %s on local host: %s",
+                         fileInfoObj.getFileId(), host)
+
+            # Check first if the local system supports retrieve requests.
+            # (if relevant).
+            if (reqPropsObj):
+                if (reqPropsObj.getCmd() == NGAMS_RETRIEVE_CMD):
+                    if (not srvObj.getCfg().getAllowRetrieveReq()):
+                        continue
+
+            # Check if the file is accessible.
             diskInfoObj = diskInfoDic[fileInfoObj.getDiskId()]
-            port        = hostDic[host].getSrvPort()
-
-            logger.debug("Checking candidate file with ID: %s on host/port: %s/%s. " + \
-                         "Location: %s",
-                         fileInfoObj.getFileId(), host, str(port), location)
-
-            # If the file is stored locally we check if it is accessible,
-            # otherwise we send a STATUS/file_access request to the
-            # host in question.
-            if (location == NGAMS_HOST_LOCAL):
-                # Check first if the local system supports retrieve requests.
-                # (if relevant).
-                if (reqPropsObj):
-                    if (reqPropsObj.getCmd() == NGAMS_RETRIEVE_CMD):
-                        if (not srvObj.getCfg().getAllowRetrieveReq()):
-                            continue
-
-                # Check if the file is accessible.
-                filename = os.path.normpath(diskInfoObj.getMountPoint()+"/" +\
-                                            fileInfoObj.getFilename())
-                logger.debug("Checking if local file with name: %s is available", filename)
-                if (not os.path.exists(filename)):
-                    logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
-                else:
-                    logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
-                    foundFile = 1
-                    break
+            filename = os.path.normpath(diskInfoObj.getMountPoint()+"/" +\
+                                        fileInfoObj.getFilename())
+            logger.debug("Checking if local file with name: %s is available", filename)
+            if (not os.path.exists(filename)):
+                logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
             else:
-                logger.debug("Checking if file with ID/Version: %s/%s " +\
-                             "is available on host/port: %s/%s",
-                             fileInfoObj.getFileId(), str(fileInfoObj.getFileVersion()),
-                             host, str(port))
-
-                # If a server hosting a file is suspended, it is woken up
-                # to be able to check if the file is really accessible.
-                if (hostDic[host].getSrvSuspended() == 1):
-                    logger.debug("Server hosting requested file (%s/%s) is suspended " + \
-                                 "- waking up server ...",
-                                 host, str(port))
-                    try:
-                        ngamsSrvUtils.wakeUpHost(srvObj, host)
-                        logger.debug("Suspended server hosting requested file (%s/%s) " +\
-                                     "has been woken up",
-                                     host, str(port))
-                    except Exception:
-                        logger.exception("Error waking up server hosting selected " +\
-                                "file")
-                        continue
+                logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
+                foundFile = 1
+                break
 
-                # The file is hosted on a host, which is not suspended or
-                # which was successfully woken up.
-                pars = [["file_access", fileInfoObj.getFileId()]]
-                if (fileInfoObj.getFileVersion() != -1):
-                    pars.append(["file_version", fileInfoObj.getFileVersion()])
-                ipAddress = hostDic[host].getIpAddress()
-                authHdr = ngamsSrvUtils.genIntAuthHdr(srvObj)
-                resp = ngamsHttpUtils.httpGet(ipAddress, port, NGAMS_STATUS_CMD,
-                                        pars=pars, auth=authHdr)
-                with contextlib.closing(resp):
-                    data = resp.read()
-                statusObj = ngamsStatus.ngamsStatus().unpackXmlDoc(data, 1)
-
-                if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug("Result of File Access Query: %s",
-                                 re.sub("\n", "", str(statusObj.genXml().toprettyxml('  ', '\n'))))
-                if ((statusObj.getMessage().\
-                     find("NGAMS_INFO_FILE_AVAIL") == -1)):
-                    logger.debug(genLog("NGAMS_INFO_FILE_NOT_AVAIL", [fileId, host]))
-                else:
-                    logger.debug(genLog("NGAMS_INFO_FILE_AVAIL", [fileId, host]))
-                    foundFile = 1
-                    break
+        if (not foundFile and remoteCandidates):
+            fileInfo = _probeReplicas(srvObj, remoteCandidates, hostDic)
+            if (fileInfo):
+                location, fileInfoObj, host = fileInfo
+                foundFile = 1
 
     # If no file was found we raise an exception.
     if (not foundFile):
@@ -517,6 +654,8 @@ def _locateArchiveFile(srvObj,
         raise Exception(errMsg)
 
     # The file was found, get the info necessary for the acquiring the file.
+    diskInfoObj = diskInfoDic[fileInfoObj.getDiskId()]
+    port = hostDic[host].getSrvPort()
     ipAddress = hostDic[host].getIpAddress()
     srcFileInfo = [location, host, ipAddress, port,
                    diskInfoObj.getMountPoint(),
@@ -580,8 +719,13 @@ def locateArchiveFile(srvObj,
     Returns:      List with information about file location (list).
     """
     # Get a list with the candidate files matching the query conditions.
-    res = srvObj.getDb().getFileInfoFromFileId(fileId, fileVersion, diskId,
-                                                 ignore=0, dbCursor=False)
+    cache_key = ('locate', fileVersion, diskId)
+    res = srvObj.file_location_cache.get(fileId, cache_key)
+    if res is None:
+        res = srvObj.getDb().getFileInfoFromFileId(fileId, fileVersion, diskId,
+                                                     ignore=0, dbCursor=False)
+        if res:
+            srvObj.file_location_cache.put(fileId, cache_key, res)
 
     # r[-2] is the host_id, r[-1] is the mount point
     all_info = []
@@ -621,9 +765,14 @@ def quickFileLocate(srvObj,
                           <Mountpoint>, <Filename>, <File Version>,
                           <format>) (tuple).
     """
-    res = srvObj.getDb().getFileSummary3(fileId, hostId, domain, diskId,
-                                         fileVersion, cursor=False,
-                                         include_compression=include_compression)
+    cache_key = ('quick', hostId, domain, diskId, fileVersion, include_compression)
+    res = srvObj.file_location_cache.get(fileId, cache_key)
+    if res is None:
+        res = srvObj.getDb().getFileSummary3(fileId, hostId, domain, diskId,
+                                             fileVersion, cursor=False,
+                                             include_compression=include_compression)
+        if res:
+            srvObj.file_location_cache.put(fileId, cache_key, res)
     if res:
         host_id = res[0][0]
         if host_id == srvObj.getHostId():
@@ -796,7 +945,7 @@ def syncCachesCheckFiles(srvObj,
         diskSyncPlugIn = srvObj.getCfg().getDiskSyncPlugIn()
         if (diskSyncPlugIn):
             logger.debug("Invoking Disk Sync Plug-In: %s ...", diskSyncPlugIn)
-            plugInMethod = loadPlugInEntryPoint(diskSyncPlugIn)
+            plugInMethod = srvObj.plugins.entry_point(diskSyncPlugIn)
             plugInMethod(srvObj)
             logger.debug("Invoked Disk Sync Plug-In: %s", diskSyncPlugIn)
         else:
@@ -66,19 +66,15 @@ from ngamsLib.ngamsCore import \
     decompressFile, get_contact_ip, rmFile, toiso8601
 from ngamsLib import ngamsFileInfo, ngamsStatus, ngamsHighLevelLib, ngamsDbm, \
     ngamsMirroringRequest, ngamsLib, ngamsHttpUtils
+from . import mirroring_queue, namespace_index
 
 logger = logging.getLogger(__name__)
 
 # Various definitions used within this module.
-# Definitions for internal DBM based queues used.
-NGAMS_MIR_QUEUE_DBM = "MIR_QUEUE"
-NGAMS_MIR_ERR_QUEUE_DBM = "MIR_ERROR_QUEUE"
-NGAMS_MIR_COMPL_QUEUE_DBM = "MIR_COMPLETED_QUEUE"
-NGAMS_MIR_DBM_COUNTER = "MIR_DBM_COUNTER"
-NGAMS_MIR_DBM_POINTER = "MIR_DBM_POINTER"
+# Definitions for the internal queue and DBMs used.
+NGAMS_MIR_QUEUE_WAL = "MIR_QUEUE_WAL"
 NGAMS_MIR_FILE_LIST_RAW = "MIR_FILE_LIST_RAW"
-NGAMS_MIR_CLUSTER_FILE_DBM = "MIR_CLUSTER_FILE_INFO"
-NGAMS_MIR_DBM_MAX_LIMIT = 2**30
+NGAMS_MIR_SCHEDULE_BATCH = 1000
 NGAMS_MIR_MIR_THREAD_TIMEOUT = 10.0
 NGAMS_MIR_SRC_ARCH_INF_DBM = "MIR_SRC_ARCH_INFO"
 NGAMS_MIR_ALL_LOCAL_SRVS = "ALL"
@@ -112,119 +108,76 @@ def suspend(stop_event, thread):
 
 def add_entry_mirror_queue(ngams_server, mirror_request, update_db=True):
     """
-    Add (schedule) a new Mirroring Request in the internal DBM Mirroring Queue
+    Add (schedule) a Mirroring Request in the internal Mirroring Queue
     :param ngams_server: Reference to server object (ngamsServer)
     :param mirror_request: Instance of Mirroring Request Object to schedule (ngamsMirroringRequest)
     :param update_db: If true, the status is updated in the DB (boolean)
     """
     try:
-        ngams_server._mirQueueDbmSem.acquire()
         logger.debug("Adding entry in Mirroring Queue: %s/%d", mirror_request.getFileId(),
                      mirror_request.getFileVersion())
-        new_key = (ngams_server._mirQueueDbm.get(NGAMS_MIR_DBM_COUNTER) + 1) % NGAMS_MIR_DBM_MAX_LIMIT
-        ngams_server._mirQueueDbm.add(str(new_key), mirror_request).add(NGAMS_MIR_DBM_COUNTER, new_key).sync()
+        ngams_server._mirQueue.put(mirror_request.genFileKey(), mirror_request, mirroring_queue.QUEUED)
         if update_db:
             ngams_server.getDb().updateMirReq(mirror_request)
-        ngams_server._mirQueueDbmSem.release()
     except Exception as e:
-        ngams_server._mirQueueDbmSem.release()
-        raise Exception("Error adding new element to DBM Mirroring Queue. Error: %s" % str(e))
+        raise Exception("Error adding new element to Mirroring Queue. Error: %s" % str(e))
 
 
 def add_entry_error_queue(ngams_server, mirror_request, update_db=True):
     """
-    Add (push) a Mirroring Request in the internal DBM Mirroring Error Queue
+    Put a Mirroring Request in the error state in the internal Mirroring Queue
     :param ngams_server: Reference to server object (ngamsServer)
     :param mirror_request: Instance of Mirroring Request Object to schedule (ngamsMirroringRequest)
     :param update_db: If true, the status is updated in the DB (boolean)
     """
     try:
-        ngams_server._errQueueDbmSem.acquire()
         logger.debug("Adding entry in Mirroring Error Queue: %s/%d", mirror_request.getFileId(),
                      mirror_request.getFileVersion())
-        ngams_server._errQueueDbm.add(mirror_request.genFileKey(), mirror_request).sync()
+        ngams_server._mirQueue.put(mirror_request.genFileKey(), mirror_request, mirroring_queue.ERROR)
         if update_db:
             ngams_server.getDb().updateMirReq(mirror_request)
-        ngams_server._errQueueDbmSem.release()
     except Exception as e:
-        ngams_server._errQueueDbmSem.release()
-        raise Exception("Error adding new element to DBM Mirroring Error Queue. Error: %s" % str(e))
+        raise Exception("Error adding new element to Mirroring Error Queue. Error: %s" % str(e))
 
 
-def pop_entry_queue(mirror_request, dbm, dbm_sem):
+def pop_entry_queue(ngams_server, mirror_request, state):
     """
-    Get (pop) a Mirroring Request Object from the given DBM queue. The entry is removed from the queue. The entry to
-    get is referenced by its Mirroring Request Object.
+    Get (pop) a Mirroring Request Object in the given state from the internal Mirroring Queue. The entry is removed
+    from the queue. The entry to get is referenced by its Mirroring Request Object.
+    :param ngams_server: Reference to server object (ngamsServer)
     :param mirror_request: Instance of Mirroring Request Object to schedule (ngamsMirroringRequest)
-    :param dbm: DBM handle to that DBM queue (ngamsDbm)
-    :param dbm_sem: Semaphore controlling access to that queue (threading.Semaphore)
-    :return: Reference to the Mirroring Request Object removed from the Error Queue DBM (ngamsMirroringRequest)
+    :param state: State in which the entry is expected to be (string)
+    :return: Reference to the Mirroring Request Object removed from the queue (ngamsMirroringRequest)
     """
-    try:
-        dbm_sem.acquire()
-        if not dbm.hasKey(mirror_request.genFileKey()):
-            raise Exception("Mirroring Request: %s not found in DBM Queue: %s"
-                            % (mirror_request.genSummary(), dbm.getDbmName()))
-        mirror_request = dbm.get(mirror_request.genFileKey())
-        dbm.rem(mirror_request.genFileKey())
-        dbm_sem.release()
-        return mirror_request
-    except Exception as e:
-        dbm_sem.release()
-        msg = "Error retrieving element from DBM queue: %s. Error: %s"
-        raise Exception(msg % (dbm.getDbmName(), str(e)))
-
-
-def dump_keys_queue(dbm, dbm_sem, target_dbm_name):
-    """
-    Make a snapshot of all keys in the referenced DBM
-    :param dbm: DBM from which to dump the keys (ngamsDbm)
-    :param dbm_sem: Semaphore used to access that DBM (threading.Semaphore)
-    :param target_dbm_name: Name of the DBM in which to dump the keys (string)
-    :return: The final name of the resulting DBM (string)
-    """
-    rmFile("%s*" % target_dbm_name)
-    key_dbm = ngamsDbm.ngamsDbm(target_dbm_name, cleanUpOnDestr=False, writePerm=True)
-    try:
-        dbm_sem.acquire()
-        dbm.initKeyPtr()
-        while True:
-            key, data = dbm.getNext()
-            if not key:
-                break
-            key_dbm.add(key, data)
-        dbm_sem.release()
-    except Exception as e:
-        dbm_sem.release()
-        raise Exception("Error dumping keys from DBM: %s. Error: %s" % (dbm.getDbmName(), str(e)))
-    dbm_name = key_dbm.sync().getDbmName()
-    return dbm_name
+    removed_request = ngams_server._mirQueue.remove(mirror_request.genFileKey(), state)
+    if removed_request is None:
+        raise Exception("Mirroring Request: %s not found in Mirroring Queue with state: %s"
+                        % (mirror_request.genSummary(), state))
+    return removed_request
 
 
 def add_entry_completed_queue(ngams_server, mirror_request, update_db=True):
     """
-    Add a Mirroring Request in the DBM Mirroring Completed Queue
+    Put a Mirroring Request in the completed state in the internal Mirroring Queue
     :param ngams_server: Reference to server object (ngamsServer)
     :param mirror_request: Instance of Mirroring Request Object to put in the queue (ngamsMirroringRequest)
     :param update_db: If true, the status is updated in the DB (boolean)
     """
     try:
-        ngams_server._complQueueDbmSem.acquire()
         logger.debug("Adding entry in Mirroring Completed Queue: %s/%d", mirror_request.getFileId(),
                      mirror_request.getFileVersion())
-        ngams_server._complQueueDbm.add(mirror_request.genFileKey(), mirror_request).sync()
+        ngams_server._mirQueue.put(mirror_request.genFileKey(), mirror_request, mirroring_queue.COMPLETED)
         if update_db:
             ngams_server.getDb().updateMirReq(mirror_request)
-        ngams_server._complQueueDbmSem.release()
     except Exception as e:
-        ngams_server._complQueueDbmSem.release()
-        raise Exception("Error adding new element to DBM Mirroring Completed Queue. Error: %s" % str(e))
+        raise Exception("Error adding new element to Mirroring Completed Queue. Error: %s" % str(e))
 
 
 def schedule_mirror_request(ngams_server, instance_id, file_id, file_version, ingestion_date, server_list_id,
                             xml_file_info):
     """
-    Schedule a new Mirroring Request in the DB Mirroring Queue and the Mirroring Queue DBM
+    Schedule a new Mirroring Request in the DB Mirroring Queue and the internal Mirroring Queue, unless the file is
+    already known to the queue (e.g. because it is offered by several source archives)
     :param ngams_server: Reference to server object (ngamsServer)
     :param instance_id: ID for instance controlling the mirroring (string)
     :param file_id: NGAS file ID (string)
@@ -232,6 +185,7 @@ def schedule_mirror_request(ngams_server, instance_id, file_id, file_version, in
     :param ingestion_date: NGAS ingestion date reference for file (number)
     :param server_list_id: Server list ID for this request indicating the nodes to contact to obtain this file (string)
     :param xml_file_info: The XML file information for the file (string/XML)
+    :return: True if the request was scheduled (boolean)
     """
     mirror_request_obj = ngamsMirroringRequest.ngamsMirroringRequest().\
         setInstanceId(instance_id).\
@@ -241,31 +195,25 @@ def schedule_mirror_request(ngams_server, instance_id, file_id, file_version, in
         setSrvListId(server_list_id).\
         setStatus(ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_SCHED).\
         setXmlFileInfo(xml_file_info)
+    if not ngams_server._mirQueue.add(mirror_request_obj.genFileKey(), mirror_request_obj):
+        return False
     logger.debug("Scheduling data object for mirroring: %s", mirror_request_obj.genSummary())
-    ngams_server.getDb().writeMirReq(mirror_request_obj)
-    add_entry_mirror_queue(ngams_server, mirror_request_obj, update_db=False)
+    try:
+        ngams_server.getDb().writeMirReq(mirror_request_obj)
+    except Exception:
+        ngams_server._mirQueue.remove(mirror_request_obj.genFileKey())
+        raise
+    return True
 
 
 def get_mir_request_from_queue(ngams_server):
     """
     Get the next Mirroring Request from the Mirroring Request Queue. If there are no requests in the queue, None is
-    returned. The entries are removed (popped) from the queue.
+    returned. The entries are kept in the queue as being mirrored until completed or failed.
     :param ngams_server: Reference to server object (ngamsServer)
     :return: Next Mirroring Request Object or None (ngamsMirroringRequest | None)
     """
-    try:
-        ngams_server._mirQueueDbmSem.acquire()
-        next_key = (ngams_server._mirQueueDbm.get(NGAMS_MIR_DBM_POINTER) + 1) % NGAMS_MIR_DBM_MAX_LIMIT
-        if ngams_server._mirQueueDbm.hasKey(str(next_key)):
-            mirror_request_obj = ngams_server._mirQueueDbm.get(str(next_key))
-            ngams_server._mirQueueDbm.add(NGAMS_MIR_DBM_POINTER, next_key).rem(str(next_key)).sync()
-        else:
-            mirror_request_obj = None
-        ngams_server._mirQueueDbmSem.release()
-        return mirror_request_obj
-    except Exception as e:
-        ngams_server._mirQueueDbmSem.release()
-        raise Exception("Error adding new element to DBM Mirroring Queue. Error: %s" % str(e))
+    return ngams_server._mirQueue.pop()
 
 
 def start_mirroring_threads(ngams_server, stop_event):
@@ -476,11 +424,12 @@ def mirroring_thread(ngams_server, stop_event):
                     mirroring_status = ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_MIR_NO
                     ngams_server.getDb().updateStatusMirReq(mirror_request.getFileId(), file_version, mirroring_status)
                     add_entry_completed_queue(ngams_server, mirror_request)
+                    ngams_server._mirNamespaceIndex.add(mirror_request.getFileId(), file_version)
             except MirroringStoppedException as e:
                 raise e
             except Exception as e:
                 logger.warning("Error handling Mirroring Request. Putting in Error Queue. Error: %s" % str(e))
-                # Put the request in the Error Queue DBM
+                # Put the request in the Error Queue
                 stat_num = ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_ERR_RETRY_NO
                 mirror_request.setStatus(stat_num).setMessage(str(e))
                 ngams_server.getDb().updateStatusMirReq(mirror_request.getFileId(), mirror_request.getFileVersion(),
@@ -498,7 +447,8 @@ def mirroring_thread(ngams_server, stop_event):
 def initialise_mirroring(ngams_server):
     """
     Initialize the NGAS Mirroring Service. If there are requests in the Mirroring Request Queue in the DB, these are
-    read out and inserted in the local Mirroring Request DBM.
+    read out and inserted in the internal Mirroring Queue. This is called each time the server goes ONLINE, and
+    replaces the Mirroring Queue and name space index of any previous call.
     :param ngams_server: Reference to server object (ngamsServer)
     """
     host_id = ngams_server.getHostId()
@@ -511,24 +461,25 @@ def initialise_mirroring(ngams_server):
         # Add compiled version of the list, which is easy to use when accessing the contact nodes
         ngams_server.getSrvListDic()[mirror_source_obj.getId()] = mirror_source_obj.getServerList().split(",")
 
-    # Create the Mirroring DBM Queue
-    mirror_queue_dbm_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
-                                          NGAMS_MIR_QUEUE_DBM, host_id)
-    rmFile("%s*" % mirror_queue_dbm_name)
-    ngams_server._mirQueueDbm = ngamsDbm.ngamsDbm(mirror_queue_dbm_name, cleanUpOnDestr=0, writePerm=1)
-    ngams_server._mirQueueDbm.add(NGAMS_MIR_DBM_COUNTER, 0).add(NGAMS_MIR_DBM_POINTER, 0)
-
-    # Create the Error DBM Queue
-    error_queue_dbm_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
-                                         NGAMS_MIR_ERR_QUEUE_DBM, host_id)
-    rmFile("%s*" % error_queue_dbm_name)
-    ngams_server._errQueueDbm = ngamsDbm.ngamsDbm(error_queue_dbm_name, cleanUpOnDestr=0, writePerm=1)
-
-    # Create the Completed DBM Queue
-    completed_queue_dbm_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
-                                             NGAMS_MIR_COMPL_QUEUE_DBM, host_id)
-    rmFile("%s*" % completed_queue_dbm_name)
-    ngams_server._complQueueDbm = ngamsDbm.ngamsDbm(completed_queue_dbm_name, cleanUpOnDestr=0, writePerm=1)
+    # Create the Mirroring Queue, restoring its contents from its write-ahead log if the service was interrupted
+    mirror_queue_wal_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
+                                          NGAMS_MIR_QUEUE_WAL, host_id)
+    if ngams_server._mirQueue is not None:
+        ngams_server._mirQueue.close()
+    ngams_server._mirQueue = mirroring_queue.MirroringQueue(os.path.normpath(mirror_queue_wal_name))
+    restore_from_db = len(ngams_server._mirQueue) == 0
+
+    # Build the index of the files in the name space of the local cluster, kept up to date with local archive events.
+    # The index of a previous initialisation stops receiving them
+    old_index = ngams_server._mirNamespaceIndex
+    cluster_name = ngams_server.getDb().getClusterNameFromHostId(host_id)
+    ngams_server._mirNamespaceIndex = namespace_index.NamespaceIndex(ngams_server.getDb(), cluster_name)
+    ngams_server._mirNamespaceIndex.build()
+    ngams_server.archive_event_subscribers = [
+        s for s in ngams_server.archive_event_subscribers
+        if old_index is None or getattr(s, '__self__', None) is not old_index
+    ]
+    ngams_server.archive_event_subscribers.append(ngams_server._mirNamespaceIndex.handle_archive_event)
 
     # Create the DBM to keep track of when synchronization was last done with the specified Source Archives. Note this
     # DBM is kept between sessions to avoid too frequent complete synchronization checks.
@@ -544,24 +495,50 @@ def initialise_mirroring(ngams_server):
             mirror_source_obj.setLastSyncTime(dbm_mirror_source_obj.getLastSyncTime())
             ngams_server._srcArchInfoDbm.add(mirror_source_obj.getId(), mirror_source_obj)
 
-    # Restore the previous state of the mirroring from the DB Mirroring Queue (if the service was interrupted)
+    # Restore the previous state of the mirroring from the DB Mirroring Queue (if the service was interrupted and the
+    # write-ahead log of the Mirroring Queue was not available)
+    if not restore_from_db:
+        return
     for mirror_request_obj in ngams_server.getDb().dumpMirroringQueue(ngams_server.getHostId()):
         logger.debug("Restoring Mirroring Request: %s", mirror_request_obj.genSummary())
-        # Add entry in the Mirroring DBM Queue?
+        # Add entry in the Mirroring Queue?
         if mirror_request_obj.getStatusAsNo() in (ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_SCHED_NO,
                                                   ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_ACTIVE_NO):
             add_entry_mirror_queue(ngams_server, mirror_request_obj)
-        # Add entry in the Error DBM Queue?
+        # Add entry in the Error Queue?
         elif mirror_request_obj.getStatusAsNo() == ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_ERR_RETRY_NO:
             add_entry_error_queue(ngams_server, mirror_request_obj)
-        # Add entry in the Completed DBM Queue?
+        # Add entry in the Completed Queue?
         elif mirror_request_obj.getStatusAsNo() in (ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_MIR_NO,
                                                     ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_REP_NO,
                                                     ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_ERR_ABANDON_NO):
             add_entry_completed_queue(ngams_server, mirror_request_obj, update_db=False)
 
 
-def retrieve_file_list(ngams_server, mirror_source, node, port, status_cmd_pars, cluster_files_dbm_name):
+def schedule_file_batch(ngams_server, mirror_source, file_batch):
+    """
+    Schedule for mirroring the files in the given batch that are neither known to the Mirroring Queue, nor available
+    in the name space of the local cluster
+    :param ngams_server: Reference to server object (ngamsServer)
+    :param mirror_source: Mirroring Source Object associated with the NGAS Cluster contacted (ngamsMirroringSource)
+    :param file_batch: List of (<File Info Object>, <XML File Info>) tuples (list)
+    """
+    candidates = [(file_info, xml_file_info) for file_info, xml_file_info in file_batch
+                  if ngamsLib.genFileKey(None, file_info.getFileId(), file_info.getFileVersion())
+                  not in ngams_server._mirQueue]
+    file_keys = [(file_info.getFileId(), int(file_info.getFileVersion())) for file_info, _ in candidates]
+    local_files = ngams_server._mirNamespaceIndex.contains(file_keys)
+    server_list_id_db = ngams_server.getSrvListDic()[mirror_source.getServerList()]
+    for (file_info, xml_file_info), file_key in zip(candidates, file_keys):
+        if file_key in local_files:
+            continue
+        # The data object is not available, schedule it!
+        schedule_mirror_request(ngams_server, ngams_server.getHostId(), file_info.getFileId(),
+                                file_info.getFileVersion(), file_info.getIngestionDate(), server_list_id_db,
+                                xml_file_info)
+
+
+def retrieve_file_list(ngams_server, mirror_source, node, port, status_cmd_pars):
     """
     Retrieve and handle the information in connection with the STATUS?file_list request
     :param ngams_server: Reference to server object (ngamsServer)
@@ -569,17 +546,15 @@ def retrieve_file_list(ngams_server, mirror_source, node, port, status_cmd_pars,
     :param node: NGAS host to contact (string)
     :param port: Port used by NGAS instance to contact (integer)
     :param status_cmd_pars: HTTP parameters for the STATUS Command (list)
-    :param cluster_files_dbm_name: Name of the DBM containing a snapshot of all files stored in the name space of the
-    local cluster (string)
     """
     host_id = ngams_server.getHostId()
 
-    # Send the STATUS?file_list query. Receive the data into a temporary file
-    raw_file_list_compressed = "%s/%s_%s.gz" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
-                                                NGAMS_MIR_FILE_LIST_RAW, host_id)
+    # Send the STATUS?file_list query. Receive the data into a temporary file, one per source since these are polled
+    # concurrently
+    raw_file_list_compressed = "%s/%s_%s_%s.gz" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
+                                                   NGAMS_MIR_FILE_LIST_RAW, host_id, mirror_source.getId())
     file_list_id = None
     try:
-        cluster_files_dbm = ngamsDbm.ngamsDbm(cluster_files_dbm_name, cleanUpOnDestr=0, writePerm=1)
         # Retrieve the file info from the specified contact nodes and schedule the files relevant
         remaining_elements = None
         while True:
@@ -595,68 +570,53 @@ def retrieve_file_list(ngams_server, mirror_source, node, port, status_cmd_pars,
 
                 with open(raw_file_list_compressed, 'wb') as raw_file_obj:
                     response_read_buffer = functools.partial(response.read, 65536)
-                    for response_buffer in iter(response_read_buffer, ''):
+                    for response_buffer in iter(response_read_buffer, b''):
                         raw_file_obj.write(response_buffer)
 
             # Decompress the file (it is always transferred compressed)
             file_list_raw = decompressFile(raw_file_list_compressed)
 
-            # Get the File List ID in connection with this request if not already extracted.
-            # Get the number of remaining items to retrieve info about. It is necessary to scan through the beginning
-            # of the file to get the FileList Element, which contains this information.
-            # The entry looks something like this:
-            # <FileList Id="a8f2cbdb705899588468f72986c813ab" Status="REMAINING_DATA_OBJECTS: 1453">
-            file_list_raw_obj = open(file_list_raw)
-            count = 0
-            while count < 100:
-                next_line = file_list_raw_obj.readline()
-                if next_line.find("FileList Id=") != -1:
-                    line_elements = filter(None, next_line.strip().split(" "))
-                    if not file_list_id:
-                        file_list_id = line_elements[1].split("=")[1].strip('"')
-                        status_cmd_pars.append([NGAMS_HTTP_PAR_FILE_LIST_ID, file_list_id])
-                    remaining_elements = int(filter(None, line_elements)[-1].split('"')[0])
-                    break
-                count += 1
-            logger.debug("Retrieving File List. File List ID: %s. Remaining Elements: %d",
-                         file_list_id, remaining_elements)
-            if count == 100:
-                raise Exception("Illegal file list received as response to STATUS?file_list Request")
-            file_list_raw_obj.seek(0)
-
-            # Read out the file info and figure out whether to schedule it for mirroring or not (file referenced by
-            # File ID + Version), if this file is:
-            # * being mirrored already (if it is queued): Skip
-            # * available in the local cluster name space: Skip
-            # * not already available in local cluster name space: Schedule it
-            while True:
-                next_line = file_list_raw_obj.readline()
-                if next_line == "":
-                    break
-                if next_line.find("FileStatus AccessDate=") != -1:
-                    tmp_file = ngamsFileInfo.ngamsFileInfo().unpackXmlDoc(next_line)
-                    file_key = ngamsLib.genFileKey(None, tmp_file.getFileId(), tmp_file.getFileVersion())
-                    # Entry found in the
-                    #   * Mirroring DBM Queue?
-                    #   * Error DBM Queue?
-                    #   * Completed DBM Queue?
-                    # Are there enough local copies in the cluster name space?
-                    logger.debug("Checking whether to schedule file: %s/%d for mirroring ...",
-                                 tmp_file.getFileId(), tmp_file.getFileVersion())
-                    if ngams_server._mirQueueDbm.hasKey(file_key):
-                        continue
-                    elif ngams_server._errQueueDbm.hasKey(file_key):
-                        continue
-                    elif ngams_server._complQueueDbm.hasKey(file_key):
+            with open(file_list_raw) as file_list_raw_obj:
+                # Get the File List ID in connection with this request if not already extracted.
+                # Get the number of remaining items to retrieve info about. It is necessary to scan through the
+                # beginning of the file to get the FileList Element, which contains this information.
+                # The entry looks something like this:
+                # <FileList Id="a8f2cbdb705899588468f72986c813ab" Status="REMAINING_DATA_OBJECTS: 1453">
+                count = 0
+                while count < 100:
+                    next_line = file_list_raw_obj.readline()
+                    if next_line.find("FileList Id=") != -1:
+                        line_elements = [element for element in next_line.strip().split(" ") if element]
+                        if not file_list_id:
+                            file_list_id = line_elements[1].split("=")[1].strip('"')
+                            status_cmd_pars.append([NGAMS_HTTP_PAR_FILE_LIST_ID, file_list_id])
+                        remaining_elements = int(line_elements[-1].split('"')[0])
+                        break
+                    count += 1
+                if count == 100:
+                    raise Exception("Illegal file list received as response to STATUS?file_list Request")
+                logger.debug("Retrieving File List. File List ID: %s. Remaining Elements: %d",
+                             file_list_id, remaining_elements)
+                file_list_raw_obj.seek(0)
+
+                # Read out the file info and figure out whether to schedule it for mirroring or not (file referenced
+                # by File ID + Version), if this file is:
+                # * being mirrored already (if it is in the Mirroring Queue): Skip
+                # * available in the local cluster name space: Skip
+                # * not already available in local cluster name space: Schedule it
+                # The files are checked in batches, so that the files that the name space index cannot rule out are
+                # looked up with few DB queries
+                file_batch = []
+                for next_line in file_list_raw_obj:
+                    if next_line.find("FileStatus AccessDate=") == -1:
                         continue
-                    else:
-                        # Check if the file is available in the name space of this cluster. If not, schedule it.
-                        if not cluster_files_dbm.hasKey(file_key):
-                            # The data object is not available, schedule it!
-                            server_list_id_db = ngams_server.getSrvListDic()[mirror_source.getServerList()]
-                            schedule_mirror_request(ngams_server, host_id, tmp_file.getFileId(),
-                                                    tmp_file.getFileVersion(), tmp_file.getIngestionDate(),
-                                                    server_list_id_db, next_line)
+                    file_batch.append((ngamsFileInfo.ngamsFileInfo().unpackXmlDoc(next_line), next_line))
+                    if len(file_batch) == NGAMS_MIR_SCHEDULE_BATCH:
+                        schedule_file_batch(ngams_server, mirror_source, file_batch)
+                        file_batch = []
+                if file_batch:
+                    schedule_file_batch(ngams_server, mirror_source, file_batch)
+
             # Stop if there are no more elements to read out
             if remaining_elements == 0:
                 break
@@ -664,108 +624,124 @@ def retrieve_file_list(ngams_server, mirror_source, node, port, status_cmd_pars,
         raise Exception("Error retrieving file list. Error: %s" % str(e))
 
 
-def check_source_archives(ngams_server):
+def check_source_archive(ngams_server, mirror_source_obj):
     """
-    Check the source archives to see if data is available for mirroring
+    Check one source archive to see if data is available for mirroring
     :param ngams_server: Reference to server object (ngamsServer)
+    :param mirror_source_obj: Mirroring Source Object to check (ngamsMirroringSource)
     """
-    # Dump the information for all files managed by this cluster
-    cluster_name = ngams_server.getDb().getClusterNameFromHostId(ngams_server.getHostId())
-    cluster_files_dbm_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
-                                           NGAMS_MIR_CLUSTER_FILE_DBM, cluster_name)
-    cluster_files_dbm_name = os.path.normpath(cluster_files_dbm_name)
-
-    # Dump information about files registered in this cluster
-    # Use the file key as key in the DBM, count occurrences of each file
-    cluster_files_dbm_name = ngams_server.getDb().dumpFileInfoCluster(cluster_name, cluster_files_dbm_name,
-                                                                      useFileKey=True, count=True)
-
-    # Loop over the various Mirroring Source Archives specified in the configuration
-    for mirror_source_obj in ngams_server.getCfg().getMirroringSrcList():
+    with ngams_server._srcArchInfoDbmSem:
         dbm_mirror_source_obj = ngams_server._srcArchInfoDbm.get(mirror_source_obj.getId())
 
-        # Figure out if a partial or complete sync should be done for this mirroring source
-        time_now = time.time()
-        do_partial_sync = False
-        do_complete_sync = False
-        if mirror_source_obj.getCompleteSyncList():
-            # OK, it is specified to do complete sync's in the configuration
-            time_now_tag = "%s_TIME_NOW" % toiso8601(time_now, fmt=FMT_TIME_ONLY_NOMSEC)
-            # Find the last time stamp compared to now
-            tmp_complete_sync_list = copy.deepcopy(mirror_source_obj.getCompleteSyncList())
-            tmp_complete_sync_list.append(time_now_tag)
-            tmp_complete_sync_list.sort()
-            time_now_idx = tmp_complete_sync_list.index(time_now_tag)
-            # Get the closest sync. time handle (from the configuration) compared to the present time
-            relevant_sync_time = tmp_complete_sync_list[time_now_idx - 1]
-            last_complete_sync = dbm_mirror_source_obj.getLastCompleteSyncDic()[relevant_sync_time]
-            if not last_complete_sync:
-                # The sync time for that cfg sync entry is None -> no sync yet done for that sync time, just do it
+    # Figure out if a partial or complete sync should be done for this mirroring source
+    time_now = time.time()
+    do_partial_sync = False
+    do_complete_sync = False
+    if mirror_source_obj.getCompleteSyncList():
+        # OK, it is specified to do complete sync's in the configuration
+        time_now_tag = "%s_TIME_NOW" % toiso8601(time_now, fmt=FMT_TIME_ONLY_NOMSEC)
+        # Find the last time stamp compared to now
+        tmp_complete_sync_list = copy.deepcopy(mirror_source_obj.getCompleteSyncList())
+        tmp_complete_sync_list.append(time_now_tag)
+        tmp_complete_sync_list.sort()
+        time_now_idx = tmp_complete_sync_list.index(time_now_tag)
+        # Get the closest sync. time handle (from the configuration) compared to the present time
+        relevant_sync_time = tmp_complete_sync_list[time_now_idx - 1]
+        last_complete_sync = dbm_mirror_source_obj.getLastCompleteSyncDic()[relevant_sync_time]
+        if not last_complete_sync:
+            # The sync time for that cfg sync entry is None -> no sync yet done for that sync time, just do it
+            do_complete_sync = True
+        else:
+            # Check if a complete sync for the relevant time was done within the last 24 hours
+            date_now = time_now_tag.split("_")[0]
+            date_last_sync = last_complete_sync.split("T")[0]
+            if date_now > date_last_sync:
                 do_complete_sync = True
-            else:
-                # Check if a complete sync for the relevant time was done within the last 24 hours
-                date_now = time_now_tag.split("_")[0]
-                date_last_sync = last_complete_sync.split("T")[0]
-                if date_now > date_last_sync:
-                    do_complete_sync = True
-
-        # Figure out if a partial sync should be done if not a complete sync should be carried out
-        if not do_complete_sync:
-            last_partial_sync_secs = dbm_mirror_source_obj.getLastSyncTime()
-            if (time_now - last_partial_sync_secs) >= dbm_mirror_source_obj.getPeriod():
-                do_partial_sync = True
-
-        # If no synchronization to be done for this source, continue to the next mirroring source
-        if not do_partial_sync and not do_complete_sync:
-            continue
 
-        # Complete sync: Don't specify a lower limit ingestion date
-        # Partial sync:  Specify lower limit ingestion date
-        # TODO: For now only ingestion date is supported as selection criteria
-        max_elements = 100000
-        status_cmd_pars = [[NGAMS_HTTP_PAR_FILE_LIST, 1],
-                           [NGAMS_HTTP_PAR_UNIQUE, 1],
-                           [NGAMS_HTTP_PAR_MAX_ELS, max_elements]]
-        if do_partial_sync:
-            status_cmd_pars.append([NGAMS_HTTP_PAR_FROM_ING_DATE, toiso8601(dbm_mirror_source_obj.getLastSyncTime())])
-
-        # Go through the list, we shuffle it to get some kind of load balancing
-        server_list_indexes = range(len(ngams_server.getSrvListDic()[mirror_source_obj.getId()]))
-        random.shuffle(server_list_indexes)
-        for server_index in server_list_indexes:
-            next_server, next_port = ngams_server.getSrvListDic()[mirror_source_obj.getId()][server_index].split(":")
-            next_port = int(next_port)
-            msg = "Sending STATUS/file_list request to Source Archive: %s. Node: %s/%d"
-            if do_complete_sync:
-                msg += ". Complete synchronization"
-            else:
-                msg += ". Partial synchronization from date: %s" % toiso8601(dbm_mirror_source_obj.getLastSyncTime())
-            logger.debug(msg, mirror_source_obj.getId(), next_server, next_port)
-            try:
-                retrieve_file_list(ngams_server, mirror_source_obj, next_server, next_port, status_cmd_pars,
-                                   cluster_files_dbm_name)
-                # The retrieval of the file list was successful, we don't need to contacting others of the
-                # specified contact nodes
-                break
-            except Exception as e:
-                # Create log entry in case it was not possible to communicate to this Mirroring Source Archive.
-                # Continue to the next Mirroring Source Archive in that case.
-                logger.error("Error sending STATUS/file_list to Mirroring Source Archive with ID: %s (%s:%d). " 
-                             "Error: %s", mirror_source_obj.getId(), next_server, next_port, str(e))
-                # Try the next contact node specified in the configuration
-                continue
-
-        # Register the times for the last partial or complete sync
+    # Figure out if a partial sync should be done if not a complete sync should be carried out
+    if not do_complete_sync:
+        last_partial_sync_secs = dbm_mirror_source_obj.getLastSyncTime()
+        if (time_now - last_partial_sync_secs) >= dbm_mirror_source_obj.getPeriod():
+            do_partial_sync = True
+
+    # If no synchronization to be done for this source, continue to the next mirroring source
+    if not do_partial_sync and not do_complete_sync:
+        return
+
+    # Complete sync: Don't specify a lower limit ingestion date
+    # Partial sync:  Specify lower limit ingestion date
+    # TODO: For now only ingestion date is supported as selection criteria
+    max_elements = 100000
+    status_cmd_pars = [[NGAMS_HTTP_PAR_FILE_LIST, 1],
+                       [NGAMS_HTTP_PAR_UNIQUE, 1],
+                       [NGAMS_HTTP_PAR_MAX_ELS, max_elements]]
+    if do_partial_sync:
+        status_cmd_pars.append([NGAMS_HTTP_PAR_FROM_ING_DATE, toiso8601(dbm_mirror_source_obj.getLastSyncTime())])
+
+    # Go through the list, we shuffle it to get some kind of load balancing
+    server_list_indexes = list(range(len(ngams_server.getSrvListDic()[mirror_source_obj.getId()])))
+    random.shuffle(server_list_indexes)
+    for server_index in server_list_indexes:
+        next_server, next_port = ngams_server.getSrvListDic()[mirror_source_obj.getId()][server_index].split(":")
+        next_port = int(next_port)
+        msg = "Sending STATUS/file_list request to Source Archive: %s. Node: %s/%d"
         if do_complete_sync:
-            dbm_mirror_source_obj.getLastCompleteSyncDic()[relevant_sync_time] = toiso8601(time_now, local=True)
-            # Fair enough to consider that a partial sync been done when a complete sync has been carried out
-            dbm_mirror_source_obj.setLastSyncTime(time_now)
-        elif do_partial_sync:
-            dbm_mirror_source_obj.setLastSyncTime(time_now)
+            msg += ". Complete synchronization"
+        else:
+            msg += ". Partial synchronization from date: %s" % toiso8601(dbm_mirror_source_obj.getLastSyncTime())
+        logger.debug(msg, mirror_source_obj.getId(), next_server, next_port)
+        try:
+            retrieve_file_list(ngams_server, mirror_source_obj, next_server, next_port, status_cmd_pars)
+            # The retrieval of the file list was successful, we don't need to contacting others of the
+            # specified contact nodes
+            break
+        except Exception as e:
+            # Create log entry in case it was not possible to communicate to this Mirroring Source Archive.
+            # Continue to the next Mirroring Source Archive in that case.
+            logger.error("Error sending STATUS/file_list to Mirroring Source Archive with ID: %s (%s:%d). "
+                         "Error: %s", mirror_source_obj.getId(), next_server, next_port, str(e))
+            # Try the next contact node specified in the configuration
+            continue
 
-        # Store the updated Source Archive Object back into the Source Archive DBM
+    # Register the times for the last partial or complete sync
+    if do_complete_sync:
+        dbm_mirror_source_obj.getLastCompleteSyncDic()[relevant_sync_time] = toiso8601(time_now, local=True)
+        # Fair enough to consider that a partial sync been done when a complete sync has been carried out
+        dbm_mirror_source_obj.setLastSyncTime(time_now)
+    elif do_partial_sync:
+        dbm_mirror_source_obj.setLastSyncTime(time_now)
+
+    # Store the updated Source Archive Object back into the Source Archive DBM
+    with ngams_server._srcArchInfoDbmSem:
         ngams_server._srcArchInfoDbm.add(mirror_source_obj.getId(), dbm_mirror_source_obj).sync()
 
+
+def check_source_archives(ngams_server):
+    """
+    Check the source archives to see if data is available for mirroring. The source archives are polled
+    concurrently, each in its own thread.
+    :param ngams_server: Reference to server object (ngamsServer)
+    """
+    # Add the files registered in this cluster since the last check to the name space index
+    ngams_server._mirNamespaceIndex.update()
+
+    def check_source(mirror_source_obj):
+        try:
+            check_source_archive(ngams_server, mirror_source_obj)
+        except Exception:
+            logger.exception("Error checking Mirroring Source Archive with ID: %s", mirror_source_obj.getId())
+
+    # Loop over the various Mirroring Source Archives specified in the configuration
+    threads = []
+    for mirror_source_obj in ngams_server.getCfg().getMirroringSrcList():
+        thread_id = "%s-SOURCE-%s" % (NGAMS_MIR_CONTROL_THR, mirror_source_obj.getId())
+        thread_handle = threading.Thread(None, check_source, thread_id, (mirror_source_obj,))
+        thread_handle.daemon = True
+        thread_handle.start()
+        threads.append(thread_handle)
+    for thread_handle in threads:
+        thread_handle.join()
+
     # Signal to the Mirroring Threads that there might be new Mirroring Requests to handle
     ngams_server.triggerMirThreads()
 
@@ -782,22 +758,7 @@ def check_error_queue(ngams_server):
     #   * If the ErrorRetryTimeOut has expired, leave the entry in the queue for the reporting.
     # * For entries marked as Error/Abandon: Leave these in the queue to be handled later by the reporting.
 
-    # We create a snapshot of the keys in the Error DBM, so that we can pass through these without interfering with
-    # other activities, and to avoid creating a maybe huge list in memory.
-    dbm_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()), "NGAMS_MIR_ERR_QUEUE_KEYS_DBM",
-                             ngams_server.getHostInfoObj().getClusterName())
-    dbm_name = dump_keys_queue(ngams_server._errQueueDbm, ngams_server._errQueueDbmSem, dbm_name)
-    error_queue_keys_dbm = ngamsDbm.ngamsDbm(dbm_name, cleanUpOnDestr=True)
-    error_queue_keys_dbm.initKeyPtr()
-    while True:
-        next_key, data = error_queue_keys_dbm.getNext()
-        if not next_key:
-            break
-        try:
-            mirror_request_obj = ngams_server._errQueueDbm.get(next_key)
-        except Exception:
-            # Maybe this entry was removed by the reporting, ignore, continue to the next entry
-            continue
+    for _, mirror_request_obj in ngams_server._mirQueue.entries(mirroring_queue.ERROR):
         if mirror_request_obj.getStatusAsNo() == ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_ERR_RETRY_NO:
             # If the time since last activity is longer than ErrorRetryPeriod reschedule the request into the
             # Mirroring Queue
@@ -805,11 +766,9 @@ def check_error_queue(ngams_server):
             if (time_now - mirror_request_obj.getLastActivityTime()) > \
                     ngams_server.getCfg().getMirroringErrorRetryPeriod():
                 try:
-                    mirror_request_obj = pop_entry_queue(mirror_request_obj, ngams_server._errQueueDbm,
-                                                         ngams_server._errQueueDbmSem)
                     add_entry_mirror_queue(ngams_server, mirror_request_obj)
                 except Exception as e:
-                    logger.error("Error moving Mirroring Request from Error DBM Queue to the Mirroring DBM Queue: %s",
+                    logger.error("Error moving Mirroring Request from Error Queue to the Mirroring Queue: %s",
                                  str(e))
         else:
             # NGAMS_MIR_REQ_STAT_ERR_ABANDON_NO: Do nothing
@@ -831,53 +790,34 @@ def generate_report(ngams_server):
     report_header = report_header % (toiso8601(), ngams_server.getHostId())
     summary = "NGAS MIRRORING - SUMMARY REPORT\n\n" + report_header
 
-    # Go through the various queue DBMs
-    dbm_name = "%s/%s_%s" % (ngamsHighLevelLib.getNgasChacheDir(ngams_server.getCfg()),
-                             "NGAMS_MIR_REPORINTG_QUEUE_KEYS_DBM",
-                             ngams_server.getHostInfoObj().getClusterName())
-
     # Go through Completed Queue
-    dbm_name = dump_keys_queue(ngams_server._complQueueDbm, ngams_server._complQueueDbmSem, dbm_name)
-    completed_queue_keys_dbm = ngamsDbm.ngamsDbm(dbm_name, cleanUpOnDestr=True)
-    completed_queue_keys_dbm.initKeyPtr()
     completed_count = 0
-
-    while True:
-        next_key, mirror_request = completed_queue_keys_dbm.getNext()
-        if not next_key:
-            break
+    for _, mirror_request in ngams_server._mirQueue.entries(mirroring_queue.COMPLETED):
         try:
-            pop_entry_queue(mirror_request, ngams_server._complQueueDbm, ngams_server._complQueueDbmSem)
+            pop_entry_queue(ngams_server, mirror_request, mirroring_queue.COMPLETED)
             completed_count += 1
         except Exception as e:
-            logger.error("Error popping Mirroring Request from the Completed DBM Queue: %s", str(e))
+            logger.error("Error popping Mirroring Request from the Completed Queue: %s", str(e))
 
     summary += "Completed Requests:    %d\n" % completed_count
 
     # Go through Error Queue
-    dbm_name = dump_keys_queue(ngams_server._errQueueDbm, ngams_server._errQueueDbmSem, dbm_name)
     error_retry_count = 0
     error_timeout_count = 0
     error_abandon_count = 0
-    error_queue_keys_dbm = ngamsDbm.ngamsDbm(dbm_name, cleanUpOnDestr=True)
-    error_queue_keys_dbm.initKeyPtr()
-
-    while True:
-        next_key, mirror_request = error_queue_keys_dbm.getNext()
-        if not next_key:
-            break
+    for _, mirror_request in ngams_server._mirQueue.entries(mirroring_queue.ERROR):
         if mirror_request.getStatusAsNo() == ngamsMirroringRequest.NGAMS_MIR_REQ_STAT_ERR_ABANDON:
             try:
-                pop_entry_queue(mirror_request, ngams_server._errQueueDbm, ngams_server._errQueueDbmSem)
+                pop_entry_queue(ngams_server, mirror_request, mirroring_queue.ERROR)
                 error_abandon_count += 1
             except Exception as e:
-                logger.error("Error popping Mirroring Request from Error DBM Queue: %s", str(e))
+                logger.error("Error popping Mirroring Request from Error Queue: %s", str(e))
         elif (time.time() - mirror_request.getSchedulingTime()) > ngams_server.getCfg().getMirroringErrorRetryPeriod():
             try:
-                pop_entry_queue(mirror_request, ngams_server._errQueueDbm, ngams_server._errQueueDbmSem)
+                pop_entry_queue(ngams_server, mirror_request, mirroring_queue.ERROR)
                 error_timeout_count += 1
             except Exception as e:
-                logger.error("Error popping Mirroring Request from Error DBM Queue: %s", str(e))
+                logger.error("Error popping Mirroring Request from Error Queue: %s", str(e))
         else:
             error_retry_count += 1
     summary += "Error Request/Retry:   %d\n" % error_retry_count
@@ -885,16 +825,7 @@ def generate_report(ngams_server):
     summary += "Error Request/Abandon: %d\n" % error_abandon_count
 
     # Go through Mirroring Queue
-    dbm_name = dump_keys_queue(ngams_server._mirQueueDbm, ngams_server._mirQueueDbmSem, dbm_name)
-    mirror_queue_keys_dbm = ngamsDbm.ngamsDbm(dbm_name, cleanUpOnDestr=True)
-    mirror_queue_keys_dbm.initKeyPtr()
-    mirror_queue_count = 0
-
-    while True:
-        next_key, mirror_request = mirror_queue_keys_dbm.getNext()
-        if not next_key:
-            break
-        mirror_queue_count += 1
+    mirror_queue_count = ngams_server._mirQueue.count(mirroring_queue.QUEUED)
     summary += "Mirroring Queue:    %d\n" % mirror_queue_count
 
     # Submit report to the specified recipients
@@ -77,6 +77,13 @@ from . import ngamsUserServiceThread
 from . import ngamsMirroringControlThread
 from . import ngamsCacheControlThread
 from . import request_db
+from . import file_location_cache
+from . import host_topology
+from . import metrics
+from . import mirroring_queue
+from . import plugin_registry
+from . import staging
+from . import volume_stats
 
 
 logger = logging.getLogger(__name__)
@@ -115,6 +122,10 @@ class thread_pool_mixin(socketserver.ThreadingMixIn):
 
         self._pool.apply_async(self.process_request_thread, args=(request, client_address))
 
+    def queue_depth(self):
+        """The number of requests waiting for a thread of the pool"""
+        return self._pool._taskqueue.qsize()
+
 class ngamsHttpServer(thread_pool_mixin, BaseHTTPServer.HTTPServer):
     """Class providing pooled multithreaded HTTP server functionality"""
 
@@ -209,6 +220,8 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         # send during the same HTTP request
         self.reply_sent = False
         self.headers_sent = False
+        self.status_code = None
+        self.bytes_sent = 0
 
         path = self.path.strip("?/ ")
         try:
@@ -247,6 +260,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         if self.reply_sent:
             raise Exception("Tried to send two responses :(")
         self.reply_sent = True
+        self.status_code = code
 
         BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message=message)
         for k, v in hdrs.items():
@@ -271,51 +285,56 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
         self.send_response(http_status, hdrs={'Location': url})
         self.end_headers()
 
-    def send_file(self, f, mime_type, start_byte=0, fname=None, hdrs={}):
+    def send_file(self, f, mime_type, start_byte=0, fname=None, hdrs={}, end_byte=None):
         """
         Sends file ``f`` of type ``mime_type`` to the client. Optionally a different
-        starting byte to start the transmission from, and a different name for
-        the file to present the data to the user can be given.
+        starting (and last, inclusive) byte to start the transmission from, and
+        a different name for the file to present the data to the user can be given.
         """
 
         fname = fname or os.path.basename(f)
         size = getFileSize(f)
+        if end_byte is not None:
+            end_byte = min(end_byte, size - 1)
 
-        self.send_file_headers(fname, mime_type, size, start_byte, hdrs=hdrs)
-        self.write_file_data(f, size, start_byte)
+        self.send_file_headers(fname, mime_type, size, start_byte, hdrs=hdrs, end_byte=end_byte)
+        self.write_file_data(f, size, start_byte, end_byte=end_byte)
 
-    def send_file_headers(self, fname, mime_type, size, start_byte=0, hdrs={}):
+    def send_file_headers(self, fname, mime_type, size, start_byte=0, hdrs={}, end_byte=None):
         """Sends the headers advertising file ``fname``, but without its data.
         Headers set by this method take precedence over values given by the
         caller via the ``hdrs`` optional argument"""
 
+        last_byte = size - 1 if end_byte is None else end_byte
         _hdrs = {'Content-Type': mime_type,
                 'Content-Disposition': 'attachment; filename="%s"' % fname,
-                'Content-Length': str(size - start_byte)}
-        if start_byte:
+                'Content-Length': str(last_byte + 1 - start_byte)}
+        if start_byte or end_byte is not None:
             _hdrs['Accept-Ranges'] = 'bytes'
-            _hdrs["Content-Range"] = "bytes %d-%d/%d" % (start_byte, size - 1, size)
+            _hdrs["Content-Range"] = "bytes %d-%d/%d" % (start_byte, last_byte, size)
 
         hdrs.update(_hdrs)
         self.send_response(200, hdrs=hdrs)
         self.end_headers()
 
-    def write_file_data(self, f, size, start_byte=0):
+    def write_file_data(self, f, size, start_byte=0, end_byte=None):
         """sends file ``f``, hopefully using ``sendfile(2)``"""
 
         if not self.headers_sent:
             raise RuntimeError('Trying to send file data but HTTP headers not sent')
 
+        count = None if end_byte is None else end_byte + 1 - start_byte
         self.wfile.flush()
         logger.info("Sending %s (%d bytes) to client, starting at byte %d", f, size, start_byte)
         with open(f, 'rb') as fin:
             st = time.time()
             if self.ngasServer.get_server_access_proto() == "https":
-                pysendfile.sendfile_send(self.connection, fin, start_byte)
+                pysendfile.sendfile_send(self.connection, fin, start_byte, count)
             else:
-                pysendfile.sendfile(self.connection, fin, start_byte)
+                pysendfile.sendfile(self.connection, fin, start_byte, count)
             howlong = time.time() - st
             size_mb = size / 1024. / 1024.
+        self.bytes_sent += (size - start_byte) if count is None else count
         logger.info("Sent %s at %.3f [MB/s]", f, size_mb / howlong)
 
     def send_data(self, data, mime_type, code=200, message=None, fname=None, hdrs={}):
@@ -349,6 +368,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             return
 
         self.wfile.write(data)
+        self.bytes_sent += len(data)
 
     def send_status(self, message, status=NGAMS_SUCCESS, code=None, http_message=None, hdrs={}):
         """Creates and sends an NGAS status XML document back to the client"""
@@ -383,7 +403,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         # If target host is suspended, wake it up.
         srv = self.ngasServer
-        if (srv.db.getSrvSuspended(host_id)):
+        if srv.host_topology.is_suspended(host_id):
             ngamsSrvUtils.wakeUpHost(srv, host_id)
 
         # If the NGAS Internal Authorization User is defined generate
@@ -411,8 +431,14 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
         else:
             # During HTTP post we need to pass down a EOF-aware,
-            # read()-able object
-            data = ngamsHttpUtils.sizeaware(self.rfile, int(self.headers['content-length']))
+            # read()-able object. Chunked data is passed down as such,
+            # together with its trailers
+            if 'chunked' in self.headers.get('transfer-encoding', '').lower():
+                reader = ngamsHttpUtils.chunked_reader(self.rfile)
+                data = ngamsHttpUtils.chunked_body(reader, lambda: reader.trailers)
+                hdrs['Transfer-Encoding'] = 'chunked'
+            else:
+                data = ngamsHttpUtils.sizeaware(self.rfile, int(self.headers['content-length']))
 
             mime_type = ''
             if 'content-type' in self.headers:
@@ -502,6 +528,7 @@ class ngamsHttpRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
             stream_buffer_size = len(stream_buffer)
             self.wfile.write(stream_buffer)
             data_sent += stream_buffer_size
+            self.bytes_sent += stream_buffer_size
             if stream_buffer_size == 0 and data_sent < data_to_send:
                 logger.error("Data stream is incomplete. Only received %d bytes, expected %d bytes.",
                              data_sent, data_to_send)
@@ -571,6 +598,18 @@ class ngamsServer(object):
         self.autoonline               = False
         self.no_autoexit              = False
         self.db                       = None
+        self.volume_stats             = None
+        self.staging_service          = None
+        self.file_location_cache      = file_location_cache.FileLocationCache(0)
+        self.host_topology            = None
+        self.plugins                  = plugin_registry.PlugInRegistry()
+        self.metrics                  = metrics.Metrics()
+        self.metrics.add_collector(self.collect_metrics)
+        for prefix, component in (('ngas_staging', lambda: self.staging_service),
+                                  ('ngas_file_location_cache', lambda: self.file_location_cache),
+                                  ('ngas_host_topology', lambda: self.host_topology),
+                                  ('ngas_plugins', lambda: self.plugins)):
+            self.metrics.add_collector(metrics.statistics_collector(prefix, component))
         self.__diskDic                = None
         self.__mimeType2PlugIn        = {}
         self.__state                  = NGAMS_OFFLINE_STATE
@@ -671,15 +710,10 @@ class ngamsServer(object):
         self._mirThreadsPauseCount    = 0
         self.mirroring_running        = False
 
-        # - Mirroring Queue DBM.
-        self._mirQueueDbm = None
-        self._mirQueueDbmSem = threading.Semaphore(1)
-        # - Error Queue DBM.
-        self._errQueueDbm = None
-        self._errQueueDbmSem = threading.Semaphore(1)
-        # - Completed Queue DBM.
-        self._complQueueDbm = None
-        self._complQueueDbmSem = threading.Semaphore(1)
+        # - Mirroring Queue, holding the queued, failed and completed requests.
+        self._mirQueue = None
+        # - Index of the files in the name space of the local cluster.
+        self._mirNamespaceIndex = None
         # - Source Archive Info DBM.
         self._srcArchInfoDbm = None
         self._srcArchInfoDbmSem = threading.Semaphore(1)
@@ -1537,6 +1571,8 @@ class ngamsServer(object):
         Returns:    Reference to object itself.
         """
         self.__diskDic = diskDic
+        if self.volume_stats:
+            self.volume_stats.invalidate()
         return self
 
 
@@ -1618,6 +1654,7 @@ class ngamsServer(object):
                                 setSrvState(state)
         if (updateDb):
             ngamsHighLevelLib.updateSrvHostInfo(self.getDb(), self.getHostInfoObj())
+            self.host_changed(self.getHostId())
         return self
 
     def get_remote_server_endpoint(self, hostId=None):
@@ -1627,14 +1664,17 @@ class ngamsServer(object):
         """
         hostId = hostId or self.host_id
         local_name = getHostName()
-        listening_ip = self.getDb().getIpFromHostId(hostId)
+        host_info = self.host_topology.get(hostId)
+        if host_info is None:
+            raise Exception("No NGAS host with host_id: %s" % hostId)
+        listening_ip = host_info.getIpAddress()
 
         if ':' in hostId:
             remote_name, remote_port = hostId.split(':')
             remote_port = int(remote_port)
         else:
             remote_name = hostId
-            remote_port = self.getDb().getPortNoFromHostId(hostId)
+            remote_port = host_info.getSrvPort()
 
         # remote server is not our same machine
         if remote_name != local_name:
@@ -1724,6 +1764,7 @@ class ngamsServer(object):
             self.serving = True
 
         # Create new request handle + add this entry in the Request DB.
+        start = time.time()
         reqPropsObj = ngamsReqProps.ngamsReqProps()
         reqPropsObj.setRequestId(str(uuid.uuid4()))
         self.request_db.add(reqPropsObj)
@@ -1770,6 +1811,7 @@ class ngamsServer(object):
             reqPropsObj.setCompletionTime(1)
             self.request_db.update(reqPropsObj)
             self.setLastReqEndTime()
+            self.observe_request(reqPropsObj, httpRef, time.time() - start)
 
             with self.serving_count_lock:
                 self.serving_count -= 1
@@ -1777,6 +1819,52 @@ class ngamsServer(object):
                     self.serving = False
 
 
+    def observe_request(self, reqPropsObj, httpRef, duration):
+        """
+        Feed the request metrics with the outcome of a request.
+
+        reqPropsObj:     Request Property object of the request (ngamsReqProps).
+
+        httpRef:         Reference to the HTTP request handler
+                         object (ngamsHttpRequestHandler).
+
+        duration:        Time taken to handle the request (float).
+
+        Returns:         Void.
+        """
+        cmd = reqPropsObj.getCmd() or 'UNKNOWN'
+        self.metrics.inc('ngas_requests_total', command=cmd,
+                         code=httpRef.status_code or 0)
+        self.metrics.observe('ngas_request_duration_seconds', duration, command=cmd)
+        if reqPropsObj.getBytesReceived():
+            self.metrics.inc('ngas_received_bytes_total', reqPropsObj.getBytesReceived(),
+                             command=cmd)
+        if httpRef.bytes_sent:
+            self.metrics.inc('ngas_sent_bytes_total', httpRef.bytes_sent, command=cmd)
+
+    def collect_metrics(self):
+        """
+        Report the current value of the gauges of this server, as expected by
+        metrics.Metrics.add_collector.
+        """
+        gauges = [('ngas_requests_in_progress', {}, self.serving_count)]
+        if self.__httpDaemon:
+            gauges.append(('ngas_request_queue_depth', {}, self.__httpDaemon.queue_depth()))
+        if self.db:
+            for key, value in self.db.getPoolStatistics().items():
+                gauges.append(('ngas_db_pool_connections', {'state': key}, value))
+        gauges.append(('ngas_subscription_backlog', {}, self.getSubcrBackLogCount()))
+        for subscrId, queue in list(self._subscrQueueDic.items()):
+            gauges.append(('ngas_subscription_queue_depth', {'subscriber': subscrId},
+                           queue.qsize()))
+        if self._mirQueue is not None:
+            for state in (mirroring_queue.QUEUED, mirroring_queue.ACTIVE,
+                          mirroring_queue.ERROR, mirroring_queue.COMPLETED):
+                gauges.append(('ngas_mirroring_queue_depth', {'state': state},
+                               self._mirQueue.count(state)))
+        return gauges
+
+
     def handleHttpRequest(self,
                           reqPropsObj,
                           httpRef,
@@ -2061,6 +2149,30 @@ class ngamsServer(object):
         # Should be possible to execute several servers on one node.
         self.getHostInfoObj().setHostId(self.host_id)
 
+        # In-memory statistics of our volumes
+        cfg = self.getCfg()
+        self.volume_stats = volume_stats.VolumeStats(self.getDb, self.host_id,
+                                                     cfg.getVolumeStatsFlushFiles(),
+                                                     cfg.getVolumeStatsFlushPeriod(),
+                                                     cfg.getVolumeCacheTime())
+
+        # Results of the queries locating files for RETRIEVE & co.
+        self.file_location_cache = file_location_cache.FileLocationCache(
+            cfg.getFileLocationCacheSize(), cfg.getFileLocationCacheTime())
+
+        # Contents of ngas_hosts, and how to reach each host
+        self.host_topology = host_topology.HostTopology(self.getDb, self.host_id,
+                                                        cfg.getHostTopologyRefreshPeriod())
+
+        # Staging of files from hierarchical storage, shared by all requests
+        fspi = cfg.getFileStagingPlugIn()
+        if fspi:
+            self.staging_service = staging.StagingService(
+                loadPlugInEntryPoint(fspi, 'isFileOffline'),
+                loadPlugInEntryPoint(fspi, 'stageFiles'),
+                cfg.getFileStagingMaxBatchSize(), cfg.getFileStagingBatchWait(),
+                cfg.getFileStagingTimeout(), server=self)
+
         # Set up missing logging conditions from configuration file
         logcfg = self.logcfg
         if logcfg.file_level is None:
@@ -2218,11 +2330,15 @@ class ngamsServer(object):
 
         # Reset the parameters for the suspension.
         self.getDb().resetWakeUpCall(self.getHostId(), 1)
+        self.host_changed(self.getHostId())
 
         # Create a mime-type to DAPI dictionary
         for stream in self.getCfg().getStreamList():
             self.getMimeTypeDic()[stream.getMimeType()] = stream.getPlugIn()
 
+        # Resolve all plug-ins and commands up-front
+        self.load_plugins()
+
         # Throw this info again to have it in the log-file as well
         logger.info("PID file for this session created: %s", self.pidFile())
 
@@ -2260,6 +2376,30 @@ class ngamsServer(object):
             raise
 
 
+    def load_plugins(self):
+        """
+        Resolve the plug-ins and commands of the current configuration, and
+        replace the registry holding them. Requests already being handled
+        keep using the entry points they got from the previous registry.
+
+        Returns:         Void.
+        """
+        self.plugins = plugin_registry.PlugInRegistry.from_config(
+            self.getCfg(), ngamsCmdHandling.command_modules(self.getCfg()))
+
+
+    def host_changed(self, hostId):
+        """
+        Notify that the entry of `hostId` in ngas_hosts has been changed.
+
+        hostId:        ID of the host whose entry changed (string).
+
+        Returns:       Void.
+        """
+        if self.host_topology:
+            self.host_topology.host_changed(hostId)
+
+
     def reqWakeUpCall(self,
                       wakeUpHostId,
                       wakeUpTime):
@@ -2275,6 +2415,7 @@ class ngamsServer(object):
         Returns:       Reference to object itself.
         """
         self.getDb().reqWakeUpCall(self.getHostId(), wakeUpHostId, wakeUpTime)
+        self.host_changed(self.getHostId())
         self.getHostInfoObj().\
                                 setSrvSuspended(1).\
                                 setSrvReqWakeUpSrv(wakeUpHostId).\
@@ -2340,7 +2481,15 @@ class ngamsServer(object):
             self.workers_pool.join()
         show_threads()
 
-        # Close all connections to the database, please
+        # Write pending volume statistics and close all connections to the
+        # database, please
+        if self.staging_service:
+            self.staging_service.stop()
+        self.file_location_cache.log_statistics()
+        if self.host_topology:
+            self.host_topology.log_statistics()
+        if self.volume_stats:
+            self.volume_stats.close()
         self.close_db()
 
         # Shut down logging. This will flush all pending logs in the system
@@ -38,7 +38,7 @@ import logging
 from ngamsLib.ngamsCore import NGAMS_NOT_RUN_STATE,\
     NGAMS_ONLINE_STATE, NGAMS_SUBSCRIBE_CMD, NGAMS_SUCCESS, genLog, \
     NGAMS_SUBSCRIBER_THR, NGAMS_UNSUBSCRIBE_CMD, NGAMS_HTTP_INT_AUTH_USER,\
-    loadPlugInEntryPoint, toiso8601, fromiso8601, NGAMS_NOTIF_ERROR
+    toiso8601, fromiso8601, NGAMS_NOTIF_ERROR
 from ngamsLib import ngamsStatus, ngamsLib, ngamsHttpUtils, utils
 from ngamsLib import ngamsSubscriber
 from ngamsLib import ngamsHighLevelLib, ngamsDiskUtils
@@ -201,7 +201,7 @@ def getDiskInfo(srvObj,
     """
     plugIn = srvObj.getCfg().getOnlinePlugIn()
     logger.info("Invoking System Online Plug-In: %s(srvObj)", plugIn)
-    plugInMethod = loadPlugInEntryPoint(plugIn)
+    plugInMethod = srvObj.plugins.entry_point(plugIn)
     diskInfoDic = plugInMethod(srvObj, reqPropsObj)
     if not diskInfoDic:
         if (not ngamsLib.trueArchiveProxySrv(srvObj.getCfg())):
@@ -230,6 +230,7 @@ def handleOnline(srvObj,
 
     # Re-load Configuration + check disk configuration.
     srvObj.loadCfg()
+    srvObj.load_plugins()
 
     hostId = srvObj.getHostId()
     for stream in srvObj.getCfg().getStreamList():
@@ -396,7 +397,7 @@ def handleOffline(srvObj,
                                         srvObj.getDb(), srvObj.getCfg())
     plugIn = srvObj.getCfg().getOfflinePlugIn()
     logger.info("Invoking System Offline Plug-In: %s(srvObj, reqPropsObj)", plugIn)
-    plugInMethod = loadPlugInEntryPoint(plugIn)
+    plugInMethod = srvObj.plugins.entry_point(plugIn)
     plugInMethod(srvObj, reqPropsObj)
     ngamsDiskUtils.markDisksAsUnmountedInDb(srvObj.getHostId(), srvObj.getDb(), srvObj.getCfg())
 
@@ -426,7 +427,7 @@ def wakeUpHost(srvObj,
     wakeUpPi = srvObj.getCfg().getWakeUpPlugIn()
     portNo = srvObj.getDb().getPortNoFromHostId(suspHost)
     try:
-        plugInMethod = loadPlugInEntryPoint(wakeUpPi)
+        plugInMethod = srvObj.plugins.entry_point(wakeUpPi)
         plugInMethod(srvObj, suspHost)
 
         ipAddress = srvObj.getDb().getIpFromHostId(suspHost)
@@ -435,6 +436,9 @@ def wakeUpHost(srvObj,
     except Exception:
         logger.exception("Error waking up host %s", suspHost)
         raise
+    finally:
+        # The host resets its suspension state as it starts
+        srvObj.host_changed(suspHost)
 
 
 def checkStagingAreas(srvObj):
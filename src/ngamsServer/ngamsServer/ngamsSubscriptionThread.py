@@ -47,7 +47,7 @@ from . import ngamsCacheControlThread
 from ngamsLib.ngamsCore import NGAMS_SUBSCRIPTION_THR, isoTime2Secs,\
     NGAMS_SUBSCR_BACK_LOG, NGAMS_DELIVERY_THR,\
     NGAMS_HTTP_INT_AUTH_USER, NGAMS_REARCHIVE_CMD, NGAMS_FAILURE,\
-    NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, getFileSize, rmFile, loadPlugInEntryPoint,\
+    NGAMS_HTTP_SUCCESS, NGAMS_SUCCESS, getFileSize, rmFile,\
     toiso8601, NGAMS_HTTP_HDR_CHECKSUM, NGAMS_HTTP_HDR_FILE_INFO, fromiso8601
 from ngamsLib import ngamsDbm, ngamsStatus, ngamsHighLevelLib, ngamsFileInfo, ngamsDbCore,\
     ngamsHttpUtils
@@ -553,7 +553,7 @@ def _checkIfFilterPluginSayYes(srvObj, subscrObj, filename, fileId, fileVersion,
         logger.debug("Invoking FPI: %s on file (version/ID): %s/%s. " +\
                      "Subscriber: %s",
                      fileId, str(fileVersion), subscrObj.getId(), plugIn)
-        plugInMethod = loadPlugInEntryPoint(plugIn)
+        plugInMethod = srvObj.plugins.entry_point(plugIn)
         fpiRes = plugInMethod(srvObj, plugInPars, filename, fileId, fileVersion)
         if (fpiRes):
             logger.debug("File (version/ID): %s/%s accepted by the FPI: " + \
@@ -732,7 +732,7 @@ def _deliveryThread(srvObj,
                         logger.debug("Invoking Job Plugin: %s on file (version/ID): %s/%s. " + \
                                      "Subscriber: %s",
                                      fileId, str(fileVersion), subscrObj.getId(), plugIn)
-                        plugInMethod = loadPlugInEntryPoint(plugIn)
+                        plugInMethod = srvObj.plugins.entry_point(plugIn)
                         jpiCode, jpiResult = plugInMethod(srvObj, plugInPars, filename, fileId, fileVersion, diskId)
                         if (0 == jpiCode):
                             reply = NGAMS_HTTP_SUCCESS
@@ -1020,16 +1020,10 @@ def addToSubscrQueue(srvObj, subscrId, fileInfo, quChunks):
             quChunks.put(fileInfo)
 
 def stageFile(srvObj, filename):
-    fspi = srvObj.getCfg().getFileStagingPlugIn()
-    if not fspi:
+    if not srvObj.staging_service:
         return
     try:
-        logger.debug("Invoking FSPI.isFileOffline: %s to check file: %s", fspi, filename)
-        isFileOffline = loadPlugInEntryPoint(fspi, 'isFileOffline')
-        if isFileOffline(filename) == 1:
-            logger.debug("File %s is offline, staging for delivery...", filename)
-            stageFiles = loadPlugInEntryPoint(fspi, 'stageFiles')
-            stageFiles(filenames = [filename], serverObj = srvObj)
+        if srvObj.staging_service.stage([filename]):
             logger.debug("File %s staging completed for delivery.", filename)
     except Exception as ex:
         logger.error("File staging error: %s", filename)
@@ -0,0 +1,172 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Registry of the plug-ins and command modules used by the server"""
+
+import importlib
+import logging
+import sys
+import threading
+
+from ngamsLib.ngamsCore import loadPlugInModule
+
+logger = logging.getLogger(__name__)
+
+# The reload function has moved around a bit
+if sys.version_info[0] < 3:
+    from __builtin__ import reload  # @UnresolvedImport
+elif sys.version_info[0:2] < (3, 4):
+    from imp import reload  # @UnresolvedImport
+else:
+    reload = importlib.reload
+
+_missing = object()
+
+
+def configured_entry_points(cfg):
+    """
+    Returns the (plug-in, entry point) pairs referenced by `cfg`, where a None
+    entry point stands for the default one. Empty names are left out.
+    """
+    entry_points = []
+    for stream in cfg.getStreamList():
+        entry_points.append((stream.getPlugIn(), None))
+        entry_points.append((stream.getPlugIn(), 'modifies_content'))
+    entry_points += [(name, None) for name in cfg.dppi_plugins]
+    entry_points += [(p.name, None) for p in cfg.register_plugins.values()]
+    entry_points += [(name, None) for name in (
+        cfg.getOnlinePlugIn(), cfg.getOfflinePlugIn(),
+        cfg.getLabelPrinterPlugIn(), cfg.getDiskSyncPlugIn(),
+        cfg.getSuspensionPlugIn(), cfg.getWakeUpPlugIn(),
+        cfg.getVal("Caching[1].CacheControlPlugIn"))]
+    fspi = cfg.getFileStagingPlugIn()
+    entry_points += [(fspi, 'isFileOffline'), (fspi, 'stageFiles')]
+    return [(name, method) for name, method in entry_points if name]
+
+
+class PlugInRegistry(object):
+    """
+    Holds the entry points of plug-ins and the command modules, already
+    resolved, so handling requests doesn't go through the import machinery.
+
+    Registries are meant to be built from the configuration (see from_config)
+    each time it is loaded, and replace the previous one as a whole. Entry
+    points and commands not known in advance (e.g., subscription filter
+    plug-ins) are resolved the first time they are requested and remembered.
+    """
+
+    def __init__(self, entry_points=None, commands=None):
+        # (plug-in name, entry point) -> callable, or _missing
+        self.entry_points = dict(entry_points or {})
+        # (command, module name) -> module
+        self.commands = dict(commands or {})
+        self.reload_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, cfg, command_modules):
+        """
+        Creates a registry with all the plug-ins referenced by `cfg`, and the
+        modules in `command_modules`, a dictionary mapping commands to module
+        names.
+
+        Plug-ins or commands that cannot be loaded are only reported, so that
+        the error shows up when they are actually used.
+        """
+        registry = cls()
+        for name, method in configured_entry_points(cfg):
+            try:
+                module = loadPlugInModule(name)
+                registry.entry_points[(name, method)] = getattr(
+                    module, method or name.split('.')[-1], _missing)
+            except Exception as e:
+                logger.debug("Plug-in %s cannot be loaded: %s", name, e)
+        for cmd, modname in command_modules.items():
+            try:
+                registry.commands[(cmd, modname)] = importlib.import_module(modname)
+            except Exception as e:
+                logger.debug("Module %s for command %s cannot be loaded: %s",
+                             modname, cmd, e)
+
+        logger.info("Loaded %d plug-in entry points and %d command modules",
+                    len(registry.entry_points), len(registry.commands))
+        return registry
+
+    def entry_point(self, plugInName, entryPointMethodName=None, returnNone=False):
+        """
+        Like ngamsCore.loadPlugInEntryPoint, but looks first into the registry
+        """
+        key = (plugInName, entryPointMethodName)
+        func = self.entry_points.get(key)
+        if func is None:
+            self.misses += 1
+            module = loadPlugInModule(plugInName)
+            func = getattr(module, entryPointMethodName or plugInName.split('.')[-1],
+                           _missing)
+            self.entry_points[key] = func
+        else:
+            self.hits += 1
+        if func is _missing:
+            if returnNone:
+                return None
+            raise AttributeError("Plug-in %s has no %s entry point" %
+                                 (plugInName, entryPointMethodName or 'default'))
+        return func
+
+    def command(self, cmd, modname):
+        """
+        Returns the module handling `cmd`, importing it from `modname` if it is
+        not in the registry yet
+        """
+        key = (cmd, modname)
+        module = self.commands.get(key)
+        if module is None:
+            self.misses += 1
+            module = importlib.import_module(modname)
+            self.commands[key] = module
+        else:
+            self.hits += 1
+        return module
+
+    def reload_command(self, cmd, modname):
+        """
+        Re-loads the module handling `cmd` from `modname` and returns it.
+        Other modules, and in particular plug-ins, are not re-loaded.
+        """
+        with self.reload_lock:
+            logger.debug("Re-loading command module: %s", modname)
+            module = reload(importlib.import_module(modname))
+            self.commands[(cmd, modname)] = module
+            return module
+
+    def statistics(self):
+        """
+        Return the number of entry points and commands in the registry, and
+        the number of lookups that did and didn't find them there
+        :return: dict
+        """
+        return {
+            'entry_points': len(self.entry_points),
+            'commands': len(self.commands),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,507 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2018
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+A parallel engine for the REGISTER command.
+
+The directory tree is scanned by a number of threads using scandir. The
+files found are handed over to a pool of workers that run the Registration
+Plug-Ins and calculate the checksums (optionally in a pool of processes,
+as this is CPU-bound), while a single thread writes the new files into the
+database in batches, each batch within a single transaction.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from six.moves import queue as Queue  # @UnresolvedImport
+
+try:
+    from os import scandir  # @UnusedImport
+except ImportError:
+    from scandir import scandir  # @UnresolvedImport @Reimport
+
+from . import ngamsArchiveUtils, ngamsCacheControlThread, ngamsFileUtils
+from ngamsLib import ngamsReqProps, ngamsFileInfo, ngamsDbCore, \
+    ngamsHighLevelLib, ngamsDiskUtils, ngamsLib, ngamsPlugInApi
+from ngamsLib.ngamsCore import genLog, mvFile, getFileCreationTime, \
+    NGAMS_HTTP_GET, NGAMS_REGISTER_CMD, \
+    NGAMS_FILE_STATUS_OK, NGAMS_DB_CH_FILE_INSERT
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of files waiting to be processed
+_QUEUE_DEPTH = 1000
+
+# Maximum time (in seconds) a processed file waits to be registered
+_BATCH_TIMEOUT = 1.0
+
+
+def scan_files(path, threads):
+    """
+    Yields the names of all files found under `path`, scanning directories
+    in parallel using `threads` threads. Symbolic links to directories are
+    not followed.
+    """
+
+    dirs = Queue.Queue()
+    found = Queue.Queue(_QUEUE_DEPTH)
+    lock = threading.Lock()
+    state = {'pending': 1, 'stopped': False}
+
+    def scanner():
+        while True:
+            dirname = dirs.get()
+            if dirname is None:
+                return
+            try:
+                for entry in scandir(dirname):
+                    if state['stopped']:
+                        break
+                    if entry.is_dir(follow_symlinks=False):
+                        with lock:
+                            state['pending'] += 1
+                        dirs.put(entry.path)
+                    elif entry.is_file():
+                        found.put(entry.path)
+            except OSError:
+                logger.warning("Error while scanning %s", dirname, exc_info=True)
+            finally:
+                with lock:
+                    state['pending'] -= 1
+                    last = state['pending'] == 0
+                if last:
+                    found.put(None)
+
+    scanners = [threading.Thread(target=scanner, name="REGISTER-SCAN-%d" % i)
+                for i in range(max(1, threads))]
+    for t in scanners:
+        t.daemon = True
+        t.start()
+
+    dirs.put(path)
+    try:
+        while True:
+            filename = found.get()
+            if filename is None:
+                break
+            yield filename
+    finally:
+        state['stopped'] = True
+        for _ in scanners:
+            dirs.put(None)
+        # Unblock scanners that might be waiting to hand over a file
+        while any(t.is_alive() for t in scanners):
+            try:
+                found.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+
+
+def _process_pool(processes):
+    """
+    Creates a pool of processes. The server is multithreaded at this point,
+    so processes are not forked directly from it where avoidable, as they
+    could inherit locks held by other threads (e.g., logging's) and deadlock.
+    """
+    for method in ('forkserver', 'spawn'):
+        try:
+            return multiprocessing.get_context(method).Pool(processes)
+        except (AttributeError, ValueError):
+            # python 2, or method not available in this platform
+            pass
+    return multiprocessing.Pool(processes)
+
+
+class _result(object):
+    """The outcome of processing a file"""
+
+    def __init__(self, filename, diskId, start, piRes=None, checksum=None,
+                 crc_variant=None, rejected=None, error=None):
+        self.filename = filename
+        self.disk_id = diskId
+        self.start = start
+        self.pi_res = piRes
+        self.checksum = checksum
+        self.crc_variant = crc_variant
+        self.rejected = rejected
+        self.error = error
+
+
+class RegisterEngine(object):
+    """
+    Registers files using a pool of workers and a single DB writer.
+    See the module documentation for details.
+    """
+
+    def __init__(self, srvObj, diskInfoDic, workers, processes, batch_size,
+                 reqPropsObj=None, regDbm=None):
+        """
+        srvObj:       Instance of NG/AMS Server object (ngamsServer).
+
+        diskInfoDic:  Dictionary with Disk IDs as keys pointing to the info
+                      about the disk (dictionary/ngamsDiskInfo).
+
+        workers:      Number of threads running the Registration Plug-Ins
+                      (integer).
+
+        processes:    Number of processes calculating checksums. If 0 the
+                      checksums are calculated by the workers (integer).
+
+        batch_size:   Maximum number of files registered in the DB within
+                      a single transaction (integer).
+
+        reqPropsObj:  Request Properties Object to update as files are
+                      processed, if any (ngamsReqProps).
+
+        regDbm:       DBM where the File Info Object of each file is stored
+                      for the registration report, if any (ngamsDbm).
+        """
+        self._srv = srvObj
+        self._db = srvObj.getDb()
+        self._disk_info = diskInfoDic
+        self._workers = max(1, workers)
+        self._processes = processes
+        self._batch_size = max(1, batch_size)
+        self._req_props = reqPropsObj
+        self._reg_dbm = regDbm
+
+        # We maintain the old checksum name for backwards compatibility
+        self._crc_variant = srvObj.cfg.getCRCVariant()
+        if self._crc_variant == ngamsFileUtils.CHECKSUM_CRC32_INCONSISTENT:
+            self._crc_variant = 'ngamsGenCrc32'
+
+        self._files = Queue.Queue(_QUEUE_DEPTH)
+        self._results = Queue.Queue()
+        self._crc_pool = None
+        self._started = None
+        self._in_flight = set()
+        self._in_flight_cond = threading.Condition()
+
+        self.file_count = 0
+        self.registered_count = 0
+        self.failed_count = 0
+        self.rejected_count = 0
+        self._bytes = 0
+
+    def run(self, files):
+        """
+        Registers the given files, an iterable of [<Filename>, <Disk ID>,
+        <Mime-Type>] lists, and returns the time spent.
+        """
+        self._started = time.time()
+        if self._processes > 0:
+            self._crc_pool = _process_pool(self._processes)
+
+        workers = [threading.Thread(target=self._work,
+                                    name="REGISTER-WORKER-%d" % i)
+                   for i in range(self._workers)]
+        writer = threading.Thread(target=self._write, name="REGISTER-DB")
+        for t in workers + [writer]:
+            t.daemon = True
+            t.start()
+
+        try:
+            for fileInfo in files:
+                if not self._srv.run_async_commands:
+                    break
+                self.file_count += 1
+                if self._req_props:
+                    self._req_props.setExpectedCount(self.file_count)
+                self._files.put(fileInfo)
+        finally:
+            for _ in workers:
+                self._files.put(None)
+            for t in workers:
+                t.join()
+            self._results.put(None)
+            writer.join()
+            if self._crc_pool:
+                self._crc_pool.close()
+                self._crc_pool.join()
+
+        elapsed = time.time() - self._started
+        self._log_progress(elapsed)
+        return elapsed
+
+    #
+    # Running Plug-Ins and calculating checksums
+    #
+    def _work(self):
+        while True:
+            fileInfo = self._files.get()
+            if fileInfo is None:
+                return
+            filename, diskId, mimeType = fileInfo
+            start = time.time()
+            try:
+                self._results.put(self._process(filename, diskId, mimeType,
+                                                start))
+            except Exception as e:
+                errMsg = genLog("NGAMS_ER_FILE_REG_FAILED", [filename, str(e)])
+                logger.error(errMsg)
+                self._results.put(_result(filename, diskId, start,
+                                          error=errMsg))
+
+    def _process(self, filename, diskId, mimeType, start):
+
+        try:
+            regPi = self._srv.cfg.register_plugins[mimeType]
+        except KeyError:
+            raise ValueError("No registration plug-in defined for mime-type '%s'" % (mimeType,))
+        params = ngamsPlugInApi.parseRawPlugInPars(regPi.pars)
+        plugInMethod = self._srv.plugins.entry_point(regPi.name)
+
+        # Versions are assigned by the Plug-Ins from the contents of the DB,
+        # so a file with the same ID as another one not yet registered has
+        # to wait for it to be registered, and then run the Plug-In again.
+        while True:
+            tmpReqPropsObj = ngamsReqProps.ngamsReqProps().\
+                             setMimeType(mimeType).\
+                             setStagingFilename(filename).\
+                             setTargDiskInfo(self._disk_info[diskId]).\
+                             setHttpMethod(NGAMS_HTTP_GET).\
+                             setCmd(NGAMS_REGISTER_CMD).\
+                             setSize(os.path.getsize(filename)).\
+                             setFileUri(filename).\
+                             setNoReplication(1)
+            piRes = plugInMethod(self._srv, tmpReqPropsObj, params)
+            fileId = piRes.getFileId()
+            with self._in_flight_cond:
+                if fileId not in self._in_flight:
+                    self._in_flight.add(fileId)
+                    break
+                while fileId in self._in_flight:
+                    self._in_flight_cond.wait()
+
+        try:
+            return self._checksum_and_move(filename, diskId, start, piRes)
+        except:
+            self._release(fileId)
+            raise
+
+    def _checksum_and_move(self, filename, diskId, start, piRes):
+
+        # Check if this file is already registered on this disk. In case
+        # yes, it is not registered again.
+        files = self._db.getFileSummary1(self._srv.getHostId(),
+                                         [piRes.getDiskId()],
+                                         [piRes.getFileId()])
+        for tmpFileInfo in files:
+            tmpComplFilename = os.path.normpath(tmpFileInfo[ngamsDbCore.SUM1_MT_PT] +
+                                                "/" + tmpFileInfo[ngamsDbCore.SUM1_FILENAME])
+            if tmpComplFilename == filename:
+                tmpMsgForm = "REJECTED: File with File ID/Version: %s/%d " +\
+                             "and path: %s is already registered on disk " +\
+                             "with Disk ID: %s"
+                tmpMsg = tmpMsgForm % (piRes.getFileId(),
+                                       piRes.getFileVersion(), filename,
+                                       piRes.getDiskId())
+                logger.warning(tmpMsg + ". File is not registered again.")
+                self._release(piRes.getFileId())
+                return _result(filename, diskId, start, rejected=tmpMsg)
+
+        args = (65536, filename, self._crc_variant)
+        if self._crc_pool:
+            checksum = self._crc_pool.apply(ngamsFileUtils.get_checksum, args)
+        else:
+            checksum = ngamsFileUtils.get_checksum(*args)
+
+        mvFile(filename, piRes.getCompleteFilename())
+        return _result(filename, diskId, start, piRes=piRes,
+                       checksum=checksum or '', crc_variant=self._crc_variant)
+
+    #
+    # Registration
+    #
+    def _write(self):
+
+        batch = []
+        last_flush = time.time()
+        while True:
+            try:
+                res = self._results.get(timeout=_BATCH_TIMEOUT)
+            except Queue.Empty:
+                res = False
+
+            if res is None:
+                break
+            elif res and res.error is not None:
+                self._failed(res, res.error)
+            elif res and res.rejected is not None:
+                self.rejected_count += 1
+                if self._reg_dbm is not None:
+                    self._reg_dbm.addIncKey(ngamsFileInfo.ngamsFileInfo().\
+                                            setDiskId(res.disk_id).\
+                                            setFilename(res.filename).\
+                                            setTag(res.rejected))
+                self._processed(res)
+            elif res:
+                batch.append(res)
+
+            if batch and (len(batch) >= self._batch_size or
+                          time.time() - last_flush >= _BATCH_TIMEOUT):
+                self._register(batch)
+                batch = []
+                last_flush = time.time()
+
+        if batch:
+            self._register(batch)
+        if self._reg_dbm is not None:
+            self._reg_dbm.sync()
+
+    def _register(self, batch):
+
+        hostId = self._srv.getHostId()
+        try:
+            # Check that the files are really contained in their final
+            # location before registering them
+            ngamsFileUtils.syncCachesCheckFiles(self._srv,
+                                                [r.pi_res.getCompleteFilename() for r in batch])
+
+            # Files with previous versions might need to be associated
+            # with a container, which is handled by updateFileInfoDb
+            simple = []
+            for res in batch:
+                piRes = res.pi_res
+                if piRes.getFileVersion() > 1:
+                    ngamsArchiveUtils.updateFileInfoDb(self._srv, piRes,
+                                                       res.checksum,
+                                                       res.crc_variant,
+                                                       sync_disk=False)
+                    ngamsDiskUtils.updateDiskStatusDb(self._db, piRes)
+                    continue
+                creDate = getFileCreationTime(piRes.getCompleteFilename())
+                simple.append(ngamsFileInfo.ngamsFileInfo().\
+                              setDiskId(piRes.getDiskId()).\
+                              setFilename(piRes.getRelFilename()).\
+                              setFileId(piRes.getFileId()).\
+                              setFileVersion(piRes.getFileVersion()).\
+                              setFormat(piRes.getFormat()).\
+                              setFileSize(piRes.getFileSize()).\
+                              setUncompressedFileSize(piRes.getUncomprSize()).\
+                              setCompression(piRes.getCompression()).\
+                              setIngestionDate(time.time()).\
+                              setChecksum(res.checksum).\
+                              setChecksumPlugIn(res.crc_variant).\
+                              setFileStatus(NGAMS_FILE_STATUS_OK).\
+                              setCreationDate(creDate).\
+                              setIoTime(piRes.getIoTime()).\
+                              setIgnore(0))
+            dbOperations = self._db.writeFileEntries(hostId, simple) if simple else []
+        except Exception as e:
+            logger.exception("Failed to register %d files", len(batch))
+            for res in batch:
+                self._release(res.pi_res.getFileId())
+                self._failed(res, genLog("NGAMS_ER_FILE_REG_FAILED",
+                                         [res.filename, str(e)]))
+            return
+
+        for fio in simple:
+            self._srv.file_location_cache.invalidate(fio.getFileId())
+
+        # Update the status of the disks once per disk
+        disks = {}
+        for fio, dbOperation in zip(simple, dbOperations):
+            newFiles, nbytes, ioTime = disks.get(fio.getDiskId(), (0, 0, 0))
+            if dbOperation == NGAMS_DB_CH_FILE_INSERT:
+                newFiles += 1
+            disks[fio.getDiskId()] = (newFiles, nbytes + fio.getFileSize(),
+                                      ioTime + fio.getIoTime())
+        for diskId, (newFiles, nbytes, ioTime) in disks.items():
+            ngamsDiskUtils.updateDiskStatusDbFiles(self._db, diskId, newFiles,
+                                                   nbytes, ioTime)
+
+        for res in batch:
+            piRes = res.pi_res
+            self._release(piRes.getFileId())
+            ngamsLib.makeFileReadOnly(piRes.getCompleteFilename())
+            self.registered_count += 1
+            self._bytes += piRes.getFileSize()
+
+            if self._reg_dbm is not None:
+                self._reg_dbm.addIncKey(ngamsFileInfo.ngamsFileInfo().\
+                                        setDiskId(res.disk_id).\
+                                        setFilename(res.filename).\
+                                        setFileId(piRes.getFileId()).\
+                                        setFileVersion(piRes.getFileVersion()).\
+                                        setFormat(piRes.getFormat()).\
+                                        setFileSize(piRes.getFileSize()).\
+                                        setUncompressedFileSize(piRes.getUncomprSize()).\
+                                        setCompression(piRes.getCompression()).\
+                                        setIngestionDate(time.time()).\
+                                        setIgnore(0).\
+                                        setChecksum(res.checksum).\
+                                        setChecksumPlugIn(res.crc_variant).\
+                                        setFileStatus(NGAMS_FILE_STATUS_OK).\
+                                        setTag("REGISTERED"))
+
+            # If running as a cache archive, update the Cache New Files DBM
+            # with the information about the new file.
+            if self._srv.getCachingActive():
+                ngamsCacheControlThread.addEntryNewFilesDbm(self._srv,
+                                                            res.disk_id,
+                                                            piRes.getFileId(),
+                                                            piRes.getFileVersion(),
+                                                            res.filename)
+
+            msg = genLog("NGAMS_INFO_FILE_REGISTERED",
+                         [res.filename, piRes.getFileId(),
+                          piRes.getFileVersion(), piRes.getFormat()])
+            logger.info(msg + ". Time: %.3fs.", time.time() - res.start,
+                        extra={'to_syslog': 1})
+            self._processed(res)
+
+        self._log_progress(time.time() - self._started)
+
+    def _release(self, fileId):
+        """Allows other files with the given ID to be registered"""
+        with self._in_flight_cond:
+            self._in_flight.discard(fileId)
+            self._in_flight_cond.notify_all()
+
+    def _failed(self, res, errMsg):
+        self.failed_count += 1
+        if self._reg_dbm is not None:
+            self._reg_dbm.addIncKey(ngamsFileInfo.ngamsFileInfo().\
+                                    setDiskId(res.disk_id).\
+                                    setFilename(res.filename).\
+                                    setTag(errMsg))
+        self._processed(res)
+
+    def _processed(self, res):
+        if self._req_props:
+            self._req_props.incActualCount(1)
+            ngamsHighLevelLib.stdReqTimeStatUpdate(self._srv, self._req_props,
+                                                   time.time() - self._started)
+
+    def _log_progress(self, elapsed):
+        elapsed = max(elapsed, 1e-6)
+        logger.info("Registered %d/%d files (%d failed, %d rejected) in %.3fs: "
+                    "%.3f files/s, %.3f MB/s",
+                    self.registered_count, self.file_count, self.failed_count,
+                    self.rejected_count, elapsed,
+                    self.registered_count / elapsed,
+                    self._bytes / 1048576. / elapsed)
@@ -0,0 +1,256 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Server-wide staging of files kept in hierarchical storage (e.g., tapes)"""
+
+import collections
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StagingServiceStopped(Exception):
+    """Raised to the requesters of files still queued when the service stops"""
+
+
+class _Recall(object):
+    """A file being brought online, shared by all its requesters"""
+
+    __slots__ = ('filename', 'request', 'requested_at', 'done', 'error')
+
+    def __init__(self, filename, request, requested_at):
+        self.filename = filename
+        self.request = request
+        self.requested_at = requested_at
+        self.done = threading.Event()
+        self.error = None
+
+
+class StagingService(object):
+    """
+    Brings files online through the isFileOffline and stageFiles functions
+    of the File Staging Plug-In, on behalf of every part of the server
+    (RETRIEVE, subscription deliveries, etc).
+
+    Files found online are returned straight away. Offline files are queued,
+    and concurrent requests for a file already queued or being staged wait
+    for the same recall. A single worker thread gathers the queued files
+    during `batch_wait` seconds (or until `max_batch` are queued), and hands
+    the oldest `max_batch` of them to stageFiles in one call, sorted by path
+    so files archived together (and thus likely on the same tape) are
+    recalled together. Requesters are woken up as soon as their batch is
+    staged, or get the error raised by the plug-in. Neither requesters nor
+    `stop` wait for the plug-in longer than `timeout` seconds.
+    """
+
+    def __init__(self, is_file_offline, stage_files, max_batch=100, batch_wait=1.0,
+                 timeout=10, server=None, clock=time.time):
+        self.is_file_offline = is_file_offline
+        self.stage_files = stage_files
+        self.max_batch = max(1, max_batch)
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.server = server
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.pending = collections.OrderedDict()
+        self.in_flight = {}
+        self.thread = None
+        self.stopping = False
+
+        # Statistics
+        self.requests = 0
+        self.online_hits = 0
+        self.coalesced = 0
+        self.recalled = 0
+        self.failed = 0
+        self.batches = 0
+        self.latency_total = 0.
+        self.latency_max = 0.
+
+    def stage(self, filenames, request=None):
+        """
+        Makes sure `filenames` are online, waiting until they have been
+        staged if necessary. `request` is the ngamsReqProps object of the
+        request needing the files, if any, and is given to the plug-in when
+        a file is staged on its own. socket.timeout is raised if the files
+        are not staged within `timeout` seconds.
+
+        :return: The number of files that were offline
+        """
+        recalls = []
+        for filename in filenames:
+            with self.condition:
+                if self.stopping:
+                    raise StagingServiceStopped("Staging service has been stopped")
+                self.requests += 1
+                recall = self.pending.get(filename) or self.in_flight.get(filename)
+                if recall:
+                    self.coalesced += 1
+                    recalls.append(recall)
+                    continue
+
+            # Checked outside the lock, it might take a while
+            if self.is_file_offline(filename) == 0:
+                with self.condition:
+                    self.online_hits += 1
+                continue
+
+            with self.condition:
+                recall = self.pending.get(filename) or self.in_flight.get(filename)
+                if recall:
+                    self.coalesced += 1
+                else:
+                    logger.debug("File %s is offline, queueing it for staging", filename)
+                    recall = _Recall(filename, request, self.clock())
+                    self.pending[filename] = recall
+                    self._start()
+                    self.condition.notify_all()
+                recalls.append(recall)
+
+        deadline = time.time() + self.timeout
+        for recall in recalls:
+            if not recall.done.wait(max(0, deadline - time.time())):
+                raise socket.timeout("Staging of %s didn't finish within %.1f [s]" %
+                                     (recall.filename, self.timeout))
+            if recall.error is not None:
+                raise recall.error
+        return len(recalls)
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='StagingService')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending and not self.stopping:
+                self.condition.wait()
+
+            # Give other requests the chance to join the batch
+            deadline = self.clock() + self.batch_wait
+            while len(self.pending) < self.max_batch and not self.stopping:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if self.stopping:
+                return None
+
+            batch = []
+            while self.pending and len(batch) < self.max_batch:
+                _, recall = self.pending.popitem(last=False)
+                self.in_flight[recall.filename] = recall
+                batch.append(recall)
+            return sorted(batch, key=lambda r: r.filename)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            filenames = [r.filename for r in batch]
+            kwargs = {'filenames': filenames, 'serverObj': self.server}
+            if len(batch) == 1 and batch[0].request is not None:
+                kwargs['requestObj'] = batch[0].request
+            logger.info("Staging %d files", len(filenames))
+            error = None
+            start = self.clock()
+            try:
+                self.stage_files(**kwargs)
+            except Exception as e:
+                logger.exception("Error while staging files %s", ', '.join(filenames))
+                error = e
+            now = self.clock()
+            logger.debug("Staged %d files in %.3f [s]", len(filenames), now - start)
+
+            with self.condition:
+                self.batches += 1
+                for recall in batch:
+                    del self.in_flight[recall.filename]
+                    if error is not None:
+                        self.failed += 1
+                    else:
+                        self.recalled += 1
+                        latency = now - recall.requested_at
+                        self.latency_total += latency
+                        self.latency_max = max(self.latency_max, latency)
+                    recall.error = error
+                    recall.done.set()
+
+    def statistics(self):
+        """
+        Return the depth of the staging queue, the hit rate of files found
+        already online and the latency of recalls, amongst others
+        :return: dict
+        """
+        with self.condition:
+            return {
+                'queue_depth': len(self.pending),
+                'in_flight': len(self.in_flight),
+                'requests': self.requests,
+                'online_hits': self.online_hits,
+                'coalesced': self.coalesced,
+                'hit_rate': self.online_hits / float(self.requests) if self.requests else 0.,
+                'recalled': self.recalled,
+                'failed': self.failed,
+                'batches': self.batches,
+                'avg_batch_size': (self.recalled + self.failed) / float(self.batches) if self.batches else 0.,
+                'avg_recall_latency': self.latency_total / self.recalled if self.recalled else 0.,
+                'max_recall_latency': self.latency_max,
+            }
+
+    def log_statistics(self):
+        stats = self.statistics()
+        logger.info("Staging: %d files requested, %.1f%% already online, %d coalesced, "
+                    "%d recalled in %d batches, %d failed, %d queued, recall latency %.3f [s] avg, %.3f [s] max",
+                    stats['requests'], stats['hit_rate'] * 100, stats['coalesced'], stats['recalled'],
+                    stats['batches'], stats['failed'], stats['queue_depth'], stats['avg_recall_latency'],
+                    stats['max_recall_latency'])
+
+    def stop(self, timeout=None):
+        """
+        Stops the service, failing the requests for files still queued. The
+        worker thread is waited for at most `timeout` seconds (the service's
+        own timeout by default), in case it is stuck in the File Staging
+        Plug-In.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self.condition:
+            self.stopping = True
+            pending, self.pending = list(self.pending.values()), collections.OrderedDict()
+            self.condition.notify_all()
+        for recall in pending:
+            recall.error = StagingServiceStopped("Staging service has been stopped")
+            recall.done.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                logger.warning("Staging thread still running after %.1f [s], "
+                               "the File Staging Plug-In might be stuck", timeout)
+            self.thread = None
+        self.log_statistics()
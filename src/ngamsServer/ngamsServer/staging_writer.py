@@ -0,0 +1,258 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Writing of incoming data into staging files"""
+
+import collections
+import errno
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_NONE = 'none'
+DURABILITY_END = 'end'
+DURABILITY_PERIODIC = 'periodic'
+
+staging_policy = collections.namedtuple('staging_policy', 'preallocate durability sync_bytes')
+
+#: Used for volumes that don't belong to any Storage Set
+DEFAULT_POLICY = staging_policy(True, DURABILITY_NONE, 64 * 1024 * 1024)
+
+# Not all platforms have these
+fdatasync = getattr(os, 'fdatasync', os.fsync)
+_fallocate = getattr(os, 'posix_fallocate', None)
+_fadvise = getattr(os, 'posix_fadvise', None)
+
+
+def staging_policy_for(cfg, slot_id):
+    """
+    Return the staging_policy configured for the Storage Set containing the
+    disk at `slot_id`
+    """
+    for storage_set in cfg.getStorageSetList():
+        if slot_id in (storage_set.getMainDiskSlotId(), storage_set.getRepDiskSlotId()):
+            return staging_policy(bool(storage_set.getPreallocate()),
+                                  storage_set.getDurability(),
+                                  storage_set.getSyncInterval() * 1024 * 1024)
+    return DEFAULT_POLICY
+
+
+def _advise(fd, offset, length, advice):
+    if _fadvise is None:
+        return
+    try:
+        _fadvise(fd, offset, length, advice)
+    except OSError as e:
+        logger.debug("posix_fadvise failed: %s", e)
+
+
+def preallocate(fd, offset, size, fname=None):
+    """
+    Preallocates `size` bytes starting at `offset` in file descriptor `fd`.
+    Failures other than lack of space are ignored.
+
+    :return: Whether the space was preallocated
+    """
+    if _fallocate is None:
+        return False
+    try:
+        _fallocate(fd, offset, size)
+        return True
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        logger.debug("Cannot preallocate %d bytes for %s: %s", size, fname or fd, e)
+        return False
+
+
+def sync_file(fname, policy):
+    """
+    Flushes to disk the contents of `fname`, written by a third party, if
+    `policy` requires it
+    """
+    if policy.durability == DURABILITY_NONE:
+        return
+    fd = os.open(fname, os.O_RDONLY)
+    try:
+        fdatasync(fd)
+    finally:
+        os.close(fd)
+
+
+class StagingFile(object):
+    """
+    A file object writing incoming data into a staging file.
+
+    When the amount of data to be written is known it is preallocated, which
+    keeps the file contiguous on disk and fails early if the volume cannot
+    hold it. Data is flushed to disk as mandated by the durability policy,
+    and if `drop_cache` is True it is also evicted from the page cache once
+    on disk, since it is not going to be read again soon.
+
+    If less data than preallocated is written (e.g., because the transfer
+    failed) the file is truncated on close, so it can be resumed later on.
+    """
+
+    def __init__(self, fname, size=None, policy=DEFAULT_POLICY, append=False,
+                 drop_cache=False):
+        self.fname = fname
+        self.policy = policy or DEFAULT_POLICY
+        self.drop_cache = drop_cache
+        # Not opened with O_APPEND, which would write after the preallocated space
+        flags = os.O_WRONLY | os.O_CREAT | (0 if append else os.O_TRUNC)
+        self.f = os.fdopen(os.open(fname, flags, 0o666), 'wb')
+        self.fd = self.f.fileno()
+        self.f.seek(0, os.SEEK_END)
+        self.offset = self.f.tell()
+        self.synced = self.offset
+        self.allocated = self.offset
+        self.syncs = 0
+        if _fadvise is not None:
+            _advise(self.fd, self.offset, 0, os.POSIX_FADV_SEQUENTIAL)
+        if size and self.policy.preallocate:
+            self._preallocate(size)
+
+    def _preallocate(self, size):
+        if preallocate(self.fd, self.offset, size, self.fname):
+            self.allocated = self.offset + size
+
+    def _sync(self):
+        self.f.flush()
+        fdatasync(self.fd)
+        self.syncs += 1
+        if self.drop_cache and _fadvise is not None:
+            _advise(self.fd, self.synced, self.offset - self.synced, os.POSIX_FADV_DONTNEED)
+        self.synced = self.offset
+
+    def write(self, data):
+        self.f.write(data)
+        self.offset += len(data)
+        if (self.policy.durability == DURABILITY_PERIODIC and
+                self.offset - self.synced >= self.policy.sync_bytes):
+            self._sync()
+
+    def close(self, completed=True):
+        """
+        Closes the file. If `completed` is False the data is not synced
+        regardless of the durability policy.
+        """
+        if self.f.closed:
+            return
+        try:
+            self.f.flush()
+            if self.allocated > self.offset:
+                os.ftruncate(self.fd, self.offset)
+            if completed and self.policy.durability != DURABILITY_NONE:
+                self._sync()
+            elif self.drop_cache and _fadvise is not None:
+                # Starts the write-back of the data, only pages already
+                # written are evicted from the page cache
+                _advise(self.fd, self.synced, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, tb):
+        self.close(completed=typ is None)
+
+
+class ChecksumFollower(object):
+    """
+    Calculates the checksum of a file while a third party writes it
+    sequentially, reading the data right behind the writer so it is still
+    in the page cache, instead of reading the whole file back afterwards.
+
+    If the file is replaced rather than written in place the checksum
+    cannot be trusted, and finish() returns None.
+    """
+
+    def __init__(self, fname, checksum_info, block_size=65536, poll_interval=0.1):
+        """
+        :param fname: string, Name of the file being written
+        :param checksum_info: The checksum to calculate, as returned by ngamsFileUtils.get_checksum_info
+        :param block_size: int, Block size (bytes) used to read the data
+        :param poll_interval: float, Time in seconds to wait for more data
+        """
+        self.fname = fname
+        self.checksum_info = checksum_info
+        self.block_size = block_size
+        self.poll_interval = poll_interval
+        self.size = 0
+        self.crc = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ChecksumFollower')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _follow(self):
+        crc_method = self.checksum_info.method
+        crc = self.checksum_info.init
+        f = None
+        try:
+            while True:
+                # Once the writer is done everything left is read in one go
+                done = self._done.is_set()
+                if f is None:
+                    try:
+                        f = open(self.fname, 'rb', 0)
+                    except (IOError, OSError):
+                        if done:
+                            return None
+                        self._done.wait(self.poll_interval)
+                        continue
+                data = f.read(self.block_size)
+                if data:
+                    crc = crc_method(data, crc)
+                    self.size += len(data)
+                elif done:
+                    break
+                else:
+                    self._done.wait(self.poll_interval)
+            stat = os.stat(self.fname)
+            if os.fstat(f.fileno()).st_ino != stat.st_ino or stat.st_size != self.size:
+                logger.info("%s was replaced while being written, cannot use its checksum", self.fname)
+                return None
+            return self.checksum_info.final(crc)
+        finally:
+            if f is not None:
+                f.close()
+
+    def _run(self):
+        try:
+            self.crc = self._follow()
+        except Exception:
+            logger.exception("Error while calculating the checksum of %s", self.fname)
+
+    def finish(self):
+        """
+        Indicates that the file has been completely written, and returns its
+        checksum, or None if it could not be calculated
+        """
+        self._done.set()
+        self._thread.join()
+        return self.crc
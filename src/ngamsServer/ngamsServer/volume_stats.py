@@ -0,0 +1,159 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""In-memory view of the volumes of a server and of their statistics"""
+
+import copy
+import logging
+import threading
+import time
+
+from ngamsLib import ngamsDiskInfo
+from ngamsLib.ngamsCore import getDiskSpaceAvail
+
+logger = logging.getLogger(__name__)
+
+
+class VolumeStats(object):
+    """
+    The volumes of this server, with their number of files and bytes stored.
+
+    As files are archived their number and size are accumulated in memory
+    per volume, and written to the ngas_disks table with a single relative
+    UPDATE (together with the volume's available space) once `flush_files`
+    files have been accumulated for a volume, or `flush_period` seconds
+    after the first of them. The volumes themselves are read from the DB at
+    most every `cache_time` seconds, with the pending increments applied on
+    top, and are used to select the target volume for new files.
+    """
+
+    def __init__(self, get_db, host_id, flush_files=1, flush_period=5, cache_time=0):
+        self.get_db = get_db
+        self.host_id = host_id
+        self.flush_files = max(1, flush_files)
+        self.flush_period = flush_period
+        self.cache_time = cache_time
+        self.lock = threading.Lock()
+        # disk_id -> [number of files, bytes, mount point]
+        self.pending = {}
+        self.volumes = None
+        self.loaded_at = 0
+        self.timer = None
+
+    def _schedule_flush(self):
+        if self.timer is None and self.pending:
+            self.timer = threading.Timer(self.flush_period, self._timed_flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _timed_flush(self):
+        with self.lock:
+            self.timer = None
+        self.flush()
+
+    def add_file(self, disk_id, file_size, mount_point=None):
+        """Accounts for a new file of `file_size` bytes stored in volume `disk_id`"""
+        with self.lock:
+            entry = self.pending.setdefault(disk_id, [0, 0, mount_point])
+            entry[0] += 1
+            entry[1] += file_size
+            entry[2] = mount_point or entry[2]
+            if self.volumes is not None and disk_id in self.volumes:
+                volume = self.volumes[disk_id]
+                volume.setNumberOfFiles(volume.getNumberOfFiles() + 1)
+                volume.setBytesStored(volume.getBytesStored() + file_size)
+                volume.setAvailableMb(volume.getAvailableMb() - file_size / 1048576.)
+            flush = entry[0] >= self.flush_files
+            if not flush:
+                self._schedule_flush()
+        if flush:
+            self.flush(disk_id)
+
+    def flush(self, disk_id=None):
+        """Writes the pending statistics of one or all volumes into the DB"""
+        with self.lock:
+            if disk_id is None:
+                pending, self.pending = self.pending, {}
+            elif disk_id in self.pending:
+                pending = {disk_id: self.pending.pop(disk_id)}
+            else:
+                return
+
+        for disk_id, (n_files, n_bytes, mount_point) in pending.items():
+            available_mb = None
+            try:
+                if mount_point:
+                    available_mb = getDiskSpaceAvail(mount_point)
+                self.get_db().add_files(disk_id, n_files, n_bytes, available_mb)
+            except Exception:
+                logger.exception("Error while updating statistics of volume %s, will retry later", disk_id)
+                with self.lock:
+                    entry = self.pending.setdefault(disk_id, [0, 0, mount_point])
+                    entry[0] += n_files
+                    entry[1] += n_bytes
+                    self._schedule_flush()
+                continue
+            if available_mb is not None:
+                with self.lock:
+                    if self.volumes is not None and disk_id in self.volumes:
+                        self.volumes[disk_id].setAvailableMb(available_mb)
+
+    def get_volumes(self):
+        """Returns a copy of the ngamsDiskInfo objects of the volumes of this server"""
+        with self.lock:
+            fresh = (self.volumes is not None and
+                     time.time() - self.loaded_at < self.cache_time)
+            if fresh:
+                return [copy.copy(v) for v in self.volumes.values()]
+
+        volumes = {}
+        for row in self.get_db().getDiskInfoForSlotsAndHost(self.host_id, []):
+            volume = ngamsDiskInfo.ngamsDiskInfo().unpackSqlResult(row)
+            volumes[volume.getDiskId()] = volume
+
+        with self.lock:
+            # Increments being flushed right now are missed until the next
+            # load, which is fine for the purpose of selecting volumes
+            for disk_id, (n_files, n_bytes, _) in self.pending.items():
+                if disk_id in volumes:
+                    volume = volumes[disk_id]
+                    volume.setNumberOfFiles(volume.getNumberOfFiles() + n_files)
+                    volume.setBytesStored(volume.getBytesStored() + n_bytes)
+            self.volumes = volumes
+            self.loaded_at = time.time()
+            return [copy.copy(v) for v in volumes.values()]
+
+    def available_volumes(self):
+        """Returns a copy of the volumes of this server not marked as completed"""
+        return [v for v in self.get_volumes() if not v.getCompleted()]
+
+    def invalidate(self):
+        """Makes the next access read the volumes from the DB again"""
+        with self.lock:
+            self.volumes = None
+
+    def close(self):
+        """Writes all pending statistics into the DB"""
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        self.flush()
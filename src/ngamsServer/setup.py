@@ -35,6 +35,7 @@ install_requires = [
     'netifaces',
     'python-daemon <= 2.3.0; python_version < "3"',
     'python-daemon; python_version >= "3"',
+    'scandir; python_version < "3.5"',
 ]
 
 # Users might opt out from depending on crc32c
@@ -51,7 +51,7 @@ import traceback
 import getpass
 
 from ngamsLib.ngamsCore import checkCreatePath, getHostName, mvFile, rmFile, NGAMS_CHECKFILE_CMD, NGAMS_CLONE_CMD, \
-    NGAMS_FAILURE
+    NGAMS_FAILURE, NGAMS_FILE_STATUS_OK
 from ngamsLib import ngamsDbCore
 from ngamsLib import ngamsDbm
 from ngamsLib import ngamsDiskInfo
@@ -165,6 +165,15 @@ list.
 4. Synchronizing an entire cluster:
 The Session ID will be the name of the Source Cluster.
 
+With the --manifest-diff option, the files to synchronize are not checked one
+by one against the Target Cluster. Instead, a manifest of (File ID, File
+Version, File Size, Checksum) entries sorted by File ID and File Version is
+streamed from the DB for the source and for the Target Cluster, and the two
+manifests are merged in a single pass. Only the files missing in the Target
+Cluster, or registered there with a different size or checksum, are queued
+for synchronization. The option cannot be used together with --file-list, and
+requires the DB to sort File IDs in byte order (e.g. the "C" collation).
+
 Files and session directories in the working directory will be kept 30 days
 after creation, independently of if the synchronization batch was successfully
 terminated or not.
@@ -208,6 +217,7 @@ PAR_DISK_ID = "disk-id"
 PAR_HOST_ID = "host-id"
 PAR_FILE_LIST = "file-list"
 PAR_INT_NOTIF = "intermediate-notif"
+PAR_MANIFEST_DIFF = "manifest-diff"
 PAR_NOTIF_EMAIL = "notif-email"
 PAR_STREAMS = "streams"
 PAR_TARGET_CLUSTER = "target-cluster"
@@ -290,7 +300,12 @@ _options = [
 
     [PAR_CHECK_FILE, [], 0, ngasUtilsLib.NGAS_OPT_OPT, 0,
      "Execute a CHECKFILE Command for each file in the list in the " +
-     "Target Cluster - TO BE USED WITH CAUTION!"]
+     "Target Cluster - TO BE USED WITH CAUTION!"],
+
+    [PAR_MANIFEST_DIFF, [], 0, ngasUtilsLib.NGAS_OPT_OPT, 0,
+     "Determine the files to synchronize by merging the sorted manifests of " +
+     "the source and the Target Cluster in one pass, instead of querying the " +
+     "Target Cluster for each file."]
 ]
 
 _option_dict, _option_document = ngasUtilsLib.generate_options_dictionary_and_document(_options)
@@ -302,7 +317,7 @@ class NgasSyncRequest:
     Class to hold the information for one synchronization request.
     """
 
-    def __init__(self, disk_id, file_id, file_version, file_size):
+    def __init__(self, disk_id, file_id, file_version, file_size, known_missing=False):
         """
         Constructor
 
@@ -310,11 +325,13 @@ class NgasSyncRequest:
         :param file_id: File ID of source file (string)
         :param file_version: Version of source file (integer)
         :param file_size: File size in bytes (integer)
+        :param known_missing: File is known to be missing in the Target Cluster (boolean)
         """
         self.__disk_id = disk_id
         self.__file_id = file_id
         self.__file_version = file_version
         self.__file_size = file_size
+        self.__known_missing = known_missing
         self.__attempts = 0
         self.__last_attempt = 0.0
         self.__message = ""
@@ -403,6 +420,26 @@ class NgasSyncRequest:
         """
         return self.__file_size
 
+    def set_known_missing(self, known_missing):
+        """
+        Set whether the file is known to be missing in the Target Cluster
+
+        :param known_missing: File is known to be missing (boolean)
+        :return: Reference to object itself
+        """
+        self.__known_missing = known_missing
+        return self
+
+    def is_known_missing(self):
+        """
+        Return whether the file is known to be missing in the Target Cluster,
+        in which case it does not need to be looked up before being cloned
+
+        :return: True if the file is known to be missing (boolean)
+        """
+        # Requests pickled by older versions of the tool don't have it
+        return getattr(self, '_NgasSyncRequest__known_missing', False)
+
 
 def get_option_dict():
     """
@@ -470,6 +507,162 @@ def _get_cluster_nodes(connection, cluster_id):
     return node_list
 
 
+def _bind_names(start, count):
+    """
+    Generate the bind variable names for an SQL IN clause
+
+    :param start: Index of the first bind variable (integer)
+    :param count: Number of bind variables (integer)
+    :return: Comma separated list of bind variables (string)
+    """
+    return ",".join(["{" + str(start + i) + "}" for i in range(count)])
+
+
+def get_manifest(connection, disk_ids=None, host_ids=None, include_last_host=False, source=True):
+    """
+    Stream the manifest of the files registered on the given disks or hosts,
+    sorted by File ID and File Version. The result is read through a DB
+    cursor, so the manifest is never held in memory.
+
+    :param connection: DB connection (ngamsDb)
+    :param disk_ids: IDs of the disks to consider (list)
+    :param host_ids: IDs of the hosts to consider (list)
+    :param include_last_host: Also consider the disks last mounted on one of the given hosts (boolean)
+    :param source: If True, only consider files that are OK and not ignored (boolean)
+    :return: Generator yielding (<File ID>, <File Version>, <File Size>, <Checksum>, <Checksum Plug-In>,
+             <Disk ID>) tuples
+    """
+    sql = "select nf.file_id, nf.file_version, nf.file_size, nf.checksum, nf.checksum_plugin, nf.disk_id " \
+          "from ngas_files nf, ngas_disks nd where nf.disk_id = nd.disk_id"
+    args = []
+    if disk_ids:
+        sql += " and nf.disk_id in ({:s})".format(_bind_names(len(args), len(disk_ids)))
+        args += disk_ids
+    if host_ids:
+        host_cond = "nd.host_id in ({:s})".format(_bind_names(len(args), len(host_ids)))
+        args += host_ids
+        if include_last_host:
+            host_cond += " or nd.last_host_id in ({:s})".format(_bind_names(len(args), len(host_ids)))
+            args += host_ids
+        sql += " and ({:s})".format(host_cond)
+    if source:
+        sql += " and nf.{:s} = 0 and nf.file_status = '{:s}'".format(connection.file_ignore_columnname,
+                                                                   NGAMS_FILE_STATUS_OK)
+    sql += " order by nf.file_id, nf.file_version"
+
+    with connection.dbCursor(sql, args=args) as cursor:
+        for file_id, file_version, file_size, checksum, checksum_plugin, disk_id in cursor.fetch(1000):
+            yield file_id, int(file_version), float(file_size), checksum, checksum_plugin, disk_id
+
+
+def _check_manifest_order(manifest, name):
+    """
+    Pass through the entries of a manifest, checking that they are sorted by
+    File ID and File Version. The merge of two manifests relies on this, and
+    it fails silently if the DB sorts strings differently than Python does.
+
+    :param manifest: Manifest entries (iterable)
+    :param name: Name of the manifest, used in error messages (string)
+    :return: Generator yielding the manifest entries
+    """
+    last_key = None
+    for entry in manifest:
+        key = entry[:2]
+        if last_key is not None and key < last_key:
+            msg = "The {:s} manifest is not sorted by File ID/Version ({:s}/{:d} after {:s}/{:d}). " \
+                  "The DB must sort File IDs in byte order (e.g. the C collation)."
+            raise Exception(msg.format(name, key[0], key[1], last_key[0], last_key[1]))
+        last_key = key
+        yield entry
+
+
+def _manifest_entries_match(source_entry, target_entry):
+    """
+    Check whether a target manifest entry is a valid copy of a source entry.
+    The checksums are only compared if computed with the same plug-in.
+
+    :param source_entry: Source manifest entry (tuple)
+    :param target_entry: Target manifest entry (tuple)
+    :return: True if the entries match (boolean)
+    """
+    _, _, source_size, source_checksum, source_plugin, _ = source_entry
+    _, _, target_size, target_checksum, target_plugin, _ = target_entry
+    if source_size != target_size:
+        return False
+    if source_checksum and target_checksum and source_plugin == target_plugin:
+        return source_checksum == target_checksum
+    return True
+
+
+def diff_manifests(source_manifest, target_manifest):
+    """
+    Merge two manifests sorted by File ID and File Version, yielding the
+    source entries that are missing in the target manifest, or for which no
+    copy in the target manifest has the same size and checksum. Both
+    manifests are read once, and only their current entries are kept in
+    memory.
+
+    :param source_manifest: Sorted source manifest entries (iterable)
+    :param target_manifest: Sorted target manifest entries (iterable)
+    :return: Generator yielding (<Source Entry>, <Reason>) tuples, the reason being either "missing" or "mismatch"
+    """
+    target_iter = _check_manifest_order(target_manifest, "target")
+    target_entry = next(target_iter, None)
+    last_key = None
+    for source_entry in _check_manifest_order(source_manifest, "source"):
+        key = source_entry[:2]
+        # A file with several copies in the source is only synchronized once
+        if key == last_key:
+            continue
+        last_key = key
+        while target_entry is not None and target_entry[:2] < key:
+            target_entry = next(target_iter, None)
+        found = matched = False
+        while target_entry is not None and target_entry[:2] == key:
+            found = True
+            matched = matched or _manifest_entries_match(source_entry, target_entry)
+            target_entry = next(target_iter, None)
+        if not found:
+            yield source_entry, "missing"
+        elif not matched:
+            yield source_entry, "mismatch"
+
+
+def _add_manifest_diff_in_file_dbm(param_dict, queue_dbm):
+    """
+    Add the files missing or differing in the Target Cluster, computed by
+    merging the sorted source and target manifests
+
+    :param param_dict: Dictionary with parameters (dictionary)
+    :param queue_dbm: DBM in which to add the file info (ngamsDbm)
+    """
+    connection = param_dict[PAR_DB_CON]
+    if param_dict[PAR_DISK_ID]:
+        source_manifest = get_manifest(connection, disk_ids=[param_dict[PAR_DISK_ID]])
+    elif param_dict[PAR_HOST_ID]:
+        source_manifest = get_manifest(connection, host_ids=[param_dict[PAR_HOST_ID]])
+    else:
+        source_manifest = get_manifest(connection, host_ids=_get_cluster_nodes(connection, param_dict[PAR_CLUSTER_ID]))
+    if param_dict[PAR_TARGET_CLUSTER]:
+        target_nodes = get_cluster_nodes(connection, param_dict[PAR_TARGET_CLUSTER])
+    else:
+        target_nodes = param_dict[PAR_TARGET_NODES].split(",")
+    target_manifest = get_manifest(connection, host_ids=target_nodes, include_last_host=True, source=False)
+
+    missing_count = mismatch_count = 0
+    for (file_id, file_version, file_size, _, _, disk_id), reason in diff_manifests(source_manifest, target_manifest):
+        if reason == "missing":
+            missing_count += 1
+        else:
+            mismatch_count += 1
+        sync_req = NgasSyncRequest(disk_id, file_id, file_version, file_size, known_missing=True)
+        key = ngamsLib.genFileKey(None, file_id, file_version)
+        logger.info("DBM: Adding entry (%s in target cluster) in Tmp Queue DBM with key: %s", reason, key)
+        queue_dbm.add(key, sync_req)
+    logger.info("Manifest diff found %d missing and %d mismatched files in the target cluster",
+                missing_count, mismatch_count)
+
+
 def get_timestamp(seconds_since_epoch=None):
     """
     Returns ISO formatted timestamp
@@ -498,6 +691,13 @@ def initialize(param_dict):
     elif param_sum == 0:
         msg = "Must specify one of the {:s}, {:s}, {:s} or {:s} options"
         raise Exception(msg.format(PAR_CLUSTER_ID, PAR_DISK_ID, PAR_HOST_ID, PAR_FILE_LIST))
+    # =Rule 3: The manifest diff needs a source name space and a target
+    if param_dict[PAR_MANIFEST_DIFF]:
+        if param_dict[PAR_FILE_LIST] is not None:
+            raise Exception("The {:s} option cannot be used with {:s}".format(PAR_MANIFEST_DIFF, PAR_FILE_LIST))
+        if not param_dict[PAR_TARGET_CLUSTER] and not param_dict[PAR_TARGET_NODES]:
+            msg = "The {:s} option requires {:s} or {:s} to be specified"
+            raise Exception(msg.format(PAR_MANIFEST_DIFF, PAR_TARGET_CLUSTER, PAR_TARGET_NODES))
 
     # Connect to the RDBMS
     connection = ngasUtilsLib.get_db_connection()
@@ -563,7 +763,9 @@ def initialize(param_dict):
         # Create Queue, first as temporary name, then rename it when complete
         tmp_queue_dbm = ngamsDbm.ngamsDbm(tmp_queue_dbm_name, writePerm=1)
         # Put file information into the queue
-        if param_dict[PAR_DISK_ID] or param_dict[PAR_HOST_ID]:
+        if param_dict[PAR_MANIFEST_DIFF]:
+            _add_manifest_diff_in_file_dbm(param_dict, tmp_queue_dbm)
+        elif param_dict[PAR_DISK_ID] or param_dict[PAR_HOST_ID]:
             if param_dict[PAR_DISK_ID]:
                 # Dump the information for that volume from the RDBMS
                 file_list_generator = param_dict[PAR_DB_CON].getFileSummary1(diskIds=[param_dict[PAR_DISK_ID]],
@@ -628,6 +830,9 @@ def initialize(param_dict):
                 key, val = proc_dbm.getNext()
                 if not key:
                     break
+                # The file may have been cloned before the interruption, so it must be looked up again
+                if param_dict[PAR_MANIFEST_DIFF]:
+                    val.set_known_missing(False)
                 logger.info("DBM: Adding entry in temporary Queue DBM: %s", key)
                 tmp_queue_dbm.add(key, val)
                 logger.info("DBM: Removing entry from processing DBM: %s", key)
@@ -1163,11 +1368,14 @@ def sync_loop(thread_group_obj):
 
             client = ngamsPClient.ngamsPClient(servers=ngasUtilsLib.get_server_list_from_string(naus_server_list))
 
-        # Check if file is already in target cluster
+        # Check if file is already in target cluster, unless the manifest diff already found it missing
         file_version = sync_req.get_file_version()
-        target_cluster_disk_id, target_cluster_file_id, target_cluster_file_version =\
-            check_if_file_in_target_cluster(param_dict[PAR_DB_CON], cluster_nodes_str, sync_req.get_file_id(),
-                                            file_version)
+        if param_dict[PAR_MANIFEST_DIFF] and sync_req.is_known_missing():
+            target_cluster_disk_id = None
+        else:
+            target_cluster_disk_id, target_cluster_file_id, target_cluster_file_version =\
+                check_if_file_in_target_cluster(param_dict[PAR_DB_CON], cluster_nodes_str, sync_req.get_file_id(),
+                                                file_version)
 
         if target_cluster_disk_id:
             # Carry out the CHECKFILE check only if requested
@@ -0,0 +1,116 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Benchmarks the generation and parsing of NG/AMS Status XML documents
+with DiskStatus elements containing a number of FileStatus elements,
+comparing the streaming writer and parser with the xml.dom.minidom path.
+
+Run with (from the repository root):
+
+  python -m test.benchmarks.status_xml [-n 1,1000,1000000]
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import time
+
+from ngamsLib import ngamsDiskInfo, ngamsFileInfo, ngamsStatus
+from ngamsLib.ngamsCore import toiso8601
+
+
+def gen_status(n_files):
+    now = time.time()
+    disk = ngamsDiskInfo.ngamsDiskInfo().setDiskId('disk-id').\
+           setArchive('archive').setInstallationDate(now).setType('type').\
+           setLogicalName('logical-name').setHostId('host:7777').\
+           setSlotId('1').setMounted(1).setMountPoint('/NGAS/volume1').\
+           setNumberOfFiles(n_files).setAvailableMb(1000).\
+           setBytesStored(n_files * 1024).setCompleted(0).setChecksum('')
+    for i in range(n_files):
+        disk.addFileObj(ngamsFileInfo.ngamsFileInfo().setDiskId('disk-id').
+                        setFilename('saf/2020-01-01/1/file-%d.fits' % i).
+                        setFileId('file-%d' % i).setFileVersion(1).
+                        setFormat('application/fits').setFileSize(1024).
+                        setUncompressedFileSize(1024).setCompression('').
+                        setIngestionDate(now).setChecksum('123456789').
+                        setChecksumPlugIn('crc32').setFileStatus('00000000').
+                        setCreationDate(now))
+    return ngamsStatus.ngamsStatus().setDate(toiso8601()).\
+           setVersion('version').setHostId('host:7777').\
+           setStatus('SUCCESS').setMessage('Benchmark & <status>').\
+           setState('ONLINE').setSubState('IDLE').addDiskStatus(disk)
+
+
+def timed(f):
+    gc.collect()
+    start = time.time()
+    res = f()
+    return time.time() - start, res
+
+
+def run(n_files, repeat):
+    status = gen_status(n_files)
+    results = {}
+    for _ in range(repeat):
+        t_dom, dom_doc = timed(lambda: status.genXml(0, 1, 1).toprettyxml('  ', '\n')[:-1])
+        t_stream, doc = timed(lambda: status.genXmlDoc(0, 1, 1))
+        if doc != dom_doc:
+            raise Exception("Documents generated for %d files differ" % n_files)
+        del dom_doc
+        t_dom_parse, _ = timed(lambda: ngamsStatus.ngamsStatus().unpackXmlDom(doc, 1))
+        t_stream_parse, _ = timed(lambda: ngamsStatus.ngamsStatus().unpackXmlDoc(doc, 1))
+        for name, t in (('generate_minidom', t_dom), ('generate_streaming', t_stream),
+                        ('parse_minidom', t_dom_parse), ('parse_streaming', t_stream_parse)):
+            results[name] = min(t, results.get(name, t))
+    results['files'] = n_files
+    results['document_bytes'] = len(doc)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-n', '--files', default='1,1000,1000000',
+                        help='Comma-separated numbers of FileStatus elements to benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of repetitions, the best time is reported')
+    parser.add_argument('-j', '--json', action='store_true', help='Print the results as JSON')
+    opts = parser.parse_args()
+
+    all_results = []
+    for n_files in map(int, opts.files.split(',')):
+        results = run(n_files, opts.repeat)
+        all_results.append(results)
+        if not opts.json:
+            print("%9d files, %12d bytes: generate %9.4f s (minidom) %9.4f s (streaming), "
+                  "parse %9.4f s (minidom) %9.4f s (streaming)" %
+                  (n_files, results['document_bytes'],
+                   results['generate_minidom'], results['generate_streaming'],
+                   results['parse_minidom'], results['parse_streaming']))
+    if opts.json:
+        print(json.dumps(all_results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
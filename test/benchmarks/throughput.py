@@ -0,0 +1,311 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+Benchmarks the archive and retrieve paths of a local NG/AMS server running
+against an SQLite database and temporary volumes, reporting MB/s, requests/s
+and latency percentiles for a number of scenarios:
+
+ * small: many small files archived and retrieved by a single client
+ * huge: a few huge files archived and retrieved by a single client
+ * concurrent: medium files archived and retrieved by many clients at once
+ * mixed: many clients archiving new files and retrieving existing ones
+
+Run with (from the repository root):
+
+  python -m test.benchmarks.throughput [-s small,huge] [-o results.json]
+
+Results written with -o can be compared against those of another commit with:
+
+  python -m test.benchmarks.throughput --compare before.json after.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import functools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from .. import ngamsTestLib
+
+SCENARIOS = ('small', 'huge', 'concurrent', 'mixed')
+MIME_TYPE = 'application/octet-stream'
+MB = 1024. * 1024.
+
+
+def percentile(values, p):
+    """Nearest-rank percentile `p` (0-100) of `values`"""
+    if not values:
+        return 0.
+    values = sorted(values)
+    idx = max(0, int(math.ceil(p / 100. * len(values))) - 1)
+    return values[min(idx, len(values) - 1)]
+
+
+class Recorder(object):
+    """Accumulates the outcome of the operations of a scenario"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+
+    def record(self, operation, nbytes, latency):
+        with self.lock:
+            self.ops.setdefault(operation, []).append((nbytes, latency))
+
+    def results(self, scenario, wall_time, params):
+        results = []
+        for operation, ops in sorted(self.ops.items()):
+            latencies = [latency for _, latency in ops]
+            nbytes = sum(n for n, _ in ops)
+            results.append({
+                'scenario': scenario,
+                'operation': operation,
+                'params': params,
+                'requests': len(ops),
+                'bytes': nbytes,
+                'seconds': wall_time,
+                'mb_per_s': nbytes / MB / wall_time,
+                'requests_per_s': len(ops) / wall_time,
+                'latency': {
+                    'p50': percentile(latencies, 50),
+                    'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99),
+                    'max': max(latencies),
+                },
+            })
+        return results
+
+
+class Benchmark(object):
+    """Runs the scenarios against a freshly started server"""
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.rnd = random.Random(opts.seed)
+        self.tmpdir = tempfile.mkdtemp(prefix='ngas-benchmark-')
+        self.file_count = 0
+        self.local = threading.local()
+        self.suite = ngamsTestLib.ngamsTestSuite()
+
+    def start(self):
+        self.suite.setUp()
+        cfg_props = [('NgamsCfg.Server[1].MaxSimReqs', str(max(30, self.opts.clients * 2)))]
+        self.suite.prepExtSrv(port=self.opts.port, cfgProps=cfg_props)
+
+    def stop(self):
+        self.suite.tearDown()
+        shutil.rmtree(self.tmpdir, True)
+
+    def client(self):
+        # ngamsPClient objects are not meant to be shared between threads
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.suite.get_client(self.opts.port, timeout=3600)
+        return client
+
+    def gen_file(self, size):
+        """Creates a file of `size` bytes with reproducible contents"""
+        self.file_count += 1
+        fname = os.path.join(self.tmpdir, 'file-%d' % self.file_count)
+        block = bytes(bytearray(self.rnd.getrandbits(8) for _ in range(min(size, 65536))))
+        with open(fname, 'wb') as f:
+            left = size
+            while left > 0:
+                f.write(block[:left])
+                left -= len(block)
+        return fname
+
+    def archive(self, recorder, fname):
+        size = os.path.getsize(fname)
+        start = time.time()
+        status = self.client().qarchive(fname, mimeType=MIME_TYPE)
+        latency = time.time() - start
+        if status.getStatus() != 'SUCCESS':
+            raise Exception("Failed to archive %s: %s" % (fname, status.getMessage()))
+        recorder.record('archive', size, latency)
+        return os.path.basename(fname)
+
+    def retrieve(self, recorder, file_id):
+        target = os.path.join(self.tmpdir, 'retrieved-%s' % threading.current_thread().name)
+        start = time.time()
+        status = self.client().retrieve(file_id, targetFile=target)
+        latency = time.time() - start
+        if status.getStatus() != 'SUCCESS':
+            raise Exception("Failed to retrieve %s: %s" % (file_id, status.getMessage()))
+        recorder.record('retrieve', os.path.getsize(target), latency)
+        os.unlink(target)
+
+    def _run(self, clients, tasks):
+        """Runs the `tasks` callables using `clients` threads, returns the wall time"""
+        pool = ThreadPool(clients)
+        try:
+            start = time.time()
+            for _ in pool.imap_unordered(lambda task: task(), tasks):
+                pass
+            return time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+
+    def archive_and_retrieve(self, scenario, count, size, clients):
+        fnames = [self.gen_file(size) for _ in range(count)]
+        recorder = Recorder()
+        archive_time = self._run(clients, [functools.partial(self.archive, recorder, f) for f in fnames])
+        file_ids = [os.path.basename(f) for f in fnames]
+        for f in fnames:
+            os.unlink(f)
+        params = {'files': count, 'size': size, 'clients': clients}
+        results = recorder.results(scenario, archive_time, params)
+
+        recorder = Recorder()
+        retrieve_time = self._run(clients, [functools.partial(self.retrieve, recorder, f) for f in file_ids])
+        results += recorder.results(scenario, retrieve_time, params)
+        return results
+
+    def small(self):
+        return self.archive_and_retrieve('small', self.opts.small_count, self.opts.small_size, 1)
+
+    def huge(self):
+        return self.archive_and_retrieve('huge', self.opts.huge_count, self.opts.huge_size, 1)
+
+    def concurrent(self):
+        return self.archive_and_retrieve('concurrent', self.opts.concurrent_count,
+                                         self.opts.concurrent_size, self.opts.clients)
+
+    def mixed(self):
+        # Half the operations retrieve files archived beforehand,
+        # in a random (but reproducible) order with the archivals
+        opts = self.opts
+        existing = [self.archive(Recorder(), self.gen_file(opts.mixed_size))
+                    for _ in range(opts.mixed_count // 2)]
+        recorder = Recorder()
+        tasks = [functools.partial(self.retrieve, recorder, f) for f in existing]
+        tasks += [functools.partial(self.archive, recorder, self.gen_file(opts.mixed_size))
+                  for _ in range(opts.mixed_count - len(existing))]
+        self.rnd.shuffle(tasks)
+        wall_time = self._run(opts.clients, tasks)
+        params = {'files': opts.mixed_count, 'size': opts.mixed_size, 'clients': opts.clients}
+        return recorder.results('mixed', wall_time, params)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+
+def run(opts):
+    benchmark = Benchmark(opts)
+    benchmark.start()
+    try:
+        results = []
+        for scenario in opts.scenarios.split(','):
+            if scenario not in SCENARIOS:
+                raise ValueError("Unknown scenario: %s" % scenario)
+            results += getattr(benchmark, scenario)()
+    finally:
+        benchmark.stop()
+    return {
+        'revision': git_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': opts.seed,
+        'results': results,
+    }
+
+
+def compare(before_fname, after_fname):
+    """Prints the relative change of the results in `after_fname` with respect to `before_fname`"""
+    with open(before_fname) as f:
+        before = json.load(f)
+    with open(after_fname) as f:
+        after = json.load(f)
+    before_results = {(r['scenario'], r['operation']): r for r in before['results']}
+    print("%-12s %-9s %12s %12s %12s %12s" % ('scenario', 'operation', 'MB/s', 'req/s', 'p50', 'p99'))
+    for r in after['results']:
+        b = before_results.get((r['scenario'], r['operation']))
+        if b is None:
+            continue
+        change = lambda new, old: (new - old) / old * 100 if old else 0.
+        print("%-12s %-9s %+11.1f%% %+11.1f%% %+11.1f%% %+11.1f%%" % (
+            r['scenario'], r['operation'],
+            change(r['mb_per_s'], b['mb_per_s']),
+            change(r['requests_per_s'], b['requests_per_s']),
+            change(r['latency']['p50'], b['latency']['p50']),
+            change(r['latency']['p99'], b['latency']['p99'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-s', '--scenarios', default=','.join(SCENARIOS),
+                        help='Comma-separated scenarios to run, defaults to all of them')
+    parser.add_argument('-o', '--output', help='File to write the results to, as JSON')
+    parser.add_argument('-p', '--port', type=int, default=8888, help='Port the server listens on')
+    parser.add_argument('-c', '--clients', type=int, default=8,
+                        help='Number of concurrent clients in the concurrent and mixed scenarios')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for file contents and operation order')
+    parser.add_argument('--small-count', type=int, default=500)
+    parser.add_argument('--small-size', type=int, default=16 * 1024)
+    parser.add_argument('--huge-count', type=int, default=2)
+    parser.add_argument('--huge-size', type=int, default=512 * 1024 * 1024)
+    parser.add_argument('--concurrent-count', type=int, default=200)
+    parser.add_argument('--concurrent-size', type=int, default=1024 * 1024)
+    parser.add_argument('--mixed-count', type=int, default=400)
+    parser.add_argument('--mixed-size', type=int, default=1024 * 1024)
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two results files instead of running the benchmark')
+    opts = parser.parse_args()
+
+    if opts.compare:
+        compare(*opts.compare)
+        return
+
+    results = run(opts)
+    for r in results['results']:
+        print("%-12s %-9s %6d requests, %10.2f MB/s, %8.2f req/s, latency p50 %.4f s, p90 %.4f s, p99 %.4f s" %
+              (r['scenario'], r['operation'], r['requests'], r['mb_per_s'], r['requests_per_s'],
+               r['latency']['p50'], r['latency']['p90'], r['latency']['p99']))
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
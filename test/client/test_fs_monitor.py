@@ -20,6 +20,7 @@
 #    MA 02111-1307  USA
 #
 
+import json
 import os
 import subprocess
 import sys
@@ -82,6 +83,40 @@ class FsMonitorTests(ngamsTestSuite):
         archive_listener.close()
         self.assert_monitor_files(archived=1)
 
+    def test_new_files_picked_up_immediately(self):
+        """Files are archived as soon as they are written, without waiting
+        for the next poll of the file system"""
+        self.start_srv()
+        archive_listener = self.notification_listener()
+        self.create_monitor(fs_poll_period=60, archive_poll_period=60, metrics_period=0.1)
+        time.sleep(0.5)
+        self.queue_smallfits()
+        self.assertIsNotNone(archive_listener.wait_for_file(10))
+        archive_listener.close()
+        self.assert_monitor_files(archived=1)
+
+        time.sleep(0.5)
+        with open(self.monitor.metrics_file) as f:
+            metrics = json.load(f)
+        self.assertEqual(1, metrics['files_queued'])
+        self.assertEqual(1, metrics['files_archived'])
+        self.assertEqual(os.path.getsize(self.resource('src/SmallFile.fits')), metrics['bytes_archived'])
+        self.assertLess(metrics['latency_max'], 10)
+
+    def test_batched_checks(self):
+        """Archived files are checked together and then removed"""
+        self.start_srv()
+        self.create_monitor(fs_poll_period=0.1, archive_poll_period=0.1,
+                            check_poll_period=0.5, cleanup_timeout=0.1)
+        self.queue_smallfits('test1.fits')
+        self.queue_smallfits('test2.fits')
+        timeout = time.time() + 10
+        while self.monitor.get_metrics()['files_verified'] < 2 and time.time() < timeout:
+            time.sleep(0.1)
+        self.assertEqual(2, self.monitor.get_metrics()['files_verified'])
+        for basename in ('test1.fits', 'test2.fits'):
+            self.assert_monitor_files(basename=basename)
+
     def test_archive_after_server_start(self):
         """Start the monitor, trigger a file archival with the server off;
         let the archiving fail, start the server, everything is fine"""
@@ -535,6 +535,37 @@ class ngamsPClientTest(ngamsTestSuite):
             self.fail("Not all specified NGAS Nodes were contacted " +\
                       "within 100 attempts")
 
+    def test_archive_retrieve_many(self):
+        """Bulk archiving and retrieval spread over a cluster"""
+
+        ports = range(8000, 8002)
+        self.prepCluster(ports)
+        client = ngamsPClient.ngamsPClient(servers=[('127.0.0.1', p) for p in ports])
+
+        fnames = []
+        for i in range(10):
+            fname = genTmpFilename(prefix='bulk_%d_' % i)
+            with open(fname, 'wb') as f:
+                f.write(os.urandom(1024 * (i + 1)))
+            fnames.append(fname)
+        missing = genTmpFilename(prefix='missing')
+        results = dict(client.archive_many(iter(fnames + [missing]), mimeType='application/octet-stream',
+                                           max_transfers=3))
+        self.assertEqual(len(fnames) + 1, len(results))
+        for fname in fnames:
+            self.assertEqual('SUCCESS', results[fname].getStatus())
+        self.assertEqual('FAILURE', results[missing].getStatus())
+        self.assertGreater(len(set(stat.getHostId() for stat in results.values())), 1)
+
+        target_dir = tmp_path('bulk_retrieve')
+        os.makedirs(target_dir)
+        file_ids = [os.path.basename(fname) for fname in fnames]
+        results = dict(client.retrieve_many(file_ids + ['unknown_file'], target_dir, max_transfers=3, retries=1))
+        for file_id, fname in zip(file_ids, fnames):
+            self.assertEqual('SUCCESS', results[file_id].getStatus())
+            self.checkFilesEq(fname, os.path.join(target_dir, file_id), "Retrieved file incorrect")
+        self.assertEqual('FAILURE', results['unknown_file'].getStatus())
+
 class CommandLineTest(ngamsTestSuite):
 
     def _assert_client(self, success_expected, *args, **kwargs):
@@ -660,4 +691,32 @@ class CommandLineTest(ngamsTestSuite):
 
         # Wrong subscriptions: missing URL, URL scheme not supported
         self.assert_client_fails('SUBSCRIBE')
-        self.assert_client_fails('SUBSCRIBE', '--url', 'ftp://somewhere:8907/QARCHIVE')
\ No newline at end of file
+        self.assert_client_fails('SUBSCRIBE', '--url', 'ftp://somewhere:8907/QARCHIVE')
+
+    def test_bulk_transfer(self):
+        """ARCHIVE/RETRIEVE with --file-list"""
+
+        self.prepExtSrv()
+        fnames = []
+        for i in range(5):
+            fname = genTmpFilename(prefix='bulk_%d_' % i)
+            with open(fname, 'wb') as f:
+                f.write(b'data %d' % i)
+            fnames.append(fname)
+        file_list = genTmpFilename(prefix='file_list')
+        with open(file_list, 'wt') as f:
+            f.write('\n'.join(fnames))
+        out, _ = self.assert_client_succeeds('QARCHIVE', '--file-list', file_list, '-j', '3')
+        self.assertEqual(5, out.count(b'SUCCESS'))
+
+        with open(file_list, 'wt') as f:
+            f.write('\n'.join(os.path.basename(fname) for fname in fnames))
+        target_dir = tmp_path('bulk_cmdline')
+        os.makedirs(target_dir)
+        self.assert_client_succeeds('RETRIEVE', '--file-list', file_list, '-o', target_dir)
+        self.assertEqual(sorted(os.path.basename(fname) for fname in fnames), sorted(os.listdir(target_dir)))
+
+        # One of the files doesn't exist
+        with open(file_list, 'at') as f:
+            f.write('\nunknown_file')
+        self.assert_client_fails('RETRIEVE', '--file-list', file_list, '-o', target_dir)
@@ -42,13 +42,15 @@ import unittest
 from multiprocessing.pool import ThreadPool
 
 from six.moves import cPickle # @UnresolvedImport
+from six.moves import http_client as httplib  # @UnresolvedImport
 
 from ngamsLib.ngamsCore import getHostName, NGAMS_ARCHIVE_CMD, checkCreatePath, NGAMS_PICKLE_FILE_EXT, rmFile,\
-    NGAMS_SUCCESS, getDiskSpaceAvail, mvFile, getFileSize
+    NGAMS_SUCCESS, getDiskSpaceAvail, mvFile, getFileSize, NGAMS_HTTP_HDR_CHECKSUM
 from ngamsLib import ngamsStatus, ngamsFileInfo, ngamsHttpUtils
 from ..ngamsTestLib import ngamsTestSuite, \
     pollForFile, remFitsKey, writeFitsKey, prepCfg, getTestUserEmail, \
     genTmpFilename, execCmd, save_to_tmp, tmp_path
+from ngamsPClient import ngamsPClient
 from ngamsServer import ngamsFileUtils
 
 
@@ -1459,6 +1461,40 @@ class ngamsArchiveCmdTest(ngamsTestSuite):
             else:
                 self.assertNotIn('NGAMS_ER_FILE_NOK', stat.getMessage())
 
+    def test_client_checksum(self):
+        """
+        Check that checksums calculated by the client while pushing a file are
+        verified by the server, and stored with the file
+        """
+
+        file_id = "SmallFile.fits"
+        filename = "src/SmallFile.fits"
+        cfg = (('NgamsCfg.ArchiveHandling[1].TrustClientChecksum', '1'),)
+        _, db = self.prepExtSrv(cfgProps=cfg)
+        expected_checksum = ngamsFileUtils.get_checksum(4096, self.resource(filename), 'crc32z')
+
+        self.qarchive(filename, mimeType='application/octet-stream', crcVariant='crc32z')
+        self.archive(filename, mimeType='application/octet-stream', crcVariant='crc32z')
+        # ARCHIVE also stores a replica of the file
+        res = db.query2("SELECT file_version, checksum, checksum_plugin FROM ngas_files WHERE file_id = {} ORDER BY file_version ASC", (file_id,))
+        self.assertEqual({1, 2}, set(int(row[0]) for row in res))
+        for _, checksum, checksum_plugin in res:
+            self.assertEqual(str(expected_checksum), str(checksum))
+            self.assertEqual('crc32z', str(checksum_plugin))
+
+        # A wrong checksum is rejected
+        with open(self.resource(filename), 'rb') as f:
+            hdrs, body = ngamsPClient._checksummed_upload(f, 'application/octet-stream', 'crc32z')
+            body.trailers = lambda: {NGAMS_HTTP_HDR_CHECKSUM: str(expected_checksum ^ 1)}
+            conn = httplib.HTTPConnection('127.0.0.1', 8888)
+            with contextlib.closing(conn):
+                conn.request('POST', '/QARCHIVE?filename=SmallFile.fits&crc_variant=crc32z', body=body, headers=hdrs)
+                resp = conn.getresponse()
+                self.assertNotEqual(200, resp.status)
+                self.assertIn(b'Checksum error', resp.read())
+        res = db.query2("SELECT file_version FROM ngas_files WHERE file_id = {}", (file_id,))
+        self.assertEqual({1, 2}, set(int(row[0]) for row in res))
+
     @unittest.skip("Run manually when necessary")
     def test_performance_of_parallel_crc32(self):
 
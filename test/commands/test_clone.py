@@ -593,4 +593,32 @@ class ngamsCloneCmdTest(ngamsTestSuite):
 
         ref_file = "ref/ngamsCloneCmdTest_test_CloneCmd_2_ref"
         msg = "Incorrect/missing CLONE Status Notification Email Msg"
-        self.assert_clone_mail(ref_file, msg)
\ No newline at end of file
+        self.assert_clone_mail(ref_file, msg)
+
+    def test_CloneCmd_parallel(self):
+        """
+        Synopsis:
+        Normal execution of CLONE Command using parallel streams.
+
+        Description:
+        Same as test_CloneCmd_2, but the files are cloned with several
+        concurrent streams and registered in small batches. The resulting
+        Clone Status Report must be the same.
+        """
+        srcFile = "src/SmallFile.fits"
+        self.start_smtp_server()
+        self.prepExtSrv(cfgProps=(('NgamsCfg.Server[1].RequestDbBackend', 'memory'),))
+        for _ in range(10):
+            self.archive(srcFile)
+        diskId = self.ngas_disk_id("FitsStorage1/Main/1")
+        statObj = self.get_status(NGAMS_CLONE_CMD,
+                                    pars = [["disk_id", diskId],
+                                            ["async", "1"],
+                                            ["parallel", "4"],
+                                            ["batch_size", "3"],
+                                            ["notif_email", 'alice@localhost.local']])
+        waitReqCompl(self, statObj.getRequestId(), 20)
+
+        ref_file = "ref/ngamsCloneCmdTest_test_CloneCmd_2_ref"
+        msg = "Incorrect/missing CLONE Status Notification Email Msg"
+        self.assert_clone_mail(ref_file, msg)
@@ -0,0 +1,75 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the METRICS command"""
+
+import contextlib
+
+from ngamsLib import ngamsHttpUtils
+from ..ngamsTestLib import ngamsTestSuite, tmp_path
+
+
+class ngamsMetricsCmdTest(ngamsTestSuite):
+    """Tests for the METRICS command"""
+
+    def _metrics(self):
+        """Returns the metric types, and the value of each metric"""
+        resp = ngamsHttpUtils.httpGet('localhost', 8888, 'METRICS')
+        with contextlib.closing(resp):
+            self.assertEqual(200, resp.status)
+            self.assertTrue(resp.getheader('content-type').startswith('text/plain'))
+            text = resp.read().decode('utf8')
+        types, values = {}, {}
+        for line in text.splitlines():
+            if line.startswith('# TYPE '):
+                _, _, name, typ = line.split()
+                types[name] = typ
+            elif line and not line.startswith('#'):
+                sample, value = line.rsplit(' ', 1)
+                values[sample] = float(value)
+        return types, values
+
+    def test_metrics_rise(self):
+        self.prepExtSrv()
+        _, before = self._metrics()
+
+        self.archive("src/SmallFile.fits")
+        self.retrieve("TEST.2001-05-08T15:25:00.123", targetFile=tmp_path("test_metrics_retrieve_tmp"))
+
+        types, after = self._metrics()
+        for name in ('ngas_requests_total', 'ngas_received_bytes_total', 'ngas_sent_bytes_total'):
+            self.assertEqual('counter', types[name])
+        self.assertEqual('histogram', types['ngas_request_duration_seconds'])
+        self.assertEqual('gauge', types['ngas_requests_in_progress'])
+        self.assertEqual('counter', types['ngas_file_location_cache_misses_total'])
+
+        def value(values, sample):
+            return values.get(sample, 0)
+        for sample in ('ngas_requests_total{code="200",command="ARCHIVE"}',
+                       'ngas_requests_total{code="200",command="RETRIEVE"}',
+                       'ngas_received_bytes_total{command="ARCHIVE"}',
+                       'ngas_sent_bytes_total{command="RETRIEVE"}',
+                       'ngas_request_duration_seconds_count{command="ARCHIVE"}',
+                       'ngas_request_duration_seconds_count{command="RETRIEVE"}'):
+            self.assertGreater(value(after, sample), value(before, sample), sample)
+        # The previous METRICS request has been accounted for too
+        self.assertGreater(value(after, 'ngas_requests_total{code="200",command="METRICS"}'),
+                           value(before, 'ngas_requests_total{code="200",command="METRICS"}'))
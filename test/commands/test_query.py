@@ -67,6 +67,28 @@ class ngamsQueryCmdTest(ngamsTestSuite):
         stat = self.assert_query(pars=[['query', 'files_list'], ['format', 'list']])
         self.assertTrue(b"TEST.2001-05-08T15:25:00.123" in stat.getData())
 
+    def test_files_in(self):
+
+        self.prepExtSrv()
+        self.archive("src/SmallFile.fits")
+        self.archive("src/TinyTestFile.fits")
+
+        pars = [['query', 'files_in'], ['format', 'json'],
+                ['file_ids', 'TEST.2001-05-08T15:25:00.123,unknown']]
+        stat = self.assert_query(pars=pars)
+        results = json.loads(utils.b2s(stat.getData()))
+        # Files are replicated, there is one row per copy
+        files = set((r['file_id'], int(r['file_version'])) for r in results)
+        self.assertEqual({('TEST.2001-05-08T15:25:00.123', 1)}, files)
+
+        # Also through the client
+        results = self.client.query('files_in', pars=[('file_ids', 'TEST.2001-05-08T15:25:00.123')])
+        files = set((r['file_id'], int(r['file_version'])) for r in results)
+        self.assertEqual({('TEST.2001-05-08T15:25:00.123', 1)}, files)
+
+        # No File IDs given
+        self.assert_query(pars=[['query', 'files_in']], expectedStatus='FAILURE')
+
     def test_column_names(self):
         """Check that column names are correctly bound to data by reading some
         of the cells and making sure they make sense. If column names are not
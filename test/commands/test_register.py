@@ -195,3 +195,23 @@ class ngamsRegisterCmdTest(ngamsTestSuite):
         fname = self.copy_to_ngas(file_suffix=".log")
         status = self.get_status_fail(NGAMS_REGISTER_CMD, (("path", fname),))
         self.assertIn("mime-type", status.getMessage().lower())
+
+    def test_register_parallel(self):
+        """Registers a directory tree using the parallel registration engine"""
+        _, db_obj = self.prepExtSrv()
+        for subdir in ('a', 'b/c'):
+            tmp_src_file = self.ngas_path(TEST_PATH + subdir + "/SmallFile.fits")
+            checkCreatePath(os.path.dirname(tmp_src_file))
+            self.cp("src/SmallFile.fits", tmp_src_file)
+
+        pars = (("path", self.ngas_path(TEST_PATH)), ("parallel", "2"),
+                ("batch_size", "1"), ("crc_processes", "2"))
+        self.get_status(NGAMS_REGISTER_CMD, pars)
+
+        # Both copies have the same File ID, and therefore get different versions
+        disk_id = self.ngas_disk_id("FitsStorage2/Main/3")
+        host_id = getHostName() + ":8888"
+        file_id = "TEST.2001-05-08T15:25:00.123"
+        for version in (1, 2):
+            res = db_obj.getFileInfoFromFileIdHostId(host_id, file_id, version, disk_id)
+            self.assertTrue(res, "File version %d not registered" % version)
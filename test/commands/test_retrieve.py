@@ -174,6 +174,25 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
         self.checkFilesEq(refFile, outFilePath, "Retrieved file incorrect")
 
 
+    def test_RetrieveCmd_dead_replica(self):
+        """
+        A node hosting a replica dies without going offline, the file is
+        still retrieved from the other node hosting it
+        """
+        self.prepCluster((8000, 8001, 8011))
+        self.archive(8001, "src/TinyTestFile.fits")
+        self.archive(8011, "src/TinyTestFile.fits")
+        srv_info = [info for info in self.extSrvInfo if info.port == 8001][0]
+        srv_info.proc.kill()
+        srv_info.proc.wait()
+
+        trgFile = tmp_path("test_RetrieveCmd_dead_replica_tmp")
+        self.retrieve(8000, "NCU.2003-11-11T11:11:11.111", targetFile=trgFile)
+        outFilePath = tmp_path('test_RetrieveCmd_dead_replica_tmp_unzip')
+        unzip(trgFile, outFilePath)
+        self.checkFilesEq("src/TinyTestFile.fits", outFilePath, "Retrieved file incorrect")
+
+
     def test_RetrieveCmd_7(self):
         """
         Synopsis:
@@ -457,9 +476,9 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
         self.prepExtSrv()
         self.archive("src/SmallFile.fits")
 
-        # Partial retrieval only supports a start offset, so using only
-        # a suffix length or a begin/end range should fail
-        ranges = ['0-1', '-1']
+        # Partial retrieval supports a start offset with an optional end,
+        # so using only a suffix length or an end before the start should fail
+        ranges = ['-1', '1-0']
 
         # Not a number, missing -, negative number
         ranges += ['a-', 'a', '0', '-100-']
@@ -488,6 +507,26 @@ class ngamsRetrieveCmdTest(ngamsTestSuite):
         for n_parts in (1, 2, 3, 7, 11, 13, 14, 20, 100):
             self._test_partial_retrieval(n_parts, file_size, full)
 
+    def test_bounded_partial_retrieval(self):
+
+        self.prepExtSrv()
+
+        contents = os.urandom(1024)
+        with open(tmp_path("source"), 'wb') as f:
+            f.write(contents)
+        self.archive(tmp_path("source"), mimeType='application/octet-stream')
+
+        # The last byte is inclusive, and ends past the file are clipped
+        for first, last in ((0, 0), (0, 99), (100, 1023), (1000, 2000)):
+            response = ngamsHttpUtils.httpGet('127.0.0.1', 8888, 'RETRIEVE',
+                                              pars=(('file_id', 'source'),),
+                                              hdrs={'Range': 'bytes=%d-%d' % (first, last)})
+            with contextlib.closing(response):
+                last = min(last, 1023)
+                self.assertEqual('bytes %d-%d/1024' % (first, last),
+                                 response.getheader('Content-Range'))
+                self.assertEqual(contents[first:last + 1], response.read())
+
     def _test_partial_retrieval(self, n_parts, file_size, full):
 
         part_size, mod = divmod(file_size, n_parts)
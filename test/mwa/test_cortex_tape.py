@@ -0,0 +1,57 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+
+import os
+import unittest
+
+from ngamsPlugIns.mwa import ngamsMWACortexTapeApi
+
+bindir = os.path.join(os.path.dirname(__file__), 'bin')
+
+class ngamsCortexTapeTest(unittest.TestCase):
+
+    def setUp(self):
+        # The fake tape tools live in bindir
+        self._path = os.environ['PATH']
+        os.environ['PATH'] += ':' + bindir
+
+    def tearDown(self):
+        os.environ['PATH'] = self._path
+
+    def test_files_on_tape(self):
+        filenames = ['/volume/OFL_%d.fits' % i for i in range(3)] + \
+                    ['/volume/REG_%d.fits' % i for i in range(3)]
+        for batchSize in (1, 4, 100):
+            onTape = ngamsMWACortexTapeApi.getFilesOnTape(filenames, batchSize)
+            self.assertEqual([1, 1, 1, 0, 0, 0], [onTape[f] for f in filenames])
+
+        # Unknown files are reported as errors without affecting the rest
+        onTape = ngamsMWACortexTapeApi.getFilesOnTape(['/volume/OFL.fits', '/volume/Error.fits'])
+        self.assertEqual({'/volume/OFL.fits': 1, '/volume/Error.fits': -1}, onTape)
+        self.assertEqual(1, ngamsMWACortexTapeApi.isFileOnTape('/volume/OFL.fits'))
+        self.assertEqual(-1, ngamsMWACortexTapeApi.isFileOnTape('/volume/Error.fits'))
+
+    def test_stage(self):
+        self.assertEqual(0, ngamsMWACortexTapeApi.requestStaging(['/volume/OFL.fits']))
+        self.assertEqual(-1, ngamsMWACortexTapeApi.requestStaging(['/volume/Error.fits']))
+        self.assertEqual(1, ngamsMWACortexTapeApi.stageFiles(['/volume/OFL.fits', '/volume/REG.fits']))
+        self.assertEqual(0, ngamsMWACortexTapeApi.stageFiles(['/volume/REG.fits']))
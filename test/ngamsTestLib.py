@@ -45,6 +45,7 @@ import logging
 import multiprocessing.pool
 import os
 import pickle
+import random
 import shutil
 import signal
 import smtpd
@@ -117,6 +118,11 @@ def save_to_tmp(text, fname=None, prefix=None, suffix=None):
 def tmp_path(*p):
     return os.path.join(tmp_root, *p)
 
+def random_data(size, seed=0):
+    """Returns `size` pseudo-random bytes, always the same for a given `seed`"""
+    rnd = random.Random(seed)
+    return bytes(bytearray(rnd.getrandbits(8) for _ in range(size)))
+
 def as_ngas_disk_id(s):
     return s.strip('/').replace('/', '-')
 
@@ -0,0 +1,109 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the in-process GLEAM cutouts"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import astropy.io.fits as pyfits
+import numpy as np
+
+from ngamsPlugIns.gleam import cutout
+
+
+def _mosaic(path, size=200, cdelt=0.01):
+    header = pyfits.Header()
+    header['CTYPE1'] = 'RA---ZEA'
+    header['CTYPE2'] = 'DEC--ZEA'
+    header['CRVAL1'] = 60.
+    header['CRVAL2'] = -30.
+    header['CRPIX1'] = size / 2 + 1
+    header['CRPIX2'] = size / 2 + 1
+    header['CDELT1'] = -cdelt
+    header['CDELT2'] = cdelt
+    # Pixel values encode their position
+    y, x = np.indices((size, size))
+    data = (y * 1000 + x).astype(np.float32)
+    pyfits.PrimaryHDU(data, header).writeto(path)
+
+
+class GleamCutoutTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'mosaic_Week2_170-231MHz.fits')
+        _mosaic(self.path)
+        self.images = cutout.ImageCache(max_images=1)
+
+    def tearDown(self):
+        self.images.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_cutout(self):
+        image = self.images.get(self.path)
+        data, header = cutout.cutout(image, 60., -30., 0.2)
+        self.assertEqual((20, 20), data.shape)
+        # The centre of the mosaic is at the centre of the cutout
+        self.assertEqual(100 * 1000 + 100, data[10, 10])
+        self.assertEqual(11, header['CRPIX1'])
+
+        # Cutouts are clipped at the edges of the mosaic
+        x, y = cutout.pixel(image, 60., -30.)
+        self.assertEqual((100, 100), (x, y))
+        data, _ = cutout.cutout(image, 60. + 0.95 / np.cos(np.radians(30)), -30., 0.2)
+        self.assertLess(data.shape[1], 20)
+        self.assertRaises(Exception, cutout.cutout, image, 0., 0., 0.2)
+
+        # Round trip through FITS
+        data, header = cutout.cutout(image, 60., -30., 0.2)
+        hdulist = pyfits.open(io.BytesIO(cutout.to_fits(data, header)))
+        np.testing.assert_array_equal(data, hdulist[0].data)
+
+    def test_reproject(self):
+        image = self.images.get(self.path)
+        data, header = cutout.cutout(image, 60., -30., 0.3)
+        target = cutout.regrid_header(header, 60., -30., data.shape, projection='SIN')
+        regridded = cutout.reproject(data, header, target)
+        self.assertEqual((20, 20), regridded.shape)
+        # Both projections agree at the reference point (CRPIX is 1-based)
+        self.assertEqual(10, target['CRPIX1'])
+        self.assertAlmostEqual(100 * 1000 + 100, regridded[9, 9], delta=1)
+
+    def test_cache(self):
+        image = self.images.get(self.path)
+        self.assertIs(image, self.images.get(self.path))
+        self.assertEqual(1, self.images.hits)
+
+        # Least recently used images are closed
+        other = os.path.join(self.tmpdir, 'other.fits')
+        _mosaic(other, size=10)
+        self.images.get(other)
+        self.assertIsNot(image, self.images.get(self.path))
+        self.assertEqual(3, self.images.misses)
+
+    @unittest.skipUnless(cutout.can_render_jpeg, 'matplotlib not available')
+    def test_jpeg(self):
+        data, _ = cutout.cutout(self.images.get(self.path), 60., -30., 0.2)
+        self.assertTrue(cutout.to_jpeg(data).startswith(b'\xff\xd8'))
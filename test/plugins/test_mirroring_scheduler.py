@@ -0,0 +1,187 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""
+This module contains the Test Suite for the mirroring scheduler
+"""
+
+import unittest
+
+from ngamsPlugIns import ngamsCmd_MIRREXEC
+from ngamsPlugIns import ngamsMirroringScheduler as sched
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+
+def _task(file_id, size, source, ingestion_date='2020-01-01T00:00:00.000'):
+    # Same layout as the rows returned by ngamsCmd_MIRREXEC.get_list_mirroring_tasks
+    return (size, 'staging', file_id, 'format', 'checksum', 'crc32', source, 'disk', 'host', 1, file_id,
+            ingestion_date)
+
+
+class MirroringSchedulerTest(unittest.TestCase):
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = sched.TokenBucket(1000, clock, clock.sleep)
+        # A burst of up to one second worth of data goes through
+        self.assertEqual(0, bucket.consume(1000))
+        # Then the flow is paced to the rate
+        self.assertAlmostEqual(2, bucket.consume(2000))
+        self.assertAlmostEqual(1, bucket.consume(1000))
+        self.assertEqual(1003, clock.now)
+        # No limit
+        self.assertEqual(0, sched.TokenBucket(0, clock, clock.sleep).consume(10 ** 9))
+
+    def test_priorities(self):
+        tasks = [_task('a', 300, 'src1', '2020-01-01T00:00:00.000'),
+                 _task('b', 100, 'src1', '2020-01-03T00:00:00.000'),
+                 _task('c', 200, 'src2', '2020-01-02T00:00:00.000')]
+        for priority, expected in ((sched.PRIORITY_SMALL, 'bca'),
+                                   (sched.PRIORITY_LARGE, 'acb'),
+                                   (sched.PRIORITY_NEWEST, 'bca')):
+            scheduler = sched.MirroringScheduler(tasks, 3, priority=priority, shared_budgets=False)
+            order = ''
+            while True:
+                task = scheduler.next_task()
+                if task is None:
+                    break
+                order += task[10]
+                scheduler.task_done(task, task[0])
+            self.assertEqual(expected, order)
+        self.assertRaises(ValueError, sched.MirroringScheduler, tasks, 3, priority='random')
+
+    def test_streams_per_source(self):
+        clock = FakeClock()
+        tasks = [_task(str(i), 100, 'src%d' % (i % 2)) for i in range(6)]
+        scheduler = sched.MirroringScheduler(tasks, 4, adaptive=False, shared_budgets=False, clock=clock)
+        started = [scheduler.next_task() for _ in range(4)]
+        self.assertEqual(2, sum(1 for t in started if t[6] == 'src0'))
+        self.assertEqual(2, scheduler.statistics()['sources']['src1']['active_streams'])
+        scheduler.task_done(started[0], 100)
+        # The free stream goes to the source the finished task came from
+        self.assertEqual(started[0][6], scheduler.next_task()[6])
+
+    def test_concurrency_controller(self):
+        clock = FakeClock()
+        controller = sched.ConcurrencyController(2, 8, window=2, min_window_time=1, clock=clock)
+
+        def window(throughput, rtt=0.1, success=True, saturated=False):
+            clock.now += 1
+            controller.record(throughput / 2, rtt, success, saturated)
+            return controller.record(throughput / 2, rtt, success, saturated)
+
+        # Throughput keeps improving with more streams
+        self.assertEqual(3, window(100))
+        self.assertEqual(4, window(200))
+        # ... unless the budget is used up already
+        self.assertEqual(4, window(300, saturated=True))
+        # No gain, no change
+        self.assertEqual(4, window(301))
+        # Throughput drops
+        self.assertEqual(3, window(200))
+        # Latency builds up
+        self.assertEqual(2, window(300, rtt=0.5))
+        # Failures
+        self.assertEqual(1, window(300, success=False))
+        self.assertEqual(1, window(0, success=False))
+
+    def test_statistics(self):
+        clock = FakeClock()
+        tasks = [_task('a', 1000, 'src1'), _task('b', 1000, 'src1')]
+        scheduler = sched.MirroringScheduler(tasks, 1, cluster_bandwidth=500, link_bandwidth=1000,
+                                             shared_budgets=False, clock=clock, sleep=clock.sleep)
+        for _ in range(2):
+            task = scheduler.next_task()
+            for _ in range(10):
+                scheduler.throttle(task, 100)
+            scheduler.task_done(task, 1000, rtt=0.1)
+        stats = scheduler.statistics()
+        self.assertEqual(500, stats['target_rate'])
+        self.assertEqual(2000, stats['bytes'])
+        # The first 500 bytes go through as a burst, the rest at 500 bytes/s
+        self.assertAlmostEqual(500, stats['achieved_rate'], delta=200)
+        src_stats = stats['sources']['src1']
+        self.assertEqual(1000, src_stats['target_rate'])
+        self.assertEqual(2, src_stats['files_done'])
+        self.assertEqual(0, src_stats['pending_files'])
+        self.assertGreater(src_stats['throttled_time'], 0)
+        self.assertIsNone(scheduler.next_task())
+
+
+class FakeDb(object):
+
+    def __init__(self):
+        self.queries = []
+
+    def query2(self, sql, args=()):
+        self.queries.append((sql, args))
+
+
+class FakeServer(object):
+
+    def __init__(self):
+        self.db = FakeDb()
+
+    def getDb(self):
+        return self.db
+
+
+class ScheduledWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._process_mirroring_task = ngamsCmd_MIRREXEC.process_mirroring_task
+        ngamsCmd_MIRREXEC.process_mirroring_task = self._process
+        self.processed = []
+
+    def tearDown(self):
+        ngamsCmd_MIRREXEC.process_mirroring_task = self._process_mirroring_task
+
+    def _process(self, item, target_node, ith_thread, ngams_server, throttle=None):
+        if item[10] == 'bad':
+            raise ValueError("Cannot calculate staging name")
+        self.processed.append(item[10])
+        return "SUCCESS", 0.1, {}, None
+
+    def test_failing_task(self):
+        tasks = [_task('a', 100, 'src1'), _task('bad', 200, 'src1'), _task('c', 300, 'src1')]
+        scheduler = sched.MirroringScheduler(tasks, 1, shared_budgets=False)
+        server = FakeServer()
+        ngamsCmd_MIRREXEC.process_scheduled_mirroring_tasks(scheduler, 'target', 0, server)
+
+        # The rest of the tasks are processed, and the bad one marked as failed
+        self.assertEqual(['a', 'c'], self.processed)
+        self.assertIsNone(scheduler.next_task())
+        self.assertEqual(1, len(server.db.queries))
+        sql, args = server.db.queries[0]
+        self.assertIn("status = 'FAILURE'", sql)
+        self.assertEqual('bad', args[-1])
+        self.assertEqual(2, scheduler.statistics()['sources']['src1']['files_done'])
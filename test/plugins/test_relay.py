@@ -0,0 +1,141 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the relaying of data used by PARCHIVE"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zlib
+
+from ngamsPlugIns import ngamsRelay
+from ngamsServer import ngamsFileUtils
+
+from ..ngamsTestLib import random_data
+
+crc32 = ngamsFileUtils.get_checksum_info('crc32')
+
+
+class FakeTarget(object):
+    """Collects the data it receives, optionally waiting for `gate` before each write"""
+
+    def __init__(self, name, gate=None, fail_at=None):
+        self.name = name
+        self.gate = gate
+        self.fail_at = fail_at
+        self.data = io.BytesIO()
+        self.finished = False
+        self.closed = False
+
+    def open(self):
+        pass
+
+    def write(self, data):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.fail_at is not None and self.data.tell() >= self.fail_at:
+            raise IOError("Connection reset by peer")
+        self.data.write(data)
+
+    def finish(self):
+        self.finished = True
+
+    def close(self):
+        self.closed = True
+
+
+class GatedReader(object):
+    """Reads from `data`, opening `gate` once everything has been read"""
+
+    def __init__(self, data, gate):
+        self.f = io.BytesIO(data)
+        self.gate = gate
+
+    def read(self, n):
+        data = self.f.read(n)
+        if not data:
+            self.gate.set()
+        return data
+
+
+class RelayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = random_data(10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_relay(self):
+        targets = [FakeTarget('a'), FakeTarget('b')]
+        fname = os.path.join(self.tmpdir, 'local')
+        targets.append(ngamsRelay.FileTarget(fname, len(self.data)))
+        relay = ngamsRelay.Relay(io.BytesIO(self.data), targets, 128, size=len(self.data),
+                                 checksum_info=crc32)
+        result = relay.run()
+        self.assertEqual(len(self.data), result.size)
+        self.assertEqual(zlib.crc32(self.data) & 0xffffffff, result.crc)
+        self.assertEqual({}, result.failed)
+        for t in targets[:2]:
+            self.assertTrue(t.finished)
+            self.assertEqual(self.data, t.data.getvalue())
+        with open(fname, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+    def test_slow_target_is_spooled(self):
+        # The slow target cannot write anything until all the data has been
+        # read, which would never happen if it blocked the reader
+        gate = threading.Event()
+        slow, fast = FakeTarget('slow', gate=gate), FakeTarget('fast')
+        relay = ngamsRelay.Relay(GatedReader(self.data, gate), [slow, fast], 100,
+                                 window=4, spool_dir=self.tmpdir)
+        result = relay.run()
+        self.assertEqual(len(self.data), result.size)
+        self.assertEqual({}, result.failed)
+        self.assertGreater(relay.senders[0].spooled_bytes, 0)
+        for t in (slow, fast):
+            self.assertTrue(t.finished)
+            self.assertEqual(self.data, t.data.getvalue())
+
+    def test_failed_target(self):
+        failing, ok = FakeTarget('failing', fail_at=1000), FakeTarget('ok')
+        relay = ngamsRelay.Relay(io.BytesIO(self.data), [failing, ok], 100, size=len(self.data))
+        result = relay.run()
+        self.assertEqual(['failing'], list(result.failed))
+        self.assertFalse(failing.finished)
+        self.assertTrue(failing.closed)
+        self.assertEqual(self.data, ok.data.getvalue())
+
+    def test_short_read_aborts_targets(self):
+        target = FakeTarget('a')
+        relay = ngamsRelay.Relay(io.BytesIO(self.data), [target], 100, size=len(self.data) + 1)
+        result = relay.run()
+        self.assertEqual(len(self.data), result.size)
+        self.assertFalse(target.finished)
+        self.assertIn('a', result.failed)
+
+
+if __name__ == '__main__':
+    unittest.main()
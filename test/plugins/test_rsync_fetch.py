@@ -0,0 +1,193 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the RSYNC fetching of mirrored files"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from ngamsPlugIns import ngamsCmd_RSYNCFETCH
+
+
+class FakeConfig(object):
+
+    def __init__(self, values):
+        self.values = values
+
+    def getVal(self, name):
+        return self.values.get(name)
+
+    def getStorageSetList(self):
+        return []
+
+
+class FakeDb(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def getFileInfoFromFileId(self, fileId, fileVersion=-1, diskId=None, ignore=None, dbCursor=1):
+        return [r for r in self.rows if r[2] == fileId]
+
+
+class FakeServer(object):
+
+    def __init__(self, cfg, db):
+        self.cfg = cfg
+        self.db = db
+
+    def getCfg(self):
+        return self.cfg
+
+    def getDb(self):
+        return self.db
+
+    def getHostId(self):
+        return 'localhost:7777'
+
+
+class FakeDiskInfo(object):
+
+    def getSlotId(self):
+        return '1'
+
+
+class FakeRequest(object):
+
+    def __init__(self, file_id, file_version, data):
+        self.fileinfo = {'sourceHost': 'source:7777', 'fileId': file_id, 'fileVersion': file_version}
+        self.checksum = str(zlib.crc32(data) & 0xffffffff)
+        self.checksum_plugin = 'crc32z'
+        self.bytes_received = 0
+
+    def getTargDiskInfo(self):
+        return FakeDiskInfo()
+
+    def setBytesReceived(self, n):
+        self.bytes_received = n
+
+    def getBytesReceived(self):
+        return self.bytes_received
+
+
+class FakeRsync(object):
+    """Stands in for ngamsHttpUtils, writing `data` into the target location like rsync would"""
+
+    def __init__(self, data):
+        self.data = data
+        self.fail = False
+        self.fail_delta = False
+        self.delta_support = True
+        self.requests = []
+
+    def httpGet(self, host, port, cmd, pars=None, timeout=None):
+        self.requests.append(dict(pars))
+        target = pars['targetLocation']
+        delta = self.delta_support and pars.get('delta') == 1
+        # Other than for deltas, rsync runs with --append
+        offset = 0 if delta or not os.path.exists(target) else os.path.getsize(target)
+        data = self.data[offset:]
+        with open(target, 'r+b' if os.path.exists(target) else 'wb') as f:
+            f.seek(offset)
+            if self.fail or (delta and self.fail_delta):
+                # Connection drops half way through
+                f.write(data[:len(data) // 2])
+                return io.BytesIO(b'FAILURE')
+            f.write(data)
+            f.truncate()
+        return io.BytesIO(b'SUCCESS')
+
+
+class RsyncFetchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_data = b'a' * 5000 + b'b' * 5000
+        self.new_data = b'a' * 5000 + b'c' * 6000
+        self.old_fname = 'old_file'
+        with open(os.path.join(self.tmpdir, self.old_fname), 'wb') as f:
+            f.write(self.old_data)
+        # Same layout as the rows returned by getFileInfoFromFileId
+        row = ['disk', self.old_fname, 'file/1', 1, 'format', len(self.old_data), len(self.old_data), '',
+               None, 0, '0', 'crc32z', '00000000', None, 0, 0, None, 'localhost:7777', self.tmpdir]
+        cfg = FakeConfig({'Mirroring[1].rsync_delta': '1'})
+        self.server = FakeServer(cfg, FakeDb([row]))
+        self.staging = os.path.join(self.tmpdir, 'staging', 'file')
+        self.rsync = FakeRsync(self.new_data)
+        self._http_utils = ngamsCmd_RSYNCFETCH.ngamsHttpUtils
+        ngamsCmd_RSYNCFETCH.ngamsHttpUtils = self.rsync
+
+    def tearDown(self):
+        ngamsCmd_RSYNCFETCH.ngamsHttpUtils = self._http_utils
+        shutil.rmtree(self.tmpdir)
+
+    def _fetch(self):
+        request = FakeRequest('file/1', 2, self.new_data)
+        return ngamsCmd_RSYNCFETCH.save_to_file(self.server, request, self.staging)
+
+    def test_delta_transfer(self):
+        result = self._fetch()
+        self.assertEqual(1, self.rsync.requests[0]['delta'])
+        self.assertEqual(len(self.new_data), result.size)
+        with open(self.staging, 'rb') as f:
+            self.assertEqual(self.new_data, f.read())
+
+    def _assert_fetched(self):
+        with open(self.staging, 'rb') as f:
+            self.assertEqual(self.new_data, f.read())
+
+    def test_failed_delta_transfer_falls_back_to_full_transfer(self):
+        self.rsync.fail_delta = True
+        result = self._fetch()
+        self.assertEqual(1, self.rsync.requests[0]['delta'])
+        self.assertNotIn('delta', self.rsync.requests[1])
+        self.assertEqual(len(self.new_data), result.size)
+        self._assert_fetched()
+
+    def test_source_without_delta_support(self):
+        # The source appends to the older version, which doesn't verify
+        self.rsync.delta_support = False
+        self._fetch()
+        self.assertEqual(2, len(self.rsync.requests))
+        self.assertNotIn('delta', self.rsync.requests[1])
+        self._assert_fetched()
+
+    def test_failed_transfer_is_resumed(self):
+        self.rsync.fail = True
+        with self.assertRaises(Exception):
+            self._fetch()
+        # The older version copied as the basis is not left behind,
+        # only what the full transfer received
+        with open(self.staging, 'rb') as f:
+            self.assertEqual(self.new_data[:len(self.new_data) // 2], f.read())
+
+        # The next attempt appends to the partial file
+        self.rsync.fail = False
+        self._fetch()
+        self.assertNotIn('delta', self.rsync.requests[2])
+        self._assert_fetched()
+
+if __name__ == '__main__':
+    unittest.main()
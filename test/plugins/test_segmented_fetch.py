@@ -0,0 +1,125 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the segmented fetching of files used by HTTPFETCH"""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zlib
+
+from ngamsPlugIns import ngamsSegmentedFetch
+from ngamsServer import ngamsFileUtils
+
+from ..ngamsTestLib import random_data
+
+crc32 = ngamsFileUtils.get_checksum_info('crc32')
+
+
+class FakeResponse(object):
+
+    def __init__(self, data, status=200, headers=None):
+        self.f = io.BytesIO(data)
+        self.status = status
+        self.headers = headers or {}
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, n=-1):
+        return self.f.read(n)
+
+    def close(self):
+        pass
+
+
+class FakeSource(object):
+    """Serves byte ranges of `data`, failing for the ranges starting at `fail_at`"""
+
+    def __init__(self, data, fail_at=(), ranges=True):
+        self.data = data
+        self.fail_at = set(fail_at)
+        self.ranges = ranges
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def __call__(self, first, last):
+        with self.lock:
+            self.requested.append(first)
+        if not self.ranges:
+            return FakeResponse(self.data)
+        if first in self.fail_at:
+            # Connection drops half way through
+            return FakeResponse(self.data[first:first + (last - first) // 2], headers={
+                'Content-Range': 'bytes %d-%d/%d' % (first, last, len(self.data))})
+        return FakeResponse(self.data[first:last + 1], headers={
+            'Content-Range': 'bytes %d-%d/%d' % (first, last, len(self.data))})
+
+
+class SegmentedFetchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'staging')
+        self.data = random_data(10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _fetch(self, source, connections=3):
+        state = ngamsSegmentedFetch.SegmentsState(self.fname, 'file/1', len(self.data), 1024)
+        state.load()
+        fetch = ngamsSegmentedFetch.SegmentedFetch(source, state, crc32, connections, 100)
+        return state, fetch.run()
+
+    def test_fetch(self):
+        source = FakeSource(self.data)
+        state, result = self._fetch(source)
+        self.assertEqual(10, len(source.requested))
+        self.assertEqual(len(self.data), result.size)
+        self.assertEqual(zlib.crc32(self.data) & 0xffffffff, result.crc)
+        with open(self.fname, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+        self.assertEqual(set(range(10)), state.done)
+
+    def test_resume_after_failure(self):
+        source = FakeSource(self.data, fail_at=[5 * 1024])
+        with self.assertRaises(Exception):
+            self._fetch(source, connections=1)
+        self.assertEqual(list(range(0, 6 * 1024, 1024)), source.requested)
+
+        # Only the missing segments are fetched again
+        source = FakeSource(self.data)
+        state, result = self._fetch(source)
+        self.assertEqual(list(range(5 * 1024, 10000, 1024)), sorted(source.requested))
+        self.assertEqual(len(self.data) - 5 * 1024, result.size)
+        self.assertEqual(zlib.crc32(self.data) & 0xffffffff, result.crc)
+
+    def test_ranges_not_supported(self):
+        with self.assertRaises(ngamsSegmentedFetch.RangesNotSupported):
+            self._fetch(FakeSource(self.data, ranges=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,7 +35,7 @@ import base64
 import contextlib
 import os
 
-from ngamsLib import ngamsHttpUtils, utils
+from ngamsLib import ngamsConfig, ngamsHttpUtils, utils
 from .ngamsTestLib import ngamsTestSuite
 
 
@@ -195,3 +195,20 @@ class ngamsAuthorizationTest(ngamsTestSuite):
         # This is merely so the tearDown() method doesn't kill it wih -9, which
         # in turn means we get no coverage measurement of what we actually tested
         self.termExtSrv(self.extSrvInfo.pop(), auth=auth1)
+
+    def test_hashed_password(self):
+        """Passwords are given as salted hashes in the configuration"""
+
+        passwd = os.urandom(16)
+        correct_auth = b'test:' + passwd
+        cfg = self._authorization_cfg([('test', passwd, 'STATUS')])
+        pwd_hash = ngamsConfig.hash_password(passwd, iterations=1000)
+        cfg = [(name, pwd_hash if name.endswith('.Password') else val) for name, val in cfg]
+        self.prepExtSrv(cfgProps=cfg)
+
+        # The second time the verification comes from the cache,
+        # but the command is still checked
+        self._assert_code(200, bauth=correct_auth)
+        self._assert_code(200, bauth=correct_auth)
+        self._assert_code(403, bauth=correct_auth, cmd='INIT')
+        self._assert_code(401, bauth=b'test:' + os.urandom(16))
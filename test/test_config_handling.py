@@ -318,4 +318,33 @@ class XmlMgrTests(unittest.TestCase):
             ngamsXmlMgr.ngamsXmlMgr('foo', fname)
         finally:
             os.close(fd)
-            os.remove(fname)
\ No newline at end of file
+            os.remove(fname)
+
+class StorageSetCheckTests(unittest.TestCase):
+
+    def _load(self, **attrs):
+        fname = os.path.join(os.path.dirname(__file__), 'src', 'ngamsCfg.xml')
+        with open(fname) as f:
+            cfg = f.read()
+        extra = ''.join(' %s="%s"' % (k, v) for k, v in attrs.items())
+        cfg = cfg.replace('<StorageSet StorageSetId="FitsStorage1"',
+                          '<StorageSet StorageSetId="FitsStorage1"' + extra, 1)
+        fd, tmp_fname = tempfile.mkstemp(suffix='.xml')
+        try:
+            os.write(fd, cfg.encode('utf8'))
+            os.close(fd)
+            return ngamsConfig.ngamsConfig().load(tmp_fname, 1)
+        finally:
+            os.remove(tmp_fname)
+
+    def test_staging_options(self):
+        cfg = self._load(Preallocate="0", Durability="periodic", SyncInterval="8")
+        storage_set = cfg.getStorageSetList()[0]
+        self.assertEqual((0, 'periodic', 8), (storage_set.getPreallocate(),
+                                              storage_set.getDurability(),
+                                              storage_set.getSyncInterval()))
+        for attrs in ({'SyncInterval': '-1'}, {'SyncInterval': '0'}, {'SyncInterval': 'often'},
+                      {'Preallocate': 'yes'}, {'Durability': 'always'}):
+            with self.assertRaises(Exception) as ctx:
+                self._load(**attrs)
+            self.assertIn('StorageSet.' + list(attrs)[0], str(ctx.exception))
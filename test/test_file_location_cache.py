@@ -0,0 +1,83 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the cache of file locations"""
+
+import unittest
+
+from ngamsServer import file_location_cache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+class FileLocationCacheTests(unittest.TestCase):
+
+    def test_hits_and_invalidation(self):
+        cache = file_location_cache.FileLocationCache(10, 30)
+        self.assertIsNone(cache.get('file1', (-1, None)))
+        cache.put('file1', (-1, None), ['row1'])
+        cache.put('file1', (2, None), ['row2'])
+        cache.put('file2', (-1, None), ['row3'])
+        self.assertEqual(['row1'], cache.get('file1', (-1, None)))
+        self.assertEqual(['row2'], cache.get('file1', (2, None)))
+
+        # All queries about a file go away together
+        cache.invalidate('file1')
+        self.assertIsNone(cache.get('file1', (-1, None)))
+        self.assertIsNone(cache.get('file1', (2, None)))
+        self.assertEqual(['row3'], cache.get('file2', (-1, None)))
+
+        stats = cache.statistics()
+        self.assertEqual(3, stats['hits'])
+        self.assertEqual(3, stats['misses'])
+        self.assertEqual(2, stats['invalidations'])
+        self.assertEqual(1, stats['entries'])
+
+        cache.clear()
+        self.assertIsNone(cache.get('file2', (-1, None)))
+
+    def test_limits(self):
+        clock = FakeClock()
+        cache = file_location_cache.FileLocationCache(2, 30, clock=clock)
+        cache.put('file1', 'key', 1)
+        cache.put('file2', 'key', 2)
+        cache.get('file1', 'key')
+        # The least recently used goes away
+        cache.put('file3', 'key', 3)
+        self.assertIsNone(cache.get('file2', 'key'))
+        self.assertEqual(1, cache.get('file1', 'key'))
+
+        # And so do expired entries
+        clock.now += 30
+        self.assertIsNone(cache.get('file1', 'key'))
+        self.assertEqual(1, cache.statistics()['entries'])
+
+        # Disabled
+        cache = file_location_cache.FileLocationCache(0)
+        cache.put('file1', 'key', 1)
+        self.assertIsNone(cache.get('file1', 'key'))
@@ -0,0 +1,121 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the in-memory host topology"""
+
+import unittest
+
+from ngamsLib.ngamsCore import NGAMS_HOST_LOCAL, NGAMS_HOST_CLUSTER, \
+    NGAMS_HOST_REMOTE
+from ngamsServer import host_topology
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+def _row(host_id, domain, ip, cluster, port, suspended=0):
+    return [host_id, domain, ip, None, -1, cluster, None, None, port,
+            1, 1, 0, 0, 0, 'ONLINE', suspended, None, None]
+
+
+class FakeDb(object):
+
+    def __init__(self):
+        self.hosts = {}
+        self.queries = 0
+
+    def add(self, *args, **kwargs):
+        row = _row(*args, **kwargs)
+        self.hosts[row[0]] = row
+
+    def getAllHostInfo(self):
+        self.queries += 1
+        return list(self.hosts.values())
+
+    def getHostInfoFromHostIds(self, hostList):
+        self.queries += 1
+        return [self.hosts[h] for h in hostList if h in self.hosts]
+
+
+class HostTopologyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDb()
+        self.db.add('local:7777', 'here.org', '10.0.0.1', 'local:7777', 7777)
+        self.db.add('node:7777', 'here.org', '10.0.0.2', 'local:7777', 7777)
+        self.db.add('far:7777', 'there.org', '10.1.0.2', 'master:7777', 7777)
+        self.db.add('master:7777', 'there.org', '10.1.0.1', 'master:7777', 8888)
+        self.clock = FakeClock()
+        self.topology = host_topology.HostTopology(lambda: self.db, 'local:7777',
+                                                   10, clock=self.clock)
+
+    def test_resolve(self):
+        hosts = self.topology.resolve(['local:7777', 'node:7777', 'far:7777'])
+        self.assertEqual(NGAMS_HOST_LOCAL, hosts['local:7777'].getHostType())
+        self.assertEqual(NGAMS_HOST_CLUSTER, hosts['node:7777'].getHostType())
+        self.assertEqual('10.0.0.2', hosts['node:7777'].getIpAddress())
+        # Remote hosts are contacted through their master unit
+        self.assertEqual(NGAMS_HOST_REMOTE, hosts['far:7777'].getHostType())
+        self.assertEqual('master:7777', hosts['far:7777'].getHostId())
+        self.assertEqual('10.1.0.1', hosts['far:7777'].getIpAddress())
+
+        # Further lookups don't go to the database,
+        # and callers can't modify the cached information
+        hosts['far:7777'].setIpAddress('1.2.3.4')
+        queries = self.db.queries
+        hosts = self.topology.resolve(['far:7777'])
+        self.assertEqual('10.1.0.1', hosts['far:7777'].getIpAddress())
+        self.assertEqual(8888, self.topology.get('master:7777').getSrvPort())
+        self.assertEqual(queries, self.db.queries)
+        self.assertEqual(1, self.topology.statistics()['hits'])
+
+        # Unknown hosts are looked up, and rejected if they don't exist
+        self.assertIsNone(self.topology.get('new:7777'))
+        self.db.add('new:7777', 'here.org', '10.0.0.3', 'local:7777', 7777)
+        self.assertEqual(NGAMS_HOST_CLUSTER,
+                         self.topology.resolve(['new:7777'])['new:7777'].getHostType())
+        self.assertRaises(Exception, self.topology.resolve, ['nothere:7777'])
+
+    def test_changes(self):
+        self.assertFalse(self.topology.is_suspended('node:7777'))
+        self.topology.resolve(['far:7777'])
+
+        # Changes done by ourselves are seen immediately
+        self.db.add('node:7777', 'here.org', '10.0.0.2', 'local:7777', 7777, suspended=1)
+        self.db.add('master:7777', 'there.org', '10.1.0.5', 'master:7777', 8888)
+        self.topology.host_changed('node:7777')
+        self.topology.host_changed('master:7777')
+        self.assertTrue(self.topology.is_suspended('node:7777'))
+        self.assertEqual('10.1.0.5',
+                         self.topology.resolve(['far:7777'])['far:7777'].getIpAddress())
+
+        # Those done by others after the refresh period
+        self.db.add('node:7777', 'here.org', '10.0.0.2', 'local:7777', 7777)
+        self.assertTrue(self.topology.is_suspended('node:7777'))
+        self.clock.now += 10
+        self.assertFalse(self.topology.is_suspended('node:7777'))
+        self.assertEqual(2, self.topology.statistics()['reloads'])
@@ -20,9 +20,13 @@
 #    MA 02111-1307  USA
 #
 
+import base64
+import io
+import os
 import unittest
 
-from ngamsLib import ngamsCore, ngamsLib
+from ngamsLib import ngamsCore, ngamsLib, ngamsHttpUtils, ngamsConfig
+from ngamsLib import ngamsDiskInfo, ngamsFileInfo, ngamsFileList, ngamsStatus
 
 class NgamsLibTests(unittest.TestCase):
 
@@ -44,4 +48,117 @@ class NgamsLibTests(unittest.TestCase):
         """Double-checks that filenames are properly escaped"""
 
         self.assertEqual('_', ngamsCore.to_valid_filename('?'))
-        self.assertEqual('__', ngamsCore.to_valid_filename('??'))
\ No newline at end of file
+        self.assertEqual('__', ngamsCore.to_valid_filename('??'))
+
+    def test_chunked_transfer_encoding(self):
+        data = b'x' * 100000 + b'y' * 10
+        body = ngamsHttpUtils.chunked_body(io.BytesIO(data), lambda: {'NGAS-File-CRC': '1234'})
+        encoded = b''
+        while True:
+            buf = body.read(4096)
+            if not buf:
+                break
+            encoded += buf
+        self.assertTrue(encoded.endswith(b'0\r\nNGAS-File-CRC: 1234\r\n\r\n'))
+
+        reader = ngamsHttpUtils.chunked_reader(io.BytesIO(encoded + b'next request'))
+        decoded = b''
+        while True:
+            buf = reader.read(10000)
+            if not buf:
+                break
+            decoded += buf
+        self.assertEqual(data, decoded)
+        self.assertEqual({'ngas-file-crc': '1234'}, reader.trailers)
+        # Data after the message is not consumed
+        self.assertEqual(b'next request', reader.f.read())
+
+        # Truncated data
+        def read_all(reader):
+            while reader.read(10000):
+                pass
+        reader = ngamsHttpUtils.chunked_reader(io.BytesIO(encoded[:5000]))
+        self.assertRaises(IOError, read_all, reader)
+
+    def test_compiled_config(self):
+        cfg = ngamsConfig.ngamsConfig()
+        cfg.load(os.path.join(os.path.dirname(__file__), 'src', 'ngamsCfg.xml'))
+        compiled = cfg.compiled
+        self.assertEqual(int(cfg.getVal('Server[1].BlockSize')), compiled.block_size)
+        self.assertEqual('FitsStorage2', cfg.getStorageSetFromSlotId('FitsStorage2-Rep-4').getStorageSetId())
+        self.assertRaises(Exception, cfg.getStorageSetFromSlotId, 'unknown')
+        self.assertEqual('image/x-fits', cfg.getStreamFromMimeType('image/x-fits').getMimeType())
+        self.assertIsNone(cfg.getStreamFromMimeType('unknown/type'))
+
+        # Changes produce a new snapshot, the previous one is left untouched
+        cfg.storeVal('NgamsCfg.Server[1].BlockSize', '1234')
+        cfg.addAuthUser('user', base64.b64encode(b'pass').decode('ascii'))
+        cfg.addAuthUserCommands('user', 'retrieve,status')
+        self.assertEqual(1234, cfg.getBlockSize())
+        self.assertNotEqual(1234, compiled.block_size)
+        self.assertNotIn('user', compiled.auth_users)
+        user = cfg.compiled.auth_users['user']
+        self.assertEqual(b'pass', user.password)
+        self.assertTrue(user.may_run('RETRIEVE'))
+        self.assertFalse(user.may_run('ARCHIVE'))
+
+        # Reloading keeps the old snapshot in use until the new one is ready
+        compiled = cfg.compiled
+        cfg.load(os.path.join(os.path.dirname(__file__), 'src', 'ngamsCfg.xml'))
+        self.assertIsNot(compiled, cfg.compiled)
+        self.assertNotIn('user', cfg.compiled.auth_users)
+
+    def test_password_hash(self):
+        pwd_hash = ngamsConfig.hash_password('secret', salt=b'salt', iterations=10)
+        self.assertTrue(pwd_hash.startswith('pbkdf2_sha256$10$'))
+        parsed = ngamsConfig.parse_password_hash(pwd_hash)
+        self.assertEqual((10, b'salt'), parsed[:2])
+        self.assertIsNone(ngamsConfig.parse_password_hash(base64.b64encode(b'secret').decode('ascii')))
+
+        cfg = ngamsConfig.ngamsConfig()
+        cfg.addAuthUser('user', pwd_hash)
+        user = cfg.compiled.auth_users['user']
+        self.assertIsNone(user.password)
+        self.assertEqual(parsed, user.password_hash)
+        self.assertRaises(Exception, cfg.getAuthHttpHdrVal, 'user')
+
+    def test_status_xml(self):
+        """The streaming XML writer and parser give the same results as minidom"""
+
+        def file_info(i):
+            return ngamsFileInfo.ngamsFileInfo().setDiskId('disk').\
+                   setFileId('file <%d> & "quoted"' % i).setFileVersion(1).\
+                   setFilename('file_%d' % i).setFileSize(i).setUncompressedFileSize(i).\
+                   setIngestionDate(1e9).setChecksum('1234')
+
+        disk = ngamsDiskInfo.ngamsDiskInfo().setDiskId('disk').\
+               setArchive('archive').setInstallationDate(1e9).\
+               setType('type').setLogicalName('name').setHostId('host').\
+               setSlotId('1').setMounted(1).setMountPoint('/mount').\
+               setNumberOfFiles(2).setAvailableMb(1).setBytesStored(1).\
+               setCompleted(0).setChecksum('')
+        disk.addFileObj(file_info(1)).addFileObj(file_info(2))
+        file_list = ngamsFileList.ngamsFileList('list', 'comment')
+        file_list.addFileInfoObj(file_info(3))
+        file_list.addFileListObj(ngamsFileList.ngamsFileList('nested'))
+        status = ngamsStatus.ngamsStatus().setDate('2020-01-01T00:00:00.000').\
+                 setVersion('version').setHostId('host').setStatus('SUCCESS').\
+                 setMessage('<message> & "quotes"').setState('ONLINE').\
+                 setSubState('IDLE').setActualCount(2).\
+                 addDiskStatus(disk).addFileList(file_list)
+
+        for args in ((), (0, 1, 1), (0, 1, 0, 1, 1), (1, 1, 1, 0)):
+            doc = status.genXmlDoc(*args)
+            self.assertEqual(status.genXml(*args).toprettyxml('  ', '\n')[:-1], doc)
+            get_status = args[3] if len(args) > 3 else 1
+            ignore_var_pars = args[4] if len(args) > 4 else 0
+            streamed = ngamsStatus.ngamsStatus().unpackXmlDoc(doc, get_status, ignore_var_pars)
+            dom = ngamsStatus.ngamsStatus().unpackXmlDom(doc, get_status, ignore_var_pars)
+            self.assertEqual(dom.genXmlDoc(*args), streamed.genXmlDoc(*args))
+
+        streamed = ngamsStatus.ngamsStatus().unpackXmlDoc(status.genXmlDoc(0, 1, 1), 1)
+        self.assertEqual('<message> & "quotes"', streamed.getMessage())
+        self.assertEqual(['file_1', 'file_2'],
+                         [f.getFilename() for f in streamed.getDiskStatusList()[0].getFileObjList()])
+        self.assertEqual(['list', 'nested'], [l.getId() for l in streamed.getFileListList()])
+        self.assertRaises(Exception, ngamsStatus.ngamsStatus().unpackXmlDoc, '<?xml version="1.0" ?><Other/>')
@@ -0,0 +1,65 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the server metrics"""
+
+import unittest
+
+from ngamsServer import metrics
+
+
+class FakeComponent(object):
+
+    def statistics(self):
+        return {'hits': 3, 'entries': 1}
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_exposition(self):
+        m = metrics.Metrics(buckets=(0.1, 1))
+        m.inc('ngas_requests_total', command='RETRIEVE', code=200)
+        m.inc('ngas_requests_total', command='RETRIEVE', code=200)
+        m.inc('ngas_sent_bytes_total', 1024, command='RETRIEVE')
+        m.observe('ngas_request_duration_seconds', 0.05, command='RETRIEVE')
+        m.observe('ngas_request_duration_seconds', 0.5, command='RETRIEVE')
+        m.observe('ngas_request_duration_seconds', 5, command='RETRIEVE')
+        m.add_collector(lambda: [('ngas_queue_depth', {'name': 'a"b'}, 2)])
+        m.add_collector(metrics.statistics_collector('ngas_cache', FakeComponent))
+        m.add_collector(metrics.statistics_collector('ngas_none', lambda: None))
+        m.add_collector(lambda: 1 / 0)
+
+        lines = m.exposition().splitlines()
+        self.assertIn('# TYPE ngas_requests_total counter', lines)
+        self.assertIn('ngas_requests_total{code="200",command="RETRIEVE"} 2.0', lines)
+        self.assertIn('ngas_sent_bytes_total{command="RETRIEVE"} 1024.0', lines)
+        self.assertIn('# TYPE ngas_request_duration_seconds histogram', lines)
+        self.assertIn('ngas_request_duration_seconds_bucket{command="RETRIEVE",le="0.1"} 1', lines)
+        self.assertIn('ngas_request_duration_seconds_bucket{command="RETRIEVE",le="1.0"} 2', lines)
+        self.assertIn('ngas_request_duration_seconds_bucket{command="RETRIEVE",le="+Inf"} 3', lines)
+        self.assertIn('ngas_request_duration_seconds_sum{command="RETRIEVE"} 5.55', lines)
+        self.assertIn('ngas_request_duration_seconds_count{command="RETRIEVE"} 3', lines)
+        self.assertIn('ngas_queue_depth{name="a\\"b"} 2.0', lines)
+        self.assertIn('# TYPE ngas_cache_hits_total counter', lines)
+        self.assertIn('ngas_cache_hits_total 3.0', lines)
+        self.assertIn('# TYPE ngas_cache_entries gauge', lines)
+        self.assertIn('ngas_cache_entries 1.0', lines)
+        self.assertFalse([l for l in lines if 'ngas_none' in l])
@@ -0,0 +1,144 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the mirroring queue and the cluster name space index"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ngamsServer import mirroring_queue, namespace_index
+
+
+class MirroringQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wal_fname = os.path.join(self.tmpdir, 'wal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_states(self):
+        q = mirroring_queue.MirroringQueue(self.wal_fname)
+        self.assertTrue(q.add('a', 'req-a'))
+        self.assertTrue(q.add('b', 'req-b'))
+        self.assertFalse(q.add('a', 'req-a'))
+        self.assertIn('a', q)
+        self.assertEqual('req-a', q.pop())
+        self.assertEqual(1, q.count(mirroring_queue.ACTIVE))
+        q.put('a', 'req-a', mirroring_queue.ERROR)
+        self.assertEqual([('a', 'req-a')], q.entries(mirroring_queue.ERROR))
+        self.assertIsNone(q.remove('a', mirroring_queue.COMPLETED))
+        self.assertEqual('req-a', q.remove('a', mirroring_queue.ERROR))
+        self.assertNotIn('a', q)
+        self.assertEqual('req-b', q.pop())
+        self.assertIsNone(q.pop())
+        q.close()
+
+    def test_recovery(self):
+        q = mirroring_queue.MirroringQueue(self.wal_fname)
+        for i in range(5):
+            q.add(str(i), 'req-%d' % i)
+        self.assertEqual('req-0', q.pop())
+        self.assertEqual('req-1', q.pop())
+        q.put('1', 'req-1', mirroring_queue.COMPLETED)
+        q.remove('4')
+        q.close()
+
+        # Simulate a record only partially written before a crash
+        with open(self.wal_fname, 'ab') as f:
+            f.write(b'\xff\x00\x00\x00garbage')
+
+        q = mirroring_queue.MirroringQueue(self.wal_fname)
+        self.assertEqual(4, len(q))
+        self.assertEqual([('1', 'req-1')], q.entries(mirroring_queue.COMPLETED))
+        # The request being mirrored is queued again
+        popped = set(q.pop() for _ in range(3))
+        self.assertEqual({'req-0', 'req-2', 'req-3'}, popped)
+        self.assertIsNone(q.pop())
+        q.close()
+
+    def test_compaction(self):
+        q = mirroring_queue.MirroringQueue(self.wal_fname)
+        for _ in range(3000):
+            q.put('a', 'req-a', mirroring_queue.ERROR)
+        self.assertLess(q.wal_records, 1001)
+        q.close()
+        q = mirroring_queue.MirroringQueue(self.wal_fname)
+        self.assertEqual([('a', 'req-a')], q.entries(mirroring_queue.ERROR))
+        q.close()
+
+
+class FakeDb(object):
+    """Answers the queries of the name space index from a set of file keys"""
+
+    def __init__(self, files):
+        self.files = files
+        self.version_queries = 0
+
+    def getNumberOfFiles(self):
+        return len(self.files)
+
+    def getClusterFileKeys(self, cluster_name, from_ing_date=None):
+        for (file_id, file_version), ing_date in sorted(self.files.items()):
+            if not from_ing_date or ing_date >= from_ing_date:
+                yield file_id, file_version, ing_date
+
+    def getClusterFileVersions(self, cluster_name, file_ids):
+        self.version_queries += 1
+        return set(key for key in self.files if key[0] in file_ids)
+
+
+class NamespaceIndexTests(unittest.TestCase):
+
+    def test_bloom_filter(self):
+        bloom = namespace_index.BloomFilter(10000)
+        for i in range(10000):
+            bloom.add('file-%d' % i, 1)
+        self.assertTrue(all(bloom.might_contain('file-%d' % i, 1) for i in range(10000)))
+        false_positives = sum(bloom.might_contain('file-%d' % i, 2) for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertFalse(bloom.full)
+
+    def test_index(self):
+        db = FakeDb({('a', 1): '2020-01-01T00:00:00', ('b', 1): '2020-01-02T00:00:00'})
+        index = namespace_index.NamespaceIndex(db, 'cluster')
+        index.build()
+        self.assertEqual({('a', 1)}, index.contains([('a', 1), ('a', 2)]))
+
+        # Files not in the filter are not looked up in the DB
+        db.version_queries = 0
+        self.assertEqual(set(), index.contains([('c', 1)]))
+        self.assertEqual(0, db.version_queries)
+
+        # New files ingested in the cluster, or archived locally
+        db.files[('c', 1)] = '2020-01-03T00:00:00'
+        index.update()
+        self.assertEqual('2020-01-03T00:00:00', index.last_ingestion_date)
+        db.files[('d', 1)] = '2020-01-04T00:00:00'
+        index.add('d', 1)
+        self.assertEqual({('c', 1), ('d', 1)}, index.contains([('c', 1), ('d', 1)]))
+
+        # Files removed from the cluster are confirmed against the DB
+        del db.files[('a', 1)]
+        self.assertEqual(set(), index.contains([('a', 1)]))
@@ -0,0 +1,131 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the registry of plug-ins and command modules"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from ngamsServer import plugin_registry
+
+
+class FakeStream(object):
+
+    def __init__(self, plugin):
+        self.plugin = plugin
+
+    def getPlugIn(self):
+        return self.plugin
+
+
+class FakeCfg(object):
+
+    def __init__(self, dapis, dppis=()):
+        self.streams = [FakeStream(dapi) for dapi in dapis]
+        self.dppi_plugins = {dppi: None for dppi in dppis}
+        self.register_plugins = {}
+
+    def getStreamList(self):
+        return self.streams
+
+    def getVal(self, name):
+        return None
+
+    def __getattr__(self, name):
+        # The rest of plug-ins are not configured
+        return lambda: None
+
+
+class PlugInRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        sys.path.insert(0, self.tmpdir)
+        self._write('test_registry_dapi', 'def test_registry_dapi(): return 1\n')
+        self._write('test_registry_dppi', 'def test_registry_dppi(): return 2\n')
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir)
+        for name in ('test_registry_dapi', 'test_registry_dppi'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, contents):
+        with open(os.path.join(self.tmpdir, name + '.py'), 'w') as f:
+            f.write(contents)
+
+    def test_resolution(self):
+        cfg = FakeCfg(['test_registry_dapi', 'missing_registry_dapi'],
+                      ['test_registry_dppi'])
+        registry = plugin_registry.PlugInRegistry.from_config(
+            cfg, {'CMD': 'test_registry_dppi', 'OTHER': 'missing_registry_cmd'})
+        self.assertEqual(1, registry.entry_point('test_registry_dapi')())
+        self.assertEqual(2, registry.entry_point('test_registry_dppi')())
+        self.assertIsNone(registry.entry_point('test_registry_dapi',
+                                               'modifies_content', returnNone=True))
+        self.assertRaises(AttributeError, registry.entry_point,
+                          'test_registry_dapi', 'modifies_content')
+        self.assertIs(sys.modules['test_registry_dppi'],
+                      registry.command('CMD', 'test_registry_dppi'))
+        self.assertEqual({'entry_points': 3, 'commands': 1, 'hits': 5, 'misses': 0},
+                         registry.statistics())
+
+        # Plug-ins that failed to load, or weren't configured, are looked up
+        self.assertRaises(ImportError, registry.entry_point, 'missing_registry_dapi')
+        self.assertRaises(ImportError, registry.command, 'OTHER', 'missing_registry_cmd')
+        self.assertEqual(2, registry.entry_point('test_registry_dppi', 'test_registry_dppi')())
+        self.assertEqual(3, registry.statistics()['misses'])
+
+    def test_changed_command_module(self):
+        registry = plugin_registry.PlugInRegistry.from_config(
+            FakeCfg([]), {'CMD': 'test_registry_dapi'})
+        self.assertIs(sys.modules['test_registry_dapi'],
+                      registry.command('CMD', 'test_registry_dapi'))
+        # The module implementing a command changed in the configuration
+        module = registry.command('CMD', 'test_registry_dppi')
+        self.assertIs(sys.modules['test_registry_dppi'], module)
+
+    def test_reload(self):
+        cfg = FakeCfg(['test_registry_dapi'])
+        registry = plugin_registry.PlugInRegistry.from_config(
+            cfg, {'CMD': 'test_registry_dppi'})
+        old = registry.entry_point('test_registry_dapi')
+
+        self._write('test_registry_dapi', 'def test_registry_dapi(): return 3\n')
+        self._write('test_registry_dppi', 'def test_registry_dppi(): return 4\n')
+        for name in ('test_registry_dapi', 'test_registry_dppi'):
+            os.utime(os.path.join(self.tmpdir, name + '.py'), (0, 0))
+        module = registry.reload_command('CMD', 'test_registry_dppi')
+        self.assertEqual(4, module.test_registry_dppi())
+        self.assertIs(module, registry.command('CMD', 'test_registry_dppi'))
+
+        # Only the command module is re-loaded
+        self.assertEqual(1, sys.modules['test_registry_dapi'].test_registry_dapi())
+        self.assertEqual(1, registry.entry_point('test_registry_dapi')())
+
+        # Building a new registry doesn't re-load plug-ins either,
+        # whoever got the old entry point can keep using it
+        new_registry = plugin_registry.PlugInRegistry.from_config(cfg, {})
+        self.assertIs(old, new_registry.entry_point('test_registry_dapi'))
+        self.assertEqual(1, old())
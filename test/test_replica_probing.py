@@ -0,0 +1,89 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the concurrent probing of remote file replicas"""
+
+import time
+import unittest
+
+from ngamsLib.ngamsCore import NGAMS_HOST_CLUSTER, NGAMS_HOST_REMOTE
+from ngamsServer import ngamsFileUtils
+
+
+class FakeFileInfo(object):
+
+    def getFileId(self):
+        return 'file/1'
+
+
+class FakeProbe(object):
+    """Answers for each host after the given delay"""
+
+    def __init__(self, answers):
+        self.answers = answers
+
+    def __call__(self, srvObj, fileInfoObj, host, hostDic):
+        delay, available = self.answers[host]
+        time.sleep(delay)
+        return available
+
+
+class ReplicaProbingTests(unittest.TestCase):
+
+    def setUp(self):
+        self._probe = ngamsFileUtils._probeReplica
+        self._timeout = ngamsFileUtils.REPLICA_PROBE_TIMEOUT
+        self._liveness = ngamsFileUtils.host_liveness
+        ngamsFileUtils.REPLICA_PROBE_TIMEOUT = 0.5
+        ngamsFileUtils.host_liveness = ngamsFileUtils.HostLiveness()
+        # Ordered by preference
+        self.candidates = [[NGAMS_HOST_CLUSTER, FakeFileInfo(), 'cluster'],
+                           [NGAMS_HOST_REMOTE, FakeFileInfo(), 'remote']]
+
+    def tearDown(self):
+        ngamsFileUtils._probeReplica = self._probe
+        ngamsFileUtils.REPLICA_PROBE_TIMEOUT = self._timeout
+        ngamsFileUtils.host_liveness = self._liveness
+
+    def _select(self, answers):
+        ngamsFileUtils._probeReplica = FakeProbe(answers)
+        return ngamsFileUtils._firstAvailableReplica(None, self.candidates, {})
+
+    def test_preferred_replica_answering_later(self):
+        selected = self._select({'cluster': (0.1, True), 'remote': (0, True)})
+        self.assertEqual('cluster', selected[2])
+
+    def test_preferred_replica_not_available(self):
+        selected = self._select({'cluster': (0.1, False), 'remote': (0, True)})
+        self.assertEqual('remote', selected[2])
+
+    def test_preferred_replica_not_answering(self):
+        start = time.time()
+        selected = self._select({'cluster': (2, True), 'remote': (0, True)})
+        self.assertEqual('remote', selected[2])
+        self.assertLess(time.time() - start, 1)
+
+    def test_no_replica_available(self):
+        self.assertIsNone(self._select({'cluster': (0, False), 'remote': (0, False)}))
+
+
+if __name__ == '__main__':
+    unittest.main()
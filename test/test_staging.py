@@ -0,0 +1,143 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the server-wide staging service"""
+
+import socket
+import threading
+import time
+import unittest
+
+from ngamsServer import staging
+
+
+class FakeFSPI(object):
+    """A File Staging Plug-In taking `latency` seconds to stage files"""
+
+    def __init__(self, offline, latency=0.1, error=None):
+        self.offline = set(offline)
+        self.latency = latency
+        self.error = error
+        self.calls = []
+
+    def isFileOffline(self, filename):
+        return 1 if filename in self.offline else 0
+
+    def stageFiles(self, filenames, requestObj=None, serverObj=None):
+        self.calls.append((list(filenames), requestObj))
+        time.sleep(self.latency)
+        if self.error:
+            raise self.error
+        self.offline.difference_update(filenames)
+        return len(filenames)
+
+
+def _service(fspi, **kwargs):
+    return staging.StagingService(fspi.isFileOffline, fspi.stageFiles, **kwargs)
+
+
+def _stage_concurrently(service, requests):
+    errors = []
+    def stage(filenames):
+        try:
+            service.stage(filenames)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=stage, args=(filenames,)) for filenames in requests]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+class StagingServiceTests(unittest.TestCase):
+
+    def test_online_files(self):
+        fspi = FakeFSPI(['/tape/b'])
+        service = _service(fspi, batch_wait=0)
+        self.assertEqual(0, service.stage(['/disk/a']))
+        self.assertEqual(1, service.stage(['/disk/a', '/tape/b'], request='request'))
+        self.assertEqual([(['/tape/b'], 'request')], fspi.calls)
+        stats = service.statistics()
+        self.assertEqual(3, stats['requests'])
+        self.assertAlmostEqual(2 / 3., stats['hit_rate'])
+        self.assertEqual(1, stats['recalled'])
+        self.assertGreater(stats['avg_recall_latency'], 0)
+        service.stop()
+
+    def test_coalescing(self):
+        files = ['/tape/%d' % i for i in range(10)]
+        fspi = FakeFSPI(files)
+        service = _service(fspi, max_batch=100, batch_wait=0.2)
+        # Everybody asks for the first file, plus a file of their own
+        self.assertEqual([], _stage_concurrently(service, [[files[0], f] for f in reversed(files[1:])]))
+
+        # A single, sorted batch
+        self.assertEqual(1, len(fspi.calls))
+        self.assertEqual(sorted(files), fspi.calls[0][0])
+        stats = service.statistics()
+        self.assertEqual(10, stats['recalled'])
+        self.assertEqual(8, stats['coalesced'])
+        self.assertEqual(0, stats['queue_depth'])
+        service.stop()
+
+    def test_max_batch(self):
+        files = ['/tape/%d' % i for i in range(5)]
+        fspi = FakeFSPI(files, latency=0)
+        service = _service(fspi, max_batch=2, batch_wait=0.2)
+        self.assertEqual([], _stage_concurrently(service, [[f] for f in files]))
+        self.assertEqual([2, 2, 1], [len(filenames) for filenames, _ in fspi.calls])
+        self.assertEqual(3, service.statistics()['batches'])
+        service.stop()
+
+    def test_errors(self):
+        fspi = FakeFSPI(['/tape/a', '/tape/b'], error=socket.timeout())
+        service = _service(fspi, batch_wait=0.1)
+        errors = _stage_concurrently(service, [['/tape/a'], ['/tape/a', '/tape/b']])
+        self.assertEqual(2, len(errors))
+        self.assertTrue(all(isinstance(e, socket.timeout) for e in errors))
+        self.assertEqual(2, service.statistics()['failed'])
+
+        service.stop()
+        self.assertRaises(staging.StagingServiceStopped, service.stage, ['/tape/a'])
+
+    def test_stop_with_stuck_plugin(self):
+        fspi = FakeFSPI(['/tape/a'], latency=5)
+        service = _service(fspi, batch_wait=0)
+        t = threading.Thread(target=service.stage, args=(['/tape/a'],))
+        t.daemon = True
+        t.start()
+        while not fspi.calls:
+            time.sleep(0.01)
+        start = time.time()
+        service.stop(timeout=0.1)
+        self.assertLess(time.time() - start, 1)
+
+    def test_recall_timeout(self):
+        fspi = FakeFSPI(['/tape/a'], latency=5)
+        service = _service(fspi, batch_wait=0, timeout=0.2)
+        start = time.time()
+        errors = _stage_concurrently(service, [['/tape/a'], ['/tape/a']])
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(2, len(errors))
+        self.assertTrue(all(isinstance(e, socket.timeout) for e in errors))
+        service.stop()
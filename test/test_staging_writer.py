@@ -0,0 +1,119 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the writing of staging files"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+from ngamsLib import ngamsStorageSet
+from ngamsServer import ngamsFileUtils, staging_writer
+
+crc32 = ngamsFileUtils.get_checksum_info('crc32')
+
+
+class FakeConfig(object):
+
+    def __init__(self, storage_sets):
+        self.storage_sets = storage_sets
+
+    def getStorageSetList(self):
+        return self.storage_sets
+
+
+class StagingWriterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'staging')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_policy_for_slot(self):
+        cfg = FakeConfig([
+            ngamsStorageSet.ngamsStorageSet('a', '', 'a-main', 'a-rep'),
+            ngamsStorageSet.ngamsStorageSet('b', '', 'b-main', '', 0, 0, 0, 'periodic', 8)])
+        self.assertEqual(staging_writer.DEFAULT_POLICY, staging_writer.staging_policy_for(cfg, 'a-rep'))
+        self.assertEqual(staging_writer.DEFAULT_POLICY, staging_writer.staging_policy_for(cfg, 'c'))
+        policy = staging_writer.staging_policy_for(cfg, 'b-main')
+        self.assertEqual((False, 'periodic', 8 * 1024 * 1024), policy)
+
+    def test_periodic_sync(self):
+        policy = staging_writer.staging_policy(True, staging_writer.DURABILITY_PERIODIC, 1000)
+        with staging_writer.StagingFile(self.fname, 4500, policy, drop_cache=True) as f:
+            for _ in range(9):
+                f.write(b'x' * 500)
+        # Four periodic syncs, plus the one at the end
+        self.assertEqual(5, f.syncs)
+        self.assertEqual(4500, os.path.getsize(self.fname))
+
+    def test_incomplete_file_is_truncated(self):
+        policy = staging_writer.staging_policy(True, staging_writer.DURABILITY_END, 0)
+        with self.assertRaises(ValueError):
+            with staging_writer.StagingFile(self.fname, 1000, policy) as f:
+                f.write(b'x' * 100)
+                raise ValueError()
+        self.assertEqual(0, f.syncs)
+        self.assertEqual(100, os.path.getsize(self.fname))
+
+        # Resuming appends to what was there
+        with staging_writer.StagingFile(self.fname, 900, policy, append=True) as f:
+            f.write(b'y' * 900)
+        self.assertEqual(1, f.syncs)
+        with open(self.fname, 'rb') as f:
+            self.assertEqual(b'x' * 100 + b'y' * 900, f.read())
+
+    def _write_slowly(self, fname, data):
+        with open(fname, 'wb') as f:
+            for i in range(0, len(data), 1000):
+                f.write(data[i:i + 1000])
+                f.flush()
+                time.sleep(0.005)
+
+    def test_checksum_follower(self):
+        data = os.urandom(20000)
+        follower = staging_writer.ChecksumFollower(self.fname, crc32, block_size=700,
+                                                   poll_interval=0.001).start()
+        writer = threading.Thread(target=self._write_slowly, args=(self.fname, data))
+        writer.start()
+        writer.join()
+        self.assertEqual(zlib.crc32(data) & 0xffffffff, follower.finish())
+        self.assertEqual(len(data), follower.size)
+
+    def test_checksum_follower_replaced_file(self):
+        with open(self.fname, 'wb') as f:
+            f.write(b'x' * 100)
+        follower = staging_writer.ChecksumFollower(self.fname, crc32, poll_interval=0.001).start()
+        time.sleep(0.05)
+        tmp_fname = self.fname + '.tmp'
+        self._write_slowly(tmp_fname, b'y' * 100)
+        os.rename(tmp_fname, self.fname)
+        self.assertIsNone(follower.finish())
+
+
+if __name__ == '__main__':
+    unittest.main()
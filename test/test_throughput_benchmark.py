@@ -0,0 +1,42 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the helpers of the throughput benchmark"""
+
+import unittest
+
+from .benchmarks import throughput
+
+
+class PercentileTests(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(10, 0, -1))
+        self.assertEqual(1, throughput.percentile(values, 0))
+        self.assertEqual(1, throughput.percentile(values, 10))
+        self.assertEqual(2, throughput.percentile(values, 11))
+        self.assertEqual(3, throughput.percentile(values, 25))
+        self.assertEqual(5, throughput.percentile(values, 50))
+        self.assertEqual(9, throughput.percentile(values, 90))
+        self.assertEqual(10, throughput.percentile(values, 99))
+        self.assertEqual(10, throughput.percentile(values, 100))
+        self.assertEqual(7, throughput.percentile([7], 50))
+        self.assertEqual(0, throughput.percentile([], 50))
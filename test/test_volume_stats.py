@@ -0,0 +1,101 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the in-memory statistics of the volumes of a server"""
+
+import tempfile
+import unittest
+
+from ngamsLib import ngamsDiskUtils
+from ngamsServer import volume_stats
+
+
+def _disk_row(disk_id, slot_id, mount_point, bytes_stored=0, completed=0):
+    # Same layout as ngamsDbCore.getNgasDisksCols()
+    return (disk_id, 'archive', disk_id, 'host:7777', slot_id, 1, mount_point, 0, 1000,
+            bytes_stored, 'type', None, 'manufacturer', None, '', 0, completed, None, None, None)
+
+
+class FakeDb(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.loads = 0
+        self.updates = []
+
+    def getDiskInfoForSlotsAndHost(self, host_id, slot_ids):
+        self.loads += 1
+        return self.rows
+
+    def add_files(self, disk_id, n_files, n_bytes, available_mb=None):
+        self.updates.append((disk_id, n_files, n_bytes, available_mb is not None))
+
+
+class VolumeStatsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.mount_point = tempfile.gettempdir()
+        self.db = FakeDb([_disk_row('disk1', '1', self.mount_point + '/volume1', 100),
+                          _disk_row('disk2', '2', self.mount_point + '/volume2', 200, completed=1)])
+
+    def test_flush(self):
+        stats = volume_stats.VolumeStats(lambda: self.db, 'host:7777', flush_files=3, flush_period=100)
+        stats.add_file('disk1', 10, self.mount_point)
+        stats.add_file('disk1', 10, self.mount_point)
+        self.assertEqual([], self.db.updates)
+        stats.add_file('disk1', 10, self.mount_point)
+        self.assertEqual([('disk1', 3, 30, True)], self.db.updates)
+
+        # Pending statistics are flushed on closing
+        stats.add_file('disk1', 5)
+        stats.close()
+        self.assertEqual(('disk1', 1, 5, False), self.db.updates[-1])
+        self.assertIsNone(stats.timer)
+
+    def test_volumes(self):
+        stats = volume_stats.VolumeStats(lambda: self.db, 'host:7777', flush_files=10, cache_time=100)
+        stats.add_file('disk1', 50)
+        volumes = {v.getDiskId(): v for v in stats.get_volumes()}
+        self.assertEqual(150, volumes['disk1'].getBytesStored())
+        self.assertEqual(['disk1'], [v.getDiskId() for v in stats.available_volumes()])
+
+        # Served from memory, and kept up to date
+        stats.add_file('disk1', 50)
+        volumes = {v.getDiskId(): v for v in stats.get_volumes()}
+        self.assertEqual(200, volumes['disk1'].getBytesStored())
+        self.assertEqual(2, volumes['disk1'].getNumberOfFiles())
+        self.assertEqual(1, self.db.loads)
+
+        # Callers get copies
+        volumes['disk1'].setCompleted(1)
+        self.assertEqual(1, len(stats.available_volumes()))
+
+        stats.invalidate()
+        stats.get_volumes()
+        self.assertEqual(2, self.db.loads)
+        stats.close()
+
+    def test_best_target_disk(self):
+        stats = volume_stats.VolumeStats(lambda: self.db, 'host:7777')
+        self.db.rows.append(_disk_row('disk3', '3', self.mount_point + '/volume3', 150))
+        volumes = stats.get_volumes()
+        self.assertEqual('disk3', ngamsDiskUtils._bestTargetDisk(volumes, self.mount_point))
+        self.assertIsNone(ngamsDiskUtils._bestTargetDisk(volumes, '/somewhere/else'))
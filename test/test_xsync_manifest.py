@@ -0,0 +1,87 @@
+#
+#    ICRAR - International Centre for Radio Astronomy Research
+#    (c) UWA - The University of Western Australia, 2020
+#    Copyright by UWA (in the framework of the ICRAR)
+#    All rights reserved
+#
+#    This library is free software; you can redistribute it and/or
+#    modify it under the terms of the GNU Lesser General Public
+#    License as published by the Free Software Foundation; either
+#    version 2.1 of the License, or (at your option) any later version.
+#
+#    This library is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#    Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public
+#    License along with this library; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston,
+#    MA 02111-1307  USA
+#
+"""Tests for the manifest-diff mode of ngasXSyncTool"""
+
+import pickle
+import unittest
+
+from ngamsUtils import ngasXSyncTool
+
+
+def _entry(file_id, version=1, size=100., checksum='1234', plugin='crc32', disk_id='disk'):
+    # Same layout as the entries yielded by ngasXSyncTool.get_manifest
+    return file_id, version, size, checksum, plugin, disk_id
+
+
+class ManifestDiffTests(unittest.TestCase):
+
+    def _diff(self, source, target):
+        return [(entry[:2], reason) for entry, reason in ngasXSyncTool.diff_manifests(source, target)]
+
+    def test_identical_manifests(self):
+        manifest = [_entry('a'), _entry('b'), _entry('b', 2)]
+        self.assertEqual([], self._diff(manifest, list(manifest)))
+
+    def test_missing_files(self):
+        source = [_entry('a'), _entry('b'), _entry('b', 2), _entry('c'), _entry('d')]
+        target = [_entry('b'), _entry('c')]
+        self.assertEqual([(('a', 1), 'missing'), (('b', 2), 'missing'), (('d', 1), 'missing')],
+                         self._diff(source, target))
+        self.assertEqual([(('a', 1), 'missing')], self._diff([_entry('a')], []))
+
+    def test_size_and_checksum_mismatches(self):
+        source = [_entry('a'), _entry('b'), _entry('c'), _entry('d')]
+        target = [_entry('a', size=99.),
+                  _entry('b', checksum='4321'),
+                  # Checksums computed with different plug-ins cannot be compared
+                  _entry('c', checksum='4321', plugin='crc32c'),
+                  # One of the copies in the target is good
+                  _entry('d', checksum='4321'), _entry('d', disk_id='other')]
+        self.assertEqual([(('a', 1), 'mismatch'), (('b', 1), 'mismatch')], self._diff(source, target))
+
+    def test_duplicate_source_copies(self):
+        source = [_entry('a'), _entry('a', disk_id='other'), _entry('b'), _entry('b', disk_id='other')]
+        target = [_entry('b')]
+        self.assertEqual([(('a', 1), 'missing')], self._diff(source, target))
+
+    def test_unsorted_manifests(self):
+        unsorted = [_entry('b'), _entry('a')]
+        with self.assertRaises(Exception):
+            self._diff(unsorted, [])
+        with self.assertRaises(Exception):
+            self._diff([_entry('a'), _entry('c')], unsorted)
+        # Versions are sorted too
+        with self.assertRaises(Exception):
+            list(ngasXSyncTool._check_manifest_order([_entry('a', 2), _entry('a', 1)], 'source'))
+
+
+class SyncRequestTests(unittest.TestCase):
+
+    def test_requests_pickled_by_older_versions(self):
+        sync_req = ngasXSyncTool.NgasSyncRequest('disk', 'a', 1, 100, known_missing=True)
+        self.assertTrue(pickle.loads(pickle.dumps(sync_req)).is_known_missing())
+        del sync_req._NgasSyncRequest__known_missing
+        self.assertFalse(pickle.loads(pickle.dumps(sync_req)).is_known_missing())
+
+
+if __name__ == '__main__':
+    unittest.main()